@@ -60,6 +60,7 @@ DEFAULTS: dict[str, str] = {
     "ADV_COMPILE_BUILD_DTB": "0",
     "ADV_COMPILE_BUILD_MODULES": "0",
     "ADV_COMPILE_DRY_RUN": "0",
+    "COMPILE_CCACHE": "1",
     "ADV_DOCKER_REBUILD": "0",
     "KT_TAG_NAME": "",
     "KT_LOG_LIMIT": "20",
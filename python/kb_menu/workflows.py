@@ -108,7 +108,9 @@ async def open_kernel_menu(app: Any) -> None:
                         "copy under the kernel tree—no Debian package.\n\n"
                         "Wizard covers tree, arch, localversion, config, build targets, threads, "
                         "DTB/overlays from saved defaults, toolchain from Settings, and advanced "
-                        "flags (clean, dry-run, build-dtb, …)."
+                        "flags (clean, dry-run, build-dtb, …).\n\n"
+                        "Builds go through the local build queue, so one started from a shell "
+                        "and one started here never run in the same tree at once."
                     ),
                     kernel_compile,
                 ),
@@ -133,6 +135,18 @@ async def open_kernel_menu(app: Any) -> None:
                     ),
                     kernel_modules_only,
                 ),
+                MenuEntry(
+                    "queue",
+                    "Build queue (status, follow, cancel)",
+                    (
+                        "Every compile (CLI or this menu) is a job of the local build queue "
+                        "daemon: one job per kernel tree at a time, module/DTB-only builds ahead "
+                        "of full and release builds, identical requests merged into one job.\n\n"
+                        "Show the queue, follow any job's log from the start, cancel a job, or "
+                        "stop the daemon."
+                    ),
+                    kernel_queue,
+                ),
                 MenuEntry(
                     "kconfig",
                     "Kernel configuration UIs",
@@ -438,6 +452,16 @@ async def open_settings_menu(app: Any) -> None:
                     ),
                     settings_compile_dtb,
                 ),
+                MenuEntry(
+                    "ccache",
+                    f"Compile ccache ({'on' if adv(c, 'COMPILE_CCACHE') else 'off'})",
+                    (
+                        "Pass --ccache to kernel_builder compile (compile and modules-only "
+                        "wizards). Keeps a persistent compiler cache in storage/ccache, shared by "
+                        "Docker, host and nvbuild builds, so rebuilds after --clean are fast."
+                    ),
+                    settings_ccache,
+                ),
                 MenuEntry(
                     "dtbp",
                     f"Package DTB ({c.get('PACKAGE_DTB_NAME') or 'empty'})",
@@ -917,7 +941,7 @@ async def kernel_compile(app: Any) -> None:
     bt = await _pick_build_target(app)
     if bt is None:
         return
-    threads = await app.dlg_input("--threads (empty=all cores)", app.cfg.get("COMPILE_THREADS", ""))
+    threads = await app.dlg_input("--threads (empty=all cores, auto=memory-aware)", app.cfg.get("COMPILE_THREADS", ""))
     if threads is None:
         return
     dtb = (app.cfg.get("COMPILE_DTB_NAME") or "").strip()
@@ -987,6 +1011,8 @@ async def kernel_compile(app: Any) -> None:
         cmd.append("--build-dtb")
     if adv(app.cfg, "ADV_COMPILE_BUILD_MODULES"):
         cmd.append("--build-modules")
+    if adv(app.cfg, "COMPILE_CCACHE"):
+        cmd.append("--ccache")
     if adv(app.cfg, "ADV_COMPILE_DRY_RUN"):
         cmd.append("--dry-run")
     if await app.dlg_confirm("Kernel: compile", f"{kname} arch={arch}"):
@@ -1102,7 +1128,7 @@ async def kernel_modules_only(app: Any) -> None:
     config = await app.dlg_input("--config (empty omit)", app.cfg.get("COMPILE_CONFIG", ""))
     if config is None:
         return
-    threads = await app.dlg_input("--threads (empty omit)", app.cfg.get("COMPILE_THREADS", ""))
+    threads = await app.dlg_input("--threads (empty omit, auto=memory-aware)", app.cfg.get("COMPILE_THREADS", ""))
     if threads is None:
         return
     sel = await app.dlg_checklist(
@@ -1144,6 +1170,8 @@ async def kernel_modules_only(app: Any) -> None:
         cmd += ["--threads", threads]
     if adv(app.cfg, "ADV_COMPILE_HOST_BUILD"):
         cmd.append("--host-build")
+    if adv(app.cfg, "COMPILE_CCACHE"):
+        cmd.append("--ccache")
     if adv(app.cfg, "ADV_COMPILE_DRY_RUN"):
         cmd.append("--dry-run")
     if await app.dlg_confirm("Kernel: modules only", kname):
@@ -1266,6 +1294,31 @@ async def kernel_docker(app: Any) -> None:
             await app.run_cmd(["python3", str(PYKB(app)), "cleanup"])
 
 
+async def kernel_queue(app: Any) -> None:
+    d = await app.dlg_select(
+        "Build queue",
+        [
+            ("status", "kernel_builder.py queue status"),
+            ("attach", "Follow a job's log"),
+            ("cancel", "Cancel a queued or running job"),
+            ("stop", "Stop the queue daemon"),
+            ("back", "Cancel"),
+        ],
+        "status",
+    )
+    if d is None or d == "back":
+        return
+    cmd = ["python3", str(PYKB(app)), "queue", d]
+    if d in ("attach", "cancel"):
+        job = await app.dlg_input("Job id (see status)", "")
+        if not job or not job.strip().isdigit():
+            return
+        cmd.append(job.strip())
+    if d == "stop" and not await app.dlg_confirm("Build queue", "Stop the daemon and any running builds?"):
+        return
+    await app.run_cmd(cmd)
+
+
 async def kernel_rebuild_bsp(app: Any) -> None:
     from kb_menu.discovery import list_extracted_bsps
 
@@ -1832,6 +1885,12 @@ async def settings_compile_dtb(app: Any) -> None:
         app.persist()
 
 
+async def settings_ccache(app: Any) -> None:
+    on = await app.dlg_confirm("ccache", "Compile through ccache (storage/ccache)?")
+    set_adv(app.cfg, "COMPILE_CCACHE", on)
+    app.persist()
+
+
 async def settings_package_dtb(app: Any) -> None:
     v = await app.dlg_input("Package --dtb-name", app.cfg.get("PACKAGE_DTB_NAME", ""))
     if v is not None:
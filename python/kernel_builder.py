@@ -2,34 +2,122 @@
 
 import argparse
 import os
+import shutil
 import subprocess
 import sys
+import time
 from utils.docker_utils import (
     build_docker_image,
     cleanup_docker,
+    docker_image_id,
+    docker_image_tag,
     ensure_docker_image,
+    export_docker_image,
+    import_docker_image,
     inspect_docker_image,
+    list_docker_images,
 )
-from utils.clone_utils import clone_kernel, clone_toolchain, clone_overlays, clone_device_tree
+from utils.artifact_index import build_artifact_index, lookup_artifact
+from utils.build_cache import (
+    DEFAULT_MAX_BYTES,
+    build_cache_root,
+    cached_manifest,
+    compute_cache_key,
+    restore_from_cache,
+    staged_module_versions,
+    store_in_cache,
+    toolchain_identity,
+    unshare_staged_outputs,
+)
+from utils.build_graph import LIGHT, BuildGraph
+from utils.build_matrix import FLAG_OPTIONS, MATRIX_ENV, VALUE_OPTIONS, load_matrix, run_matrix
+from utils.build_metrics import BuildMetrics, print_build_stats, step_stats_dir
+from utils.build_plan import BuildPlan
+from utils.build_queue import (
+    DEFAULT_MAX_RUNNING,
+    JOB_ENV,
+    PRIORITIES,
+    attach_job,
+    build_slot,
+    cancel_job,
+    hold_tree_lock,
+    print_queue_status,
+    run_daemon,
+    stop_daemon,
+    submit_and_follow,
+)
+from utils.ccache import (
+    CCACHE_DOCKER_DIR,
+    ccache_docker_volume_args,
+    ccache_env_commands,
+    ccache_prepare_commands,
+    ccache_stats_command,
+    ensure_ccache_dir,
+    host_ccache_available,
+)
+from utils.ctags_index import update_ctags_index
+from utils.distcc import (
+    DEFAULT_BIND as DISTCC_DEFAULT_BIND,
+    DISTCC_DOCKER_DIR,
+    DistccPool,
+    default_workers_path,
+    distcc_host_dir,
+    load_workers,
+    start_worker_container,
+    stop_worker_container,
+    worker_logs,
+)
+from utils.docker_session import DEFAULT_IDLE_TIMEOUT, BuildSession, parse_exec_stats, stop_named_session
+from utils.dtb_deps import changed_sources, find_dtbs, load_dtb_graph, refresh_cmd_file
+from utils.fdt import FdtError, merge_overlays, merged_dtb_path
+from utils.job_planner import kbuild_has_vmlinux_a, make_jobs_flags, parse_jobs, plan_jobs
+from utils.module_push import (
+    ModuleError,
+    built_modules,
+    changed_modules,
+    check_prepared,
+    extra_symbols,
+    kernel_release,
+    module_dirs,
+    push_modules,
+    stage_modules,
+)
+from utils.ram_build import DEFAULT_RAM_ROOT, drop_dangling_ram_link, finish_ram_build, parse_size, setup_ram_build
+from utils.resource_profiles import PROFILE_NAMES, print_throttling, resource_limits, throttling_report
+from utils.storage_gc import CATEGORIES as GC_CATEGORIES, SCAN_WORKERS, auto_gc, parse_quota, run_gc
+from utils.toolchain_registry import cached_toolchain, ensure_toolchain, print_toolchains, toolchain_gcc
+from utils.staging import stage_file
+from utils.sync_journal import (
+    CHANGES_NAME,
+    JOURNAL_NAME,
+    invalidate_journal,
+    plan_incremental_sync,
+    save_journal,
+)
+from utils.clone_utils import clone_kernel, clone_toolchain, clone_overlays, clone_device_tree, git_cache_docker_args
 from utils.kernel_tree import (
     cross_compile_prefix,
     ensure_jp7_toolchain_storage,
     is_nvbuild_kernel,
     jp7_toolchain_defaults,
-    locate_nvbuild_dtb,
+    kernel_modules_dir,
     nvbuild_image_path,
-    nvbuild_incremental_build_commands,
+    nvbuild_incremental_build_steps,
     nvbuild_incremental_ready,
     nvbuild_kernel_out_dir,
     nvbuild_kernel_src_dir,
     nvbuild_kernel_src_subdir,
     nvbuild_localversion_export,
+    nvbuild_out_config_path,
     normalize_localversion_suffix,
     kernel_tree_root,
+    validate_variant_name,
+    variant_build_dir,
+    variant_root,
 )
 
 
-def _host_cross_compile_suffix(toolchain_name: str | None, toolchain_version: str | None) -> str:
+def _host_cross_compile_prefix(toolchain_name: str | None, toolchain_version: str | None) -> str:
     """Absolute CROSS_COMPILE prefix for host builds (make -C kernel uses kernel cwd)."""
     if not toolchain_name or not toolchain_version:
         return ""
@@ -38,116 +126,290 @@ def _host_cross_compile_suffix(toolchain_name: str | None, toolchain_version: st
             "storage", "toolchains", toolchain_name, toolchain_version, "bin", toolchain_name
         )
     )
-    return f" CROSS_COMPILE={bindir}-"
+    return f"{bindir}-"
+
+
+def _host_cross_compile_suffix(toolchain_name: str | None, toolchain_version: str | None) -> str:
+    prefix = _host_cross_compile_prefix(toolchain_name, toolchain_version)
+    return f" CROSS_COMPILE={prefix}" if prefix else ""
+
+
+def _host_ccache_enabled(ccache: bool) -> bool:
+    if ccache and not host_ccache_available():
+        print("Warning: --ccache requested but ccache is not installed on the host; building without it.")
+        return False
+    return ccache
+
+
+def _lookup_variant_artifact(kernel_name, name, variant):
+    """*name* from the variant's O= dir, else from outside every build dir (OOT dtbs)."""
+    path = lookup_artifact(kernel_name, name, [variant_build_dir(kernel_name, variant)])
+    if path:
+        return path
+    top_level_dir = kernel_tree_root(kernel_name)
+    return lookup_artifact(
+        kernel_name,
+        name,
+        [top_level_dir],
+        exclude_roots=[
+            os.path.join(top_level_dir, "variants"),
+            # An in-place build of the same source is a different variant.
+            os.path.join(top_level_dir, "kernel", "kernel"),
+        ],
+    )
 
 
-def locate_dtb_file(kernel_name, dtb_name):
+def locate_dtb_file(kernel_name, dtb_name, variant=None):
     kernel_subdir = nvbuild_kernel_src_subdir(kernel_name) or "kernel"
     kernel_source_dir = os.path.join("storage", "kernels", kernel_name, "kernel", kernel_subdir)
     legacy_kernel_source_dir = os.path.join("storage", "kernels", kernel_name, "kernel", "kernel")
     top_level_dir = os.path.join("storage", "kernels", kernel_name)
     search_dirs = [kernel_source_dir, legacy_kernel_source_dir, top_level_dir]
 
-    for search_dir in search_dirs:
-        # Search for the specified DTB file within the directory
-        find_command = f"find {search_dir} -name {dtb_name}"
-        print(f"Running DTB search command: {find_command}")
-        try:
-            find_output = subprocess.check_output(find_command, shell=True, universal_newlines=True).strip()
-            if find_output:
-                print(f"DTB file found at: {find_output}")
-                return find_output.splitlines()[0]  # Return the first match found
-        except subprocess.CalledProcessError:
-            print(f"Info: DTB file {dtb_name} not found in {search_dir}.")
-
-    nvbuild_dtb = locate_nvbuild_dtb(kernel_name, dtb_name)
-    if nvbuild_dtb:
-        print(f"DTB file found at: {nvbuild_dtb}")
-        return nvbuild_dtb
+    # The artifact index resolves the first match in search_dirs order; it
+    # rescans the tree itself only when its recorded directories changed.
+    if variant:
+        dtb_path = _lookup_variant_artifact(kernel_name, dtb_name, variant)
+    else:
+        dtb_path = lookup_artifact(
+            kernel_name, dtb_name, search_dirs, exclude_roots=[os.path.join(top_level_dir, "variants")]
+        )
+    if dtb_path:
+        print(f"DTB file found at: {dtb_path}")
+        return dtb_path
 
     print(f"Warning: DTB file {dtb_name} not found in any of the search paths.")
     return None
 
 
+def locate_overlay_files(kernel_name, overlays, variant=None):
+    """Resolve comma-separated DTBO names to paths; returns None if any is missing."""
+    overlay_paths = []
+    for overlay_file in overlays.split(','):
+        if variant:
+            overlay_path = _lookup_variant_artifact(kernel_name, overlay_file, variant)
+        else:
+            overlay_path = lookup_artifact(
+                kernel_name, overlay_file, exclude_roots=[os.path.join(kernel_tree_root(kernel_name), "variants")]
+            )
+        if not overlay_path:
+            print(f"Error: Overlay file {overlay_file} not found.")
+            return None
+        overlay_paths.append(overlay_path)
+    return overlay_paths
+
+
+def _apply_overlays(base_dtb_path, overlay_paths):
+    """Merge overlays into <base>-merged.dtb; the base DTB is left as built."""
+    try:
+        merge_overlays(base_dtb_path, overlay_paths)
+    except (FdtError, OSError) as e:
+        print(f"Error: applying overlays to {base_dtb_path} failed: {e}")
+        return 1
+    return 0
+
+
+def _distcc_commands(distcc, cross, distcc_dir, docker=False):
+    """(env exports, setup commands, CROSS_COMPILE) for compiling through *distcc*."""
+    if distcc is None or not distcc.workers:
+        return [], [], cross
+    if not cross:
+        print("Warning: --distcc needs a cross toolchain (--toolchain-name/--toolchain-version); compiling locally.")
+        return [], [], cross
+    env, new_cross = distcc.env_commands(cross, distcc_dir, docker=docker)
+    return env, distcc.prepare_commands(cross, distcc_dir), new_cross
+
+
 def _repo_root() -> str:
     return os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
 
+def _empty_dir_command(path) -> str:
+    """Delete everything in *path*, which may be a --ram-build symlink (rm -rf would drop the link)."""
+    return f'if [ -d "{path}" ]; then find "{path}/" -mindepth 1 -delete; fi'
+
+
 def _nvbuild_threads(threads) -> str:
     return str(threads) if threads else "$(nproc)"
 
 
+def _stage_artifact(src, dst):
+    """Stage one build output into modules/boot; reflinked where possible, never hardlinked
+    (objcopy and make rewrite build outputs in place)."""
+    try:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        stats = stage_file(src, dst)
+    except OSError as e:
+        print(f"Error: staging {src} -> {dst} failed: {e}")
+        return 1
+    print(f"Staged {os.path.basename(dst)}: {stats.summary()}")
+    return 0
+
+
 def _copy_nvbuild_artifacts(kernel_name, arch, localversion, dtb_name, dry_run=False):
-    root = kernel_tree_root(kernel_name)
-    modules_boot = os.path.join(root, "modules", "boot")
-    image_src = nvbuild_image_path(kernel_name)
+    modules_boot = os.path.join(kernel_modules_dir(kernel_name), "boot")
     image_filename = f"Image.{localversion}" if localversion else "Image"
-    commands = [
-        f"mkdir -p {modules_boot}",
-        f"cp {image_src} {os.path.join(modules_boot, image_filename)}",
-    ]
+    artifacts = [(nvbuild_image_path(kernel_name), os.path.join(modules_boot, image_filename))]
     if dtb_name:
         dtb_path = locate_dtb_file(kernel_name, dtb_name)
         if dtb_path:
             suffix = normalize_localversion_suffix(localversion)
             new_dtb_name = f"{os.path.splitext(dtb_name)[0]}{suffix}.dtb"
-            commands.append(f"cp {dtb_path} {os.path.join(modules_boot, new_dtb_name)}")
+            artifacts.append((dtb_path, os.path.join(modules_boot, new_dtb_name)))
         else:
             print(f"Warning: DTB file {dtb_name} not found after nvbuild.")
-    combined = " && ".join(commands)
     if dry_run:
-        print(f"[Dry-run] Would run: {combined}")
+        for src, dst in artifacts:
+            print(f"[Dry-run] Would stage {src} -> {dst}")
         return 0
-    print(f"Staging build artifacts: {combined}")
-    return subprocess.run(combined, shell=True).returncode
+    for src, dst in artifacts:
+        rc = _stage_artifact(src, dst)
+        if rc != 0:
+            return rc
+    return 0
 
 
-def _nvbuild_append_build_steps(
-    parts: list[str],
+def _nvbuild_build_graph(
     *,
     kernel_name: str,
     arch: str,
     kernel_src: str,
+    tree_dir: str,
+    preamble: list[str],
     config: str | None,
     build_target: str | None,
     build_modules: bool,
     threads: int | None,
+    link_threads: int | None,
+    max_load: int | None,
     incremental: bool,
     clean: bool,
-) -> None:
-    """Extend *parts* with nvbuild full or incremental build commands."""
-    if build_target == "menuconfig":
-        return
-    if build_target == "mrproper":
-        return
+    ccache_prepare: list[str],
+    distcc_prepare: list[str],
+    localversion: str,
+    dtb_name: str | None,
+    dry_run: bool,
+) -> BuildGraph:
+    """nvbuild full or incremental build as a chain of steps, then artifact staging.
+
+    *preamble* (cd into the tree, CROSS_COMPILE / LOCALVERSION / ccache and
+    distcc exports) runs before every step's command. *tree_dir* is the tree
+    root as the commands see it.
+    """
+    jobs = threads or os.cpu_count() or 1
+    link_jobs = min(link_threads or jobs, jobs)
+    out_dir = f"{tree_dir}/kernel_out"
+    tree_io = {"inputs": (tree_dir,), "outputs": (out_dir,)}
+    graph = BuildGraph(budget=jobs + LIGHT, preamble=list(preamble))
+    tree = None
+    if distcc_prepare:
+        tree = graph.add("distcc-setup", " && ".join(distcc_prepare), kind="setup")
+    if ccache_prepare:
+        tree = graph.add("ccache-setup", " && ".join(ccache_prepare), deps=(tree,), kind="setup")
+    if clean and not build_target:
+        tree = graph.add("clean", _empty_dir_command("kernel_out"), deps=(tree,), kind="setup", outputs=(out_dir,))
 
     oot_only = build_target in ("modules",) or build_modules
     use_incremental = incremental and not clean and nvbuild_incremental_ready(kernel_name)
+    image_filename = f"Image.{localversion}" if localversion else "Image"
+    stage_description = f"copy {image_filename}{f' and {dtb_name}' if dtb_name else ''} into {kernel_modules_dir(kernel_name)}/boot"
+    stage_io = {
+        "inputs": (os.path.abspath(nvbuild_kernel_out_dir(kernel_name)),),
+        "outputs": (os.path.abspath(os.path.join(kernel_modules_dir(kernel_name), "boot")),),
+    }
+
+    # Everything that changes the build output besides the sources themselves.
+    sync_settings = "\n".join([arch, f"oot_only={oot_only}", *preamble])
+    sync_plan = plan_incremental_sync(kernel_name, sync_settings)
+
+    if use_incremental and sync_plan and sync_plan.up_to_date:
+        print("nvbuild: kernel_out is up to date (no source or settings changes since the last build); skipping make.")
+        graph = BuildGraph(budget=jobs + LIGHT)
+        graph.skip("nvbuild", "make", "kernel_out is up to date with the sources and settings")
+        graph.add(
+            "stage",
+            action=lambda: _copy_nvbuild_artifacts(kernel_name, arch, localversion, dtb_name, dry_run=dry_run),
+            kind="copy",
+            description=stage_description,
+            **stage_io,
+        )
+        return graph
 
     if use_incremental:
         print("Incremental build: reusing kernel_out/.config and object files.")
-        parts.extend(nvbuild_incremental_build_commands(arch, threads, oot_only=oot_only))
-        return
-
-    if incremental and not clean:
-        print(
-            "Incremental: no kernel_out/.config found — running full nvbuild "
-            "(use --no-incremental to force full rebuild when kernel_out exists)."
+        changes_file = None
+        if sync_plan and sync_plan.changed is not None:
+            changes_file = CHANGES_NAME
+            print(f"Change journal: {len(sync_plan.changed)} source file(s) changed since the last build.")
+        env, steps = nvbuild_incremental_build_steps(
+            arch,
+            threads,
+            oot_only=oot_only,
+            changes_file=changes_file,
+            link_threads=link_threads,
+            max_load=max_load,
+            split_link=kbuild_has_vmlinux_a(nvbuild_kernel_src_dir(kernel_name) or ""),
         )
+        graph.preamble.extend(env)
+        for name, command in steps:
+            if name == "sync":
+                if changes_file and not sync_plan.changed:
+                    graph.skip(name, "sync", "no source changes in the change journal")
+                    continue
+                tree = graph.add(name, command, deps=(tree,), kind="sync", **tree_io)
+            else:
+                weight = link_jobs if name in ("kernel", "link") else jobs
+                tree = graph.add(name, command, deps=(tree,), weight=weight, kind="make", **tree_io)
+    else:
+        if not dry_run:
+            invalidate_journal(kernel_name)
+        if incremental and not clean:
+            print(
+                "Incremental: no kernel_out/.config found — running full nvbuild "
+                "(use --no-incremental to force full rebuild when kernel_out exists)."
+            )
 
-    if config:
-        parts.append(f"make -C {kernel_src} ARCH={arch} {config}")
+        if config:
+            tree = graph.add(
+                "config", f"make -C {kernel_src} ARCH={arch} {config}", deps=(tree,), weight=jobs, kind="make", **tree_io
+            )
 
-    if oot_only:
-        headers = os.path.join(
-            nvbuild_kernel_out_dir(kernel_name),
-            "kernel",
-            nvbuild_kernel_src_subdir(kernel_name),
+        if oot_only:
+            headers = os.path.join(
+                nvbuild_kernel_out_dir(kernel_name),
+                "kernel",
+                nvbuild_kernel_src_subdir(kernel_name),
+            )
+            tree = graph.add(
+                "oot-modules",
+                f'export KERNEL_HEADERS="{headers}" && ./nvbuild.sh -m',
+                deps=(tree,),
+                weight=jobs,
+                kind="make",
+                **tree_io,
+            )
+        else:
+            tree = graph.add("nvbuild", "./nvbuild.sh", deps=(tree,), weight=jobs, kind="make", **tree_io)
+
+    if sync_plan:
+        graph.add(
+            "sync-journal",
+            action=lambda: save_journal(kernel_name, sync_plan.snapshot, sync_settings) or 0,
+            deps=(tree,),
+            kind="journal",
+            description=f"record {len(sync_plan.snapshot)} source file stamps in {JOURNAL_NAME}",
         )
-        parts.append(f'export KERNEL_HEADERS="{headers}"')
-        parts.append("./nvbuild.sh -m")
-    else:
-        parts.append("./nvbuild.sh")
+    graph.add(
+        "stage",
+        action=lambda: _copy_nvbuild_artifacts(kernel_name, arch, localversion, dtb_name, dry_run=dry_run),
+        deps=(tree,),
+        kind="copy",
+        description=stage_description,
+        **stage_io,
+    )
+    if ccache_prepare:
+        _add_ccache_stats_step(graph)
+    return graph
 
 
 def compile_nvbuild_kernel_host(
@@ -158,11 +420,17 @@ def compile_nvbuild_kernel_host(
     config=None,
     build_target=None,
     threads=None,
+    link_threads=None,
+    max_load=None,
     clean=True,
     incremental=True,
     localversion="",
     dtb_name=None,
     build_modules=False,
+    ccache=False,
+    distcc=None,
+    metrics=None,
+    plan=None,
     dry_run=False,
 ):
     if not is_nvbuild_kernel(kernel_name):
@@ -188,55 +456,70 @@ def compile_nvbuild_kernel_host(
         return 1
 
     parts = [f"cd {root}"]
+    distcc_env, distcc_prepare, cross = _distcc_commands(distcc, cross, os.path.abspath(distcc_host_dir()))
+    parts.extend(distcc_env)
+    ccache_prepare = []
+    if _host_ccache_enabled(ccache):
+        ccache_dir = ensure_ccache_dir()
+        ccache_prepare = ccache_prepare_commands(cross, ccache_dir)
+        ccache_env, cross = ccache_env_commands(cross, ccache_dir)
+        parts.extend(ccache_env)
     parts.append(f'export CROSS_COMPILE="{cross}"')
     lv_export = nvbuild_localversion_export(localversion)
     if lv_export:
         parts.append(lv_export)
 
-    if clean and not build_target:
-        parts.append(f"rm -rf {nvbuild_kernel_out_dir(kernel_name)}")
-
     if build_target == "menuconfig":
         parts.append(
             f"make -C {kernel_src} ARCH={arch} menuconfig"
         )
         combined = " && ".join(parts)
+        if plan is not None:
+            plan.add_step("menuconfig", "interactive", command=combined, workdir=os.getcwd())
+            return 0
         if dry_run:
             print(f"[Dry-run] Would run: {combined}")
             return 0
         return subprocess.run(combined, shell=True).returncode
 
     if build_target == "mrproper":
-        parts.append(f"rm -rf {nvbuild_kernel_out_dir(kernel_name)}")
+        parts.append(_empty_dir_command(nvbuild_kernel_out_dir(kernel_name)))
         combined = " && ".join(parts)
+        if plan is not None:
+            plan.add_step("mrproper", "setup", command=combined, workdir=os.getcwd(), outputs=(f"{root}/kernel_out",))
+            return 0
         if dry_run:
             print(f"[Dry-run] Would run: {combined}")
             return 0
         return subprocess.run(combined, shell=True).returncode
 
-    _nvbuild_append_build_steps(
-        parts,
+    graph = _nvbuild_build_graph(
         kernel_name=kernel_name,
         arch=arch,
         kernel_src=kernel_src,
+        tree_dir=root,
+        preamble=parts,
         config=config,
         build_target=build_target,
         build_modules=build_modules,
         threads=threads,
+        link_threads=link_threads,
+        max_load=max_load,
         incremental=incremental,
         clean=clean,
+        ccache_prepare=ccache_prepare,
+        distcc_prepare=distcc_prepare,
+        localversion=localversion,
+        dtb_name=dtb_name,
+        dry_run=dry_run,
     )
-
-    combined = " && ".join(parts)
-    if dry_run:
-        print(f"[Dry-run] Would run: {combined}")
-        return _copy_nvbuild_artifacts(kernel_name, arch, localversion, dtb_name, dry_run=True)
-
-    print(f"Running nvbuild command: {combined}")
-    rc = subprocess.run(combined, shell=True).returncode
-    if rc != 0:
-        return rc
-    return _copy_nvbuild_artifacts(kernel_name, arch, localversion, dtb_name)
+    if plan is not None:
+        plan.add_graph(graph, workdir=os.getcwd())
+        return 0
+    rc = graph.run(_host_spawn, dry_run=dry_run)
+    if metrics is not None:
+        metrics.add_steps(graph.results)
+    return rc
 
 
 def compile_nvbuild_kernel_docker(
@@ -247,11 +530,21 @@ def compile_nvbuild_kernel_docker(
     config=None,
     build_target=None,
     threads=None,
+    link_threads=None,
+    max_load=None,
     clean=True,
     incremental=True,
     localversion="",
     dtb_name=None,
     build_modules=False,
+    ccache=False,
+    distcc=None,
+    session_name=None,
+    session_idle_timeout=None,
+    ram_root=None,
+    resources=None,
+    metrics=None,
+    plan=None,
     dry_run=False,
 ):
     if not is_nvbuild_kernel(kernel_name):
@@ -262,58 +555,96 @@ def compile_nvbuild_kernel_docker(
     volume_args = [
         "-v", f"{kernels_dir_abs}:/builder/kernels",
         "-v", f"{toolchains_dir_abs}:/builder/toolchains",
+        # Clones borrow objects from storage/git-cache by absolute path (setlocalversion runs git).
+        *git_cache_docker_args(),
     ]
-
-    docker_tty = ["-it"] if (sys.stdin.isatty() and sys.stdout.isatty()) else []
-    docker_command_base = [
-        "docker", "run", "--rm", *docker_tty, "--init", "-u", "0:0",
-        "--cpus=" + str(os.cpu_count()),
-    ] + volume_args + [
-        "-w", f"/builder/kernels/{kernel_name}",
-        "kernel_builder_jp7", "/bin/bash", "-c",
-    ]
+    if ccache:
+        volume_args += ccache_docker_volume_args()
+    if ram_root:
+        # kernel_out is a symlink to this absolute host path (--ram-build).
+        volume_args += ["-v", f"{ram_root}:{ram_root}"]
 
     if not toolchain_name or not toolchain_version:
         toolchain_name, toolchain_version = jp7_toolchain_defaults()
 
     cross = cross_compile_prefix(toolchain_name, toolchain_version, docker=True)
     kernel_src_rel = f"kernel/{nvbuild_kernel_src_subdir(kernel_name)}"
-    parts = [f'export CROSS_COMPILE="{cross}"']
+    tree_docker = f"/builder/kernels/{kernel_name}"
+    parts = []
+    distcc_env, distcc_prepare, cross = _distcc_commands(distcc, cross, DISTCC_DOCKER_DIR, docker=True)
+    if distcc_env:
+        parts.extend(distcc_env)
+        volume_args += distcc.docker_args()
+
+    session = BuildSession(
+        docker_image_tag(jp7=True),
+        volume_args,
+        user="0:0",
+        cpus=resources.cpus if resources else None,
+        resource_args=resources.docker_args() if resources else None,
+        name=session_name,
+        idle_timeout=session_idle_timeout,
+        dry_run=dry_run,
+    )
+    if plan is None and not session.is_warm():
+        if ensure_docker_image(jp7=True, dry_run=dry_run) != 0:
+            return 1
+
+    ccache_prepare = []
+    if ccache:
+        ccache_prepare = ccache_prepare_commands(cross, CCACHE_DOCKER_DIR)
+        ccache_env, cross = ccache_env_commands(cross, CCACHE_DOCKER_DIR)
+        parts.extend(ccache_env)
+    parts.append(f'export CROSS_COMPILE="{cross}"')
     lv_export = nvbuild_localversion_export(localversion)
     if lv_export:
         parts.append(lv_export)
 
-    if clean and not build_target:
-        parts.append("rm -rf kernel_out")
-
-    if build_target == "menuconfig":
-        parts.append(f"make -C {kernel_src_rel} ARCH={arch} menuconfig")
-    elif build_target == "mrproper":
-        parts.append("rm -rf kernel_out")
-    else:
-        _nvbuild_append_build_steps(
-            parts,
-            kernel_name=kernel_name,
-            arch=arch,
-            kernel_src=kernel_src_rel,
-            config=config,
-            build_target=build_target,
-            build_modules=build_modules,
-            threads=threads,
-            incremental=incremental,
-            clean=clean,
-        )
-
-    combined = " && ".join(parts)
-    if dry_run:
-        print(f"[Dry-run] Would run nvbuild docker: {' '.join(docker_command_base + [combined])}")
-        return _copy_nvbuild_artifacts(kernel_name, arch, localversion, dtb_name, dry_run=True)
+    if build_target in ("menuconfig", "mrproper"):
+        if build_target == "menuconfig":
+            parts.append(f"make -C {kernel_src_rel} ARCH={arch} menuconfig")
+        else:
+            parts.append(_empty_dir_command("kernel_out"))
+        if plan is not None:
+            plan.add_step(
+                build_target,
+                "interactive" if build_target == "menuconfig" else "setup",
+                command=" && ".join(parts),
+                workdir=tree_docker,
+                container=session.describe(),
+            )
+            return 0
+        with session:
+            return session.exec(" && ".join(parts), workdir=tree_docker, label="nvbuild")
 
-    print(f"Running Docker nvbuild command: {' '.join(docker_command_base + [combined])}")
-    rc = subprocess.Popen(docker_command_base + [combined]).wait()
-    if rc != 0:
-        return rc
-    return _copy_nvbuild_artifacts(kernel_name, arch, localversion, dtb_name)
+    graph = _nvbuild_build_graph(
+        kernel_name=kernel_name,
+        arch=arch,
+        kernel_src=kernel_src_rel,
+        tree_dir=tree_docker,
+        preamble=parts,
+        config=config,
+        build_target=build_target,
+        build_modules=build_modules,
+        threads=threads,
+        link_threads=link_threads,
+        max_load=max_load,
+        incremental=incremental,
+        clean=clean,
+        ccache_prepare=ccache_prepare,
+        distcc_prepare=distcc_prepare,
+        localversion=localversion,
+        dtb_name=dtb_name,
+        dry_run=dry_run,
+    )
+    if plan is not None:
+        plan.add_graph(graph, workdir=tree_docker, container=session.describe())
+        return 0
+    spawn, usage = _session_step_runner(session, kernel_name, workdir=tree_docker)
+    rc = _run_in_session(session, lambda: graph.run(spawn, dry_run=dry_run, usage=usage), resources, metrics)
+    if metrics is not None:
+        metrics.add_steps(graph.results)
+    return rc
 
 
 def _host_kernel_path_to_docker(host_path: str, kernels_dir_abs: str) -> str:
@@ -340,7 +671,203 @@ def _host_kernel_path_to_docker(host_path: str, kernels_dir_abs: str) -> str:
     return s
 
 
-def compile_kernel_host(kernel_name, arch, toolchain_name=None, toolchain_version=None, config=None, generate_ctags=False, build_target=None, threads=None, clean=True, incremental=True, use_current_config=False, localversion="", dtb_name=None, build_dtb=False, build_modules=False, overlays=None, dry_run=False):
+_INTERACTIVE_TARGETS = ("menuconfig", "nconfig", "xconfig", "gconfig", "config")
+
+
+def _kernel_build_graph(
+    *,
+    jobs,
+    base_command,
+    dtbs_command,
+    modules_command,
+    modules_dir,
+    headers_path,
+    source_dir,
+    object_dir,
+    ctags_action=None,
+    link_jobs=None,
+    split_link=False,
+    config=None,
+    use_current_config=False,
+    build_target=None,
+    clean=True,
+    incremental=True,
+    build_dtb=False,
+    build_modules=False,
+    ccache_env=(),
+    ccache_prepare=(),
+    distcc_env=(),
+    distcc_prepare=(),
+):
+    """Make steps shared by host and Docker builds.
+
+    Steps that run make in the kernel tree are chained in order, dtbs and
+    modules_install included; only ctags and staging, which read the finished
+    tree, run alongside them. With *link_jobs* below *jobs* the kernel target
+    links at that -j, after a "compile" step that builds vmlinux.a at the full
+    -j if *split_link*. Returns (graph, compiled, dtbs) where *compiled* is
+    the last tree step and *dtbs* the dtbs step or None. *source_dir* and
+    *object_dir* (the O= dir, or the source dir itself) are paths as the
+    commands see them.
+    """
+    tree_io = {"inputs": (source_dir, f"{object_dir}/.config"), "outputs": (object_dir,)}
+    # distcc's PATH export first: ccache's wrapper must come ahead of it on PATH.
+    graph = BuildGraph(budget=jobs + LIGHT, preamble=[*distcc_env, *ccache_env])
+    tree = None
+    if distcc_prepare:
+        tree = graph.add("distcc-setup", " && ".join(distcc_prepare), kind="setup")
+    if ccache_prepare:
+        tree = graph.add("ccache-setup", " && ".join(ccache_prepare), deps=(tree,), kind="setup")
+    if clean and not incremental:
+        tree = graph.add("mrproper", f"{base_command} mrproper", deps=(tree,), weight=jobs, kind="make", outputs=(object_dir,))
+    if config or use_current_config:
+        tree = graph.add(
+            "config",
+            f"{base_command} {config or 'oldconfig'}",
+            deps=(tree,),
+            weight=jobs,
+            kind="make",
+            inputs=(source_dir,),
+            outputs=(f"{object_dir}/.config",),
+        )
+    if build_modules:
+        tree = graph.add("modules", modules_command, deps=(tree,), weight=jobs, kind="make", **tree_io)
+
+    install_modules = False
+    for target in build_target.split(',') if build_target else ["kernel"]:
+        if target == "kernel":
+            if link_jobs and link_jobs < jobs:
+                name = "kernel"
+                if split_link:
+                    tree = graph.add("compile", f"{base_command} vmlinux.a", deps=(tree,), weight=jobs, kind="make", **tree_io)
+                    name = "link"
+                # make takes the last -j on its command line.
+                tree = graph.add(name, f"{base_command} -j{link_jobs}", deps=(tree,), weight=link_jobs, kind="make", **tree_io)
+            else:
+                tree = graph.add("kernel", base_command, deps=(tree,), weight=jobs, kind="make", **tree_io)
+            install_modules = True
+        elif target == "modules":
+            tree = graph.add("modules", f"{base_command} modules", deps=(tree,), weight=jobs, kind="make", **tree_io)
+            install_modules = True
+        elif target == "headers_install":
+            tree = graph.add(
+                "headers_install",
+                f"mkdir -p {headers_path} && {base_command} headers_install INSTALL_HDR_PATH={headers_path}",
+                deps=(tree,),
+                weight=jobs,
+                kind="make",
+                inputs=tree_io["inputs"],
+                outputs=(headers_path,),
+            )
+        elif target in _INTERACTIVE_TARGETS:
+            # Owns the terminal: the full budget keeps anything else from starting.
+            tree = graph.add(target, f"{base_command} {target}", deps=(tree,), weight=graph.budget, kind="interactive", **tree_io)
+        else:
+            tree = graph.add(target, f"{base_command} {target}", deps=(tree,), weight=jobs, kind="make", **tree_io)
+
+    if ctags_action:
+        # Indexes what the build compiled, so it waits for the .o.cmd files.
+        graph.add(
+            "ctags",
+            action=ctags_action,
+            deps=(tree,),
+            kind="ctags",
+            description="ctags over the sources and headers listed in the build's .o.cmd files",
+            inputs=(object_dir,),
+        )
+
+    # Two makes in one kbuild tree race on its generated files (include/config,
+    # scripts, .tmp_*), even when one only re-checks prerequisites; dtbs and
+    # modules_install run one after the other.
+    dtbs = graph.add("dtbs", dtbs_command, deps=(tree,), weight=jobs, kind="make", **tree_io) if build_dtb else None
+    if install_modules:
+        graph.add(
+            "modules_install",
+            f"{base_command} modules_install INSTALL_MOD_PATH={modules_dir}",
+            deps=(dtbs or tree,),
+            kind="install",
+            inputs=(object_dir,),
+            outputs=(modules_dir,),
+        )
+    return graph, tree, dtbs
+
+
+def _add_ccache_stats_step(graph):
+    graph.add("ccache-stats", ccache_stats_command(), deps=tuple(graph.steps), kind="report")
+
+
+def _host_spawn(command, step):
+    return subprocess.Popen(command, shell=True)
+
+
+def _session_step_runner(session, kernel_name, *, workdir="/builder", env=None):
+    """spawn/usage callbacks that run graph steps in *session*.
+
+    Each step leaves its in-container CPU and I/O figures in
+    build_metrics/.steps/<step>.stats (inside the mounted kernels dir).
+    """
+    stats_dir = step_stats_dir(kernel_name)
+    stats_dir_docker = _host_kernel_path_to_docker(
+        os.path.abspath(stats_dir), os.path.abspath(os.path.join("storage", "kernels"))
+    )
+
+    def spawn(command, step):
+        # Started on first use: an up-to-date build never needs the container.
+        if session.start() != 0:
+            raise RuntimeError(f"could not start build session '{session.name}'")
+        # Created from the host so a root nvbuild session does not own the dir.
+        os.makedirs(stats_dir, exist_ok=True)
+        stats_file = os.path.join(stats_dir, f"{step.name}.stats")
+        if os.path.exists(stats_file):
+            os.remove(stats_file)
+        return session.popen(
+            command,
+            workdir=workdir,
+            label=step.name,
+            env=env,
+            tty=None if step.kind == "interactive" else False,
+            stats_path=f"{stats_dir_docker}/{step.name}.stats",
+        )
+
+    def usage(step):
+        return parse_exec_stats(os.path.join(stats_dir, f"{step.name}.stats"))
+
+    return spawn, usage
+
+
+def _run_in_session(session, run, resources=None, metrics=None):
+    """run() with *session* stopped afterwards; under a --resource-profile, report its throttling."""
+    with session:
+        if resources is None or session.dry_run:
+            return run()
+        if session.start() != 0:
+            print(f"Error: could not start build session '{session.name}'.")
+            return 1
+        # Counters of a warm session are cumulative; only this build's share is reported.
+        before = session.cgroup_stats()
+        rc = run()
+        report = throttling_report(before, session.cgroup_stats())
+    print_throttling(resources, report)
+    if metrics is not None:
+        metrics.context["resources"] = {**resources.record(), "throttling": report}
+    return rc
+
+
+def _prepare_variant_build_dir(kernel_name, variant, dry_run=False):
+    """Create the variant's O= dir; kbuild refuses O= while the source tree holds a build."""
+    if not variant:
+        return
+    in_tree_config = os.path.join(kernel_tree_root(kernel_name), "kernel", "kernel", ".config")
+    if os.path.exists(in_tree_config):
+        print(
+            f"Warning: {in_tree_config} exists; kbuild rejects O= builds until the in-place build "
+            "is cleaned (compile --build-target mrproper without --variant)."
+        )
+    if not dry_run:
+        os.makedirs(variant_build_dir(kernel_name, variant), exist_ok=True)
+
+
+def compile_kernel_host(kernel_name, arch, toolchain_name=None, toolchain_version=None, config=None, generate_ctags=False, build_target=None, threads=None, link_threads=None, max_load=None, clean=True, incremental=True, use_current_config=False, localversion="", dtb_name=None, build_dtb=False, build_modules=False, overlays=None, ccache=False, distcc=None, variant=None, metrics=None, plan=None, dry_run=False):
     if is_nvbuild_kernel(kernel_name):
         return compile_nvbuild_kernel_host(
             kernel_name=kernel_name,
@@ -350,160 +877,158 @@ def compile_kernel_host(kernel_name, arch, toolchain_name=None, toolchain_versio
             config=config,
             build_target=build_target,
             threads=threads,
+            link_threads=link_threads,
+            max_load=max_load,
             clean=clean,
             incremental=incremental,
             localversion=localversion,
             dtb_name=dtb_name,
             build_modules=build_modules or build_dtb,
+            ccache=ccache,
+            distcc=distcc,
+            metrics=metrics,
+            plan=plan,
             dry_run=dry_run,
         )
     # Compiles the kernel directly on the host system.
     kernels_dir = os.path.join("storage", "kernels")
     kernel_dir = os.path.join(kernels_dir, kernel_name, "kernel", "kernel")
-    cc_suffix = _host_cross_compile_suffix(toolchain_name, toolchain_version)
+    # Absolute: make -C changes cwd, the cp/mkdir steps run from the repo root.
+    modules_dir = os.path.abspath(kernel_modules_dir(kernel_name, variant))
+    # --variant builds into its own O= dir so variants never share objects.
+    out_dir = os.path.abspath(variant_build_dir(kernel_name, variant)) if variant else None
+    _prepare_variant_build_dir(kernel_name, variant, dry_run=dry_run)
+    cross = _host_cross_compile_prefix(toolchain_name, toolchain_version)
+    distcc_env, distcc_prepare, cross = _distcc_commands(distcc, cross, os.path.abspath(distcc_host_dir()))
+    ccache_env, ccache_prepare = [], []
+    if _host_ccache_enabled(ccache):
+        ccache_dir = ensure_ccache_dir()
+        ccache_prepare = ccache_prepare_commands(cross, ccache_dir)
+        ccache_env, cross = ccache_env_commands(cross, ccache_dir)
+    cc_suffix = f" CROSS_COMPILE={cross}" if cross else ""
+    jobs = threads or os.cpu_count() or 1
+    make_jobs = make_jobs_flags(threads, max_load) if threads else '$(nproc)'
 
     # Base command for invoking make
-    base_command = f"make -C {kernel_dir} ARCH={arch} -j{threads if threads else '$(nproc)'}{cc_suffix}"
+    base_command = f"make -C {kernel_dir} ARCH={arch} -j{make_jobs}{cc_suffix}"
+    if out_dir:
+        base_command += f" O={out_dir}"
 
     if localversion:
         base_command += f" LOCALVERSION=-{localversion}"
 
     # If use_current_config is specified, get the current kernel config and place it in the kernel directory
     if use_current_config:
-        current_config_path = os.path.join(kernel_dir, ".config")
+        current_config_path = os.path.join(out_dir or kernel_dir, ".config")
         zcat_command = f"zcat /proc/config.gz > {current_config_path}"
         print(f"Fetching current kernel config: {zcat_command}")
         if not dry_run:
             subprocess.run(zcat_command, shell=True, check=True)
 
-    # Combine mrproper (if enabled), configuration, and kernel compilation into a single command
-    combined_command = ""
-    if clean and not incremental:
-        combined_command += f"{base_command} mrproper && "
-    if config or use_current_config:
-        combined_command += f"{base_command} {config or 'oldconfig'} && "
-
-    if build_dtb:
-        top_level_makefile = os.path.join(kernels_dir, kernel_name, "Makefile")
-        if os.path.exists(top_level_makefile):
-            make_dir = os.path.join(kernels_dir, kernel_name)
-
-            dtbs_make_command = f"make -C {make_dir} ARCH={arch} -j{threads if threads else '$(nproc)'}{cc_suffix}"
-
-            dtbs_command = f"{dtbs_make_command} dtbs KERNEL_HEADERS={kernel_dir}"
-            combined_command += f"{dtbs_command} && "
-        else:
-             combined_command += f"{base_command} dtbs && "
+    top_level_makefile = os.path.join(kernels_dir, kernel_name, "Makefile")
+    if os.path.exists(top_level_makefile):
+        make_dir = os.path.join(kernels_dir, kernel_name)
+        top_make_command = f"make -C {make_dir} ARCH={arch} -j{make_jobs}{cc_suffix}"
+        if out_dir:
+            top_make_command += f" KERNEL_OUTPUT={out_dir}"
+        dtbs_command = f"{top_make_command} dtbs KERNEL_HEADERS={kernel_dir}"
+        modules_command = f"{top_make_command} modules KERNEL_HEADERS={kernel_dir}"
+    else:
+        dtbs_command = f"{base_command} dtbs"
+        modules_command = f"{base_command} modules"
 
-    if build_modules:
-        top_level_makefile = os.path.join(kernels_dir, kernel_name, "Makefile")
-        if os.path.exists(top_level_makefile):
-            make_dir = os.path.join(kernels_dir, kernel_name)
+    ctags_action = None
+    if generate_ctags:
+        ctags_action = lambda: update_ctags_index(
+            kernel_name, [out_dir or kernel_dir], lambda command, label: subprocess.run(command, shell=True).returncode
+        )
 
-            modules_make_command = f"make -C {make_dir} ARCH={arch} -j{threads if threads else '$(nproc)'}{cc_suffix}"
+    graph, compiled, dtbs = _kernel_build_graph(
+        jobs=jobs,
+        base_command=base_command,
+        dtbs_command=dtbs_command,
+        modules_command=modules_command,
+        modules_dir=modules_dir,
+        headers_path=os.path.abspath(os.path.join(variant_root(kernel_name, variant), "headers")) if variant else "../headers",
+        source_dir=os.path.abspath(kernel_dir),
+        object_dir=out_dir or os.path.abspath(kernel_dir),
+        ctags_action=ctags_action,
+        link_jobs=link_threads,
+        split_link=kbuild_has_vmlinux_a(kernel_dir),
+        config=config,
+        use_current_config=use_current_config,
+        build_target=build_target,
+        clean=clean,
+        incremental=incremental,
+        build_dtb=build_dtb,
+        build_modules=build_modules,
+        ccache_env=ccache_env,
+        ccache_prepare=ccache_prepare,
+        distcc_env=distcc_env,
+        distcc_prepare=distcc_prepare,
+    )
 
-            modules_command = f"{modules_make_command} modules KERNEL_HEADERS={kernel_dir}"
-            combined_command += f"{modules_command} && "
-        else:
-             combined_command += f"{base_command} modules && "
-
-    if build_target:
-        targets = build_target.split(',')
-        for target in targets:
-            if target == "kernel":
-                combined_command += f"{base_command} && "
-                combined_command += f"{base_command} modules_install INSTALL_MOD_PATH=../modules && "
-                combined_command += f"mkdir -p ../modules/boot && "
-                combined_command += f"cp {kernel_dir}/arch/{arch}/boot/Image ../modules/boot/Image.{localversion} && "
-                # Copy the DTB file with modified filename to include localversion
-                if dtb_name:
-                    dtb_path = locate_dtb_file(kernel_name, dtb_name)
-                    if dtb_path:
-                        if overlays:
-                            overlay_files = overlays.split(',')
-                            overlay_paths = []
-                            kernel_source_dir = os.path.join("storage", "kernels", kernel_name)
-                            for overlay_file in overlay_files:
-                                find_command = f"find {kernel_source_dir} -name {overlay_file}"
-                                try:
-                                    find_output = subprocess.check_output(find_command, shell=True, universal_newlines=True).strip()
-                                    if find_output:
-                                        overlay_paths.append(find_output.splitlines()[0])
-                                    else:
-                                        print(f"Error: Overlay file {overlay_file} not found.")
-                                        return 1
-                                except subprocess.CalledProcessError:
-                                    print(f"Error: Failed to find overlay file {overlay_file}.")
-                                    return 1
-
-                            output_dtb_name = f"{os.path.splitext(dtb_name)[0]}-merged.dtb"
-                            output_dtb_path = os.path.join(os.path.dirname(dtb_path), output_dtb_name)
-
-                            fdtoverlay_command = f"fdtoverlay -i {dtb_path} -o {output_dtb_path} {' '.join(overlay_paths)}"
-                            print(f"Running fdtoverlay command: {fdtoverlay_command}")
-                            if not dry_run:
-                                try:
-                                    subprocess.run(fdtoverlay_command, shell=True, check=True)
-                                except FileNotFoundError:
-                                    print("Error: fdtoverlay command not found. Please install it.")
-                                    return 1
-                                except subprocess.CalledProcessError as e:
-                                    print(f"Error running fdtoverlay: {e}")
-                                    return 1
-
-                            print(f"Renaming {output_dtb_path} to {dtb_path}")
-                            if not dry_run:
-                                os.rename(output_dtb_path, dtb_path)
-
-                        new_dtb_name = f"{os.path.splitext(dtb_name)[0]}{localversion}.dtb"
-                        combined_command += f"cp {dtb_path} ../modules/boot/{new_dtb_name} && "
-                    else:
-                        print(f"Warning: DTB file {dtb_name} not found in the kernel directory.")
-            elif target == "modules":
-                combined_command += f"{base_command} modules && "
-                combined_command += f"{base_command} modules_install INSTALL_MOD_PATH=../modules && "
-            elif target == "headers_install":
-                headers_path = f"../headers"
-                combined_command += f"mkdir -p {headers_path} && "
-                combined_command += f"{base_command} headers_install INSTALL_HDR_PATH={headers_path} && "
-            else:
-                # General case for any target, including menuconfig
-                combined_command += f"{base_command} {target} && "
-    else:
-        # If no specific target is provided, build the kernel and copy the Image
-        combined_command += f"{base_command} && "
-        combined_command += f"{base_command} modules_install INSTALL_MOD_PATH=../modules && "
-        combined_command += f"mkdir -p ../modules/boot && "
-         # Conditional logic for the kernel image filename
-        image_filename = f"Image.{localversion}" if localversion else "Image"
-        combined_command += f"cp {kernel_dir}/arch/{arch}/boot/Image ../modules/boot/{image_filename} && "
-
-        # Copy the DTB file with modified filename to include localversion
+    # Stage the kernel Image and DTB (with localversion in the file names)
+    targets = build_target.split(',') if build_target else []
+    if not targets or "kernel" in targets:
+        # --build-target kernel always suffixes the Image; a plain build only with a localversion
+        image_filename = f"Image.{localversion}" if (localversion or targets) else "Image"
+        image_src = f"{out_dir or kernel_dir}/arch/{arch}/boot/Image"
+        graph.add(
+            "stage-image",
+            action=lambda: _stage_artifact(image_src, f"{modules_dir}/boot/{image_filename}"),
+            deps=(compiled,),
+            kind="copy",
+            description=f"stage {image_src} -> {modules_dir}/boot/{image_filename}",
+            inputs=(image_src,),
+            outputs=(f"{modules_dir}/boot/{image_filename}",),
+        )
         if dtb_name:
-            dtb_path = locate_dtb_file(kernel_name, dtb_name)
+            dtb_path = locate_dtb_file(kernel_name, dtb_name, variant)
             if dtb_path:
+                overlay_step = None
+                staged_dtb_path = dtb_path
+                if overlays and targets:
+                    overlay_paths = locate_overlay_files(kernel_name, overlays, variant)
+                    if overlay_paths is None:
+                        return 1
+                    staged_dtb_path = merged_dtb_path(dtb_path)
+                    overlay_step = graph.add(
+                        "overlays",
+                        action=lambda: _apply_overlays(dtb_path, overlay_paths),
+                        deps=(compiled, dtbs),
+                        kind="dtb",
+                        description=f"merge {overlays} into {staged_dtb_path}",
+                        inputs=(dtb_path, *overlay_paths),
+                        outputs=(staged_dtb_path,),
+                    )
                 new_dtb_name = f"{os.path.splitext(dtb_name)[0]}{localversion}.dtb"
-                combined_command += f"cp {dtb_path} ../modules/boot/{new_dtb_name}"
-
-    # Remove any trailing '&&'
-    combined_command = combined_command.rstrip(' &&')
+                graph.add(
+                    "stage-dtb",
+                    action=lambda: _stage_artifact(staged_dtb_path, f"{modules_dir}/boot/{new_dtb_name}"),
+                    deps=(compiled, dtbs, overlay_step),
+                    kind="copy",
+                    description=f"stage {staged_dtb_path} -> {modules_dir}/boot/{new_dtb_name}",
+                    inputs=(staged_dtb_path,),
+                    outputs=(f"{modules_dir}/boot/{new_dtb_name}",),
+                )
+            else:
+                print(f"Warning: DTB file {dtb_name} not found in the kernel directory.")
 
-    # Adjust permissions before running ctags to avoid permission issues
-    if generate_ctags:
-        combined_command += f" && chmod -R u+w {kernel_dir} && ctags -R -f ../tags {kernel_dir}"
+    if ccache_prepare:
+        _add_ccache_stats_step(graph)
 
-    # Run the combined command directly on the host
-    if dry_run:
-        print(f"[Dry-run] Would run combined command: {combined_command}")
+    if plan is not None:
+        plan.add_graph(graph, workdir=os.getcwd())
         return 0
-    print(f"Running combined command: {combined_command}")
-    proc = subprocess.run(combined_command, shell=True)
-    return proc.returncode
+    rc = graph.run(_host_spawn, dry_run=dry_run)
+    if metrics is not None:
+        metrics.add_steps(graph.results)
+    return rc
 
 
-def compile_kernel_docker(kernel_name, arch, toolchain_name=None, toolchain_version=None, rpi_model=None, config=None, generate_ctags=False, build_target=None, threads=None, clean=True, incremental=True, use_current_config=False, localversion="", dtb_name=None, build_dtb=False, build_modules=False, overlays=None, dry_run=False):
+def compile_kernel_docker(kernel_name, arch, toolchain_name=None, toolchain_version=None, rpi_model=None, config=None, generate_ctags=False, build_target=None, threads=None, link_threads=None, max_load=None, clean=True, incremental=True, use_current_config=False, localversion="", dtb_name=None, build_dtb=False, build_modules=False, overlays=None, ccache=False, distcc=None, variant=None, session_name=None, session_idle_timeout=None, ram_root=None, resources=None, metrics=None, plan=None, dry_run=False):
     if is_nvbuild_kernel(kernel_name):
-        ensure_docker_image(jp7=True, dry_run=dry_run)
         return compile_nvbuild_kernel_docker(
             kernel_name=kernel_name,
             arch=arch,
@@ -512,22 +1037,51 @@ def compile_kernel_docker(kernel_name, arch, toolchain_name=None, toolchain_vers
             config=config,
             build_target=build_target,
             threads=threads,
+            link_threads=link_threads,
+            max_load=max_load,
             clean=clean,
             incremental=incremental,
             localversion=localversion,
             dtb_name=dtb_name,
             build_modules=build_modules or build_dtb,
+            ccache=ccache,
+            distcc=distcc,
+            session_name=session_name,
+            session_idle_timeout=session_idle_timeout,
+            ram_root=ram_root,
+            resources=resources,
+            metrics=metrics,
+            plan=plan,
             dry_run=dry_run,
         )
-    ensure_docker_image(jp7=False, dry_run=dry_run)
     # Compiles the kernel using Docker for encapsulation.
     kernels_dir = os.path.join("storage", "kernels")
     toolchains_dir = os.path.join("storage", "toolchains")
 
+    if overlays and not dtb_name:
+        print("Error: --dtb-name must be provided when using --overlays.")
+        return 1
+
     # Create Docker volume arguments to mount kernel, toolchain, and overlays directories into a builder working directory
     kernels_dir_abs = os.path.abspath(kernels_dir)
     toolchains_dir_abs = os.path.abspath(toolchains_dir)
-    volume_args = ["-v", f"{kernels_dir_abs}:/builder/kernels", "-v", f"{toolchains_dir_abs}:/builder/toolchains"]
+    volume_args = ["-v", f"{kernels_dir_abs}:/builder/kernels", "-v", f"{toolchains_dir_abs}:/builder/toolchains", *git_cache_docker_args()]
+    if ram_root:
+        # The variant's O= dir is a symlink to this absolute host path (--ram-build).
+        volume_args += ["-v", f"{ram_root}:{ram_root}"]
+
+    cross_prefix = ""
+    if toolchain_name and toolchain_version:
+        cross_prefix = f"/builder/toolchains/{toolchain_name}/{toolchain_version}/bin/{toolchain_name}-"
+    distcc_env, distcc_prepare, cross_prefix = _distcc_commands(distcc, cross_prefix, DISTCC_DOCKER_DIR, docker=True)
+    if distcc_env:
+        volume_args += distcc.docker_args()
+    ccache_env, ccache_prepare = [], []
+    if ccache:
+        volume_args += ccache_docker_volume_args()
+        ccache_prepare = ccache_prepare_commands(cross_prefix, CCACHE_DOCKER_DIR)
+        ccache_env, cross_prefix = ccache_env_commands(cross_prefix, CCACHE_DOCKER_DIR)
+    cc_suffix = f" CROSS_COMPILE={cross_prefix}" if cross_prefix else ""
 
     # Get current user ID and group ID to run Docker commands as the current user
     user_id = os.getuid()
@@ -535,25 +1089,39 @@ def compile_kernel_docker(kernel_name, arch, toolchain_name=None, toolchain_vers
 
     # Get total number of CPUs on the machine
     total_cpus = os.cpu_count()
+    jobs = threads or total_cpus or 1
+    make_jobs = make_jobs_flags(threads, max_load) if threads else '$(nproc)'
+
+    # One container serves every step below (docker exec per step); a named
+    # session stays warm across invocations until its idle timeout.
+    session = BuildSession(
+        docker_image_tag(jp7=False),
+        volume_args,
+        user=f"{user_id}:{group_id}",
+        cpus=resources.cpus if resources else total_cpus,
+        resource_args=resources.docker_args() if resources else None,
+        name=session_name,
+        idle_timeout=session_idle_timeout,
+        dry_run=dry_run,
+    )
+    if plan is None and not session.is_warm():
+        if ensure_docker_image(jp7=False, dry_run=dry_run) != 0:
+            return 1
 
-    # -t requires a real TTY; kb-menu (and CI) pipe stdout to tee, which breaks
-    # "docker run -it" with "the input device is not a TTY". Batch builds do
-    # not need a pseudo-TTY.
-    docker_tty = ["-it"] if (sys.stdin.isatty() and sys.stdout.isatty()) else []
-
-    # Construct the Docker command
-    docker_command_base = [
-        "docker", "run", "--rm", *docker_tty, "--init", "-u", f"{user_id}:{group_id}",
-        "--cpus=" + str(total_cpus)
-    ] + volume_args + [
-        "-w", "/builder", "kernel_builder", "/bin/bash", "-c"
-    ]
+    kernel_dir_docker = f"/builder/kernels/{kernel_name}/kernel/kernel"
+    modules_dir_docker = f"/builder/kernels/{kernel_name}/modules"
+    # --variant builds into its own O= dir so variants never share objects.
+    out_dir_docker = None
+    if variant:
+        _prepare_variant_build_dir(kernel_name, variant, dry_run=dry_run)
+        variant_dir_docker = f"/builder/kernels/{kernel_name}/variants/{variant}"
+        out_dir_docker = f"{variant_dir_docker}/out"
+        modules_dir_docker = f"{variant_dir_docker}/modules"
 
     # Base command for invoking make
-    base_command = f"make -C /builder/kernels/{kernel_name}/kernel/kernel ARCH={arch} -j{threads if threads else '$(nproc)'}"
-
-    if toolchain_name and toolchain_version:
-        base_command += f" CROSS_COMPILE=/builder/toolchains/{toolchain_name}/{toolchain_version}/bin/{toolchain_name}-"
+    base_command = f"make -C {kernel_dir_docker} ARCH={arch} -j{make_jobs}{cc_suffix}"
+    if out_dir_docker:
+        base_command += f" O={out_dir_docker}"
 
     if localversion:
         base_command += f" LOCALVERSION=-{localversion}"
@@ -564,175 +1132,439 @@ def compile_kernel_docker(kernel_name, arch, toolchain_name=None, toolchain_vers
 
     # If use_current_config is specified, get the current kernel config and place it in the kernel directory
     if use_current_config:
-        current_config_path = f"/builder/kernels/{kernel_name}/kernel/kernel/.config"
+        current_config_path = f"{out_dir_docker or kernel_dir_docker}/.config"
         zcat_command = f"zcat /proc/config.gz > {current_config_path}"
         print(f"Fetching current kernel config: {zcat_command}")
         if not dry_run:
             subprocess.run(zcat_command, shell=True, check=True)
 
-    # Combine mrproper (if enabled), configuration, and kernel compilation into a single Docker run command
-    combined_command_phase_1 = ""
-    if clean and not incremental:
-        combined_command_phase_1 += f"{base_command} mrproper && "
-    if config or use_current_config:
-        combined_command_phase_1 += f"{base_command} {config or 'oldconfig'} && "
-
-    if build_dtb:
-        top_level_makefile_path_host = os.path.join("storage", "kernels", kernel_name, "Makefile")
-        if os.path.exists(top_level_makefile_path_host):
-            make_dir_docker = f"/builder/kernels/{kernel_name}"
-            kernel_source_dir_docker = f"/builder/kernels/{kernel_name}/kernel/kernel"
+    top_level_makefile_path_host = os.path.join("storage", "kernels", kernel_name, "Makefile")
+    if os.path.exists(top_level_makefile_path_host):
+        make_dir_docker = f"/builder/kernels/{kernel_name}"
+        top_make_command = f"make -C {make_dir_docker} ARCH={arch} -j{make_jobs}{cc_suffix}"
+        if out_dir_docker:
+            top_make_command += f" KERNEL_OUTPUT={out_dir_docker}"
+        dtbs_command = f"{top_make_command} dtbs KERNEL_HEADERS={kernel_dir_docker}"
+        modules_command = f"{top_make_command} modules KERNEL_HEADERS={kernel_dir_docker}"
+    else:
+        dtbs_command = f"{base_command} dtbs"
+        modules_command = f"{base_command} modules"
 
-            dtbs_make_command = f"make -C {make_dir_docker} ARCH={arch} -j{threads if threads else '$(nproc)'}"
-            if toolchain_name and toolchain_version:
-                dtbs_make_command += f" CROSS_COMPILE=/builder/toolchains/{toolchain_name}/{toolchain_version}/bin/{toolchain_name}-"
+    ctags_action = None
+    if generate_ctags:
+        ctags_action = lambda: update_ctags_index(
+            kernel_name,
+            [variant_build_dir(kernel_name, variant) if variant else os.path.join(kernels_dir_abs, kernel_name, "kernel", "kernel")],
+            lambda command, label: session.exec(command, label=label, env=env),
+            exec_tree_root=f"/builder/kernels/{kernel_name}",
+            path_map={"/builder/kernels": kernels_dir_abs},
+        )
 
-            dtbs_command = f"{dtbs_make_command} dtbs KERNEL_HEADERS={kernel_source_dir_docker}"
-            combined_command_phase_1 += f"{dtbs_command} && "
-        else:
-            combined_command_phase_1 += f"{base_command} dtbs && "
+    graph, compiled, dtbs = _kernel_build_graph(
+        jobs=jobs,
+        base_command=base_command,
+        dtbs_command=dtbs_command,
+        modules_command=modules_command,
+        modules_dir=modules_dir_docker,
+        headers_path=f"{variant_dir_docker}/headers" if variant else f"/builder/kernels/{kernel_name}/headers",
+        source_dir=kernel_dir_docker,
+        object_dir=out_dir_docker or kernel_dir_docker,
+        ctags_action=ctags_action,
+        link_jobs=link_threads,
+        split_link=kbuild_has_vmlinux_a(os.path.join(kernels_dir, kernel_name, "kernel", "kernel")),
+        config=config,
+        use_current_config=use_current_config,
+        build_target=build_target,
+        clean=clean,
+        incremental=incremental,
+        build_dtb=build_dtb,
+        build_modules=build_modules,
+        ccache_env=ccache_env,
+        ccache_prepare=ccache_prepare,
+        distcc_env=distcc_env,
+        distcc_prepare=distcc_prepare,
+    )
 
-    if build_modules:
-        top_level_makefile_path_host = os.path.join("storage", "kernels", kernel_name, "Makefile")
-        if os.path.exists(top_level_makefile_path_host):
-            make_dir_docker = f"/builder/kernels/{kernel_name}"
-            kernel_source_dir_docker = f"/builder/kernels/{kernel_name}/kernel/kernel"
+    # DTB paths are resolved once the build has produced them.
+    def apply_overlays():
+        base_dtb_path = locate_dtb_file(kernel_name, dtb_name, variant)
+        if not base_dtb_path:
+            print(f"Error: Base DTB file {dtb_name} not found.")
+            return 1
+        overlay_paths = locate_overlay_files(kernel_name, overlays, variant)
+        if overlay_paths is None:
+            return 1
+        return _apply_overlays(base_dtb_path, overlay_paths)
 
-            modules_make_command = f"make -C {make_dir_docker} ARCH={arch} -j{threads if threads else '$(nproc)'}"
-            if toolchain_name and toolchain_version:
-                modules_make_command += f" CROSS_COMPILE=/builder/toolchains/{toolchain_name}/{toolchain_version}/bin/{toolchain_name}-"
+    def stage_dtb():
+        dtb_path = locate_dtb_file(kernel_name, dtb_name, variant)
+        if not dtb_path:
+            print(f"Warning: DTB file {dtb_name} not found in the kernel directory.")
+            return 0
+        if overlays:
+            dtb_path = merged_dtb_path(dtb_path)
+        new_dtb_name = f"{os.path.splitext(dtb_name)[0]}{localversion}.dtb"
+        return _stage_artifact(dtb_path, os.path.join(modules_dir_host, "boot", new_dtb_name))
 
-            modules_command = f"{modules_make_command} modules KERNEL_HEADERS={kernel_source_dir_docker}"
-            combined_command_phase_1 += f"{modules_command} && "
-        else:
-            combined_command_phase_1 += f"{base_command} modules && "
-
-    # Add the kernel and module build targets to the first Docker invocation
-    if build_target:
-        targets = build_target.split(',')
-        for target in targets:
-            if target == "kernel":
-                combined_command_phase_1 += f"{base_command} && "
-                combined_command_phase_1 += f"{base_command} modules_install INSTALL_MOD_PATH=/builder/kernels/{kernel_name}/modules && "
-            elif target == "modules":
-                combined_command_phase_1 += f"{base_command} modules && "
-                combined_command_phase_1 += f"{base_command} modules_install INSTALL_MOD_PATH=/builder/kernels/{kernel_name}/modules && "
-            elif target == "headers_install":
-                headers_path = f"/builder/kernels/{kernel_name}/headers"
-                combined_command_phase_1 += f"mkdir -p {headers_path} && "
-                combined_command_phase_1 += f"{base_command} headers_install INSTALL_HDR_PATH={headers_path} && "
-            else:
-                # General case for any target, including menuconfig
-                combined_command_phase_1 += f"{base_command} {target} && "
-    else:
-        # If no specific target is provided, build the kernel and modules
-        combined_command_phase_1 += f"{base_command} && "
-        combined_command_phase_1 += f"{base_command} modules_install INSTALL_MOD_PATH=/builder/kernels/{kernel_name}/modules && "
+    # Stage the Image and DTB after the build, whatever the targets were
+    overlay_step = None
+    if overlays:
+        overlay_step = graph.add(
+            "overlays",
+            action=apply_overlays,
+            deps=(compiled, dtbs),
+            kind="dtb",
+            description=f"merge {overlays} into {os.path.splitext(dtb_name)[0]}-merged.dtb",
+        )
+    # Staged from the host: the outputs sit in the mounted kernels dir, and
+    # reflinks need no container.
+    image_filename = f"Image.{localversion}" if localversion else "Image"
+    modules_dir_host = kernel_modules_dir(kernel_name, variant)
+    image_src_host = os.path.join(
+        variant_build_dir(kernel_name, variant) if variant else os.path.join(kernels_dir_abs, kernel_name, "kernel", "kernel"),
+        "arch", arch, "boot", "Image",
+    )
+    graph.add(
+        "stage-image",
+        action=lambda: _stage_artifact(image_src_host, os.path.join(modules_dir_host, "boot", image_filename)),
+        deps=(compiled,),
+        kind="copy",
+        description=f"stage {image_src_host} -> {modules_dir_host}/boot/{image_filename}",
+        inputs=(image_src_host,),
+        outputs=(os.path.join(modules_dir_host, "boot", image_filename),),
+    )
+    if dtb_name:
+        graph.add(
+            "stage-dtb",
+            action=stage_dtb,
+            deps=(compiled, dtbs, overlay_step),
+            kind="copy",
+            description=f"stage {dtb_name} -> {modules_dir_host}/boot/{os.path.splitext(dtb_name)[0]}{localversion}.dtb",
+        )
 
-    # Remove any trailing '&&'
-    combined_command_phase_1 = combined_command_phase_1.rstrip(' &&')
+    if ccache_prepare:
+        _add_ccache_stats_step(graph)
 
-    # Adjust permissions before running ctags to avoid permission issues
-    if generate_ctags:
-        combined_command_phase_1 += f" && chmod -R u+w /builder/kernels/{kernel_name}/kernel && ctags -R -f /builder/tags /builder/kernels/{kernel_name}/kernel"
+    if plan is not None:
+        plan.add_graph(graph, workdir="/builder", container=session.describe())
+        return 0
+    spawn, usage = _session_step_runner(session, kernel_name, env=env)
+    rc = _run_in_session(session, lambda: graph.run(spawn, dry_run=dry_run, usage=usage), resources, metrics)
+    if metrics is not None:
+        metrics.add_steps(graph.results)
+    return rc
 
-    # Run the first Docker container session for kernel build and module installation
-    if dry_run:
-        print(f"[Dry-run] Would run combined command (Phase 1): {' '.join(docker_command_base + [combined_command_phase_1])}")
-    else:
-        full_command_phase_1 = docker_command_base + [combined_command_phase_1]
-        print(f"Running Docker command (Phase 1): {' '.join(full_command_phase_1)}")
-        phase1_rc = subprocess.Popen(full_command_phase_1, env=env).wait()
-        if phase1_rc != 0:
-            return phase1_rc
 
-    # Phase 1.5: Handle Overlays
-    if overlays:
-        if not dtb_name:
-            print("Error: --dtb-name must be provided when using --overlays.")
+def _copy_synced_sources(pairs):
+    """Copy changed tree sources over their kernel_out copies (nvbuild --dtb-only)."""
+    for src, dst in pairs:
+        try:
+            shutil.copy2(src, dst)
+        except OSError as e:
+            print(f"Error: copying {src} -> {dst} failed: {e}")
             return 1
+    return 0
 
-        # Find the base DTB file path inside the container
-        base_dtb_path_host = locate_dtb_file(kernel_name, dtb_name)
-        if not base_dtb_path_host:
-            print(f"Error: Base DTB file {dtb_name} not found.")
-            return 1
 
-        base_dtb_path_docker = _host_kernel_path_to_docker(base_dtb_path_host, kernels_dir_abs)
+def compile_dtb_only(kernel_name, arch, names, localversion="", variant=None, overlays=None, host_build=False, session_name=None, session_idle_timeout=None, ram_root=None, resources=None, metrics=None, plan=None, dry_run=False):
+    """Rebuild only the named DTBs, and only if a source in their include graph changed.
 
-        # Find the overlay files paths inside the container
-        overlay_files = overlays.split(',')
-        overlay_paths_docker = []
-        kernel_source_dir_host = os.path.join("storage", "kernels", kernel_name)
-        for overlay_file in overlay_files:
-            find_command = f"find {kernel_source_dir_host} -name {overlay_file}"
-            try:
-                find_output = subprocess.check_output(find_command, shell=True, universal_newlines=True).strip()
-                if find_output:
-                    overlay_path_host = find_output.splitlines()[0]
-                    overlay_path_docker = _host_kernel_path_to_docker(overlay_path_host, kernels_dir_abs)
-                    overlay_paths_docker.append(overlay_path_docker)
-                else:
-                    print(f"Error: Overlay file {overlay_file} not found.")
-                    return 1
-            except subprocess.CalledProcessError:
-                print(f"Error: Failed to find overlay file {overlay_file}.")
+    Each stale DTB is rebuilt by replaying the command kbuild recorded for it
+    (no make, no dtbs_prepare); DTBs whose sources are unchanged are only staged.
+    """
+    nvbuild = is_nvbuild_kernel(kernel_name)
+    kernels_dir_abs = os.path.abspath(os.path.join("storage", "kernels"))
+    root = os.path.abspath(kernel_tree_root(kernel_name))
+    source_map = None
+    if nvbuild:
+        out_dir = os.path.abspath(nvbuild_kernel_out_dir(kernel_name))
+        objtree = os.path.join(out_dir, "kernel", nvbuild_kernel_src_subdir(kernel_name) or "")
+        roots = [out_dir]
+        # nvbuild compiled copies of the sources; edits land in the tree itself.
+        source_map = (out_dir, root)
+    else:
+        objtree = os.path.abspath(variant_build_dir(kernel_name, variant)) if variant else os.path.join(root, "kernel", "kernel")
+        roots = [objtree] if variant else [os.path.join(root, "kernel")]
+    path_map = {"/builder/kernels": kernels_dir_abs}
+    dtb_graph = load_dtb_graph(kernel_name, roots, objtree, path_map=path_map)
+
+    records = {}
+    for name in names:
+        matches = find_dtbs(dtb_graph, name)
+        if not matches:
+            # Built since the graph was cached, in a directory it never saw.
+            dtb_graph = load_dtb_graph(kernel_name, roots, objtree, path_map=path_map, full=True)
+            matches = find_dtbs(dtb_graph, name)
+        if not matches:
+            print(f"Error: no kbuild record for {name} under {', '.join(roots)}; build it once with --build-dtb.")
+            return 1
+        records[name] = matches[0]
+
+    modules_dir = kernel_modules_dir(kernel_name, variant)
+    graph = BuildGraph(budget=max(1, len(records)))
+    for name, record in records.items():
+        changed, to_sync = changed_sources(record, source_map)
+        step = None
+        if not changed:
+            print(f"{name}: up to date ({len(record.deps)} sources in its include graph).")
+            graph.skip(f"dtc-{name}", "dtb", f"none of the {len(record.deps)} sources in its include graph changed")
+        else:
+            shown = ", ".join(os.path.relpath(p, root) for p in changed[:3])
+            print(f"{name}: {len(changed)} changed source(s) ({shown}{', ...' if len(changed) > 3 else ''}); rebuilding.")
+            if to_sync:
+                step = graph.add(
+                    f"sync-{name}",
+                    action=lambda pairs=to_sync: _copy_synced_sources(pairs),
+                    kind="sync",
+                    description=f"copy {len(to_sync)} changed source(s) into kernel_out",
+                    inputs=[src for src, _ in to_sync],
+                    outputs=[dst for _, dst in to_sync],
+                )
+            # The command holds the paths of wherever it last ran (host or container).
+            if host_build:
+                command, cwd = record.command.replace("/builder/kernels", kernels_dir_abs), record.cwd
+                to_exec = lambda p: p
+            else:
+                command = record.command.replace(kernels_dir_abs, "/builder/kernels")
+                cwd = _host_kernel_path_to_docker(record.cwd, kernels_dir_abs)
+                to_exec = lambda p: _host_kernel_path_to_docker(p, kernels_dir_abs)
+            step = graph.add(
+                f"dtc-{name}",
+                f"cd {cwd} && {command}",
+                deps=(step,),
+                kind="dtb",
+                inputs=[to_exec(p) for p in record.deps],
+                outputs=(to_exec(record.dtb),),
+            )
+            step = graph.add(
+                f"cmd-{name}",
+                action=lambda r=record: refresh_cmd_file(r),
+                deps=(step,),
+                kind="dtb",
+                description=f"check {os.path.basename(record.cmd_file)} still lists every include",
+            )
+        staged = record.dtb
+        if overlays:
+            overlay_paths = locate_overlay_files(kernel_name, overlays, variant)
+            if overlay_paths is None:
                 return 1
+            staged = merged_dtb_path(record.dtb)
+            step = graph.add(
+                f"overlays-{name}",
+                action=lambda r=record, paths=overlay_paths: _apply_overlays(r.dtb, paths),
+                deps=(step,),
+                kind="dtb",
+                description=f"merge {overlays} into {staged}",
+            )
+        stem = os.path.splitext(os.path.basename(record.dtb))[0]
+        suffix = normalize_localversion_suffix(localversion) if nvbuild else localversion
+        dst = os.path.join(modules_dir, "boot", f"{stem}{suffix}.dtb")
+        graph.add(
+            f"stage-{name}",
+            action=lambda src=staged, dst=dst: _stage_artifact(src, dst),
+            deps=(step,),
+            kind="copy",
+            description=f"stage {staged} -> {dst}",
+            inputs=(staged,),
+            outputs=(dst,),
+        )
 
-        # Construct the fdtoverlay command for docker
-        output_dtb_name = f"{os.path.splitext(dtb_name)[0]}-merged.dtb"
-        output_dtb_path_docker = os.path.join(os.path.dirname(base_dtb_path_docker), output_dtb_name)
+    if host_build or not any(step.command for step in graph.steps.values()):
+        if plan is not None:
+            plan.add_graph(graph, workdir=os.getcwd())
+            return 0
+        rc = graph.run(_host_spawn, dry_run=dry_run)
+    else:
+        volume_args = ["-v", f"{kernels_dir_abs}:/builder/kernels", *git_cache_docker_args()]
+        if ram_root:
+            volume_args += ["-v", f"{ram_root}:{ram_root}"]
+        session = BuildSession(
+            docker_image_tag(jp7=nvbuild),
+            volume_args,
+            # Same user as the build that wrote these files.
+            user="0:0" if nvbuild else f"{os.getuid()}:{os.getgid()}",
+            cpus=resources.cpus if resources else None,
+            resource_args=resources.docker_args() if resources else None,
+            name=session_name,
+            idle_timeout=session_idle_timeout,
+            dry_run=dry_run,
+        )
+        if plan is not None:
+            plan.add_graph(graph, workdir="/builder", container=session.describe())
+            return 0
+        if not session.is_warm():
+            if ensure_docker_image(jp7=nvbuild, dry_run=dry_run) != 0:
+                return 1
+        spawn, usage = _session_step_runner(session, kernel_name)
+        rc = _run_in_session(session, lambda: graph.run(spawn, dry_run=dry_run, usage=usage), resources, metrics)
+    if metrics is not None:
+        metrics.add_steps(graph.results)
+    return rc
 
-        fdtoverlay_command = f"fdtoverlay -i {base_dtb_path_docker} -o {output_dtb_path_docker} {' '.join(overlay_paths_docker)}"
 
-        if dry_run:
-            print(f"[Dry-run] Would run fdtoverlay command in docker: {fdtoverlay_command}")
-        else:
-            print(f"Running fdtoverlay command in docker: {fdtoverlay_command}")
-            process = subprocess.Popen(docker_command_base + [fdtoverlay_command])
-            process.wait()
-            if process.returncode != 0:
-                print("Error: fdtoverlay command failed.")
-                return 1
+def build_module(kernel_name, arch, path, toolchain_name=None, toolchain_version=None, threads=None, variant=None, host_build=False, session_name=None, session_idle_timeout=None, metrics=None, dry_run=False):
+    """`make M=<dir> modules` for the driver at *path* against the prepared tree.
 
-        # Now, on the host, rename the file
-        output_dtb_path_host = os.path.join(os.path.dirname(base_dtb_path_host), output_dtb_name)
-        print(f"Renaming {output_dtb_path_host} to {base_dtb_path_host}")
-        if not dry_run:
-            os.rename(output_dtb_path_host, base_dtb_path_host)
+    Returns (rc, object dir, objtree).
+    """
+    nvbuild = is_nvbuild_kernel(kernel_name)
+    source, build_dir, objtree = module_dirs(kernel_name, path, variant)
+    check_prepared(objtree)
+    kernels_dir_abs = os.path.abspath(os.path.join("storage", "kernels"))
+    if nvbuild and not (toolchain_name and toolchain_version):
+        toolchain_name, toolchain_version = jp7_toolchain_defaults()
+    if host_build:
+        cross = (
+            os.path.abspath(cross_compile_prefix(toolchain_name, toolchain_version))
+            if nvbuild
+            else _host_cross_compile_prefix(toolchain_name, toolchain_version)
+        )
+        to_exec = lambda p: p
+    else:
+        cross = (
+            cross_compile_prefix(toolchain_name, toolchain_version, docker=True)
+            if toolchain_name and toolchain_version
+            else ""
+        )
+        to_exec = lambda p: _host_kernel_path_to_docker(p, kernels_dir_abs)
+
+    jobs = threads or os.cpu_count() or 1
+    kernel_src = os.path.join(kernel_tree_root(kernel_name), "kernel", "kernel")
+    command = f"make -C {to_exec(objtree)} ARCH={arch} -j{jobs}"
+    if variant:
+        command = f"make -C {to_exec(os.path.abspath(kernel_src))} O={to_exec(objtree)} ARCH={arch} -j{jobs}"
+    if cross:
+        command += f" CROSS_COMPILE={cross}"
+    symbols = extra_symbols(kernel_name, objtree, build_dir)
+    if symbols:
+        command += f' KBUILD_EXTRA_SYMBOLS="{" ".join(to_exec(p) for p in symbols)}"'
+    command += f" M={to_exec(build_dir)} modules"
+
+    graph = BuildGraph(budget=jobs + LIGHT)
+    step = None
+    if build_dir != source:
+        # Only this directory's edited sources; the rest of the object tree stays as built.
+        step = graph.add(
+            "sync",
+            f"mkdir -p {to_exec(build_dir)} && rsync -a {to_exec(source)}/ {to_exec(build_dir)}/",
+            kind="sync",
+        )
+    graph.add("module", command, deps=(step,), weight=jobs, kind="make")
+
+    if host_build:
+        rc = graph.run(_host_spawn, dry_run=dry_run)
+    else:
+        toolchains_dir_abs = os.path.abspath(os.path.join("storage", "toolchains"))
+        volume_args = ["-v", f"{kernels_dir_abs}:/builder/kernels", "-v", f"{toolchains_dir_abs}:/builder/toolchains", *git_cache_docker_args()]
+        link = objtree
+        while link.startswith(kernels_dir_abs + os.sep) and not os.path.islink(link):
+            link = os.path.dirname(link)
+        if os.path.islink(link):
+            # Object tree kept in RAM by --ram-build: its target must resolve in the container too.
+            ram_dir = os.path.realpath(link)
+            volume_args += ["-v", f"{ram_dir}:{ram_dir}"]
+        session = BuildSession(
+            docker_image_tag(jp7=nvbuild),
+            volume_args,
+            user="0:0" if nvbuild else f"{os.getuid()}:{os.getgid()}",
+            name=session_name,
+            idle_timeout=session_idle_timeout,
+            dry_run=dry_run,
+        )
+        if not session.is_warm():
+            if ensure_docker_image(jp7=nvbuild, dry_run=dry_run) != 0:
+                return 1
+        with session:
+            spawn, usage = _session_step_runner(session, kernel_name)
+            rc = graph.run(spawn, dry_run=dry_run, usage=usage)
+    if metrics is not None:
+        metrics.add_steps(graph.results)
+    return rc, build_dir, objtree
 
-    # Phase 2: Copy Image and DTB after kernel build
-    commands_phase_2 = []
-    # Conditional logic for the kernel image filename
-    image_filename = f"Image.{localversion}" if localversion else "Image"
-    commands_phase_2.append(f"mkdir -p /builder/kernels/{kernel_name}/modules/boot")
-    commands_phase_2.append(f"cp /builder/kernels/{kernel_name}/kernel/kernel/arch/{arch}/boot/Image /builder/kernels/{kernel_name}/modules/boot/{image_filename}")
 
-    # Copy the DTB file with modified filename to include localversion
+def _staged_boot_names(kernel_name, build_target, localversion, dtb_name):
+    """File names a full compile stages into modules/boot (mirrors the cp steps)."""
+    if is_nvbuild_kernel(kernel_name):
+        image = f"Image.{localversion}" if localversion else "Image"
+        dtb_suffix = normalize_localversion_suffix(localversion)
+    else:
+        image = f"Image.{localversion}" if (localversion or build_target == "kernel") else "Image"
+        dtb_suffix = localversion
+    names = [image]
     if dtb_name:
-        dtb_path = locate_dtb_file(kernel_name, dtb_name)
-        if dtb_path:
-            dtb_path_docker = _host_kernel_path_to_docker(dtb_path, kernels_dir_abs)
-            new_dtb_name = f"{os.path.splitext(dtb_name)[0]}{localversion}.dtb"
-            commands_phase_2.append(f"cp {dtb_path_docker} /builder/kernels/{kernel_name}/modules/boot/{new_dtb_name}")
+        names.append(f"{os.path.splitext(dtb_name)[0]}{dtb_suffix}.dtb")
+    return names
+
+
+def _build_cache_key(args):
+    """Cache key for a full compile, or None when this invocation is not cacheable.
+
+    --clean asks for a rebuild, and --generate-ctags for an index that only a
+    build (in its container) refreshes: a restore would skip both.
+    """
+    if (args.dry_run and not args.plan) or args.use_current_config or args.build_target not in (None, "", "kernel"):
+        return None
+    if args.clean or args.generate_ctags:
+        return None
+    nvbuild = is_nvbuild_kernel(args.kernel_name)
+    config = args.config
+    if nvbuild:
+        config_path = nvbuild_out_config_path(args.kernel_name)
+        if not config and (not args.incremental or not nvbuild_incremental_ready(args.kernel_name)):
+            # Full nvbuild runs its own defconfig from the (hashed) sources.
+            config = "nvbuild.sh"
+        gcc = f"{os.path.abspath(cross_compile_prefix(args.toolchain_name, args.toolchain_version))}gcc"
+        toolchain = cached_toolchain(args.toolchain_name, args.toolchain_version)
+    else:
+        if args.variant:
+            config_path = os.path.join(variant_build_dir(args.kernel_name, args.variant), ".config")
         else:
-            print(f"Warning: DTB file {dtb_name} not found in the kernel directory.")
+            config_path = os.path.join(kernel_tree_root(args.kernel_name), "kernel", "kernel", ".config")
+        toolchain = None
+        if args.toolchain_name and args.toolchain_version:
+            gcc = toolchain_gcc(args.toolchain_name, args.toolchain_version)
+            toolchain = cached_toolchain(args.toolchain_name, args.toolchain_version)
+        else:
+            gcc = shutil.which("gcc")
+    image_id = ""
+    if not args.host_build:
+        image_id = docker_image_id(docker_image_tag(jp7=nvbuild))
+        if not image_id:
+            return None
+        if nvbuild:
+            # nvbuild in Docker compiles with the image's toolchain.
+            gcc = toolchain = None
+    build_mode = f"{args.build_target or ''}|dtb={args.build_dtb}|modules={args.build_modules}"
+    return compute_cache_key(
+        args.kernel_name,
+        arch=args.arch,
+        localversion=args.localversion or "",
+        toolchain_id=toolchain_identity(gcc, image_id, toolchain.fingerprint if toolchain else None),
+        config=config,
+        config_path=config_path,
+        dtb_name=args.dtb_name,
+        overlays=args.overlays,
+        build_mode=build_mode,
+    )
 
-    combined_command_phase_2 = " && ".join(commands_phase_2)
 
-    # Run the second Docker container session to copy the kernel Image and DTB
-    if dry_run:
-        print(f"[Dry-run] Would run combined command (Phase 2): {' '.join(docker_command_base + [combined_command_phase_2])}")
-    else:
-        full_command_phase_2 = docker_command_base + [combined_command_phase_2]
-        print(f"Running Docker command (Phase 2): {' '.join(full_command_phase_2)}")
-        process = subprocess.Popen(full_command_phase_2, env=env)
-        process.wait()
-        if process.returncode != 0:
-            print("Error: Docker encountered an error during execution.")
-            return process.returncode
+# Targets that make up a quick edit-build-test loop; anything else may wait behind them.
+_QUICK_TARGETS = {"modules", "dtbs", "headers_install"}
 
-    return 0
+
+def _queue_priority(args) -> str | None:
+    """Build queue priority for this compile, or None to run it directly."""
+    targets = {t.strip() for t in (args.build_target or "").split(",") if t.strip()}
+    if args.no_queue or os.environ.get(JOB_ENV) or args.dry_run or targets & set(_INTERACTIVE_TARGETS):
+        # Queued jobs (and matrix entries) run directly; menuconfig needs this terminal.
+        return None
+    if args.queue_priority:
+        return args.queue_priority
+    if args.dtb_only is not None or (targets and targets <= _QUICK_TARGETS and not args.clean):
+        return "interactive"
+    if args.matrix or args.clean or "bindeb-pkg" in targets:
+        return "release"
+    return "normal"
 
 
 def main():
@@ -744,6 +1576,17 @@ def main():
     build_parser.add_argument("--rebuild", action="store_true", help="Rebuild the Docker image without using the cache")
     build_parser.add_argument("--jp7", action="store_true", help="Build the JetPack 7.x nvbuild Docker image (kernel_builder_jp7)")
 
+    # Move prebuilt builder images between machines
+    image_parser = subparsers.add_parser("image")
+    image_parser.add_argument("action", choices=("export", "import", "list"))
+    image_parser.add_argument(
+        "path",
+        nargs="?",
+        help="export: output tarball (default: storage/docker_images/<repo>-<hash>.tar[.zst]); import: tarball to load",
+    )
+    image_parser.add_argument("--jp7", action="store_true", help="Export the JetPack 7.x nvbuild image (kernel_builder_jp7)")
+    image_parser.add_argument("--dry-run", action="store_true", help="Print what would be exported or loaded")
+
     # Clone kernel command
     clone_parser = subparsers.add_parser("clone-kernel")
     clone_parser.add_argument("--kernel-source-url", required=True, help="URL of the kernel source to be cloned")
@@ -769,6 +1612,11 @@ def main():
     clone_device_tree_parser.add_argument("--kernel-name", required=True, help="Name of the kernel subfolder where device tree will be added")
     clone_device_tree_parser.add_argument("--git-tag", help="Git tag to check out after cloning the device tree")
 
+    for clone_subparser in (clone_parser, clone_toolchain_parser, clone_overlays_parser, clone_device_tree_parser):
+        clone_subparser.add_argument("--depth", type=int, help="Shallow clone of the last N commits (of --git-tag if given)")
+        clone_subparser.add_argument("--partial", action="store_true", help="Partial clone (--filter=blob:none): fetch file contents on demand")
+        clone_subparser.add_argument("--no-git-cache", action="store_true", help="Clone without the shared mirror in storage/git-cache")
+
     # Compile kernel command
     compile_parser = subparsers.add_parser("compile")
     compile_parser.add_argument("--kernel-name", required=True, help="Name of the kernel subfolder to use for compilation")
@@ -779,7 +1627,19 @@ def main():
     compile_parser.add_argument("--config", help="Kernel configuration to use for compilation (e.g., defconfig, tegra_defconfig)")
     compile_parser.add_argument("--generate-ctags", action="store_true", help="Generate ctags/tags file for the kernel source")
     compile_parser.add_argument("--build-target", help="Comma-separated list of build targets (e.g., kernel,dtbs,modules,bindeb-pkg). If 'kernel' is specified, it will directly call make without a target.")
-    compile_parser.add_argument("--threads", type=int, help="Number of threads to use for compilation (default: use all available cores)")
+    compile_parser.add_argument(
+        "--threads",
+        "--jobs",
+        dest="threads",
+        type=parse_jobs,
+        help="Number of make jobs (default: use all available cores), or 'auto' to size compile and link "
+        "parallelism from idle cores, free memory and the peak per-job RSS of past builds",
+    )
+    compile_parser.add_argument(
+        "--link-jobs",
+        type=int,
+        help="make -j for the link phase of the kernel target (default: same as --jobs; set by --jobs auto)",
+    )
     compile_parser.add_argument("--clean", action="store_true", help="Delete kernel_out / run mrproper before building (full rebuild)")
     compile_parser.add_argument(
         "--no-incremental",
@@ -794,8 +1654,213 @@ def main():
     compile_parser.add_argument("--dtb-name", help="Name of the DTB file to be copied alongside the compiled kernel")
     compile_parser.add_argument("--build-dtb", action="store_true", help="Build the Device Tree Blob (DTB) separately using 'make dtbs'.")
     compile_parser.add_argument("--build-modules", action="store_true", help="Build kernel modules separately.")
+    compile_parser.add_argument(
+        "--dtb-only",
+        nargs="?",
+        const="",
+        metavar="NAMES",
+        help="Rebuild only these DTBs (comma-separated, default --dtb-name), and only if a source in their include graph changed; then stage them",
+    )
     compile_parser.add_argument("--overlays", help="Comma-separated list of DTBO files to apply as overlays.")
     compile_parser.add_argument("--dry-run", action="store_true", help="Print the commands without executing them")
+    compile_parser.add_argument(
+        "--plan",
+        choices=("text", "json"),
+        help="Execute nothing; print the build steps with commands, working dirs, container, inputs/outputs, "
+        "estimated durations from earlier builds and cache-hit flags (json: on stdout, messages on stderr)",
+    )
+    compile_parser.add_argument(
+        "--ccache",
+        action="store_true",
+        help="Compile through ccache with a persistent storage/ccache cache (mounted at /builder/ccache in Docker)",
+    )
+    compile_parser.add_argument(
+        "--variant",
+        help="Build into storage/kernels/<name>/variants/<variant>/out (make O=) and stage into that variant's modules/; "
+        "each variant keeps its own config and objects",
+    )
+    compile_parser.add_argument(
+        "--matrix",
+        help="Build every combination in a matrix file (YAML or JSON) concurrently, one variant per entry",
+    )
+    compile_parser.add_argument(
+        "--matrix-parallel",
+        type=int,
+        help="Concurrent matrix builds (default: derived from cores and available memory)",
+    )
+    compile_parser.add_argument(
+        "--distcc",
+        action="store_true",
+        help="Distribute compiles to the distcc workers listed in storage/distcc_workers.json (falls back to local)",
+    )
+    compile_parser.add_argument(
+        "--distcc-workers",
+        help=f"distcc workers config file (default: {default_workers_path()})",
+    )
+    compile_parser.add_argument(
+        "--no-build-cache",
+        dest="build_cache",
+        action="store_false",
+        help="Always run make instead of restoring identical outputs from storage/build_cache",
+    )
+    compile_parser.add_argument(
+        "--build-cache-max-gb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / 1024**3,
+        help="Size cap for storage/build_cache; least recently used entries are evicted (default: 20)",
+    )
+    compile_parser.add_argument(
+        "--session-name",
+        help="Keep the Docker build container warm under this name and reuse it on later compiles",
+    )
+    compile_parser.add_argument(
+        "--session-idle-timeout",
+        type=int,
+        help=f"Seconds a named build session may sit idle before it exits (default: {DEFAULT_IDLE_TIMEOUT})",
+    )
+    compile_parser.add_argument(
+        "--resource-profile",
+        choices=PROFILE_NAMES,
+        help="Docker builds: pin CPUs (NUMA-aware), cap memory from telemetry and weight I/O; "
+        "interactive leaves a CPU free, background takes half the CPUs at low priority",
+    )
+    compile_parser.add_argument(
+        "--ram-build",
+        action="store_true",
+        help="Keep the object tree (nvbuild kernel_out, or the --variant O= dir) on a tmpfs; only staged outputs reach storage/",
+    )
+    compile_parser.add_argument(
+        "--ram-size",
+        type=parse_size,
+        help="Size guard for --ram-build, e.g. 24G (default: last measured tree size + 25%%, else 16G)",
+    )
+    compile_parser.add_argument(
+        "--ram-dir",
+        default=DEFAULT_RAM_ROOT,
+        help=f"tmpfs directory for --ram-build trees (default: {DEFAULT_RAM_ROOT})",
+    )
+    compile_parser.add_argument(
+        "--ram-snapshot",
+        action="store_true",
+        help="After a --ram-build, save the object tree to <dir>.snapshot.tar; the next --ram-build restores it",
+    )
+    compile_parser.add_argument(
+        "--ram-keep",
+        action="store_true",
+        help="Leave the --ram-build tree in RAM after the build for the next incremental compile",
+    )
+    compile_parser.add_argument(
+        "--no-queue",
+        action="store_true",
+        help="Build in this process instead of submitting to the local build queue daemon",
+    )
+    compile_parser.add_argument(
+        "--queue-priority",
+        choices=PRIORITIES,
+        help="Build queue priority (default: interactive for modules/dtbs-only builds, release for bindeb-pkg, --clean and --matrix)",
+    )
+
+    # Rebuild one driver directory (make M=) and optionally push its .ko to a target
+    module_parser = subparsers.add_parser("module")
+    module_parser.add_argument("--kernel-name", required=True, help="Name of the kernel subfolder (built once with compile)")
+    module_parser.add_argument("--arch", required=True, help="Target architecture (e.g., arm64 for Jetson)")
+    module_parser.add_argument(
+        "--path",
+        required=True,
+        help="Driver source file or directory, relative to the kernel source or the tree root (e.g. drivers/media/i2c/d4xx.c)",
+    )
+    module_parser.add_argument("--toolchain-name", help="Name of the toolchain to use for cross-compiling")
+    module_parser.add_argument("--toolchain-version", help="Version of the toolchain to use")
+    module_parser.add_argument("--variant", help="Build against this --variant's O= dir")
+    module_parser.add_argument("--host-build", action="store_true", help="Build on the host instead of in Docker")
+    module_parser.add_argument("--threads", type=int, help="make -j (default: all cores)")
+    module_parser.add_argument("--session-name", help="Reuse this warm Docker build session (see compile --session-name)")
+    module_parser.add_argument("--device-ip", help="Push the changed .ko files to this target")
+    module_parser.add_argument("--user", default="root", help="scp user on the target (default: root)")
+    module_parser.add_argument("--reload", action="store_true", help="rmmod/insmod the pushed modules on the target")
+    module_parser.add_argument("--dry-run", action="store_true", help="Print the commands without executing them")
+
+    # Rebuild the DTB/DTBO artifact index for a kernel tree
+    reindex_parser = subparsers.add_parser("reindex")
+    reindex_parser.add_argument("--kernel-name", required=True, help="Name of the kernel subfolder to index")
+
+    # Re-tag the compiled sources of an already built tree (host ctags)
+    ctags_parser = subparsers.add_parser("ctags")
+    ctags_parser.add_argument("--kernel-name", required=True, help="Name of the kernel subfolder")
+    ctags_parser.add_argument("--variant", help="Index the sources compiled by this --variant build")
+    ctags_parser.add_argument("--full", action="store_true", help="Discard the index and re-tag every compiled file")
+
+    # Copy a file through the staging layer (reflink, optional hardlink, copy)
+    stage_parser = subparsers.add_parser("stage")
+    stage_parser.add_argument("src", help="File to stage")
+    stage_parser.add_argument("dst", help="Destination file or directory")
+    stage_parser.add_argument(
+        "--hardlink",
+        action="store_true",
+        help="Allow a hardlink when reflinks are unsupported (only for sources that are replaced, never rewritten)",
+    )
+
+    # List the toolchains in storage/toolchains with their probed facts
+    toolchains_parser = subparsers.add_parser("toolchains")
+    toolchains_parser.add_argument("--reprobe", action="store_true", help="Probe every toolchain again and rewrite its stamp")
+
+    # Local build queue daemon shared by compile and kb-menu
+    queue_parser = subparsers.add_parser("queue")
+    queue_parser.add_argument("action", choices=["daemon", "status", "attach", "cancel", "stop"], help="Queue action")
+    queue_parser.add_argument("job", nargs="?", type=int, help="Job id for attach/cancel")
+    queue_parser.add_argument(
+        "--max-running",
+        type=int,
+        default=DEFAULT_MAX_RUNNING,
+        help="daemon: jobs run at once, never two on one kernel tree (default: 1)",
+    )
+    queue_parser.add_argument("--idle-timeout", type=int, help="daemon: exit after this many idle seconds (default: never)")
+
+    # Evict storage/ content over its per-category quotas
+    gc_parser = subparsers.add_parser("gc")
+    gc_parser.add_argument(
+        "--quota",
+        action="append",
+        default=[],
+        metavar="CATEGORY=GB",
+        help=f"Override a quota (repeatable); categories in eviction order: {', '.join(GC_CATEGORIES)}",
+    )
+    gc_parser.add_argument("--total-gb", type=float, help="Also keep the sum of all categories under this size")
+    gc_parser.add_argument("--report", action="store_true", help="Only print usage per category")
+    gc_parser.add_argument("--jobs", type=int, default=SCAN_WORKERS, help=f"Parallel scan/delete workers (default: {SCAN_WORKERS})")
+    gc_parser.add_argument("--dry-run", action="store_true", help="List what would be removed")
+
+    # Summarize per-phase build telemetry
+    stats_parser = subparsers.add_parser("stats")
+    stats_parser.add_argument("--kernel-name", required=True, help="Name of the kernel subfolder")
+    stats_parser.add_argument("--last", type=int, default=10, help="Number of recent compiles to list (default: 10)")
+
+    # Stop a named (warm) Docker build session
+    stop_session_parser = subparsers.add_parser("stop-session")
+    stop_session_parser.add_argument("--session-name", required=True, help="Name passed to compile --session-name")
+
+    # Run or stop a local distcc worker container (stands in for a remote build host)
+    distcc_worker_parser = subparsers.add_parser("distcc-worker")
+    distcc_worker_parser.add_argument("action", choices=["start", "stop", "logs"], help="Start or stop the worker container, or print its distccd log")
+    distcc_worker_parser.add_argument("--name", default="local", help="Worker name (container kb-distcc-<name>)")
+    distcc_worker_parser.add_argument("--port", type=int, default=3632, help="Host port for distccd (default: 3632)")
+    distcc_worker_parser.add_argument("--stats-port", type=int, default=3633, help="Host port for distccd --stats (default: 3633)")
+    distcc_worker_parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Concurrent compiles to accept (default: all cores)")
+    distcc_worker_parser.add_argument(
+        "--allow",
+        action="append",
+        default=[],
+        metavar="CIDR",
+        help="Client network distccd accepts, repeatable (default: only the docker bridge, i.e. this host)",
+    )
+    distcc_worker_parser.add_argument(
+        "--bind",
+        default=DISTCC_DEFAULT_BIND,
+        help=f"Host address to publish the ports on (default: {DISTCC_DEFAULT_BIND}; the docker bridge gateway, e.g. 172.17.0.1, also serves Docker builds on this host)",
+    )
+    distcc_worker_parser.add_argument("--jp7", action="store_true", help="Run the worker from the kernel_builder_jp7 image")
+    distcc_worker_parser.add_argument("--follow", action="store_true", help="logs: keep printing until the worker exits")
+    distcc_worker_parser.add_argument("--dry-run", action="store_true", help="Print the docker command without running it")
 
     # Inspect Docker image command
     inspect_parser = subparsers.add_parser("inspect")
@@ -810,40 +1875,123 @@ def main():
         parser.print_help()
         exit(1)
 
+    if args.command.startswith("clone-"):
+        clone_options = {"depth": args.depth, "partial": args.partial, "use_cache": not args.no_git_cache}
+
     if args.command == "build":
         build_docker_image(rebuild=args.rebuild, jp7=args.jp7)
+    elif args.command == "image":
+        if args.action == "export":
+            sys.exit(export_docker_image(jp7=args.jp7, output=args.path, dry_run=args.dry_run))
+        if args.action == "import":
+            if not args.path:
+                print("Error: image import needs the tarball to load.", file=sys.stderr)
+                sys.exit(1)
+            sys.exit(import_docker_image(args.path, dry_run=args.dry_run))
+        sys.exit(list_docker_images())
     elif args.command == "clone-kernel":
-        clone_kernel(kernel_source_url=args.kernel_source_url, kernel_name=args.kernel_name, git_tag=args.git_tag)
+        sys.exit(clone_kernel(kernel_source_url=args.kernel_source_url, kernel_name=args.kernel_name, git_tag=args.git_tag, **clone_options))
     elif args.command == "clone-toolchain":
-        clone_toolchain(toolchain_url=args.toolchain_url, toolchain_name=args.toolchain_name, toolchain_version=args.toolchain_version, git_tag=args.git_tag)
+        sys.exit(clone_toolchain(toolchain_url=args.toolchain_url, toolchain_name=args.toolchain_name, toolchain_version=args.toolchain_version, git_tag=args.git_tag, **clone_options))
     elif args.command == "clone-overlays":
-        clone_overlays(overlays_url=args.overlays_url, kernel_name=args.kernel_name, git_tag=args.git_tag)
+        sys.exit(clone_overlays(overlays_url=args.overlays_url, kernel_name=args.kernel_name, git_tag=args.git_tag, **clone_options))
     elif args.command == "clone-device-tree":
-        clone_device_tree(device_tree_url=args.device_tree_url, kernel_name=args.kernel_name, git_tag=args.git_tag)
+        sys.exit(clone_device_tree(device_tree_url=args.device_tree_url, kernel_name=args.kernel_name, git_tag=args.git_tag, **clone_options))
     elif args.command == "compile":
+        plan_stdout = sys.stdout
+        if args.plan:
+            if args.matrix:
+                print("Error: --plan cannot be combined with --matrix.", file=sys.stderr)
+                sys.exit(1)
+            # A plan is a dry run that reports its steps instead of printing them.
+            args.dry_run = True
+            if args.plan == "json":
+                # stdout carries only the JSON document.
+                sys.stdout = sys.stderr
+        priority = _queue_priority(args)
+        if priority:
+            label = f"compile {args.kernel_name} {args.build_target or 'kernel'}{f' --variant {args.variant}' if args.variant else ''}"
+            rc = submit_and_follow(
+                os.path.abspath(__file__),
+                args.kernel_name,
+                sys.argv[1:],
+                priority,
+                label,
+            )
+            if rc is not None:
+                sys.exit(rc)
+            print("Warning: build queue daemon unavailable; building directly.")
+        if args.matrix:
+            if args.variant:
+                print("Error: --variant cannot be combined with --matrix (each entry gets its own variant).", file=sys.stderr)
+                sys.exit(1)
+            try:
+                entries = load_matrix(args.matrix)
+            except (OSError, ValueError) as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(1)
+            base = {key: getattr(args, key) for key in VALUE_OPTIONS + FLAG_OPTIONS if getattr(args, key, None)}
+            base["extra_args"] = [
+                *([] if args.build_cache else ["--no-build-cache"]),
+                *([] if args.incremental else ["--no-incremental"]),
+                *(["--distcc"] if args.distcc else []),
+                *(["--distcc-workers", args.distcc_workers] if args.distcc_workers else []),
+                # Entries share one tree: queueing them would serialize the matrix.
+                "--no-queue",
+            ]
+            rc = run_matrix(
+                os.path.abspath(__file__),
+                args.kernel_name,
+                args.arch,
+                entries,
+                base,
+                # The matrix splits cores and memory between its builds itself.
+                threads=None if args.threads == "auto" else args.threads,
+                parallel=args.matrix_parallel,
+                dry_run=args.dry_run,
+            )
+            if not args.dry_run:
+                auto_gc()
+            sys.exit(rc)
+        dtb_only = None
+        if args.dtb_only is not None:
+            dtb_only = [n.strip() for n in (args.dtb_only or args.dtb_name or "").split(",") if n.strip()]
+            if not dtb_only:
+                print("Error: --dtb-only needs DTB names (or --dtb-name).", file=sys.stderr)
+                sys.exit(1)
+            if args.clean or args.build_target:
+                print("Error: --dtb-only cannot be combined with --clean or --build-target.", file=sys.stderr)
+                sys.exit(1)
+        if args.variant:
+            try:
+                validate_variant_name(args.variant)
+            except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(1)
+            if is_nvbuild_kernel(args.kernel_name):
+                print("Error: --variant is not supported for nvbuild trees (nvbuild.sh always builds into kernel_out).", file=sys.stderr)
+                sys.exit(1)
+        if not args.dry_run:
+            # Queued or not, one compile per object tree at a time.
+            hold_tree_lock(args.kernel_name, build_slot(args.variant))
         if is_nvbuild_kernel(args.kernel_name):
             default_name, default_version = jp7_toolchain_defaults()
             if not args.toolchain_name:
                 args.toolchain_name = default_name
             if not args.toolchain_version:
                 args.toolchain_version = default_version
-            if not args.dry_run:
+            if not args.dry_run and dtb_only is None:
+                # --dtb-only replays recorded host-cc/dtc commands; no cross toolchain needed.
                 ensure_jp7_toolchain_storage(_repo_root())
         elif (
             args.toolchain_name
             and args.toolchain_version
             and not args.dry_run
+            and dtb_only is None
         ):
-            gcc_rel = os.path.join(
-                "storage",
-                "toolchains",
-                args.toolchain_name,
-                args.toolchain_version,
-                "bin",
-                f"{args.toolchain_name}-gcc",
-            )
-            if not os.path.isfile(os.path.abspath(gcc_rel)):
-                abs_gcc = os.path.abspath(gcc_rel)
+            # Probed once, then validated against the registry stamp.
+            if ensure_toolchain(args.toolchain_name, args.toolchain_version) is None:
+                abs_gcc = os.path.abspath(toolchain_gcc(args.toolchain_name, args.toolchain_version))
                 print(
                     f"Error: Cross-compiler not found: {abs_gcc}",
                     file=sys.stderr,
@@ -865,48 +2013,404 @@ def main():
                     file=sys.stderr,
                 )
                 sys.exit(1)
-        if args.host_build:
-            rc = compile_kernel_host(
-                kernel_name=args.kernel_name,
-                arch=args.arch,
-                toolchain_name=args.toolchain_name,
-                toolchain_version=args.toolchain_version,
-                config=args.config,
-                generate_ctags=args.generate_ctags,
-                build_target=args.build_target,
-                threads=args.threads,
+        distcc = None
+        if args.distcc:
+            workers_path = args.distcc_workers or default_workers_path()
+            try:
+                workers = load_workers(workers_path)
+            except (OSError, ValueError) as e:
+                print(f"Error: could not read distcc workers from {workers_path}: {e}", file=sys.stderr)
+                sys.exit(1)
+            distcc = DistccPool(workers) if args.dry_run else DistccPool.probe(workers)
+            if distcc.workers:
+                if not args.threads:
+                    args.threads = distcc.total_jobs
+                print(
+                    f"distcc: {len(distcc.workers)} worker(s) "
+                    f"({', '.join(f'{w.label}/{w.jobs}' for w in distcc.workers)}); {distcc.total_jobs} job slot(s)"
+                )
+                if not args.dry_run:
+                    distcc.snapshot_stats()
+            else:
+                print("Warning: no reachable distcc workers; compiling locally.")
+        max_load = None
+        if args.threads == "auto":
+            plan = plan_jobs(args.kernel_name, distcc_jobs=distcc.total_jobs if distcc and distcc.workers else None)
+            args.threads = plan.compile_jobs
+            args.link_jobs = args.link_jobs or plan.link_jobs
+            max_load = plan.max_load
+            print(
+                f"--jobs auto: compile -j{args.threads}, link -j{min(args.link_jobs, args.threads)}"
+                f"{f', load limit {max_load}' if max_load else ''} ({plan.note})"
+            )
+        resources = None
+        if args.resource_profile and args.host_build:
+            print("Warning: --resource-profile only applies to Docker builds; ignored with --host-build.")
+        elif args.resource_profile:
+            resources = resource_limits(args.resource_profile, args.kernel_name, args.threads)
+            if args.threads and args.threads > resources.cpus:
+                print(f"Limiting -j{args.threads} to the profile's {resources.cpus} CPU(s).")
+                args.threads = resources.cpus
+            print(f"Resource profile {resources.summary()} ({resources.note})")
+        modules_dir = kernel_modules_dir(args.kernel_name, args.variant)
+        context = dict(
+            mode="host" if args.host_build else "docker",
+            arch=args.arch,
+            threads=args.threads or (resources.cpus if resources else os.cpu_count()),
+            link_jobs=args.link_jobs,
+            toolchain=f"{args.toolchain_name}-{args.toolchain_version}" if args.toolchain_name else "native",
+            build_target=args.build_target or "",
+            variant=args.variant or "",
+            localversion=args.localversion or "",
+            ccache=args.ccache,
+            distcc=[w.label for w in distcc.workers] if distcc else [],
+            incremental=args.incremental,
+            clean=args.clean,
+        )
+        if dtb_only is not None:
+            context["dtb_only"] = dtb_only
+        if resources is not None:
+            context["resource_profile"] = resources.profile
+        metrics = None if args.dry_run else BuildMetrics(args.kernel_name, **context)
+        plan = BuildPlan(args.kernel_name, **context) if args.plan else None
+        cache_key = _build_cache_key(args) if args.build_cache and dtb_only is None else None
+        if cache_key and plan is not None:
+            manifest = cached_manifest(cache_key)
+            plan.context["build_cache_key"] = cache_key
+            plan.context["build_cache_hit"] = manifest is not None
+            if manifest:
+                restored = manifest["boot"] + [f"lib/modules/{v}" for v in manifest["modules"]]
+                plan.add_step(
+                    "build-cache-restore",
+                    "copy",
+                    description=f"restore {', '.join(restored)} from build cache entry {cache_key[:12]}",
+                    inputs=(os.path.abspath(os.path.join(build_cache_root(), cache_key)),),
+                    outputs=(os.path.abspath(modules_dir),),
+                    cache_hit=True,
+                )
+        elif cache_key:
+            restore_started = time.time()
+            manifest = restore_from_cache(cache_key, modules_dir)
+            if manifest:
+                restored = manifest["boot"] + [f"lib/modules/{v}" for v in manifest["modules"]]
+                print(f"Build cache hit ({cache_key[:12]}); restored into {modules_dir}: {', '.join(restored)}")
+                metrics.context["build_cache_hit"] = True
+                metrics.add_step("build-cache-restore", "copy", 0, restore_started)
+                metrics.write(0)
+                sys.exit(0)
+            print(f"Build cache miss ({cache_key[:12]}); building.")
+        if not args.dry_run:
+            # Staged files may still share an inode with a cache entry, whether
+            # or not this build is cacheable; staging rewrites them in place.
+            unshare_staged_outputs(modules_dir)
+        nvbuild = is_nvbuild_kernel(args.kernel_name)
+        object_dir = (
+            nvbuild_kernel_out_dir(args.kernel_name)
+            if nvbuild
+            else variant_build_dir(args.kernel_name, args.variant) if args.variant else None
+        )
+        ram = None
+        if args.ram_build:
+            if object_dir is None:
+                print("Error: --ram-build needs --variant for non-nvbuild trees (in-place builds keep objects in the source tree).", file=sys.stderr)
+                sys.exit(1)
+            ram = setup_ram_build(
+                args.kernel_name,
+                object_dir,
+                root=os.path.abspath(args.ram_dir),
+                size=args.ram_size,
                 clean=args.clean,
-                incremental=args.incremental,
-                use_current_config=args.use_current_config,
-                localversion=args.localversion or "",
-                dtb_name=args.dtb_name,
-                build_dtb=args.build_dtb,
-                build_modules=args.build_modules,
-                overlays=args.overlays,
                 dry_run=args.dry_run,
             )
-        else:
-            rc = compile_kernel_docker(
-                kernel_name=args.kernel_name,
+            if metrics is not None:
+                metrics.context["ram_build"] = ram is not None
+        elif object_dir and not args.dry_run:
+            drop_dangling_ram_link(object_dir)
+        build_started = time.time()
+        try:
+            if plan is not None and plan.context.get("build_cache_hit"):
+                rc = 0
+            elif dtb_only is not None:
+                rc = compile_dtb_only(
+                    args.kernel_name,
+                    args.arch,
+                    dtb_only,
+                    localversion=args.localversion or "",
+                    variant=args.variant,
+                    overlays=args.overlays,
+                    host_build=args.host_build,
+                    session_name=args.session_name,
+                    session_idle_timeout=args.session_idle_timeout,
+                    ram_root=ram.root if ram else None,
+                    resources=resources,
+                    metrics=metrics,
+                    plan=plan,
+                    dry_run=args.dry_run,
+                )
+            elif args.host_build:
+                rc = compile_kernel_host(
+                    kernel_name=args.kernel_name,
+                    arch=args.arch,
+                    toolchain_name=args.toolchain_name,
+                    toolchain_version=args.toolchain_version,
+                    config=args.config,
+                    generate_ctags=args.generate_ctags,
+                    build_target=args.build_target,
+                    threads=args.threads,
+                    link_threads=args.link_jobs,
+                    max_load=max_load,
+                    clean=args.clean,
+                    incremental=args.incremental,
+                    use_current_config=args.use_current_config,
+                    localversion=args.localversion or "",
+                    dtb_name=args.dtb_name,
+                    build_dtb=args.build_dtb,
+                    build_modules=args.build_modules,
+                    overlays=args.overlays,
+                    ccache=args.ccache,
+                    distcc=distcc,
+                    variant=args.variant,
+                    metrics=metrics,
+                    plan=plan,
+                    dry_run=args.dry_run,
+                )
+            else:
+                rc = compile_kernel_docker(
+                    kernel_name=args.kernel_name,
+                    arch=args.arch,
+                    toolchain_name=args.toolchain_name,
+                    toolchain_version=args.toolchain_version,
+                    rpi_model=args.rpi_model,
+                    config=args.config,
+                    generate_ctags=args.generate_ctags,
+                    build_target=args.build_target,
+                    threads=args.threads,
+                    link_threads=args.link_jobs,
+                    max_load=max_load,
+                    clean=args.clean,
+                    incremental=args.incremental,
+                    use_current_config=args.use_current_config,
+                    localversion=args.localversion or "",
+                    dtb_name=args.dtb_name,
+                    build_dtb=args.build_dtb,
+                    build_modules=args.build_modules,
+                    overlays=args.overlays,
+                    ccache=args.ccache,
+                    distcc=distcc,
+                    variant=args.variant,
+                    session_name=args.session_name,
+                    session_idle_timeout=args.session_idle_timeout,
+                    ram_root=ram.root if ram else None,
+                    resources=resources,
+                    metrics=metrics,
+                    plan=plan,
+                    dry_run=args.dry_run,
+                )
+        except BaseException:
+            # A failed or interrupted compile must not strand the object tree in RAM.
+            if ram is not None:
+                finish_ram_build(ram, snapshot=args.ram_snapshot, keep=args.ram_keep, dry_run=args.dry_run)
+            raise
+        if distcc and distcc.workers and not args.dry_run:
+            metrics.context["distcc_jobs"] = distcc.report()
+        if ram is not None:
+            ram_started = time.time()
+            ram_rc = finish_ram_build(ram, snapshot=args.ram_snapshot, keep=args.ram_keep, dry_run=args.dry_run)
+            if metrics is not None and args.ram_snapshot:
+                metrics.add_step("ram-snapshot", "copy", ram_rc, ram_started)
+        if plan is not None:
+            if ram is not None and args.ram_snapshot:
+                plan.add_step(
+                    "ram-snapshot",
+                    "copy",
+                    description=f"snapshot {ram.ram_dir} to {ram.build_dir}.snapshot.tar",
+                    deps=[s["name"] for s in plan.steps if not s.get("reason")],
+                    inputs=(ram.ram_dir,),
+                    outputs=(os.path.abspath(f"{ram.build_dir}.snapshot.tar"),),
+                    cache_hit=False,
+                )
+            if cache_key and not plan.context["build_cache_hit"]:
+                plan.add_step(
+                    "build-cache-store",
+                    "copy",
+                    description=f"store the staged outputs as build cache entry {cache_key[:12]}",
+                    deps=[s["name"] for s in plan.steps if not s.get("reason")],
+                    inputs=(os.path.abspath(modules_dir),),
+                    outputs=(os.path.abspath(os.path.join(build_cache_root(), cache_key)),),
+                    cache_hit=False,
+                )
+            if args.plan == "json":
+                plan.write_json(plan_stdout)
+            else:
+                plan.print_text()
+            sys.exit(rc)
+        if rc == 0 and cache_key:
+            store_started = time.time()
+            boot_names = _staged_boot_names(args.kernel_name, args.build_target, args.localversion or "", args.dtb_name)
+            module_versions = staged_module_versions(modules_dir, args.localversion or "", since=build_started)
+            if store_in_cache(
+                cache_key,
+                modules_dir,
+                boot_names,
+                module_versions,
+                metadata={"kernel_name": args.kernel_name, "localversion": args.localversion or ""},
+                max_bytes=int(args.build_cache_max_gb * 1024**3),
+            ):
+                print(f"Stored build outputs in cache ({cache_key[:12]}).")
+                metrics.add_step("build-cache-store", "copy", 0, store_started)
+        if metrics is not None:
+            metrics_path = metrics.write(rc)
+            if metrics_path:
+                print(f"Build metrics written to {metrics_path}")
+        # Matrix entries leave gc to the matrix run, once all of them are done.
+        if rc == 0 and not args.dry_run and not os.environ.get(MATRIX_ENV):
+            auto_gc()
+        sys.exit(rc)
+    elif args.command == "module":
+        started = time.time()
+        if args.variant:
+            try:
+                validate_variant_name(args.variant)
+            except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(1)
+        if not args.dry_run:
+            hold_tree_lock(args.kernel_name, build_slot(args.variant))
+        metrics = None
+        if not args.dry_run:
+            metrics = BuildMetrics(
+                args.kernel_name,
+                mode="host" if args.host_build else "docker",
                 arch=args.arch,
+                threads=args.threads or os.cpu_count(),
+                build_target=f"module:{args.path}",
+                variant=args.variant or "",
+            )
+        try:
+            rc, build_dir, objtree = build_module(
+                args.kernel_name,
+                args.arch,
+                args.path,
                 toolchain_name=args.toolchain_name,
                 toolchain_version=args.toolchain_version,
-                rpi_model=args.rpi_model,
-                config=args.config,
-                generate_ctags=args.generate_ctags,
-                build_target=args.build_target,
                 threads=args.threads,
-                clean=args.clean,
-                incremental=args.incremental,
-                use_current_config=args.use_current_config,
-                localversion=args.localversion or "",
-                dtb_name=args.dtb_name,
-                build_dtb=args.build_dtb,
-                build_modules=args.build_modules,
-                overlays=args.overlays,
+                variant=args.variant,
+                host_build=args.host_build,
+                session_name=args.session_name,
+                metrics=metrics,
                 dry_run=args.dry_run,
             )
+        except ModuleError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        if rc == 0 and not args.dry_run:
+            release = kernel_release(objtree)
+            kos = built_modules(build_dir)
+            print(f"Built {len(kos)} module(s) in {os.path.relpath(build_dir)} for {release}.")
+            stage_modules(args.kernel_name, kos, release, args.variant)
+            if args.device_ip:
+                changed = changed_modules(args.kernel_name, args.device_ip, kos)
+                if not changed:
+                    print(f"Nothing to push: every module is unchanged since the last push to {args.device_ip}.")
+                else:
+                    push_started = time.time()
+                    rc = push_modules(
+                        args.kernel_name,
+                        changed,
+                        device_ip=args.device_ip,
+                        user=args.user,
+                        release=release,
+                        reload=args.reload,
+                    )
+                    metrics.add_step("push", "deploy", rc, push_started)
+        elif rc == 0 and args.device_ip:
+            print(f"[Dry-run] Would push the changed .ko files to {args.device_ip} after checking their vermagic")
+        if metrics is not None:
+            metrics.write(rc)
+        if rc == 0:
+            print(f"module: done in {time.time() - started:.1f}s")
         sys.exit(rc)
+    elif args.command == "reindex":
+        if not os.path.isdir(kernel_tree_root(args.kernel_name)):
+            print(f"Error: kernel tree {kernel_tree_root(args.kernel_name)} does not exist.", file=sys.stderr)
+            sys.exit(1)
+        index = build_artifact_index(args.kernel_name)
+        count = sum(len(paths) for paths in index["artifacts"].values())
+        print(f"Indexed {count} DTB/DTBO files ({len(index['artifacts'])} names) in {kernel_tree_root(args.kernel_name)}")
+    elif args.command == "ctags":
+        if not os.path.isdir(kernel_tree_root(args.kernel_name)):
+            print(f"Error: kernel tree {kernel_tree_root(args.kernel_name)} does not exist.", file=sys.stderr)
+            sys.exit(1)
+        if args.variant:
+            try:
+                validate_variant_name(args.variant)
+            except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(1)
+        build_dir = (
+            variant_build_dir(args.kernel_name, args.variant)
+            if args.variant
+            else os.path.join(kernel_tree_root(args.kernel_name), "kernel", "kernel")
+        )
+        sys.exit(
+            update_ctags_index(
+                args.kernel_name,
+                [build_dir],
+                lambda command, label: subprocess.run(command, shell=True).returncode,
+                full=args.full,
+            )
+        )
+    elif args.command == "stage":
+        dst = os.path.join(args.dst, os.path.basename(args.src)) if os.path.isdir(args.dst) else args.dst
+        try:
+            stats = stage_file(args.src, dst, hardlink=args.hardlink)
+        except OSError as e:
+            print(f"Error: staging {args.src} -> {dst} failed: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"  Staged {os.path.basename(dst)}: {stats.summary()}")
+    elif args.command == "toolchains":
+        sys.exit(print_toolchains(reprobe=args.reprobe))
+    elif args.command == "queue":
+        if args.action == "daemon":
+            sys.exit(run_daemon(os.path.abspath(__file__), args.max_running, args.idle_timeout))
+        if args.action in ("attach", "cancel") and args.job is None:
+            print(f"Error: queue {args.action} needs a job id (see `queue status`).", file=sys.stderr)
+            sys.exit(1)
+        if args.action == "attach":
+            sys.exit(attach_job(args.job))
+        if args.action == "cancel":
+            sys.exit(cancel_job(args.job))
+        sys.exit(stop_daemon() if args.action == "stop" else print_queue_status())
+    elif args.command == "gc":
+        try:
+            overrides = dict(parse_quota(q) for q in args.quota)
+        except ValueError as e:
+            print(f"Error: --quota: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(run_gc(overrides, args.total_gb, report_only=args.report, workers=args.jobs, dry_run=args.dry_run))
+    elif args.command == "stats":
+        sys.exit(print_build_stats(args.kernel_name, last=args.last))
+    elif args.command == "stop-session":
+        sys.exit(stop_named_session(args.session_name))
+    elif args.command == "distcc-worker":
+        if args.action == "stop":
+            sys.exit(stop_worker_container(args.name))
+        if args.action == "logs":
+            sys.exit(worker_logs(args.name, follow=args.follow))
+        if not args.dry_run and ensure_docker_image(jp7=args.jp7) != 0:
+            sys.exit(1)
+        sys.exit(
+            start_worker_container(
+                docker_image_tag(jp7=args.jp7),
+                args.name,
+                port=args.port,
+                stats_port=args.stats_port,
+                jobs=args.jobs,
+                allow=args.allow,
+                bind=args.bind,
+                dry_run=args.dry_run,
+            )
+        )
     elif args.command == "inspect":
         inspect_docker_image()
     elif args.command == "cleanup":
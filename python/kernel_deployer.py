@@ -4,12 +4,14 @@ import argparse
 import os
 import subprocess
 
-def create_deb_package(kernel_name, localversion=None, dtb_name="tegra234-p3701-0000-p3737-0000.dtb"):
-    import shutil
+from utils.kernel_tree import kernel_modules_dir
+from utils.staging import StageStats, stage_file, stage_tree
+
+def create_deb_package(kernel_name, localversion=None, dtb_name="tegra234-p3701-0000-p3737-0000.dtb", variant=None):
     import tempfile
 
-    # Define kernel version and paths
-    modules_base_dir = os.path.join("storage", "kernels", kernel_name, "modules")
+    # Define kernel version and paths (a --variant build stages under variants/<variant>/modules)
+    modules_base_dir = kernel_modules_dir(kernel_name, variant)
     kernel_versions = os.listdir(os.path.join(modules_base_dir, "lib", "modules"))
     kernel_version = next((version for version in kernel_versions if version.endswith(localversion)), kernel_versions[-1]) if localversion else kernel_versions[0]
 
@@ -53,7 +55,9 @@ def create_deb_package(kernel_name, localversion=None, dtb_name="tegra234-p3701-
     package_name = f"linux-custom-{kernel_version}.deb"
     deb_file_path = os.path.join(output_dir, package_name)
 
-    with tempfile.TemporaryDirectory() as temp_dir:
+    # Package tree next to the output, so staging can reflink or hardlink
+    # instead of copying (both need one filesystem).
+    with tempfile.TemporaryDirectory(prefix=".deb-staging-", dir=output_dir) as temp_dir:
         debian_dir = os.path.join(temp_dir, package_name.replace(".deb", ""))
         os.makedirs(debian_dir, exist_ok=True)
 
@@ -107,8 +111,10 @@ fi
         os.makedirs(dtb_dir, exist_ok=True)
         os.makedirs(lib_modules_dir, exist_ok=True)
 
-        shutil.copy(kernel_image, boot_dir)
-        shutil.copy(dtb_file, dtb_dir)
+        # The package tree is read once by dpkg-deb and deleted, so hardlinks are safe.
+        staged = StageStats()
+        staged.add(stage_file(kernel_image, os.path.join(boot_dir, os.path.basename(kernel_image)), hardlink=True))
+        staged.add(stage_file(dtb_file, os.path.join(dtb_dir, os.path.basename(dtb_file)), hardlink=True))
 
         def ignore_symlinks(src, names):
             ignored = []
@@ -121,16 +127,19 @@ fi
                         ignored.append(name)
             return ignored
 
-        shutil.copytree(
+        staged.add(stage_tree(
             modules_dir,
             os.path.join(lib_modules_dir, kernel_version),
-            symlinks=True,  # Preserve symlinks
+            hardlink=True,
             ignore=ignore_symlinks  # Ignore broken symlinks
-        )
-
+        ))
+        print(f"Staged package tree: {staged.summary()}")
 
-        # Build the Debian package
-        subprocess.run(["dpkg-deb", "--build", debian_dir, deb_file_path], check=True)
+        # Build the Debian package; replacing (not rewriting) the .deb keeps
+        # hardlinked archive copies of an older build intact.
+        deb_tmp_path = f"{deb_file_path}.tmp"
+        subprocess.run(["dpkg-deb", "--build", debian_dir, deb_tmp_path], check=True)
+        os.replace(deb_tmp_path, deb_file_path)
 
         # Print the full path of the generated .deb package
         print("")
@@ -195,9 +204,9 @@ def deploy_device(device_ip, user, dry_run=False, localversion=None, kernel_only
         if not dry_run:
             subprocess.run(["scp", "-r", modules_dir, remote_modules_dir], check=True)
 
-def deploy_jetson(kernel_name, device_ip, user, dry_run=False, localversion=None, dtb=False, kernel_only=False):
+def deploy_jetson(kernel_name, device_ip, user, dry_run=False, localversion=None, dtb=False, kernel_only=False, variant=None):
     # Deploys the compiled kernel to a remote Jetson device via SCP.
-    modules_base_dir = os.path.join("storage", "kernels", kernel_name, "modules")
+    modules_base_dir = kernel_modules_dir(kernel_name, variant)
     kernel_versions = os.listdir(os.path.join(modules_base_dir, "lib", "modules"))
     kernel_version = next((version for version in kernel_versions if version.endswith(localversion)), kernel_versions[-1]) if localversion else kernel_versions[0]
 
@@ -348,6 +357,7 @@ def main():
     deploy_debian_parser.add_argument(
     "--dtb-name", default="tegra234-p3701-0000-p3737-0000",
     help="DTB filename prefix (without .dtb) to include in the package")
+    deploy_debian_parser.add_argument("--variant", help="Package the outputs of compile --variant <name>")
 
     # Deploy to Jetson command
     deploy_jetson_parser = subparsers.add_parser("deploy-jetson")
@@ -358,6 +368,7 @@ def main():
     deploy_jetson_parser.add_argument('--localversion', help='Specify the LOCALVERSION string to choose the correct kernel to deploy')
     deploy_jetson_parser.add_argument('--dtb', action='store_true', help='Sets the DTB compiled with the kernel to be the default')
     deploy_jetson_parser.add_argument('--kernel-only', action='store_true', help='Only deploy the kernel, skipping modules')
+    deploy_jetson_parser.add_argument('--variant', help='Deploy the outputs of compile --variant <name>')
 
     args = parser.parse_args()
 
@@ -371,9 +382,9 @@ def main():
     elif args.command == "deploy-device":
         deploy_device(device_ip=args.ip, user=args.user, dry_run=args.dry_run, localversion=args.localversion, kernel_only=args.kernel_only)
     elif args.command == "deploy-jetson":
-        deploy_jetson(kernel_name=args.kernel_name, device_ip=args.ip, user=args.user, dry_run=args.dry_run, localversion=args.localversion, dtb=args.dtb, kernel_only=args.kernel_only)
+        deploy_jetson(kernel_name=args.kernel_name, device_ip=args.ip, user=args.user, dry_run=args.dry_run, localversion=args.localversion, dtb=args.dtb, kernel_only=args.kernel_only, variant=args.variant)
     elif args.command == "deploy-debian":
-        deb_file = create_deb_package(kernel_name=args.kernel_name, localversion=args.localversion, dtb_name=args.dtb_name)
+        deb_file = create_deb_package(kernel_name=args.kernel_name, localversion=args.localversion, dtb_name=args.dtb_name, variant=args.variant)
     else:
         print("Failed to create Debian package.")
 
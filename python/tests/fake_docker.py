@@ -0,0 +1,202 @@
+"""A fake Docker Engine API on a unix socket, for tests of utils.docker_api and its callers.
+
+It keeps containers, images and exec instances in memory, records every
+request as (method, path, query, body), and speaks HTTP/1.1 keep-alive like
+dockerd. Exec and logs output is sent as multiplexed 8-byte-header frames.
+"""
+
+from __future__ import annotations
+
+import http.server
+import json
+import os
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import utils.docker_api as docker_api
+
+
+def frame(stream: int, data: bytes) -> bytes:
+    return struct.pack(">BxxxL", stream, len(data)) + data
+
+
+class FakeDocker:
+    def __init__(self) -> None:
+        self.containers: dict[str, dict] = {}
+        self.images: dict[str, dict] = {}
+        self.execs: dict[str, dict] = {}
+        self.requests: list[tuple[str, str, dict, object]] = []
+        # name -> (stdout, stderr, exit code) for exec; name -> frames for logs.
+        self.exec_output: dict[str, tuple[bytes, bytes, int]] = {}
+        self.logs: dict[str, list[tuple[int, bytes]]] = {}
+        self.gateway = "172.17.0.1"
+        self.connections = 0
+        self._dir = tempfile.mkdtemp(prefix="fake-docker-")
+        self.path = os.path.join(self._dir, "docker.sock")
+        self._server = _Server(self.path, self)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FakeDocker":
+        self._thread.start()
+        self._env = os.environ.get("DOCKER_HOST")
+        os.environ["DOCKER_HOST"] = f"unix://{self.path}"
+        docker_api._client = None
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if docker_api._client is not None:
+            docker_api._client.close()
+        self._server.shutdown()
+        self._server.server_close()
+        if self._env is None:
+            os.environ.pop("DOCKER_HOST", None)
+        else:
+            os.environ["DOCKER_HOST"] = self._env
+        docker_api._client = None
+        os.remove(self.path)
+        os.rmdir(self._dir)
+
+    def add_container(self, name: str, running: bool = True, labels: dict | None = None) -> None:
+        self.containers[name] = {
+            "Id": f"id-{name}",
+            "Names": [f"/{name}"],
+            "State": {"Running": running, "Status": "running" if running else "exited"},
+            "Config": {"Labels": dict(labels or {})},
+        }
+
+    def _find(self, ref: str) -> dict | None:
+        for name, container in self.containers.items():
+            if ref in (name, container["Id"]):
+                return container
+        return None
+
+    def handle(self, method: str, path: str, query: dict, body) -> tuple[int, object]:
+        """(status, JSON body | bytes | ("stream", frames))."""
+        parts = path.split("/")[2:]  # drop "" and the API version
+        self.requests.append((method, "/" + "/".join(parts), query, body))
+        if parts == ["_ping"]:
+            return 200, b"OK"
+        if parts[:1] == ["networks"]:
+            if parts[1] != "bridge":
+                return 404, {"message": f"network {parts[1]} not found"}
+            return 200, {"Name": "bridge", "IPAM": {"Config": [{"Subnet": "172.17.0.0/16", "Gateway": self.gateway}]}}
+        if parts[:1] == ["images"]:
+            if parts[1] == "json":
+                return 200, list(self.images.values())
+            ref = "/".join(parts[1:-1]) if parts[-1] == "json" else "/".join(parts[1:])
+            if ref not in self.images:
+                return 404, {"message": f"No such image: {ref}"}
+            if method == "DELETE":
+                del self.images[ref]
+                return 200, [{"Deleted": ref}]
+            return 200, self.images[ref]
+        if parts[:1] == ["containers"]:
+            if parts[1] == "json":
+                include_stopped = query.get("all") == "1"
+                return 200, [c for c in self.containers.values() if include_stopped or c["State"]["Running"]]
+            if parts[1] == "create":
+                name = query.get("name") or f"anon{len(self.containers)}"
+                if name in self.containers:
+                    return 409, {"message": f'Conflict. The container name "/{name}" is already in use'}
+                self.add_container(name, running=False, labels=body.get("Labels"))
+                self.containers[name]["Create"] = body
+                return 201, {"Id": self.containers[name]["Id"], "Warnings": []}
+            container = self._find(parts[1])
+            if container is None:
+                return 404, {"message": f"No such container: {parts[1]}"}
+            name = container["Names"][0][1:]
+            action = parts[2] if len(parts) > 2 else None
+            if method == "DELETE":
+                if container["State"]["Running"] and query.get("force") != "1":
+                    return 409, {"message": "You cannot remove a running container"}
+                del self.containers[name]
+                return 204, b""
+            if action == "json":
+                return 200, container
+            if action == "start":
+                container["State"] = {"Running": True, "Status": "running"}
+                return 204, b""
+            if action == "stop":
+                if not container["State"]["Running"]:
+                    return 304, b""
+                container["State"] = {"Running": False, "Status": "exited"}
+                if (container.get("Create") or {}).get("HostConfig", {}).get("AutoRemove"):
+                    del self.containers[name]
+                return 204, b""
+            if action == "wait":
+                return 200, {"StatusCode": container.get("ExitCode", 0)}
+            if action == "logs":
+                return 200, ("stream", self.logs.get(name, []))
+            if action == "exec":
+                exec_id = f"exec{len(self.execs) + 1}"
+                self.execs[exec_id] = {"container": name, "body": body}
+                return 201, {"Id": exec_id}
+        if parts[:1] == ["exec"] and parts[1] in self.execs:
+            instance = self.execs[parts[1]]
+            out, err, rc = self.exec_output.get(instance["container"], (b"", b"", 0))
+            if parts[2] == "start":
+                instance["ExitCode"] = rc
+                return 200, ("stream", [(1, out), (2, err)])
+            return 200, {"ExitCode": instance.get("ExitCode"), "Running": False}
+        return 404, {"message": f"page not found: {path}"}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.fake.connections += 1
+
+    def _dispatch(self) -> None:
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        body = json.loads(raw) if raw else None
+        status, payload = self.server.fake.handle(self.command, unquote(url.path), query, body)
+        if isinstance(payload, tuple):
+            # Streams end by closing the connection, as dockerd's do.
+            self.send_response(status)
+            self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for stream, data in payload[1]:
+                if data:
+                    self.wfile.write(frame(stream, data))
+            self.close_connection = True
+            return
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_DELETE = _dispatch
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, fake: FakeDocker) -> None:
+        self.fake = fake
+        super().__init__(path, _Handler)
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients may hang up mid-reply; dockerd does not complain either.
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) client address.
+        request, _ = super().get_request()
+        return request, ("local", 0)
@@ -0,0 +1,55 @@
+"""Build cache entries stay intact when later builds rewrite the staged outputs."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils.build_cache import build_cache_root, restore_from_cache, store_in_cache, unshare_staged_outputs
+
+
+def _write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Truncate and write through the existing inode, as `cp` in modules_install does.
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class BuildCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        self.addCleanup(os.chdir, cwd)
+        self.modules_dir = os.path.join("storage", "kernels", "k", "modules")
+        self.image = os.path.join(self.modules_dir, "boot", "Image")
+        self.ko = os.path.join(self.modules_dir, "lib", "modules", "6.1.0-kb", "kernel", "a.ko")
+
+    def test_non_cacheable_build_after_a_hit_leaves_the_entry_alone(self) -> None:
+        _write(self.image, b"image v1")
+        _write(self.ko, b"module v1")
+        self.assertTrue(store_in_cache("k1", self.modules_dir, ["Image"], ["6.1.0-kb"]))
+        shutil.rmtree(self.modules_dir)
+        self.assertIsNotNone(restore_from_cache("k1", self.modules_dir))
+        entry = os.path.join(build_cache_root(), "k1")
+
+        # The next build has no cache key (e.g. --no-build-cache) but still unshares first.
+        unshare_staged_outputs(self.modules_dir)
+        self.assertEqual(os.stat(self.ko).st_nlink, 1)
+        _write(self.image, b"image v2")
+        _write(self.ko, b"module v2")
+
+        self.assertEqual(_read(os.path.join(entry, "boot", "Image")), b"image v1")
+        self.assertEqual(_read(os.path.join(entry, "lib", "modules", "6.1.0-kb", "kernel", "a.ko")), b"module v1")
+
+
+if __name__ == "__main__":
+    unittest.main()
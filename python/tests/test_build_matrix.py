@@ -0,0 +1,60 @@
+"""Matrix runs: a failing entry must not skip the entries queued behind it."""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from utils.build_graph import BuildGraph
+from utils.build_matrix import run_matrix
+from utils.kernel_tree import kernel_tree_root
+
+# Stands in for kernel_builder.py: fails the debug_defconfig builds.
+FAKE_BUILDER = "import sys\nsys.exit(2 if 'debug_defconfig' in sys.argv else 0)\n"
+
+
+class OrderOnlyTest(unittest.TestCase):
+    def test_after_waits_but_does_not_skip(self) -> None:
+        graph = BuildGraph(budget=4)
+        graph.add("a", "exit 3")
+        graph.add("b", "true", after=("a",))
+        graph.add("c", "true", deps=("a",))
+        with mock.patch("sys.stdout", new_callable=io.StringIO):
+            rc = graph.run(lambda command, step: subprocess.Popen(command, shell=True), keep_going=True)
+        self.assertEqual(rc, 3)
+        self.assertEqual({r["name"]: r["rc"] for r in graph.results}, {"a": 3, "b": 0})
+
+
+class RunMatrixTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        self.addCleanup(os.chdir, cwd)
+        self.script = os.path.join(self.dir, "builder.py")
+        with open(self.script, "w") as f:
+            f.write(FAKE_BUILDER)
+
+    def test_nvbuild_chain_keeps_going_after_a_failure(self) -> None:
+        # nvbuild trees share kernel_out, so every entry is in one chain.
+        os.makedirs(kernel_tree_root("k"))
+        open(os.path.join(kernel_tree_root("k"), "nvbuild.sh"), "w").close()
+        entries = [{"config": "debug_defconfig"}, {"config": "tegra_defconfig"}, {"config": "debug_defconfig", "dtb_name": "b.dtb"}]
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertEqual(run_matrix(self.script, "k", "arm64", entries, {}, threads=1, parallel=1), 1)
+        self.assertIn("1 chain(s)", out.getvalue())
+        (summary,) = [os.path.join(d, "results.json") for d, _, files in os.walk(kernel_tree_root("k")) if "results.json" in files]
+        with open(summary) as f:
+            statuses = [e["status"] for e in json.load(f)["entries"]]
+        self.assertEqual(statuses, ["rc=2", "ok", "rc=2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
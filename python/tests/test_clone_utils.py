@@ -0,0 +1,102 @@
+"""Clones through the git cache against file:// repositories, including failing mirrors."""
+
+from __future__ import annotations
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import utils.clone_utils as clone_utils
+from utils.clone_utils import clone_device_tree, clone_kernel, clone_overlays, mirror_path
+
+
+def _git(*args: str, cwd: str | None = None) -> str:
+    return subprocess.run(
+        ["git", "-c", "user.name=t", "-c", "user.email=t@example.com", *args],
+        cwd=cwd, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    ).stdout.strip()
+
+
+@unittest.skipIf(shutil.which("git") is None, "needs git")
+class CloneTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        upstream = os.path.join(self.dir, "upstream")
+        os.makedirs(upstream)
+        _git("init", "-q", "-b", "main", cwd=upstream)
+        with open(os.path.join(upstream, "Makefile"), "w") as f:
+            f.write("v1\n")
+        _git("add", "Makefile", cwd=upstream)
+        _git("commit", "-q", "-m", "v1", cwd=upstream)
+        _git("tag", "v1", cwd=upstream)
+        with open(os.path.join(upstream, "Makefile"), "w") as f:
+            f.write("v2\n")
+        _git("commit", "-q", "-am", "v2", cwd=upstream)
+        self.upstream = upstream
+        self.url = f"file://{upstream}"
+        # The clone helpers work on storage/ relative to the repo root.
+        self.work = os.path.join(self.dir, "work")
+        os.makedirs(self.work)
+        cwd = os.getcwd()
+        os.chdir(self.work)
+        self.addCleanup(os.chdir, cwd)
+        self.out = mock.patch("sys.stdout", new_callable=io.StringIO)
+        self.stdout = self.out.start()
+        self.addCleanup(self.out.stop)
+
+    def _kernel(self, name: str) -> str:
+        return os.path.join("storage", "kernels", name, "kernel", "kernel")
+
+    def test_clone_borrows_from_the_mirror(self) -> None:
+        self.assertEqual(clone_kernel(self.url, "a", git_tag="v1"), 0)
+        self.assertEqual(clone_kernel(self.url, "b"), 0)
+        mirror = os.path.abspath(mirror_path(self.url))
+        for name in ("a", "b"):
+            with open(os.path.join(self._kernel(name), ".git", "objects", "info", "alternates")) as f:
+                self.assertEqual(f.read().strip(), os.path.join(mirror, "objects"))
+        with open(os.path.join(self._kernel("a"), "Makefile")) as f:
+            self.assertEqual(f.read(), "v1\n")
+        self.assertEqual(clone_kernel(self.url, "a"), 0)
+        self.assertIn("already exists", self.stdout.getvalue())
+
+    def test_failed_refresh_clones_directly(self) -> None:
+        self.assertEqual(clone_kernel(self.url, "a"), 0)
+        mirror = mirror_path(self.url)
+        _git("-C", mirror, "remote", "set-url", "origin", f"file://{self.dir}/gone")
+        self.assertEqual(clone_kernel(self.url, "b"), 0)
+        self.assertIn("Error: could not refresh the git cache mirror", self.stdout.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self._kernel("b"), ".git", "objects", "info", "alternates")))
+        self.assertEqual(_git("-C", self._kernel("b"), "log", "-1", "--format=%s"), "v2")
+
+    def test_failed_mirror_clones_directly(self) -> None:
+        real_run = clone_utils._run
+
+        def run(command, check=True):
+            if "--mirror" in command:
+                raise subprocess.CalledProcessError(128, command)
+            return real_run(command, check)
+
+        with mock.patch.object(clone_utils, "_run", side_effect=run):
+            self.assertEqual(clone_device_tree(self.url, "a"), 0)
+        self.assertIn("Error: could not mirror", self.stdout.getvalue())
+        self.assertTrue(os.path.isfile(os.path.join("storage", "kernels", "a", "hardware", "Makefile")))
+        self.assertEqual([n for n in os.listdir(clone_utils.GIT_CACHE_DIR) if not n.endswith(".lock")], [])
+
+    def test_failed_clone_returns_its_exit_code(self) -> None:
+        url = f"file://{self.dir}/gone"
+        self.assertNotEqual(clone_kernel(url, "a"), 0)
+        self.assertNotEqual(clone_overlays(url, "a"), 0)
+        self.assertFalse(os.path.exists(os.path.join("storage", "kernels", "a", "kernel", "temp_overlays")))
+        self.assertIn(f"Error: cloning {url}", self.stdout.getvalue())
+
+    def test_unknown_tag_fails(self) -> None:
+        self.assertNotEqual(clone_kernel(self.url, "a", git_tag="v9", use_cache=False), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""distcc worker containers: what `distcc-worker start` asks the daemon for, and a real local worker."""
+
+from __future__ import annotations
+
+import io
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from tests.fake_docker import FakeDocker
+from utils.distcc import (
+    DEFAULT_PORT,
+    DistccWorker,
+    _reachable,
+    start_worker_container,
+    stop_worker_container,
+    worker_container_name,
+    worker_logs,
+)
+from utils.docker_api import DockerAPIError, docker_client
+from utils.docker_utils import docker_image_tag
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _InTempRepo(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, "storage", "toolchains"))
+        os.chdir(self.dir)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+
+class WorkerContainerConfigTest(_InTempRepo):
+    def _create_body(self, fake: FakeDocker) -> dict:
+        return fake.containers[worker_container_name("t")]["Create"]
+
+    def test_defaults_publish_on_loopback_for_the_bridge_only(self) -> None:
+        with FakeDocker() as fake:
+            self.assertEqual(start_worker_container("img", "t", 4632, 4633, 4), 0)
+            body = self._create_body(fake)
+        bindings = body["HostConfig"]["PortBindings"]
+        self.assertEqual(bindings[f"{DEFAULT_PORT}/tcp"], [{"HostIp": "127.0.0.1", "HostPort": "4632"}])
+        self.assertEqual(bindings["3633/tcp"], [{"HostIp": "127.0.0.1", "HostPort": "4633"}])
+        script = body["Cmd"][-1]
+        self.assertIn("--allow 172.17.0.1 ", script)
+        self.assertNotIn("0.0.0.0/0", script)
+        self.assertNotIn("--enable-tcp-insecure", script)
+        self.assertIn("/usr/lib/distcc/", script)
+
+    def test_allow_and_bind(self) -> None:
+        with FakeDocker() as fake:
+            rc = start_worker_container("img", "t", 4632, 4633, 4, allow=["10.0.0.0/24"], bind="10.0.0.5")
+            body = self._create_body(fake)
+        self.assertEqual(rc, 0)
+        self.assertEqual(body["HostConfig"]["PortBindings"][f"{DEFAULT_PORT}/tcp"][0]["HostIp"], "10.0.0.5")
+        self.assertIn("--allow 172.17.0.1 --allow 10.0.0.0/24 ", body["Cmd"][-1])
+
+    def test_no_gateway_and_no_allow_is_refused(self) -> None:
+        with FakeDocker() as fake:
+            fake.gateway = None
+            self.assertEqual(start_worker_container("img", "t", 4632, 4633, 4), 1)
+            self.assertNotIn(worker_container_name("t"), fake.containers)
+
+    def test_stop(self) -> None:
+        with FakeDocker() as fake:
+            start_worker_container("img", "t", 4632, 4633, 4)
+            self.assertEqual(stop_worker_container("t"), 0)
+            # Graceful stop; --rm removes it.
+            self.assertIn(("POST", "/containers/kb-distcc-t/stop", {"t": "10"}, None), fake.requests)
+            self.assertEqual(fake.containers, {})
+            self.assertEqual(stop_worker_container("t"), 1)
+
+    def test_logs(self) -> None:
+        with FakeDocker() as fake:
+            start_worker_container("img", "t", 4632, 4633, 4)
+            fake.logs["kb-distcc-t"] = [(2, b"distccd[1] (dcc_job_summary) client: 172.17.0.1\n")]
+            with mock.patch("sys.stderr", new_callable=io.StringIO) as err:
+                self.assertEqual(worker_logs("t"), 0)
+            self.assertIn("dcc_job_summary", err.getvalue())
+            self.assertEqual(worker_logs("missing"), 1)
+
+
+def _docker_image() -> str | None:
+    try:
+        tag = docker_image_tag()
+        return tag if docker_client().image_inspect(tag) else None
+    except DockerAPIError:
+        return None
+
+
+@unittest.skipUnless(_docker_image(), "needs a Docker daemon and the kernel_builder image (`kernel_builder.py build`)")
+class LocalWorkerTest(_InTempRepo):
+    def test_local_worker_serves_loopback(self) -> None:
+        port, stats_port = _free_port(), _free_port()
+        self.assertEqual(start_worker_container(_docker_image(), "unittest", port, stats_port, 2), 0)
+        try:
+            worker = DistccWorker("127.0.0.1", port, 2, stats_port)
+            deadline = time.time() + 20
+            while not _reachable(worker) and time.time() < deadline:
+                time.sleep(0.5)
+            self.assertTrue(_reachable(worker))
+        finally:
+            self.assertEqual(stop_worker_container("unittest"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,213 @@
+"""utils.docker_api against a fake Engine API server, plus daemon discovery and the CLI fallback."""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import utils.docker_api as docker_api
+from tests.fake_docker import FakeDocker
+from utils.docker_api import (
+    STDERR,
+    STDOUT,
+    DockerAPIError,
+    DockerCLIClient,
+    DockerClient,
+    _run_flags,
+    container_config,
+    docker_client,
+    docker_endpoint,
+)
+from utils.docker_utils import cleanup_docker, ensure_docker_image
+
+
+class ClientTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.fake = FakeDocker().__enter__()
+        self.client = docker_client()
+
+    def tearDown(self) -> None:
+        self.fake.__exit__(None, None, None)
+
+    def test_uses_the_socket_with_one_keep_alive_connection(self) -> None:
+        self.assertIsInstance(self.client, DockerClient)
+        self.fake.add_container("a")
+        for _ in range(5):
+            self.assertIsNotNone(self.client.inspect_container("a"))
+        self.assertIsNone(self.client.inspect_container("missing"))
+        self.assertEqual(self.fake.connections, 1)
+
+    def test_images(self) -> None:
+        self.fake.images["kernel_builder:abc"] = {"Id": "sha256:1", "RepoTags": ["kernel_builder:abc"], "Size": 1, "Created": 0}
+        self.assertEqual(self.client.image_inspect("kernel_builder:abc")["Id"], "sha256:1")
+        self.assertIsNone(self.client.image_inspect("kernel_builder:other"))
+        self.client.remove_image("kernel_builder:abc", force=True)
+        self.assertEqual(self.fake.images, {})
+
+    def test_run_translates_docker_run_flags(self) -> None:
+        config = container_config(
+            "img",
+            ["bash", "-c", "sleep 1"],
+            args=["--rm", "--init", "--cpus=1.5", "-v", "/a:/b:ro", "-p", "127.0.0.1:1:2", "--memory=1024", "-e", "A=1"],
+            user="1000:1000",
+            labels={"l": "v"},
+        )
+        self.client.run_container(config, name="s")
+        created = self.fake.containers["s"]["Create"]
+        self.assertEqual(created["User"], "1000:1000")
+        self.assertEqual(created["HostConfig"]["NanoCpus"], 1_500_000_000)
+        self.assertEqual(created["HostConfig"]["Binds"], ["/a:/b:ro"])
+        self.assertEqual(created["HostConfig"]["Memory"], 1024)
+        self.assertTrue(created["HostConfig"]["AutoRemove"])
+        self.assertTrue(self.fake.containers["s"]["State"]["Running"])
+        with self.assertRaises(ValueError):
+            container_config("img", [], args=["--privileged"])
+
+    def test_stop_and_remove(self) -> None:
+        self.fake.add_container("a")
+        self.client.stop_container("a")
+        # Already stopped (304) is not an error.
+        self.client.stop_container("a")
+        self.assertTrue(self.client.remove_container("a"))
+        self.assertFalse(self.client.remove_container("a", missing_ok=True))
+        with self.assertRaises(DockerAPIError) as raised:
+            self.client.remove_container("a")
+        self.assertEqual(raised.exception.status, 404)
+        self.fake.add_container("b")
+        with self.assertRaises(DockerAPIError) as raised:
+            self.client.remove_container("b")
+        self.assertEqual(raised.exception.status, 409)
+
+    def test_concurrent_cleanup(self) -> None:
+        for i in range(12):
+            self.fake.add_container(f"c{i}")
+        errors = self.client.remove_containers([f"c{i}" for i in range(12)] + ["gone"])
+        self.assertEqual(set(errors.values()), {None})
+        self.assertEqual(self.fake.containers, {})
+
+    def test_cleanup_docker_removes_containers_of_the_image(self) -> None:
+        self.fake.images["kernel_builder:abc"] = {"Id": "sha256:1", "RepoTags": ["kernel_builder:abc"], "Size": 1, "Created": 0}
+        self.fake.add_container("build")
+        with mock.patch("sys.stdout", new_callable=io.StringIO):
+            cleanup_docker()
+        self.assertEqual(self.fake.containers, {})
+        self.assertEqual(self.fake.images, {})
+        _, path, query, _ = next(r for r in self.fake.requests if r[1] == "/containers/json")
+        self.assertEqual(json.loads(query["filters"]), {"ancestor": ["kernel_builder:abc"]})
+
+    def test_logs_and_wait(self) -> None:
+        self.fake.add_container("w")
+        self.fake.containers["w"]["ExitCode"] = 3
+        self.fake.logs["w"] = [(STDOUT, b"out\n"), (STDERR, b"err\n"), (STDOUT, b"more\n")]
+        self.assertEqual(list(self.client.logs("w", follow=True)), self.fake.logs["w"])
+        self.assertEqual(self.client.wait("w"), 3)
+        with self.assertRaises(DockerAPIError):
+            list(self.client.logs("missing"))
+
+    def test_exec_streams_output_and_exit_code(self) -> None:
+        self.fake.add_container("e")
+        self.fake.exec_output["e"] = (b"cpu.stat:usage_usec 5\n", b"warning\n", 7)
+        seen = []
+        rc, out, err = self.client.exec_run("e", ["cat"], user="1:1", on_output=lambda s, d: seen.append(s))
+        self.assertEqual((rc, out, err), (7, b"cpu.stat:usage_usec 5\n", b"warning\n"))
+        self.assertEqual(seen, [STDOUT, STDERR])
+        self.assertEqual(self.fake.execs["exec1"]["body"]["User"], "1:1")
+
+    def test_unreachable_daemon_is_a_clean_error(self) -> None:
+        self.fake.__exit__(None, None, None)
+        with mock.patch.dict(os.environ, {"DOCKER_HOST": "unix:///nonexistent/docker.sock"}):
+            docker_api._client = None
+            with self.assertRaises(DockerAPIError):
+                docker_client().image_inspect("x")
+            with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+                self.assertEqual(ensure_docker_image(), 1)
+            self.assertIn("Error: cannot talk to the Docker daemon", out.getvalue())
+            docker_api._client = None
+        self.fake = FakeDocker().__enter__()
+
+
+class EndpointTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.home = tempfile.mkdtemp()
+        env = {"DOCKER_CONFIG": os.path.join(self.home, ".docker"), "XDG_RUNTIME_DIR": self.home}
+        self.env = mock.patch.dict(os.environ, env)
+        self.env.start()
+        for key in ("DOCKER_HOST", "DOCKER_CONTEXT", "DOCKER_TLS_VERIFY"):
+            os.environ.pop(key, None)
+        docker_api._client = None
+
+    def tearDown(self) -> None:
+        self.env.stop()
+        docker_api._client = None
+        shutil.rmtree(self.home)
+
+    def _context(self, name: str, host: str) -> None:
+        meta = os.path.join(self.home, ".docker", "contexts", "meta", hashlib.sha256(name.encode()).hexdigest())
+        os.makedirs(meta)
+        with open(os.path.join(meta, "meta.json"), "w") as f:
+            json.dump({"Name": name, "Endpoints": {"docker": {"Host": host}}}, f)
+
+    def test_docker_host_wins(self) -> None:
+        os.environ["DOCKER_HOST"] = "unix:///run/other.sock"
+        self.assertEqual(docker_endpoint(), "unix:///run/other.sock")
+
+    def test_current_context(self) -> None:
+        self._context("remote", "ssh://builder@farm")
+        with open(os.path.join(self.home, ".docker", "config.json"), "w") as f:
+            json.dump({"currentContext": "remote"}, f)
+        self.assertEqual(docker_endpoint(), "ssh://builder@farm")
+        self._context("rootless", f"unix://{self.home}/docker.sock")
+        os.environ["DOCKER_CONTEXT"] = "rootless"
+        self.assertEqual(docker_endpoint(), f"unix://{self.home}/docker.sock")
+
+    @unittest.skipIf(os.path.exists(docker_api.DOCKER_SOCKET), "a system Docker socket takes precedence")
+    def test_rootless_socket(self) -> None:
+        open(os.path.join(self.home, "docker.sock"), "w").close()
+        self.assertEqual(docker_endpoint(), f"unix://{self.home}/docker.sock")
+
+    def test_non_unix_endpoints_fall_back_to_the_cli(self) -> None:
+        os.environ["DOCKER_HOST"] = "tcp://10.0.0.2:2376"
+        self.assertIsInstance(docker_client(), DockerCLIClient)
+        docker_api._client = None
+        os.environ["DOCKER_HOST"] = "unix:///var/run/docker.sock"
+        os.environ["DOCKER_TLS_VERIFY"] = "1"
+        self.assertIsInstance(docker_client(), DockerCLIClient)
+
+
+class CLIClientTest(unittest.TestCase):
+    def test_run_flags_round_trip(self) -> None:
+        args = ["--rm", "--init", "--cpus=2", "-v", "/a:/b:ro", "-p", "127.0.0.1:3632:3632", "--memory=5", "--add-host=h:host-gateway"]
+        flags = _run_flags(container_config("img", ["true"], args=args, user="1:1", labels={"l": "v"}))
+        self.assertEqual(container_config("img", ["true"], args=[f for f in flags if f not in ("-u", "1:1", "--label", "l=v")])["HostConfig"],
+                         container_config("img", ["true"], args=args)["HostConfig"])
+        self.assertEqual(flags[:4], ["-u", "1:1", "--label", "l=v"])
+
+    def test_missing_container_maps_to_404(self) -> None:
+        client = DockerCLIClient()
+        result = mock.Mock(returncode=1, stdout="", stderr="Error response from daemon: No such container: x")
+        with mock.patch("subprocess.run", return_value=result):
+            self.assertIsNone(client.inspect_container("x"))
+            self.assertFalse(client.remove_container("x", missing_ok=True))
+            with self.assertRaises(DockerAPIError) as raised:
+                client.stop_container("x")
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_exec_streams_stdout_and_stderr_apart(self) -> None:
+        bin_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bin_dir)
+        with open(os.path.join(bin_dir, "docker"), "w") as f:
+            f.write('#!/bin/sh\necho "$*"\nprintf err >&2\nexit 4\n')
+        os.chmod(os.path.join(bin_dir, "docker"), 0o755)
+        with mock.patch.dict(os.environ, {"PATH": f"{bin_dir}:{os.environ['PATH']}"}):
+            rc, out, err = DockerCLIClient().exec_run("c", ["make", "-j8"], user="1:1", env=["A=1"])
+        self.assertEqual((rc, out, err), (4, b"exec -u 1:1 -e A=1 c make -j8\n", b"err"))
+
+
+if __name__ == "__main__":
+    unittest.main()
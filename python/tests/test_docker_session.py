@@ -0,0 +1,126 @@
+"""Stopping session commands: the exec/kill scripts under local bash, and graph cancellation."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import utils.docker_session as docker_session
+from tests.fake_docker import FakeDocker
+from utils.build_graph import BuildGraph, terminate_process_tree
+from utils.docker_session import BuildSession, SessionProcess, _exec_script, _kill_script
+
+
+def _alive(pgid: int) -> bool:
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+class ScriptTest(unittest.TestCase):
+    """The scripts BuildSession runs in the container, run by a local bash."""
+
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.job = os.path.join(self.dir, "job")
+        patcher = mock.patch.object(docker_session, "HEARTBEAT", os.path.join(self.dir, "heartbeat"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _start(self, command: str) -> subprocess.Popen:
+        # A new session without a terminal, like a non-TTY `docker exec`.
+        return subprocess.Popen(
+            ["bash", "-c", _exec_script(command, job=self.job)],
+            start_new_session=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+
+    def _pgid(self) -> int:
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            try:
+                with open(f"{self.job}.pgid") as f:
+                    return int(f.read())
+            except (OSError, ValueError):
+                time.sleep(0.05)
+        self.fail("job never recorded its process group")
+
+    def test_exit_code_and_cleanup(self) -> None:
+        proc = self._start("exit 3")
+        self.assertEqual(proc.wait(timeout=10), 3)
+        proc.stdout.close()
+        self.assertEqual(os.listdir(self.dir), ["heartbeat"])
+
+    def test_kill_stops_the_whole_job_but_not_the_exec_shell(self) -> None:
+        proc = self._start("sleep 60 & sleep 60; wait")
+        pgid = self._pgid()
+        self.assertNotEqual(pgid, proc.pid)
+        subprocess.run(["bash", "-c", _kill_script(self.job)], check=True)
+        # The exec shell survives to clean up and report the job's status.
+        self.assertEqual(proc.wait(timeout=10), 143)
+        proc.stdout.close()
+        deadline = time.time() + 5
+        while _alive(pgid) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(_alive(pgid))
+
+    def test_kill_before_start_cancels_the_job(self) -> None:
+        subprocess.run(["bash", "-c", _kill_script(self.job)], check=True)
+        proc = self._start(f"touch {self.dir}/ran")
+        self.assertEqual(proc.wait(timeout=10), 143)
+        proc.stdout.close()
+        self.assertFalse(os.path.exists(f"{self.dir}/ran"))
+
+
+class TerminateTest(unittest.TestCase):
+    def test_session_process_signals_its_job_in_the_container(self) -> None:
+        with FakeDocker() as fake:
+            fake.add_container("kb-session-t")
+            session = BuildSession("img", [], user="1000:1000", name="kb-session-t")
+            proc = SessionProcess(["true"], session=session, job="/tmp/.kb-job-1-1")
+            proc.wait()  # the client already died, e.g. with our process group
+            terminate_process_tree(proc)
+        exec_body = fake.execs["exec1"]["body"]
+        self.assertEqual(exec_body["User"], "1000:1000")
+        self.assertEqual(exec_body["Cmd"][:2], ["/bin/bash", "-c"])
+        self.assertIn("kill -TERM -- -$(cat /tmp/.kb-job-1-1.pgid)", exec_body["Cmd"][2])
+
+
+class GraphCancelTest(unittest.TestCase):
+    def test_sigterm_stops_running_steps(self) -> None:
+        graph = BuildGraph(budget=2)
+        graph.add("a", "sleep 60", weight=1)
+        graph.add("b", "sleep 60", weight=1)
+        procs = []
+
+        def spawn(command, step):
+            proc = subprocess.Popen(command, shell=True)
+            procs.append(proc)
+            return proc
+
+        threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM)).start()
+        started = time.time()
+        with self.assertRaises(SystemExit) as raised:
+            graph.run(spawn)
+        self.assertEqual(raised.exception.code, 143)
+        # The graph's workers reap the steps (wait4) and record how they ended.
+        while any(proc.returncode is None for proc in procs) and time.time() - started < 10:
+            time.sleep(0.05)
+        self.assertEqual([proc.returncode for proc in procs], [-signal.SIGTERM] * 2)
+        # SIGTERM handling is only installed while the graph runs.
+        self.assertEqual(signal.getsignal(signal.SIGTERM), signal.SIG_DFL)
+
+
+if __name__ == "__main__":
+    unittest.main()
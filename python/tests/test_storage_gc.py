@@ -0,0 +1,41 @@
+"""Concurrent gc runs: only the one holding storage/gc.lock evicts."""
+
+from __future__ import annotations
+
+import fcntl
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from utils.storage_gc import run_gc
+
+
+class GcLockTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs("storage")
+
+    def test_second_gc_skips(self) -> None:
+        with open(os.path.join("storage", "gc.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with mock.patch("utils.storage_gc.collect_units") as collect, \
+                    mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+                self.assertEqual(run_gc(), 0)
+        collect.assert_not_called()
+        self.assertIn("Another gc is already running", out.getvalue())
+
+    def test_gc_runs_once_the_lock_is_free(self) -> None:
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertEqual(run_gc(), 0)
+        self.assertIn("Nothing to evict", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Per-kernel-tree index of device-tree artifacts (DTB/DTBO) for O(1) lookups.
+
+The index lives at storage/kernels/<name>/.artifact_index.json and maps a file
+name to every path (relative to the tree root) where it was found. Each entry
+directory's mtime is recorded; an index whose directories changed (files
+added/removed, kernel_out wiped) is stale and is rebuilt by a single walk.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+
+from utils.kernel_tree import kernel_tree_root
+
+INDEX_FILENAME = ".artifact_index.json"
+INDEX_VERSION = 1
+INDEXED_SUFFIXES = (".dtb", ".dtbo")
+_SKIP_DIRS = {".git"}
+
+# Per-process cache so repeated lookups during one compile skip the JSON load.
+_loaded: dict[str, dict] = {}
+
+
+def artifact_index_path(kernel_name: str) -> str:
+    return os.path.join(kernel_tree_root(kernel_name), INDEX_FILENAME)
+
+
+def _walk_tree(root: str, want=None):
+    """Yield (dirpath, filename) for files under *root* matching *want*.
+
+    Directory symlinks that leave the tree (a --ram-build kernel_out on tmpfs)
+    are walked through; links back into the tree (O= dirs' `source`) are not.
+    """
+    real_root = os.path.realpath(root)
+    tops = [root]
+    while tops:
+        for dirpath, dirnames, filenames in os.walk(tops.pop()):
+            dirnames[:] = [d for d in dirnames if d not in _SKIP_DIRS]
+            for d in dirnames:
+                path = os.path.join(dirpath, d)
+                if os.path.islink(path) and not os.path.realpath(path).startswith(real_root + os.sep):
+                    tops.append(path)
+            for filename in filenames:
+                if want is None or want(filename):
+                    yield dirpath, filename
+
+
+def scan_artifacts(kernel_name: str) -> dict:
+    """Walk the kernel tree once and return a fresh index (not written)."""
+    root = kernel_tree_root(kernel_name)
+    artifacts: dict[str, list[str]] = {}
+    dirs: dict[str, int] = {}
+    for dirpath, filename in _walk_tree(root, lambda f: f.endswith(INDEXED_SUFFIXES)):
+        rel_dir = os.path.relpath(dirpath, root)
+        artifacts.setdefault(filename, []).append(os.path.normpath(os.path.join(rel_dir, filename)))
+        if rel_dir not in dirs:
+            try:
+                dirs[rel_dir] = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                continue
+    return {"version": INDEX_VERSION, "artifacts": artifacts, "dirs": dirs}
+
+
+def build_artifact_index(kernel_name: str) -> dict:
+    """Rescan the tree and atomically rewrite the on-disk index."""
+    index = scan_artifacts(kernel_name)
+    path = artifact_index_path(kernel_name)
+    if os.path.isdir(os.path.dirname(path)):
+        # Per-process temp name: matrix builds may reindex the same tree at once.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, path)
+    _loaded[kernel_name] = index
+    return index
+
+
+def invalidate_artifact_index(kernel_name: str) -> None:
+    _loaded.pop(kernel_name, None)
+    try:
+        os.remove(artifact_index_path(kernel_name))
+    except FileNotFoundError:
+        pass
+
+
+def _index_is_fresh(kernel_name: str, index: dict) -> bool:
+    if index.get("version") != INDEX_VERSION:
+        return False
+    root = kernel_tree_root(kernel_name)
+    for rel_dir, mtime_ns in index.get("dirs", {}).items():
+        try:
+            if os.stat(os.path.join(root, rel_dir)).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def load_artifact_index(kernel_name: str) -> tuple[dict, bool]:
+    """Return (index, rescanned). Rebuilds the index when missing or stale."""
+    index = _loaded.get(kernel_name)
+    if index is None:
+        try:
+            with open(artifact_index_path(kernel_name), encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+    if index is not None and _index_is_fresh(kernel_name, index):
+        _loaded[kernel_name] = index
+        return index, False
+    return build_artifact_index(kernel_name), True
+
+
+def _under(path: str, root: str) -> bool:
+    prefix = os.path.normpath(root)
+    return path == prefix or path.startswith(prefix + os.sep)
+
+
+def _select(
+    kernel_name: str,
+    paths: list[str],
+    search_roots: list[str] | None,
+    exclude_roots: list[str] | None = None,
+) -> str | None:
+    root = kernel_tree_root(kernel_name)
+    candidates = [
+        os.path.join(root, p) for p in paths
+        if not any(_under(os.path.join(root, p), ex) for ex in exclude_roots or ())
+    ]
+    if not search_roots:
+        search_roots = [root]
+    for search_root in search_roots:
+        for candidate in candidates:
+            if _under(candidate, search_root) and os.path.isfile(candidate):
+                return candidate
+    return None
+
+
+def lookup_artifact(
+    kernel_name: str,
+    name: str,
+    search_roots: list[str] | None = None,
+    exclude_roots: list[str] | None = None,
+) -> str | None:
+    """First path of *name* under the earliest matching *search_roots* (tree-relative to cwd).
+
+    Paths under *exclude_roots* are never returned. Names outside
+    INDEXED_SUFFIXES fall back to a direct walk of the tree.
+    """
+    if not os.path.isdir(kernel_tree_root(kernel_name)):
+        return None
+    if not name.endswith(INDEXED_SUFFIXES):
+        root = kernel_tree_root(kernel_name)
+        paths = [
+            os.path.relpath(os.path.join(d, f), root)
+            for d, f in _walk_tree(root, lambda f: f == name)
+        ]
+        return _select(kernel_name, paths, search_roots, exclude_roots)
+
+    index, rescanned = load_artifact_index(kernel_name)
+    match = _select(kernel_name, index["artifacts"].get(name, []), search_roots, exclude_roots)
+    if match is None and not rescanned:
+        # A miss may mean the artifact appeared in a directory we never indexed.
+        index = build_artifact_index(kernel_name)
+        match = _select(kernel_name, index["artifacts"].get(name, []), search_roots, exclude_roots)
+    return match
@@ -0,0 +1,319 @@
+"""Content-addressed cache of staged compile outputs (Image, DTB, lib/modules).
+
+Entries live under storage/build_cache/<key>/ and mirror the layout of
+storage/kernels/<name>/modules (boot/ + lib/modules/<ver>/). The key hashes
+every git checkout in the kernel tree (HEAD + dirty diff + untracked files),
+the kernel config, toolchain identity, arch and LOCALVERSION, so restoring an
+entry is only done when `make` would have produced the same files.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+
+from utils.kernel_tree import kernel_tree_root, normalize_localversion_suffix
+from utils.staging import stage_file, stage_tree
+
+CACHE_KEY_VERSION = 1
+DEFAULT_MAX_BYTES = 20 * 1024**3
+MANIFEST_NAME = "manifest.json"
+# Build outputs that live inside a kernel tree and must not feed the key.
+_OUTPUT_DIRS = ("kernel_out", "modules", "headers", "build_metrics", "variants", "matrix_logs", ".ctags_index", ".build_locks")
+# Builder bookkeeping kept at the tree root (artifact index, sync journal, DTB include graph, module push record, --ram-build snapshot).
+_STATE_FILES = (
+    ".artifact_index.json", ".sync_journal.json", ".sync_changes", ".dtb_deps.json", ".module_push.json",
+    "kernel_out.snapshot.tar", "kernel_out.snapshot.tar.json",
+)
+
+
+def build_cache_root() -> str:
+    return os.path.join("storage", "build_cache")
+
+
+def _git(repo: str, *args: str) -> bytes:
+    return subprocess.run(
+        ["git", "-C", repo, *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    ).stdout
+
+
+def _source_repos(kernel_name: str, max_depth: int = 3) -> list[str]:
+    root = kernel_tree_root(kernel_name)
+    repos = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        depth = 0 if rel == "." else rel.count(os.sep) + 1
+        if ".git" in dirnames or ".git" in filenames:
+            repos.append(dirpath)
+        dirnames[:] = [
+            d for d in sorted(dirnames)
+            if d != ".git" and not (dirpath == root and d in _OUTPUT_DIRS) and depth < max_depth
+        ]
+    return repos
+
+
+def source_fingerprint(kernel_name: str) -> str | None:
+    """Hash HEAD, dirty diff and untracked files of every checkout in the tree.
+
+    Returns None when the tree has no git checkout (nothing stable to key on).
+    """
+    root = kernel_tree_root(kernel_name)
+    repos = _source_repos(kernel_name)
+    if not repos:
+        return None
+    excludes = [f":(exclude){d}" for d in _OUTPUT_DIRS + _STATE_FILES]
+    digest = hashlib.sha256()
+    for repo in repos:
+        try:
+            head = _git(repo, "rev-parse", "HEAD").strip()
+            diff = _git(repo, "diff", "HEAD", "--binary", "--", ".", *excludes)
+            untracked = _git(
+                repo, "ls-files", "--others", "--exclude-standard", "-z", "--", ".", *excludes
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        digest.update(os.path.relpath(repo, root).encode() + b"\0" + head + b"\0")
+        digest.update(hashlib.sha256(diff).digest())
+        for name in untracked.split(b"\0"):
+            if not name:
+                continue
+            path = os.path.join(repo, os.fsdecode(name))
+            digest.update(name + b"\0" + file_fingerprint(path).encode())
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: str) -> str:
+    """sha256 of a file's content, or '' if it cannot be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except OSError:
+        return ""
+    return digest.hexdigest()
+
+
+def toolchain_identity(gcc_path: str | None, docker_image_id: str = "", fingerprint: str | None = None) -> str:
+    """Identity of the compiler (+ image id): the registry's content fingerprint
+    when there is one, else the resolved path, size and mtime."""
+    parts = [docker_image_id]
+    if fingerprint:
+        parts.append(f"sha256:{fingerprint}")
+    elif gcc_path:
+        real = os.path.realpath(gcc_path)
+        try:
+            st = os.stat(real)
+            parts.append(f"{real}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            parts.append(real)
+    return "|".join(parts)
+
+
+def compute_cache_key(
+    kernel_name: str,
+    *,
+    arch: str,
+    localversion: str,
+    toolchain_id: str,
+    config: str | None,
+    config_path: str | None,
+    dtb_name: str | None,
+    overlays: str | None,
+    build_mode: str,
+) -> str | None:
+    """Return the cache key, or None when the inputs cannot be pinned down."""
+    sources = source_fingerprint(kernel_name)
+    if sources is None:
+        return None
+    if config:
+        # `make <defconfig>` regenerates .config from sources already hashed above.
+        config_id = f"target:{config}"
+    else:
+        config_hash = file_fingerprint(config_path) if config_path else ""
+        if not config_hash:
+            return None
+        config_id = f"file:{config_hash}"
+    fields = {
+        "version": CACHE_KEY_VERSION,
+        "sources": sources,
+        "config": config_id,
+        "toolchain": toolchain_id,
+        "arch": arch,
+        "localversion": localversion or "",
+        "dtb_name": dtb_name or "",
+        "overlays": overlays or "",
+        "build_mode": build_mode,
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def _entry_dir(key: str) -> str:
+    return os.path.join(build_cache_root(), key)
+
+
+def _read_manifest(entry: str) -> dict | None:
+    try:
+        with open(os.path.join(entry, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(entry: str, manifest: dict) -> None:
+    tmp = os.path.join(entry, f"{MANIFEST_NAME}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(entry, MANIFEST_NAME))
+
+
+def staged_module_versions(modules_dir: str, localversion: str, since: float = 0.0) -> list[str]:
+    """lib/modules/<ver> dirs produced for *localversion* (or newer than *since*)."""
+    lib_modules = os.path.join(modules_dir, "lib", "modules")
+    if not os.path.isdir(lib_modules):
+        return []
+    suffix = normalize_localversion_suffix(localversion)
+    versions = []
+    for ver in sorted(os.listdir(lib_modules)):
+        path = os.path.join(lib_modules, ver)
+        if not os.path.isdir(path):
+            continue
+        if suffix and ver.endswith(suffix):
+            versions.append(ver)
+        elif not suffix and os.path.getmtime(path) >= since:
+            versions.append(ver)
+    return versions
+
+
+def cached_manifest(key: str) -> dict | None:
+    """Manifest of a complete entry for *key*, without restoring it."""
+    entry = _entry_dir(key)
+    manifest = _read_manifest(entry)
+    if manifest is None:
+        return None
+    for name in manifest.get("boot", []):
+        if not os.path.isfile(os.path.join(entry, "boot", name)):
+            return None
+    return manifest
+
+
+def restore_from_cache(key: str, modules_dir: str) -> dict | None:
+    """Clone a cached entry into *modules_dir*; returns its manifest on a hit."""
+    entry = _entry_dir(key)
+    manifest = cached_manifest(key)
+    if manifest is None:
+        return None
+    boot_dir = os.path.join(modules_dir, "boot")
+    os.makedirs(boot_dir, exist_ok=True)
+    for name in manifest.get("boot", []):
+        stage_file(os.path.join(entry, "boot", name), os.path.join(boot_dir, name), hardlink=True)
+    for ver in manifest.get("modules", []):
+        dst = os.path.join(modules_dir, "lib", "modules", ver)
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            shutil.rmtree(dst)
+        stage_tree(os.path.join(entry, "lib", "modules", ver), dst, hardlink=True)
+    manifest["last_used"] = time.time()
+    manifest["hits"] = manifest.get("hits", 0) + 1
+    _write_manifest(entry, manifest)
+    return manifest
+
+
+def store_in_cache(
+    key: str,
+    modules_dir: str,
+    boot_names: list[str],
+    module_versions: list[str],
+    metadata: dict | None = None,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> bool:
+    """Record staged outputs under *key*, then evict LRU entries above *max_bytes*."""
+    present = [n for n in boot_names if os.path.isfile(os.path.join(modules_dir, "boot", n))]
+    if not present and not module_versions:
+        return False
+    entry = _entry_dir(key)
+    tmp_entry = f"{entry}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_entry, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_entry, "boot"))
+    size = 0
+    for name in present:
+        size += stage_file(
+            os.path.join(modules_dir, "boot", name), os.path.join(tmp_entry, "boot", name), hardlink=True
+        ).bytes_total
+    for ver in module_versions:
+        size += stage_tree(
+            os.path.join(modules_dir, "lib", "modules", ver),
+            os.path.join(tmp_entry, "lib", "modules", ver),
+            hardlink=True,
+        ).bytes_total
+    now = time.time()
+    manifest = {
+        "key": key,
+        "created": now,
+        "last_used": now,
+        "hits": 0,
+        "size": size,
+        "boot": present,
+        "modules": module_versions,
+        **(metadata or {}),
+    }
+    _write_manifest(tmp_entry, manifest)
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp_entry, entry)
+    evict_build_cache(max_bytes)
+    return True
+
+
+def evict_build_cache(max_bytes: int = DEFAULT_MAX_BYTES) -> list[str]:
+    """Drop least-recently-used entries until the cache fits in *max_bytes*."""
+    root = build_cache_root()
+    if not os.path.isdir(root):
+        return []
+    entries = []
+    for key in os.listdir(root):
+        entry = os.path.join(root, key)
+        manifest = _read_manifest(entry)
+        if manifest is None:
+            if ".tmp-" not in key:
+                shutil.rmtree(entry, ignore_errors=True)
+            continue
+        entries.append((manifest.get("last_used", 0), manifest.get("size", 0), key))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, key in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(os.path.join(root, key), ignore_errors=True)
+        total -= size
+        evicted.append(key)
+    return evicted
+
+
+def unshare_staged_outputs(modules_dir: str) -> int:
+    """Give hardlinked staged files a private inode before `make` rewrites them.
+
+    kbuild and `cp` overwrite files in place, which would corrupt a cache entry
+    sharing the inode. Returns the number of files detached.
+    """
+    detached = 0
+    for dirpath, _, filenames in os.walk(modules_dir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path) or os.path.islink(path) or st.st_nlink < 2:
+                continue
+            tmp = f"{path}.kb-unshare"
+            shutil.copy2(path, tmp)
+            os.replace(tmp, path)
+            detached += 1
+    return detached
@@ -0,0 +1,299 @@
+"""Compile plans as a DAG of steps, run concurrently within a job budget.
+
+Each step is either a shell command (spawned through a caller-supplied
+function, so the same graph runs on the host or inside a build session) or an
+in-process action. A step starts once all its dependencies succeeded, its
+order-only predecessors (`after`) finished however they ended, and its
+weight fits in the remaining budget; a step heavier than the whole budget may
+still run alone. The first failing step stops the graph: nothing new is
+started and running commands are terminated. With keep_going, a failure only
+skips the steps that depend on it. Ctrl-C or SIGTERM (kb-menu's "Stop build",
+a build queue cancel) terminates the running commands the same way.
+"""
+
+from __future__ import annotations
+
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable
+
+# Weight of a step that mostly waits on I/O or runs one process (cp, ctags).
+LIGHT = 1
+
+
+def _descendants(pid: int) -> list[int]:
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf-8") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def terminate_process_tree(proc: subprocess.Popen) -> None:
+    """SIGTERM a `shell=True` process and everything it started (make -jN).
+
+    A `docker exec` client (BuildSession.popen) has a terminate_remote(): the
+    command it started keeps running in the container when the client dies,
+    even if it already died with the rest of our process group.
+    """
+    terminate_remote = getattr(proc, "terminate_remote", None)
+    if terminate_remote is not None:
+        terminate_remote()
+    # returncode, not poll(): reaping here would steal the worker's wait4().
+    if proc.returncode is not None:
+        return
+    for pid in [proc.pid] + _descendants(proc.pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+@contextmanager
+def sigterm_as_exit():
+    """Turn SIGTERM into SystemExit(143) so cleanup runs, as Ctrl-C's KeyboardInterrupt does."""
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_term(signum, frame):
+        raise SystemExit(128 + signum)
+
+    previous = signal.signal(signal.SIGTERM, on_term)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+def wait_with_usage(proc: subprocess.Popen) -> tuple[int, dict]:
+    """Wait for *proc* and return (exit code, resource usage of it and its children)."""
+    try:
+        _, status, ru = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        return proc.wait(), {}
+    proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return proc.returncode, {
+        "cpu_user_s": round(ru.ru_utime, 3),
+        "cpu_sys_s": round(ru.ru_stime, 3),
+        "max_rss_kb": ru.ru_maxrss,
+        # Linux counts ru_oublock in 512-byte units of storage I/O.
+        "bytes_written": ru.ru_oublock * 512,
+    }
+
+
+@dataclass
+class BuildStep:
+    name: str
+    command: str | None = None
+    action: Callable[[], int] | None = None
+    deps: tuple[str, ...] = ()
+    weight: int = LIGHT
+    kind: str = "shell"
+    description: str = ""
+    # Paths the step reads and writes, as seen where it runs (see build_plan).
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+    # Steps that must finish first, though not necessarily succeed.
+    after: tuple[str, ...] = ()
+
+    def summary(self) -> str:
+        return self.command if self.command is not None else self.description
+
+
+@dataclass
+class BuildGraph:
+    """Ordered collection of steps; insertion order breaks scheduling ties."""
+
+    budget: int
+    preamble: list[str] = field(default_factory=list)
+    steps: dict[str, BuildStep] = field(default_factory=dict)
+    # Per finished step: name, kind, rc, start time, wall time and resource usage.
+    results: list[dict] = field(default_factory=list)
+    # Steps left out because their work is already done: name, kind, reason.
+    skipped: list[dict] = field(default_factory=list)
+
+    def add(
+        self,
+        name: str,
+        command: str | None = None,
+        *,
+        action: Callable[[], int] | None = None,
+        deps=(),
+        weight: int = LIGHT,
+        kind: str = "shell",
+        description: str = "",
+        inputs=(),
+        outputs=(),
+        after=(),
+    ) -> str:
+        """Add a step and return its (possibly de-duplicated) name."""
+        if name in self.steps:
+            # Repeated targets (e.g. --build-target modules,modules) get #2, #3, ...
+            base, n = name, 2
+            while f"{base}#{n}" in self.steps:
+                n += 1
+            name = f"{base}#{n}"
+        deps = tuple(d for d in deps if d)
+        after = tuple(a for a in after if a)
+        for dep in deps + after:
+            if dep not in self.steps:
+                raise ValueError(f"build step {name!r} depends on unknown step {dep!r}")
+        if (command is None) == (action is None):
+            raise ValueError(f"build step {name!r} needs exactly one of command or action")
+        self.steps[name] = BuildStep(
+            name, command, action, deps, weight, kind, description, tuple(inputs), tuple(outputs), after
+        )
+        return name
+
+    def skip(self, name: str, kind: str, reason: str) -> None:
+        """Record a step the plan would have had if its work were not already done."""
+        self.skipped.append({"name": name, "kind": kind, "reason": reason})
+
+    def shell_command(self, step: BuildStep) -> str:
+        return " && ".join(self.preamble + [step.command])
+
+    def print_plan(self, dry_run: bool = False) -> None:
+        header = "[Dry-run] Build plan" if dry_run else "Build plan"
+        print(f"{header} ({len(self.steps)} steps, job budget {self.budget}):")
+        if self.preamble:
+            print(f"  (every command runs after: {' && '.join(self.preamble)})")
+        for i, step in enumerate(self.steps.values(), 1):
+            order = list(step.deps) + [f"{a} (any result)" for a in step.after]
+            after = f" after {', '.join(order)}" if order else ""
+            print(f"  {i:2}. {step.name} [{step.kind}, weight {step.weight}]{after}")
+            print(f"      {step.summary()}")
+        for step in self.skipped:
+            print(f"   -. {step['name']} [{step['kind']}] skipped: {step['reason']}")
+
+    def run(
+        self,
+        spawn: Callable[[str, BuildStep], subprocess.Popen],
+        dry_run: bool = False,
+        usage: Callable[[BuildStep], dict | None] | None = None,
+        keep_going: bool = False,
+    ) -> int:
+        """Execute the graph; *spawn(command, step)* starts a shell command.
+
+        *usage(step)* may replace the rusage measured for a step's process (a
+        `docker exec` client uses next to nothing; the real numbers come from
+        inside the container). Returns 0, or the exit code of the first step
+        that failed.
+        """
+        self.print_plan(dry_run=dry_run)
+        if dry_run:
+            return 0
+
+        pending = list(self.steps.values())
+        done: set[str] = set()
+        # Finished or skipped, whatever the outcome; what `after` waits for.
+        ended: set[str] = set()
+        running: dict[str, subprocess.Popen | None] = {}
+        finished: queue.Queue = queue.Queue()
+        lock = threading.Lock()
+        stopping = threading.Event()
+        used = 0
+        failure = 0
+
+        def worker(step: BuildStep) -> None:
+            started = time.time()
+            measured: dict = {}
+            try:
+                if step.action is not None:
+                    rc = step.action()
+                else:
+                    proc = spawn(self.shell_command(step), step)
+                    with lock:
+                        running[step.name] = proc
+                    if stopping.is_set():
+                        terminate_process_tree(proc)
+                    rc, measured = wait_with_usage(proc)
+                    if usage is not None:
+                        measured = usage(step) or {}
+            except Exception as e:  # surfaced as a failed step, not a hung graph
+                print(f"Error: build step {step.name} raised {e!r}")
+                rc = 1
+            elapsed = time.time() - started
+            self.results.append({
+                "name": step.name,
+                "kind": step.kind,
+                "rc": rc,
+                "started": started,
+                "wall_s": round(elapsed, 3),
+                **measured,
+            })
+            finished.put((step, rc, elapsed))
+
+        def stop_running() -> None:
+            stopping.set()
+            with lock:
+                for proc in running.values():
+                    if proc is not None:
+                        terminate_process_tree(proc)
+
+        with sigterm_as_exit():
+            try:
+                while pending or running:
+                    if not stopping.is_set():
+                        for step in list(pending):
+                            if not all(d in done for d in step.deps) or not all(a in ended for a in step.after):
+                                continue
+                            if running and used + step.weight > self.budget:
+                                continue
+                            pending.remove(step)
+                            used += step.weight
+                            with lock:
+                                running[step.name] = None
+                            print(f"==> [{step.name}] started")
+                            threading.Thread(target=worker, args=(step,), daemon=True).start()
+                    if not running:
+                        # Remaining steps depend on a failed or skipped step.
+                        break
+                    step, rc, elapsed = finished.get()
+                    with lock:
+                        running.pop(step.name, None)
+                    used -= step.weight
+                    ended.add(step.name)
+                    if rc == 0:
+                        done.add(step.name)
+                        print(f"==> [{step.name}] done in {elapsed:.1f}s")
+                        continue
+                    if stopping.is_set():
+                        print(f"==> [{step.name}] stopped")
+                        continue
+                    print(f"Error: build step {step.name} failed with exit code {rc}.")
+                    failure = failure or rc
+                    if keep_going:
+                        failed = {step.name}
+                        for other in list(pending):
+                            # pending is in insertion order, so deps are seen first.
+                            if failed.intersection(other.deps):
+                                failed.add(other.name)
+                                ended.add(other.name)
+                                pending.remove(other)
+                                print(f"==> [{other.name}] skipped ({step.name} failed)")
+                        continue
+                    pending.clear()
+                    stop_running()
+            except BaseException:
+                # Ctrl-C or SIGTERM: stop what is still running, here and in build containers.
+                stop_running()
+                raise
+        return failure
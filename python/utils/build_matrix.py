@@ -0,0 +1,225 @@
+"""`compile --matrix`: build every combination of a matrix file concurrently.
+
+A matrix file (YAML, or JSON) lists option axes whose cartesian product is
+built, plus optional explicit entries:
+
+    matrix:
+      config: [tegra_defconfig, debug_defconfig]
+      localversion: [rel, dbg]
+      dtb_name: [tegra234-p3701-0000-p3737-0000.dtb]
+    include:
+      - {config: tegra_defconfig, localversion: lab, overlays: cam.dtbo}
+
+Keys are `compile` option names (dashes or underscores). Every entry runs as
+its own `kernel_builder.py compile --variant <v>` process with output in a log
+file, so a failing entry never takes the others down. Entries that would
+share an O= dir (same variant, e.g. only the DTB differs) run one after the
+other, each whatever the previous one's result; distinct variants run side by
+side. Cores and RAM are split between the concurrent builds: a little
+oversubscription keeps the CPU busy while another build links or runs modpost,
+and memory caps the total -j using the peak compiler RSS from past build
+metrics.
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import math
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+
+from utils.build_graph import BuildGraph
+from utils.build_metrics import fmt_seconds
+from utils.job_planner import job_memory_kb, mem_available_kb
+from utils.kernel_tree import is_nvbuild_kernel, kernel_modules_dir, kernel_tree_root
+
+# Set in the environment of entry builds; the matrix runs auto gc once for all of them.
+MATRIX_ENV = "KB_MATRIX_ENTRY"
+# Options a matrix entry may set, mapped to how they are passed to `compile`.
+VALUE_OPTIONS = (
+    "config", "localversion", "dtb_name", "overlays", "build_target",
+    "toolchain_name", "toolchain_version", "rpi_model", "variant",
+)
+FLAG_OPTIONS = ("build_dtb", "build_modules", "host_build", "ccache", "clean", "generate_ctags")
+# Options that change what lands in the O= dir; entries differing only in
+# others (dtb_name, overlays) can share one variant build.
+_VARIANT_KEYS = ("config", "localversion", "build_target", "toolchain_name", "toolchain_version", "rpi_model", "host_build")
+# Total -j across builds relative to the core count.
+OVERSUBSCRIBE = 1.25
+MIN_JOBS_PER_BUILD = 4
+
+
+def _normalize(entry: dict, path: str) -> dict:
+    out = {}
+    for key, value in entry.items():
+        key = key.replace("-", "_")
+        if key not in VALUE_OPTIONS + FLAG_OPTIONS:
+            raise ValueError(f"{path}: unknown compile option {key!r}")
+        out[key] = value
+    return out
+
+
+def load_matrix(path: str) -> list[dict]:
+    """Expanded entries of a matrix file; raises ValueError on a bad file."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f"{path}: reading YAML needs PyYAML (pip install pyyaml), or use a .json matrix")
+        data = yaml.safe_load(text)
+    else:
+        data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: expected a mapping with 'matrix' and/or 'include'")
+    axes = _normalize(data.get("matrix") or {}, path)
+    for key, values in axes.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"{path}: matrix axis {key!r} must be a non-empty list")
+    entries = []
+    if axes:
+        keys = list(axes)
+        for combo in itertools.product(*(axes[k] for k in keys)):
+            entries.append(dict(zip(keys, combo)))
+    for extra in data.get("include") or []:
+        entries.append(_normalize(extra, path))
+    excludes = [_normalize(e, path) for e in data.get("exclude") or []]
+    entries = [e for e in entries if not any(all(e.get(k) == v for k, v in ex.items()) for ex in excludes)]
+    if not entries:
+        raise ValueError(f"{path}: the matrix has no entries")
+    return entries
+
+
+def _slug(value) -> str:
+    text = str(value)
+    text = re.sub(r"\.(dtbo?|config)$|_?defconfig$", "", text)
+    return re.sub(r"[^A-Za-z0-9._+-]+", "_", text).strip("_") or "x"
+
+
+def variant_name(entry: dict) -> str:
+    if entry.get("variant"):
+        return str(entry["variant"])
+    parts = []
+    for key in _VARIANT_KEYS:
+        value = entry.get(key)
+        if value is True:
+            parts.append(key.replace("_", "-"))
+        elif value:
+            parts.append(_slug(value))
+    return "-".join(parts) or "default"
+
+
+def entry_name(entry: dict) -> str:
+    extras = [_slug(entry[k]) for k in ("dtb_name", "overlays") if entry.get(k)]
+    return "-".join([variant_name(entry)] + extras)
+
+
+def plan_resources(kernel_name: str, groups: int, threads: int | None, parallel: int | None) -> tuple[int, int, str]:
+    """(concurrent builds, -j per build, explanation) for *groups* independent chains."""
+    cores = os.cpu_count() or 1
+    budget = math.ceil(cores * OVERSUBSCRIBE)
+    per_job = job_memory_kb(kernel_name)[0]
+    available = mem_available_kb()
+    note = f"{cores} cores"
+    if available:
+        mem_jobs = max(1, available // per_job)
+        note += f", {available // 1024} MiB available / {per_job // 1024} MiB per job"
+        budget = min(budget, mem_jobs)
+    concurrent = parallel or max(1, min(groups, budget // MIN_JOBS_PER_BUILD))
+    concurrent = min(concurrent, groups)
+    jobs = threads or max(1, budget // concurrent)
+    return concurrent, jobs, note
+
+
+def _compile_argv(script: str, kernel_name: str, arch: str, entry: dict, base: dict, jobs: int, nvbuild: bool) -> list[str]:
+    options = {**base, **entry}
+    argv = [sys.executable, script, "compile", "--kernel-name", kernel_name, "--arch", arch, "--threads", str(jobs)]
+    if not nvbuild:
+        options["variant"] = variant_name(entry)
+    for key in VALUE_OPTIONS:
+        if options.get(key):
+            argv += [f"--{key.replace('_', '-')}", str(options[key])]
+    for key in FLAG_OPTIONS:
+        if options.get(key):
+            argv.append(f"--{key.replace('_', '-')}")
+    argv += base.get("extra_args", [])
+    return argv
+
+
+def run_matrix(
+    script: str,
+    kernel_name: str,
+    arch: str,
+    entries: list[dict],
+    base: dict,
+    *,
+    threads: int | None = None,
+    parallel: int | None = None,
+    dry_run: bool = False,
+) -> int:
+    """Build every entry; prints and writes a per-entry result table. Returns 0 if all passed."""
+    nvbuild = is_nvbuild_kernel(kernel_name)
+    # One chain per O= dir; nvbuild trees share kernel_out, so everything is one chain.
+    chains: dict[str, list[dict]] = {}
+    for entry in entries:
+        chains.setdefault("kernel_out" if nvbuild else variant_name(entry), []).append(entry)
+    concurrent, jobs, note = plan_resources(kernel_name, len(chains), threads, parallel)
+    print(
+        f"Matrix: {len(entries)} build(s) in {len(chains)} chain(s); "
+        f"{concurrent} concurrent at -j{jobs} ({note})."
+    )
+    if nvbuild and len(entries) > 1:
+        print("nvbuild tree: entries share kernel_out and run one at a time.")
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    log_dir = os.path.join(kernel_tree_root(kernel_name), "matrix_logs", stamp)
+    graph = BuildGraph(budget=concurrent * jobs)
+    rows: dict[str, dict] = {}
+    for chain_entries in chains.values():
+        previous = None
+        for entry in chain_entries:
+            name = entry_name(entry)
+            argv = _compile_argv(script, kernel_name, arch, entry, base, jobs, nvbuild)
+            log_path = os.path.join(log_dir, f"{name}.log")
+            previous = graph.add(
+                name,
+                f"{shlex.join(argv)} > {shlex.quote(log_path)} 2>&1",
+                after=(previous,),
+                weight=jobs,
+                kind="compile",
+            )
+            rows[previous] = {
+                "name": previous,
+                "variant": None if nvbuild else variant_name(entry),
+                "options": entry,
+                "log": log_path,
+                "staged": kernel_modules_dir(kernel_name, None if nvbuild else variant_name(entry)),
+            }
+    if not dry_run:
+        os.makedirs(log_dir, exist_ok=True)
+    env = {**os.environ, MATRIX_ENV: "1"}
+    rc = graph.run(lambda command, step: subprocess.Popen(command, shell=True, env=env), dry_run=dry_run, keep_going=True)
+    if dry_run:
+        return 0
+
+    results = {r["name"]: r for r in graph.results}
+    print()
+    print(f"Matrix results ({kernel_name}):")
+    print(f"  {'entry':<40} {'status':<8} {'wall':>9}  staged / log")
+    for name, row in rows.items():
+        result = results.get(name)
+        row["status"] = "skipped" if result is None else ("ok" if result["rc"] == 0 else f"rc={result['rc']}")
+        row["wall_s"] = result["wall_s"] if result else None
+        where = row["staged"] if row["status"] == "ok" else row["log"]
+        print(f"  {name:<40} {row['status']:<8} {fmt_seconds(row['wall_s']):>9}  {where}")
+    summary_path = os.path.join(log_dir, "results.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump({"kernel_name": kernel_name, "arch": arch, "jobs": jobs, "concurrent": concurrent, "entries": list(rows.values())}, f, indent=2)
+    print(f"Results written to {summary_path}")
+    return 1 if rc else 0
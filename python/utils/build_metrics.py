@@ -0,0 +1,234 @@
+"""Per-phase compile telemetry under storage/kernels/<name>/build_metrics/.
+
+Every non-dry-run compile writes one <timestamp>.json holding the build
+context (tree commit, threads, toolchain, host/Docker, ccache) and one record
+per executed step: wall time, CPU time, peak RSS and bytes written. Docker
+steps report CPU and I/O measured inside the container; peak RSS is only
+available for host steps. `kernel_builder.py stats` summarizes the history.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import statistics
+import subprocess
+import time
+
+from utils.kernel_tree import kernel_tree_root, nvbuild_kernel_src_dir
+
+METRICS_VERSION = 1
+
+
+def metrics_dir(kernel_name: str) -> str:
+    return os.path.join(kernel_tree_root(kernel_name), "build_metrics")
+
+
+def step_stats_dir(kernel_name: str) -> str:
+    """Scratch dir for per-step stats files written from inside the container."""
+    return os.path.join(metrics_dir(kernel_name), ".steps")
+
+
+def tree_commit(kernel_name: str) -> dict:
+    """HEAD and dirty state of the kernel source checkout (empty if not a git tree)."""
+    source = nvbuild_kernel_src_dir(kernel_name) or os.path.join(
+        kernel_tree_root(kernel_name), "kernel", "kernel"
+    )
+    try:
+        toplevel, head = subprocess.run(
+            ["git", "-C", source, "rev-parse", "--show-toplevel", "HEAD"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True,
+        ).stdout.split()
+        dirty = subprocess.run(
+            ["git", "-C", source, "status", "--porcelain", "--untracked-files=no"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return {}
+    tree = os.path.realpath(kernel_tree_root(kernel_name))
+    toplevel = os.path.realpath(toplevel)
+    if toplevel != tree and not toplevel.startswith(tree + os.sep):
+        # Not a checkout of its own; git found an enclosing repository.
+        return {}
+    return {"commit": head, "dirty": bool(dirty)}
+
+
+class BuildMetrics:
+    """Collects step results for one compile and writes them as JSON."""
+
+    def __init__(self, kernel_name: str, **context) -> None:
+        self.kernel_name = kernel_name
+        self.started = time.time()
+        self.context = context
+        self.steps: list[dict] = []
+
+    def add_steps(self, results: list[dict]) -> None:
+        self.steps.extend(results)
+
+    def add_step(self, name: str, kind: str, rc: int, started: float, **measured) -> None:
+        self.steps.append({
+            "name": name,
+            "kind": kind,
+            "rc": rc,
+            "started": started,
+            "wall_s": round(time.time() - started, 3),
+            **measured,
+        })
+
+    def write(self, rc: int) -> str | None:
+        """Write the record; returns its path, or None if the tree is gone."""
+        out_dir = metrics_dir(self.kernel_name)
+        if not os.path.isdir(kernel_tree_root(self.kernel_name)):
+            return None
+        os.makedirs(out_dir, exist_ok=True)
+        finished = time.time()
+        record = {
+            "version": METRICS_VERSION,
+            "kernel_name": self.kernel_name,
+            "started": self.started,
+            "finished": finished,
+            "wall_s": round(finished - self.started, 3),
+            "rc": rc,
+            **tree_commit(self.kernel_name),
+            **self.context,
+            "steps": sorted(self.steps, key=lambda s: s["started"]),
+        }
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        path = os.path.join(out_dir, f"{stamp}.json")
+        n = 1
+        while True:
+            # O_EXCL reserves the name against concurrent (matrix) compiles.
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                path = os.path.join(out_dir, f"{stamp}-{n}.json")
+                n += 1
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp, path)
+        return path
+
+
+def load_build_metrics(kernel_name: str) -> list[dict]:
+    """All readable records for *kernel_name*, oldest first."""
+    out_dir = metrics_dir(kernel_name)
+    if not os.path.isdir(out_dir):
+        return []
+    records = []
+    for name in sorted(os.listdir(out_dir)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(out_dir, name), encoding="utf-8") as f:
+                records.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    records.sort(key=lambda r: r.get("started", 0))
+    return records
+
+
+def fmt_seconds(value: float | None) -> str:
+    """1m05.0s / 4.2s, or "-" for no value; shared by the build reports."""
+    if value is None:
+        return "-"
+    if value >= 60:
+        return f"{int(value // 60)}m{value % 60:04.1f}s"
+    return f"{value:.1f}s"
+
+
+def fmt_bytes(value: float | None) -> str:
+    """512B / 3K / 20G, or "-" for no value."""
+    if value is None:
+        return "-"
+    for unit in ("B", "K", "M", "G"):
+        if value < 1024:
+            return f"{value:.0f}{unit}"
+        value /= 1024
+    return f"{value:.1f}T"
+
+
+def phase_name(step_name: str) -> str:
+    """The phase of a graph step: "modules#2" -> "modules"."""
+    return step_name.split("#", 1)[0]
+
+
+def print_build_stats(kernel_name: str, last: int = 10) -> int:
+    records = load_build_metrics(kernel_name)
+    if not records:
+        print(f"No build metrics recorded under {metrics_dir(kernel_name)}.")
+        return 1
+
+    print(f"Recent compiles of {kernel_name} ({len(records)} recorded):")
+    print(f"  {'started':<19} {'rc':>3} {'wall':>9} {'cpu':>9} {'-j':>4} {'mode':<7} {'commit':<12} toolchain")
+    for record in records[-last:]:
+        cpu = sum(s.get("cpu_user_s", 0) + s.get("cpu_sys_s", 0) for s in record.get("steps", []))
+        commit = (record.get("commit") or "-")[:10] + ("+" if record.get("dirty") else "")
+        print(
+            f"  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.get('started', 0)))} "
+            f"{record.get('rc', '-'):>3} {fmt_seconds(record.get('wall_s')):>9} {fmt_seconds(cpu):>9} "
+            f"{str(record.get('threads') or '-'):>4} {record.get('mode', '-'):<7} {commit:<12} "
+            f"{record.get('toolchain') or '-'}"
+        )
+
+    # Throttling under each --resource-profile, to right-size the profiles.
+    profiles: dict[str, list[dict]] = {}
+    for record in records:
+        if record.get("resources"):
+            profiles.setdefault(record["resources"]["profile"], []).append(record["resources"])
+    if profiles:
+        print()
+        print("Resource profiles:")
+        print(
+            f"  {'profile':<12} {'runs':>4} {'throttled':>9} {'cpu stall':>9} {'io stall':>9} "
+            f"{'peak mem':>9} {'limit':>9} {'at limit':>8} {'oom':>4}"
+        )
+        for name, runs in profiles.items():
+            throttling = [r.get("throttling", {}) for r in runs]
+            peak = max((t["memory_peak"] for t in throttling if t.get("memory_peak")), default=None)
+            print(
+                f"  {name:<12} {len(runs):>4} "
+                f"{fmt_seconds(statistics.median(t.get('cpu_throttled_s', 0) for t in throttling)):>9} "
+                f"{fmt_seconds(statistics.median(t.get('cpu_stall_s', 0) for t in throttling)):>9} "
+                f"{fmt_seconds(statistics.median(t.get('io_stall_s', 0) for t in throttling)):>9} "
+                f"{fmt_bytes(peak):>9} {fmt_bytes(runs[-1].get('memory') or None):>9} "
+                f"{sum(t.get('memory_max_events', 0) for t in throttling):>8} "
+                f"{sum(t.get('oom_kills', 0) for t in throttling):>4}"
+            )
+
+    # Phase trends over successful runs: median, latest and latest vs median.
+    phases: dict[str, list[dict]] = {}
+    for record in records:
+        if record.get("rc") != 0:
+            continue
+        for step in record.get("steps", []):
+            if step.get("rc") == 0:
+                phases.setdefault(phase_name(step["name"]), []).append(step)
+    if not phases:
+        return 0
+    print()
+    print("Phases (successful runs):")
+    print(
+        f"  {'phase':<18} {'runs':>4} {'median':>9} {'last':>9} {'trend':>7} "
+        f"{'cpu/wall':>8} {'peak rss':>9} {'written':>9}"
+    )
+    for name, steps in phases.items():
+        walls = [s["wall_s"] for s in steps]
+        median = statistics.median(walls)
+        latest = walls[-1]
+        trend = f"{(latest - median) / median * 100:+.0f}%" if median > 0 else "-"
+        ratios = [
+            (s["cpu_user_s"] + s["cpu_sys_s"]) / s["wall_s"]
+            for s in steps
+            if "cpu_user_s" in s and s["wall_s"] > 0
+        ]
+        util = f"{statistics.median(ratios):.1f}x" if ratios else "-"
+        rss = max((s["max_rss_kb"] for s in steps if s.get("max_rss_kb")), default=None)
+        written = [s["bytes_written"] for s in steps if "bytes_written" in s]
+        print(
+            f"  {name:<18} {len(steps):>4} {fmt_seconds(median):>9} {fmt_seconds(latest):>9} {trend:>7} "
+            f"{util:>8} {fmt_bytes(rss * 1024 if rss else None):>9} "
+            f"{fmt_bytes(statistics.median(written) if written else None):>9}"
+        )
+    return 0
@@ -0,0 +1,166 @@
+"""`compile --plan`: the build graph as data, with durations from earlier builds.
+
+--plan implies --dry-run. Instead of running its graph, each compile path
+hands it to a BuildPlan along with where the commands would run: on the
+host, or in the builder container (image, user, mounts). Each step
+carries:
+
+- its full shell command (or, for in-process actions, a description);
+- its working dir and whether it runs on the host or in the container;
+- its inputs and outputs, as paths seen by whatever runs the step;
+- estimate_s: the median wall time of the same phase in successful earlier
+  builds of the tree (build_metrics/). Runs in the same mode and at the same
+  -j are preferred. The value is null if the phase never ran;
+- cache_hit: true for work that is already done (a build cache entry, an
+  up-to-date nvbuild tree or DTB). Such a step is listed with its reason
+  instead of running. false means the step runs; null means only make
+  can tell.
+
+The plan's eta_s is the longest estimated path through the dependencies.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import statistics
+
+from utils.build_graph import BuildGraph
+from utils.build_metrics import fmt_seconds, load_build_metrics, phase_name
+
+PLAN_VERSION = 1
+# Recent successful runs of a phase that feed its estimate.
+ESTIMATE_SAMPLES = 10
+
+
+def _phase_walls(records: list[dict], match) -> dict[str, list[float]]:
+    walls: dict[str, list[float]] = {}
+    for record in records:
+        if record.get("rc") != 0 or not match(record):
+            continue
+        for step in record.get("steps", []):
+            if step.get("rc") == 0 and "wall_s" in step:
+                walls.setdefault(phase_name(step["name"]), []).append(step["wall_s"])
+    return walls
+
+
+class BuildPlan:
+    """Steps a compile would run, collected instead of executed."""
+
+    def __init__(self, kernel_name: str, **context) -> None:
+        self.kernel_name = kernel_name
+        self.context = context
+        self.steps: list[dict] = []
+        self._history: list[tuple[str, dict[str, list[float]]]] | None = None
+
+    def _estimate(self, name: str) -> tuple[float | None, int, str]:
+        """(seconds, samples, basis) for the phase of step *name*."""
+        if self._history is None:
+            records = load_build_metrics(self.kernel_name)
+            mode, threads = self.context.get("mode"), self.context.get("threads")
+            self._history = [
+                ("same mode and -j", _phase_walls(records, lambda r: r.get("mode") == mode and r.get("threads") == threads)),
+                ("same mode", _phase_walls(records, lambda r: r.get("mode") == mode)),
+                ("any build", _phase_walls(records, lambda r: True)),
+            ]
+        phase = phase_name(name)
+        for basis, walls in self._history:
+            samples = walls.get(phase, [])[-ESTIMATE_SAMPLES:]
+            if samples:
+                return round(statistics.median(samples), 1), len(samples), basis
+        return None, 0, ""
+
+    def add_step(
+        self,
+        name: str,
+        kind: str,
+        *,
+        command: str | None = None,
+        description: str = "",
+        deps=(),
+        workdir: str | None = None,
+        container: dict | None = None,
+        inputs=(),
+        outputs=(),
+        cache_hit: bool | None = None,
+        reason: str = "",
+    ) -> None:
+        estimate, samples, basis = (0.0, 0, "") if reason else self._estimate(name)
+        self.steps.append({
+            "name": name,
+            "kind": kind,
+            "command": command,
+            "description": description,
+            "deps": list(deps),
+            # In-process actions always run in the builder itself.
+            "runs_in": "container" if container and command is not None else "host",
+            "workdir": workdir if command is not None else os.getcwd(),
+            "inputs": list(inputs),
+            "outputs": list(outputs),
+            "estimate_s": estimate,
+            "estimate_samples": samples,
+            "estimate_basis": basis,
+            "cache_hit": cache_hit,
+            **({"reason": reason} if reason else {}),
+        })
+        if container and "container" not in self.context:
+            self.context["container"] = container
+
+    def add_graph(self, graph: BuildGraph, *, workdir: str, container: dict | None = None) -> None:
+        """Record *graph*'s steps; shell commands would run in *workdir* (host or *container*)."""
+        for step in graph.steps.values():
+            self.add_step(
+                step.name,
+                step.kind,
+                command=graph.shell_command(step) if step.command is not None else None,
+                description=step.description,
+                deps=step.deps,
+                workdir=workdir,
+                container=container,
+                inputs=step.inputs,
+                outputs=step.outputs,
+                # make decides for itself; in-process actions always do their work.
+                cache_hit=None if step.kind in ("make", "dtb") and step.command is not None else False,
+            )
+        for step in graph.skipped:
+            self.add_step(step["name"], step["kind"], cache_hit=True, reason=step["reason"])
+
+    def eta(self) -> float:
+        """Longest estimated path through the steps (unknown estimates count as 0)."""
+        finish: dict[str, float] = {}
+        for step in self.steps:
+            if step["cache_hit"] and step.get("reason"):
+                continue
+            start = max((finish.get(d, 0.0) for d in step["deps"]), default=0.0)
+            finish[step["name"]] = start + (step["estimate_s"] or 0.0)
+        return round(max(finish.values(), default=0.0), 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": PLAN_VERSION,
+            "kernel_name": self.kernel_name,
+            **self.context,
+            "eta_s": self.eta(),
+            "unestimated": [s["name"] for s in self.steps if s["estimate_s"] is None and not s.get("reason")],
+            "steps": self.steps,
+        }
+
+    def write_json(self, out) -> None:
+        json.dump(self.to_dict(), out, indent=2)
+        out.write("\n")
+
+    def print_text(self) -> None:
+        plan = self.to_dict()
+        unknown = f", {len(plan['unestimated'])} step(s) without history" if plan["unestimated"] else ""
+        print(f"Build plan for {self.kernel_name} ({len(self.steps)} steps, ETA {fmt_seconds(plan['eta_s'])}{unknown}):")
+        container = self.context.get("container")
+        if container:
+            print(f"  container: {container['image']} as {container['user']} (session {container['name']})")
+        for i, step in enumerate(self.steps, 1):
+            if step.get("reason"):
+                print(f"  {i:2}. {step['name']} [{step['kind']}] skipped: {step['reason']}")
+                continue
+            after = f" after {', '.join(step['deps'])}" if step["deps"] else ""
+            estimate = f"~{fmt_seconds(step['estimate_s'])}" if step["estimate_s"] is not None else "no history"
+            print(f"  {i:2}. {step['name']} [{step['kind']}, {step['runs_in']}] {estimate}{after}")
+            print(f"      {step['command'] if step['command'] is not None else step['description']}")
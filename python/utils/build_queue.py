@@ -0,0 +1,575 @@
+"""Local build queue: one daemon runs compiles for every CLI and kb-menu client.
+
+`kernel_builder.py compile` submits its own arguments to the daemon over a
+Unix socket (storage/build_queue/queue.sock) and streams the job's log back;
+the daemon runs them as `<its python> <its kernel_builder.py> compile ...` from
+its own cwd (the repo root), with the client's values of ENV_PASSTHROUGH
+only. The socket is private to the daemon's user (0600), and the daemon
+checks every client's uid (SO_PEERCRED). If no daemon is running, the first
+client starts one, which exits again after sitting idle.
+
+- Per-tree locks: at most one job per kernel tree runs at a time, and at most
+  --max-running jobs overall, so builds never share kernel_out or cores.
+- Priorities: interactive (module/DTB-only builds) run before normal ones,
+  normal before release (bindeb-pkg, --clean, --matrix). Equal priorities
+  run in submission order.
+- Deduplication: submitting the argv of a job that is still queued or
+  running attaches to that job instead of queueing another.
+- Logs go to storage/build_queue/logs/<id>.log and to every attached client,
+  each starting from the beginning of the log.
+
+Every compile process also holds a flock on its build slot (the tree, or one
+--variant's O= dir), so a --no-queue compile still cannot trample a queued one.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+from utils.kernel_tree import kernel_tree_root
+
+# Set in the environment of jobs the daemon runs: their compile runs directly.
+JOB_ENV = "KB_BUILD_QUEUE_JOB"
+PRIORITIES = ("interactive", "normal", "release")
+DEFAULT_IDLE_TIMEOUT = 600
+DEFAULT_MAX_RUNNING = 1
+KEEP_LOGS = 50
+# The only variables of the client's environment a job sees.
+ENV_PASSTHROUGH = (
+    "PATH", "HOME", "USER", "LOGNAME", "LANG", "LC_ALL", "LC_CTYPE", "TERM", "TZ", "TMPDIR",
+    # Rootless ($XDG_RUNTIME_DIR/docker.sock), TLS and ssh:// Docker daemons.
+    "DOCKER_HOST", "DOCKER_CONFIG", "DOCKER_CONTEXT", "DOCKER_TLS_VERIFY", "DOCKER_CERT_PATH",
+    "XDG_RUNTIME_DIR", "SSH_AUTH_SOCK",
+)
+_CONNECT_TIMEOUT = 10
+
+
+def queue_dir() -> str:
+    return os.path.join("storage", "build_queue")
+
+
+def socket_path() -> str:
+    # Relative on purpose: AF_UNIX paths are limited to ~108 bytes, and every
+    # client and the daemon run from the repo root.
+    return os.path.join(queue_dir(), "queue.sock")
+
+
+def logs_dir() -> str:
+    return os.path.join(queue_dir(), "logs")
+
+
+# --- per-slot flock ---------------------------------------------------------
+
+_held_locks: list[int] = []
+
+
+def build_slot(variant: str | None) -> str:
+    return f"variant-{variant}" if variant else "tree"
+
+
+def hold_tree_lock(kernel_name: str, slot: str) -> None:
+    """Block until this process owns *slot* of the tree; held until exit."""
+    lock_dir = os.path.join(kernel_tree_root(kernel_name), ".build_locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    fd = os.open(os.path.join(lock_dir, f"{slot}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        try:
+            holder = os.pread(fd, 64, 0).decode(errors="replace").strip()
+        except OSError:
+            holder = ""
+        print(f"Waiting for {kernel_name} ({slot}), locked by {holder or 'another compile'} ...", flush=True)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, f"pid {os.getpid()}".encode(), 0)
+    _held_locks.append(fd)
+
+
+# --- jobs and the daemon ------------------------------------------------------
+
+
+@dataclass
+class Job:
+    id: int
+    kernel_name: str
+    argv: list[str]
+    priority: str
+    label: str
+    submitted: float
+    state: str = "queued"  # queued, running, done, cancelled
+    rc: int | None = None
+    started: float | None = None
+    finished: float | None = None
+    log_path: str = ""
+    env: dict = field(default_factory=dict, repr=False)
+
+    def info(self) -> dict:
+        data = asdict(self)
+        data.pop("env")
+        return data
+
+
+class _JobLog:
+    """Output of one job: appended by its reader thread, followed by clients."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.chunks: list[str] = []
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def append(self, text: str) -> None:
+        with self.cond:
+            self.chunks.append(text)
+            self.cond.notify_all()
+
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def follow(self):
+        """Yield every chunk from the first one until the job has finished."""
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.closed:
+                    self.cond.wait()
+                new = self.chunks[index:]
+                index = len(self.chunks)
+                closed = self.closed
+            yield from new
+            if closed and index >= len(self.chunks):
+                return
+
+
+class BuildQueue:
+    def __init__(self, script: str, max_running: int = DEFAULT_MAX_RUNNING) -> None:
+        self.script = script
+        self.max_running = max(1, max_running)
+        self.jobs: dict[int, Job] = {}
+        self.logs: dict[int, _JobLog] = {}
+        self.procs: dict[int, subprocess.Popen] = {}
+        self.next_id = int(time.time() * 1000) % 1_000_000
+        self.lock = threading.Condition()
+        self.last_activity = time.time()
+        self.clients = 0
+        self.stopping = False
+
+    def submit(self, request: dict) -> tuple[Job, bool]:
+        """Queue a job, or return the identical queued/running one (deduplicated=True)."""
+        args = request.get("args")
+        if not isinstance(args, list) or not args or args[0] != "compile" or not all(isinstance(a, str) for a in args):
+            raise ValueError("only `compile ...` arguments can be queued")
+        argv = [sys.executable, self.script, *args]
+        env = {k: v for k, v in (request.get("env") or {}).items() if k in ENV_PASSTHROUGH and isinstance(v, str)}
+        with self.lock:
+            self.last_activity = time.time()
+            for job in self.jobs.values():
+                if job.state in ("queued", "running") and job.argv == argv:
+                    return job, True
+            self.next_id += 1
+            priority = request.get("priority") if request.get("priority") in PRIORITIES else "normal"
+            job = Job(
+                id=self.next_id,
+                kernel_name=request["kernel_name"],
+                argv=argv,
+                priority=priority,
+                label=request.get("label") or " ".join(args),
+                submitted=time.time(),
+                env=env,
+            )
+            job.log_path = os.path.join(logs_dir(), f"{job.id}.log")
+            self.jobs[job.id] = job
+            self.logs[job.id] = _JobLog(job.log_path)
+            self.lock.notify_all()
+            return job, False
+
+    def cancel(self, job_id: int) -> bool:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in ("queued", "running"):
+                return False
+            if job.state == "queued":
+                job.state = "cancelled"
+                job.finished = time.time()
+                self.logs[job_id].append("[build queue] cancelled before it started\n")
+                self.logs[job_id].close()
+                self.lock.notify_all()
+                return True
+            proc = self.procs.get(job_id)
+        if proc is not None:
+            try:
+                # The job runs in its own session: this reaches make and the compilers.
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            job.state = "cancelled"
+        return True
+
+    def _next_job(self) -> Job | None:
+        running = [j for j in self.jobs.values() if j.state == "running"]
+        if len(running) >= self.max_running:
+            return None
+        busy = {j.kernel_name for j in running}
+        queued = [j for j in self.jobs.values() if j.state == "queued" and j.kernel_name not in busy]
+        if not queued:
+            return None
+        return min(queued, key=lambda j: (PRIORITIES.index(j.priority), j.submitted, j.id))
+
+    def _run(self, job: Job) -> None:
+        log = self.logs[job.id]
+        env = {**job.env, JOB_ENV: str(job.id), "PYTHONUNBUFFERED": "1"}
+        os.makedirs(logs_dir(), exist_ok=True)
+        rc = 1
+        try:
+            with open(job.log_path, "w", encoding="utf-8", errors="replace") as f:
+                header = f"[build queue] job {job.id} ({job.priority}): {job.label}\n"
+                f.write(header)
+                log.append(header)
+                proc = subprocess.Popen(
+                    job.argv,
+                    env=env,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True,
+                )
+                with self.lock:
+                    self.procs[job.id] = proc
+                for raw in iter(lambda: proc.stdout.read1(65536), b""):
+                    text = raw.decode(errors="replace")
+                    f.write(text)
+                    f.flush()
+                    log.append(text)
+                rc = proc.wait()
+                tail = f"[build queue] job {job.id} finished with exit code {rc}\n"
+                f.write(tail)
+                log.append(tail)
+        except OSError as e:
+            log.append(f"[build queue] job {job.id} could not run: {e}\n")
+        with self.lock:
+            self.procs.pop(job.id, None)
+            job.rc = rc
+            job.finished = time.time()
+            if job.state != "cancelled":
+                job.state = "done"
+            self.last_activity = time.time()
+            self.lock.notify_all()
+        log.close()
+        self._prune()
+
+    def _prune(self) -> None:
+        with self.lock:
+            finished = sorted(
+                (j for j in self.jobs.values() if j.state in ("done", "cancelled")),
+                key=lambda j: j.finished or 0,
+            )
+            for job in finished[:-KEEP_LOGS]:
+                self.jobs.pop(job.id, None)
+                self.logs.pop(job.id, None)
+                try:
+                    os.remove(job.log_path)
+                except OSError:
+                    pass
+
+    def schedule_forever(self, idle_timeout: int | None) -> None:
+        with self.lock:
+            while not self.stopping:
+                job = self._next_job()
+                if job is not None:
+                    job.state = "running"
+                    job.started = time.time()
+                    threading.Thread(target=self._run, args=(job,), daemon=True).start()
+                    continue
+                active = any(j.state in ("queued", "running") for j in self.jobs.values()) or self.clients
+                if idle_timeout and not active and time.time() - self.last_activity > idle_timeout:
+                    return
+                self.lock.wait(timeout=5)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "_QueueServer"
+
+    def _send(self, message: dict) -> None:
+        self.wfile.write((json.dumps(message) + "\n").encode())
+        self.wfile.flush()
+
+    def _stream(self, job: Job) -> None:
+        queue = self.server.queue
+        for chunk in queue.logs[job.id].follow():
+            self._send({"log": chunk})
+        self._send({"exit": job.rc if job.state == "done" else None, "state": job.state})
+
+    def _peer_allowed(self) -> bool:
+        creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _pid, uid, _gid = struct.unpack("3i", creds)
+        return uid in (os.getuid(), 0)
+
+    def handle(self) -> None:
+        queue = self.server.queue
+        if not self._peer_allowed():
+            self._send({"error": "permission denied: the build queue belongs to another user"})
+            return
+        with queue.lock:
+            queue.clients += 1
+        try:
+            line = self.rfile.readline()
+            if not line:
+                return
+            request = json.loads(line)
+            op = request.get("op")
+            if op == "submit":
+                job, dedup = queue.submit(request)
+                self._send({"job": job.info(), "deduplicated": dedup})
+                self._stream(job)
+            elif op == "attach":
+                job = queue.jobs.get(int(request.get("job", -1)))
+                if job is None:
+                    self._send({"error": f"no job {request.get('job')}"})
+                    return
+                self._send({"job": job.info(), "deduplicated": True})
+                self._stream(job)
+            elif op == "status":
+                with queue.lock:
+                    jobs = [j.info() for j in sorted(queue.jobs.values(), key=lambda j: j.id)]
+                self._send({"jobs": jobs, "max_running": queue.max_running, "pid": os.getpid()})
+            elif op == "cancel":
+                self._send({"ok": queue.cancel(int(request.get("job", -1)))})
+            elif op == "shutdown":
+                with queue.lock:
+                    queue.stopping = True
+                    queue.lock.notify_all()
+                self._send({"ok": True})
+            else:
+                self._send({"error": f"unknown op {op!r}"})
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client detached; the job keeps running
+        except ValueError as e:
+            self._send({"error": f"bad request: {e}"})
+        finally:
+            with queue.lock:
+                queue.clients -= 1
+                queue.last_activity = time.time()
+
+
+class _QueueServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, queue: BuildQueue) -> None:
+        self.queue = queue
+        super().__init__(path, _Handler)
+
+
+def run_daemon(script: str, max_running: int = DEFAULT_MAX_RUNNING, idle_timeout: int | None = None) -> int:
+    """Serve the queue in the foreground until idle (if *idle_timeout*) or shut down.
+
+    Jobs run *script* (kernel_builder.py) with the submitted `compile` arguments.
+    """
+    os.makedirs(logs_dir(), exist_ok=True)
+    lock_fd = os.open(os.path.join(queue_dir(), "daemon.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("Build queue daemon is already running.")
+        return 0
+    path = socket_path()
+    if os.path.exists(path):
+        os.remove(path)  # left by a daemon that died; we hold the daemon lock
+    queue = BuildQueue(script, max_running)
+    # Owner only from the start: jobs run as this user.
+    old_umask = os.umask(0o177)
+    try:
+        server = _QueueServer(path, queue)
+    finally:
+        os.umask(old_umask)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Build queue daemon {os.getpid()} listening on {path} (max running {queue.max_running}).", flush=True)
+    try:
+        queue.schedule_forever(idle_timeout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        with queue.lock:
+            procs = list(queue.procs.values())
+        for proc in procs:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if os.path.exists(path):
+            os.remove(path)
+    print("Build queue daemon stopped.", flush=True)
+    return 0
+
+
+# --- client -----------------------------------------------------------------
+
+
+def _connect() -> socket.socket | None:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _spawn_daemon(script: str) -> None:
+    os.makedirs(queue_dir(), exist_ok=True)
+    with open(os.path.join(queue_dir(), "daemon.log"), "ab") as log:
+        subprocess.Popen(
+            [sys.executable, script, "queue", "daemon", "--idle-timeout", str(DEFAULT_IDLE_TIMEOUT)],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+
+def connect_or_start(script: str) -> socket.socket | None:
+    sock = _connect()
+    if sock is not None:
+        return sock
+    _spawn_daemon(script)
+    deadline = time.time() + _CONNECT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.1)
+        sock = _connect()
+        if sock is not None:
+            return sock
+    return None
+
+
+def _request(message: dict) -> dict | None:
+    sock = _connect()
+    if sock is None:
+        return None
+    with sock, sock.makefile("rwb") as f:
+        f.write((json.dumps(message) + "\n").encode())
+        f.flush()
+        line = f.readline()
+    return json.loads(line) if line else None
+
+
+def _follow(sock: socket.socket, message: dict, cancel_on_term: bool) -> int:
+    """Send *message*, print the streamed log, return the job's exit code."""
+    job_id = None
+
+    def on_term(signum, frame):
+        # kb-menu's "Stop build" (SIGTERM) stops a job this client submitted.
+        if cancel_on_term and job_id is not None:
+            _request({"op": "cancel", "job": job_id})
+        raise SystemExit(143)
+
+    previous = signal.signal(signal.SIGTERM, on_term)
+    try:
+        with sock, sock.makefile("rwb") as f:
+            f.write((json.dumps(message) + "\n").encode())
+            f.flush()
+            for line in f:
+                reply = json.loads(line)
+                if "error" in reply:
+                    print(f"Error: build queue: {reply['error']}", file=sys.stderr)
+                    return 1
+                if "job" in reply:
+                    job = reply["job"]
+                    job_id = job["id"]
+                    cancel_on_term = cancel_on_term and not reply.get("deduplicated")
+                    verb = "Attached to" if reply.get("deduplicated") else "Queued as"
+                    print(f"[build queue] {verb} job {job_id} ({job['priority']}, {job['kernel_name']})", flush=True)
+                elif "log" in reply:
+                    sys.stdout.write(reply["log"])
+                    sys.stdout.flush()
+                elif "exit" in reply:
+                    if reply.get("state") == "cancelled":
+                        return 130
+                    return reply["exit"] if reply["exit"] is not None else 1
+    except KeyboardInterrupt:
+        print(
+            f"\n[build queue] Detached; job {job_id} keeps running "
+            f"(`kernel_builder.py queue attach {job_id}`, `queue cancel {job_id}`).",
+            file=sys.stderr,
+        )
+        return 130
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    print("Error: lost the connection to the build queue daemon.", file=sys.stderr)
+    return 1
+
+
+def submit_and_follow(script: str, kernel_name: str, args: list[str], priority: str, label: str = "") -> int | None:
+    """Run `kernel_builder.py <args>` (a compile) through the queue; None if no daemon could be reached or started."""
+    sock = connect_or_start(script)
+    if sock is None:
+        return None
+    message = {
+        "op": "submit",
+        "kernel_name": kernel_name,
+        "args": args,
+        "env": {k: v for k, v in os.environ.items() if k in ENV_PASSTHROUGH},
+        "priority": priority,
+        "label": label,
+    }
+    return _follow(sock, message, cancel_on_term=True)
+
+
+def attach_job(job_id: int) -> int:
+    sock = _connect()
+    if sock is None:
+        print("Build queue daemon is not running.")
+        return 1
+    return _follow(sock, {"op": "attach", "job": job_id}, cancel_on_term=False)
+
+
+def cancel_job(job_id: int) -> int:
+    reply = _request({"op": "cancel", "job": job_id})
+    if reply is None:
+        print("Build queue daemon is not running.")
+        return 1
+    print(f"Cancelled job {job_id}." if reply.get("ok") else f"Job {job_id} is not queued or running.")
+    return 0 if reply.get("ok") else 1
+
+
+def stop_daemon() -> int:
+    reply = _request({"op": "shutdown"})
+    if reply is None:
+        print("Build queue daemon is not running.")
+        return 0
+    print("Build queue daemon is shutting down (running jobs are stopped).")
+    return 0
+
+
+def print_queue_status() -> int:
+    reply = _request({"op": "status"})
+    if reply is None:
+        print("Build queue daemon is not running.")
+        return 0
+    jobs = reply.get("jobs", [])
+    print(f"Build queue daemon {reply.get('pid')}: {len(jobs)} job(s), max running {reply.get('max_running')}")
+    if not jobs:
+        return 0
+    print(f"  {'id':>7} {'state':<9} {'priority':<11} {'rc':>3} {'submitted':<19} {'kernel':<16} command")
+    for job in jobs:
+        print(
+            f"  {job['id']:>7} {job['state']:<9} {job['priority']:<11} "
+            f"{'-' if job['rc'] is None else job['rc']:>3} "
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['submitted']))} "
+            f"{job['kernel_name']:<16} {job['label']}"
+        )
+    return 0
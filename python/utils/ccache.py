@@ -0,0 +1,109 @@
+"""ccache wiring shared by host, Docker and nvbuild compiles.
+
+ccache runs in masquerade mode: a wrapper dir holds symlinks named after the
+cross gcc and the host gcc that point at ccache, and is put first on PATH.
+CROSS_COMPILE is reduced to the bare triple prefix so every $(CROSS_COMPILE)gcc
+and $(HOSTCC) call (in-tree kbuild, nvbuild.sh and the NVIDIA OOT Makefiles)
+resolves through the wrapper without passing CC/HOSTCC to each make.
+Host and Docker builds each have their own wrapper dir (bin/host, bin/docker):
+the links point at the ccache of the system the build runs on.
+
+The cache is shared between the host user and root (Docker nvbuilds): the
+directory is setgid to the user's group and ccache runs with umask 002, so
+entries are group-writable rather than world-writable.
+
+The statistics of one build come from its own stats log (ccache 4+); the
+shared counters are never zeroed, since builds run concurrently.
+"""
+
+from __future__ import annotations
+
+import itertools
+import os
+import shutil
+import stat
+
+CCACHE_DOCKER_DIR = "/builder/ccache"
+DEFAULT_MAX_SIZE = "20G"
+
+_stats_logs = itertools.count(1)
+
+
+def ccache_host_dir() -> str:
+    return os.path.join("storage", "ccache")
+
+
+def ensure_ccache_dir() -> str:
+    """Create storage/ccache (so Docker does not create it root-owned); returns abs path.
+
+    Made setgid so entries written by root builds keep the user's group.
+    """
+    path = os.path.abspath(ccache_host_dir())
+    os.makedirs(path, exist_ok=True)
+    st = os.stat(path)
+    if st.st_uid == os.getuid() and (st.st_mode & 0o7777) != (stat.S_ISGID | 0o775):
+        os.chmod(path, stat.S_ISGID | 0o775)
+    return path
+
+
+def ccache_docker_volume_args() -> list[str]:
+    return ["-v", f"{ensure_ccache_dir()}:{CCACHE_DOCKER_DIR}"]
+
+
+def host_ccache_available() -> bool:
+    return shutil.which("ccache") is not None
+
+
+def wrapper_dir(ccache_dir: str) -> str:
+    """bin/docker inside build containers, bin/host otherwise."""
+    return f"{ccache_dir}/bin/{'docker' if ccache_dir == CCACHE_DOCKER_DIR else 'host'}"
+
+
+def ccache_env_commands(cross_prefix: str, ccache_dir: str) -> tuple[list[str], str]:
+    """Exports every build shell needs, plus the CROSS_COMPILE to use.
+
+    *cross_prefix* is the full toolchain prefix (e.g. /opt/.../bin/aarch64-none-linux-gnu-)
+    or '' for a native build.
+    """
+    path_dirs = [wrapper_dir(ccache_dir)]
+    new_prefix = cross_prefix
+    if cross_prefix:
+        toolchain_bin, triple_prefix = os.path.split(cross_prefix)
+        if toolchain_bin:
+            path_dirs.append(toolchain_bin)
+        new_prefix = triple_prefix
+    commands = [
+        f'export CCACHE_DIR="{ccache_dir}"',
+        f'export CCACHE_MAXSIZE="${{CCACHE_MAXSIZE:-{DEFAULT_MAX_SIZE}}}"',
+        # Docker nvbuilds run as root; the setgid dir gives their entries the user's group.
+        "export CCACHE_UMASK=002",
+        # This build's hits and misses (ccache 4+; older versions ignore it).
+        f'export CCACHE_STATSLOG="/tmp/kb-ccache-{os.getpid()}-{next(_stats_logs)}.log"',
+        f'export PATH="{":".join(path_dirs)}:$PATH"',
+    ]
+    return commands, new_prefix
+
+
+def ccache_prepare_commands(cross_prefix: str, ccache_dir: str) -> list[str]:
+    """One-off steps: create the masquerade symlinks and start this build's stats log."""
+    wrapper = wrapper_dir(ccache_dir)
+    compilers = ["gcc", "cc"]
+    if cross_prefix:
+        compilers.append(f"{os.path.basename(cross_prefix)}gcc")
+    # Concurrent builds share the links: replace one only if it is wrong, by
+    # rename, so a running build never finds it missing.
+    links = " && ".join(
+        f'{{ [ "$(readlink "{wrapper}/{name}")" = "$kb_ccache" ] || '
+        f'{{ ln -sf "$kb_ccache" "{wrapper}/.{name}.$$" && mv -f "{wrapper}/.{name}.$$" "{wrapper}/{name}"; }}; }}'
+        for name in compilers
+    )
+    return [f'mkdir -p "{wrapper}"', 'kb_ccache="$(command -v ccache)"', links, ': > "$CCACHE_STATSLOG"']
+
+
+def ccache_stats_command() -> str:
+    return (
+        'echo "==> ccache statistics (this build)" && '
+        '{ ccache --show-log-stats 2>/dev/null || '
+        '{ echo "(ccache < 4.0 keeps no per-build log; totals for the whole cache:)" && ccache -s; }; }; '
+        'rm -f "$CCACHE_STATSLOG"'
+    )
@@ -1,41 +1,121 @@
+"""git clones for kernels, toolchains, overlays and device trees.
+
+Every URL is mirrored once into storage/git-cache/<name>.git (a bare
+`git clone --mirror`, refreshed with `git fetch` on each later clone), and
+clones borrow its objects through --reference (objects/info/alternates).
+A second kernel name from an already mirrored URL therefore transfers and
+stores next to nothing beyond its checkout.
+
+- partial (--filter=blob:none): a new mirror and the clone skip file
+  contents; the clone fetches the blobs of what it checks out on demand, into
+  itself (it borrows history, not the checkout, from a blobless mirror).
+- depth with a git tag: a shallow clone of just that tag (--depth --branch).
+
+The mirrors keep every object they ever fetched (gc.pruneExpire=never),
+since clones rely on them. Deleting storage/git-cache breaks those clones;
+run `git repack -a -d` and remove objects/info/alternates in a clone first.
+Build containers mount the cache read-only at the same path.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import hashlib
 import os
+import re
 import shutil
 import subprocess
 
-def clone_kernel(kernel_source_url, kernel_name, git_tag=None):
+GIT_CACHE_DIR = os.path.join("storage", "git-cache")
+
+
+def _run(command: list[str], check: bool = True) -> int:
+    print(f"Running command: {' '.join(command)}")
+    return subprocess.run(command, check=check).returncode
+
+
+def mirror_path(url: str) -> str:
+    """storage/git-cache/<readable name>-<url hash>.git for *url*."""
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", url.rstrip("/").removesuffix(".git").split("/")[-1]) or "repo"
+    return os.path.join(GIT_CACHE_DIR, f"{name}-{hashlib.sha1(url.encode()).hexdigest()[:12]}.git")
+
+
+def ensure_mirror(url: str, partial: bool = False) -> str | None:
+    """Create or refresh the bare mirror of *url*; returns its absolute path.
+
+    None (with the error printed) if git fails: the caller clones directly.
+    """
+    mirror = os.path.abspath(mirror_path(url))
+    os.makedirs(GIT_CACHE_DIR, exist_ok=True)
+    # One clone/fetch of a mirror at a time (parallel clones of the same URL).
+    with open(f"{mirror}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isdir(mirror):
+            try:
+                _run(["git", "-C", mirror, "fetch", "--prune", "--tags", "origin"])
+            except subprocess.CalledProcessError as e:
+                print(f"Error: could not refresh the git cache mirror {mirror} (exit {e.returncode}); cloning without it.")
+                return None
+            return mirror
+        tmp = f"{mirror}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            _run(["git", "clone", "--mirror", *(["--filter=blob:none"] if partial else []), url, tmp])
+            # Clones borrow these objects: never prune them, even once unreferenced here.
+            _run(["git", "-C", tmp, "config", "gc.pruneExpire", "never"])
+            _run(["git", "-C", tmp, "config", "gc.reflogExpireUnreachable", "never"])
+        except subprocess.CalledProcessError as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            print(f"Error: could not mirror {url} into {GIT_CACHE_DIR} (exit {e.returncode}); cloning without the git cache.")
+            return None
+        os.replace(tmp, mirror)
+    return mirror
+
+
+def git_cache_docker_args() -> list[str]:
+    """Mount for build containers: clones' alternates point at absolute host paths in the cache."""
+    cache = os.path.abspath(GIT_CACHE_DIR)
+    return ["-v", f"{cache}:{cache}:ro"] if os.path.isdir(cache) else []
+
+
+def _clone(url, dest, git_tag=None, depth=None, partial=False, use_cache=True):
+    """Clone *url* into *dest* (borrowing from the git cache), then check out *git_tag*; returns git's exit code."""
+    command = ["git", "clone"]
+    mirror = ensure_mirror(url, partial=partial) if use_cache else None
+    if mirror:
+        command += ["--reference", mirror]
+    if partial:
+        command.append("--filter=blob:none")
+    if depth:
+        command += ["--depth", str(depth)]
+        if git_tag:
+            command += ["--branch", git_tag]
+    rc = _run([*command, url, dest], check=False)
+    if rc == 0 and git_tag and not depth:
+        rc = _run(["git", "-C", dest, "checkout", git_tag], check=False)
+    if rc != 0:
+        print(f"Error: cloning {url} into {dest} failed (exit {rc}).")
+    return rc
+
+
+def clone_kernel(kernel_source_url, kernel_name, git_tag=None, depth=None, partial=False, use_cache=True):
     # Clones the kernel source.
     kernel_base_dir = os.path.join("storage", "kernels", kernel_name, "kernel", "kernel")
     if not os.path.exists(kernel_base_dir):
-        os.makedirs(kernel_base_dir)
-        clone_command = f"git clone {kernel_source_url} {kernel_base_dir}"
-        print(f"Running command: {clone_command}")
-        os.system(clone_command)
-        if git_tag:
-            os.chdir(kernel_base_dir)
-            checkout_command = f"git checkout {git_tag}"
-            print(f"Running command: {checkout_command}")
-            os.system(checkout_command)
-            os.chdir("..")
-    else:
-        print(f"Kernel directory {kernel_base_dir} already exists. Skipping clone.")
+        os.makedirs(os.path.dirname(kernel_base_dir), exist_ok=True)
+        return _clone(kernel_source_url, kernel_base_dir, git_tag, depth, partial, use_cache)
+    print(f"Kernel directory {kernel_base_dir} already exists. Skipping clone.")
+    return 0
 
-def clone_toolchain(toolchain_url, toolchain_name, toolchain_version, git_tag=None):
+def clone_toolchain(toolchain_url, toolchain_name, toolchain_version, git_tag=None, depth=None, partial=False, use_cache=True):
     # Clones the toolchain source.
     toolchain_dir = os.path.join("storage", "toolchains", toolchain_name, toolchain_version)
     if not os.path.exists(toolchain_dir):
-        clone_command = f"git clone {toolchain_url} {toolchain_dir}"
-        print(f"Running command: {clone_command}")
-        os.system(clone_command)
-        if git_tag:
-            os.chdir(toolchain_dir)
-            checkout_command = f"git checkout {git_tag}"
-            print(f"Running command: {checkout_command}")
-            os.system(checkout_command)
-            os.chdir("..")
-    else:
-        print(f"Toolchain directory {toolchain_dir} already exists. Skipping clone.")
+        return _clone(toolchain_url, toolchain_dir, git_tag, depth, partial, use_cache)
+    print(f"Toolchain directory {toolchain_dir} already exists. Skipping clone.")
+    return 0
 
-def clone_overlays(overlays_url, kernel_name, git_tag=None):
+def clone_overlays(overlays_url, kernel_name, git_tag=None, depth=None, partial=False, use_cache=True):
     # Clones the overlays for the given kernel.
     kernel_base_dir = os.path.join("storage", "kernels", kernel_name, "kernel")
     if not os.path.exists(kernel_base_dir):
@@ -46,14 +126,10 @@ def clone_overlays(overlays_url, kernel_name, git_tag=None):
         shutil.rmtree(temp_overlays_dir)
 
     # Clone overlays into a temporary directory
-    clone_command = f"git clone {overlays_url} {temp_overlays_dir}"
-    print(f"Running command: {clone_command}")
-    subprocess.run(clone_command, shell=True, check=True)
-
-    if git_tag:
-        checkout_command = f"git -C {temp_overlays_dir} checkout {git_tag}"
-        print(f"Running command: {checkout_command}")
-        subprocess.run(checkout_command, shell=True, check=True)
+    rc = _clone(overlays_url, temp_overlays_dir, git_tag, depth, partial, use_cache)
+    if rc != 0:
+        shutil.rmtree(temp_overlays_dir, ignore_errors=True)
+        return rc
 
     # Ensure the temporary directory exists before attempting to move files
     if os.path.isdir(temp_overlays_dir):
@@ -71,21 +147,13 @@ def clone_overlays(overlays_url, kernel_name, git_tag=None):
         shutil.rmtree(temp_overlays_dir)
     else:
         print(f"Temporary overlays directory {temp_overlays_dir} does not exist. Skipping move.")
+    return 0
 
-def clone_device_tree(device_tree_url, kernel_name, git_tag=None):
+def clone_device_tree(device_tree_url, kernel_name, git_tag=None, depth=None, partial=False, use_cache=True):
     # Clones the device tree hardware repository for the given kernel.
     kernel_base_dir = os.path.join("storage", "kernels", kernel_name)
     device_tree_dir = os.path.join(kernel_base_dir, "hardware")
     if not os.path.exists(device_tree_dir):
-        clone_command = f"git clone {device_tree_url} {device_tree_dir}"
-        print(f"Running command: {clone_command}")
-        os.system(clone_command)
-        if git_tag:
-            os.chdir(device_tree_dir)
-            checkout_command = f"git checkout {git_tag}"
-            print(f"Running command: {checkout_command}")
-            os.system(checkout_command)
-            os.chdir("..")
-    else:
-        print(f"Device tree directory {device_tree_dir} already exists. Skipping clone.")
-
+        return _clone(device_tree_url, device_tree_dir, git_tag, depth, partial, use_cache)
+    print(f"Device tree directory {device_tree_dir} already exists. Skipping clone.")
+    return 0
@@ -0,0 +1,323 @@
+"""Build-aware, sharded, incremental ctags index for `--generate-ctags`.
+
+`ctags -R` over the whole tree indexed every architecture and driver the
+build never touched. This index instead reads the `.*.o.cmd` files kbuild
+leaves next to each object (the compiled source plus every header fixdep
+recorded) and tags only those files, so it follows the current .config.
+
+Tags are kept in shards under storage/kernels/<name>/.ctags_index/, one per
+core at the first full run; a file always lands in the same shard. On later
+runs only files whose content hash changed are re-tagged (one ctags process
+per affected shard, in parallel), stale lines of changed or no-longer-built
+files are dropped, and the shards are merged into storage/kernels/<name>/kernel/tags
+with paths relative to that directory.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+from utils.kernel_tree import kernel_tree_root
+
+INDEX_DIR = ".ctags_index"
+STATE_NAME = "state.json"
+INDEX_VERSION = 1
+# Readable by exuberant and universal ctags; pseudo-tags are dropped and the
+# merge sorts, so neither --extras nor ctags' own sorting is relied on.
+CTAGS_OPTIONS = "--fields=+l --languages=C,C++ --c-kinds=+p --sort=no"
+TAGS_HEADER = (
+    "!_TAG_FILE_FORMAT\t2\t/extended format; --format=1 will not append ;\" to lines/\n"
+    "!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted, 2=foldcase/\n"
+)
+_SOURCE_SUFFIXES = (".c", ".h", ".cc", ".cpp", ".hpp")
+_SKIP_DIRS = {".git", INDEX_DIR}
+_CMD_CHUNK = 512
+
+
+def index_dir(kernel_name: str) -> str:
+    return os.path.join(kernel_tree_root(kernel_name), INDEX_DIR)
+
+
+def tags_dir(kernel_name: str) -> str:
+    """Directory holding the tags file; tag paths are relative to it."""
+    return os.path.join(kernel_tree_root(kernel_name), "kernel")
+
+
+def tags_path(kernel_name: str) -> str:
+    return os.path.join(tags_dir(kernel_name), "tags")
+
+
+def _find_cmd_files(root: str) -> list[str]:
+    found = []
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in _SKIP_DIRS:
+                        stack.append(entry.path)
+                elif entry.name.startswith(".") and entry.name.endswith(".o.cmd"):
+                    found.append(entry.path)
+    return found
+
+
+def find_cmd_files(roots: list[str]) -> list[str]:
+    """Every `.*.o.cmd` under *roots*, walked one top-level dir per thread."""
+    units, found = [], []
+    for root in roots:
+        try:
+            entries = list(os.scandir(root))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in _SKIP_DIRS:
+                    units.append(entry.path)
+            elif entry.name.startswith(".") and entry.name.endswith(".o.cmd"):
+                found.append(entry.path)
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 2)) as pool:
+        for files in pool.map(_find_cmd_files, units):
+            found.extend(files)
+    return found
+
+
+def parse_cmd_file(path: str) -> set[str]:
+    """The source and dependency paths recorded in one kbuild .cmd file, as written."""
+    paths: set[str] = set()
+    in_deps = False
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if in_deps:
+                    in_deps = line.endswith("\\")
+                    token = line.rstrip("\\").strip()
+                    if token and not token.startswith("$("):
+                        paths.add(token)
+                elif line.startswith("source_"):
+                    paths.add(line.partition(":=")[2].strip())
+                elif line.startswith("deps_") and ":=" in line:
+                    in_deps = line.endswith("\\")
+    except OSError:
+        pass
+    return paths
+
+
+def _parse_chunk(paths: list[str]) -> set[str]:
+    found: set[str] = set()
+    for path in paths:
+        found |= parse_cmd_file(path)
+    return found
+
+
+def compiled_sources(
+    kernel_name: str,
+    build_dirs: list[str],
+    path_map: dict[str, str] | None = None,
+) -> tuple[list[str], int]:
+    """Compiled C sources and headers as paths relative to tags_dir(), plus the .cmd count.
+
+    *build_dirs* are the kbuild object trees (the source tree for in-tree
+    builds, the O= dir otherwise); relative paths in .cmd files resolve
+    against them. *path_map* maps absolute path prefixes written inside a
+    build container to their host location.
+    """
+    root = os.path.abspath(tags_dir(kernel_name))
+    build_dirs = [os.path.abspath(d) for d in build_dirs]
+    cmd_files = find_cmd_files([root] + [d for d in build_dirs if not d.startswith(root + os.sep)])
+    chunks = [cmd_files[i:i + _CMD_CHUNK] for i in range(0, len(cmd_files), _CMD_CHUNK)]
+    raw: set[str] = set()
+    if len(chunks) > 1:
+        # Parsing is CPU-bound; spawn, not fork, since the build graph runs threads.
+        with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as pool:
+            for found in pool.map(_parse_chunk, chunks):
+                raw |= found
+    elif chunks:
+        raw = _parse_chunk(chunks[0])
+
+    sources = set()
+    for path in raw:
+        if not path.endswith(_SOURCE_SUFFIXES):
+            continue
+        if os.path.isabs(path):
+            for prefix, host in (path_map or {}).items():
+                if path.startswith(prefix.rstrip("/") + "/"):
+                    path = os.path.join(host, path[len(prefix.rstrip("/")) + 1:])
+                    break
+            candidates = [path]
+        else:
+            candidates = [os.path.join(d, path) for d in build_dirs]
+        for candidate in candidates:
+            candidate = os.path.normpath(candidate)
+            if candidate.startswith(root + os.sep) and os.path.isfile(candidate):
+                sources.add(os.path.relpath(candidate, root))
+                break
+    return sorted(sources), len(cmd_files)
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_state(kernel_name: str) -> dict | None:
+    try:
+        with open(os.path.join(index_dir(kernel_name), STATE_NAME), encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("version") != INDEX_VERSION or state.get("options") != CTAGS_OPTIONS:
+        return None
+    return state
+
+
+def _shard_of(rel: str, shards: int) -> int:
+    return zlib.crc32(rel.encode()) % shards
+
+
+def _shard_path(kernel_name: str, shard: int, suffix: str) -> str:
+    return os.path.join(index_dir(kernel_name), f"shard-{shard:03}.{suffix}")
+
+
+def _read_tag_lines(path: str) -> list[str]:
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return [line for line in f if not line.startswith("!_")]
+    except FileNotFoundError:
+        return []
+
+
+def update_ctags_index(
+    kernel_name: str,
+    build_dirs: list[str],
+    run: Callable[[str, str], int],
+    exec_tree_root: str | None = None,
+    path_map: dict[str, str] | None = None,
+    full: bool = False,
+) -> int:
+    """Re-tag what changed since the last run and rewrite the tags file.
+
+    *run(command, label)* executes a shell command where ctags lives (the
+    host, or a build session); *exec_tree_root* is the tree root as that
+    command sees it. Returns 0 or the first failing ctags exit code.
+    """
+    tree_root = kernel_tree_root(kernel_name)
+    exec_tree_root = exec_tree_root or os.path.abspath(tree_root)
+    sources, cmd_count = compiled_sources(kernel_name, build_dirs, path_map)
+    if not cmd_count:
+        print(f"Error: no .o.cmd files under {tags_dir(kernel_name)}; build the kernel before indexing it.")
+        return 1
+
+    state = None if full else _load_state(kernel_name)
+    if state and not all(os.path.isfile(_shard_path(kernel_name, s, "tags")) for s in range(state["shards"])):
+        state = None
+    shards = state["shards"] if state else max(1, os.cpu_count() or 1)
+    previous = state["files"] if state else {}
+    root = tags_dir(kernel_name)
+
+    # Stat first; hash only files whose (mtime, size) moved.
+    def check(rel: str) -> tuple[str, list, bool]:
+        st = os.stat(os.path.join(root, rel))
+        old = previous.get(rel)
+        if old and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+            return rel, old, False
+        digest = _file_hash(os.path.join(root, rel))
+        return rel, [st.st_mtime_ns, st.st_size, digest], not old or old[2] != digest
+
+    files: dict[str, list] = {}
+    changed: list[str] = []
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 2)) as pool:
+        for rel, entry, is_changed in pool.map(check, sources):
+            files[rel] = entry
+            if is_changed:
+                changed.append(rel)
+    removed = [rel for rel in previous if rel not in files]
+
+    work: dict[int, tuple[list[str], set[str]]] = {}
+    for rel in changed:
+        work.setdefault(_shard_of(rel, shards), ([], set()))[0].append(rel)
+    for rel in changed + removed:
+        work.setdefault(_shard_of(rel, shards), ([], set()))[1].add(rel)
+
+    os.makedirs(index_dir(kernel_name), exist_ok=True)
+    exec_index = f"{exec_tree_root.rstrip('/')}/{INDEX_DIR}"
+    exec_root = f"{exec_tree_root.rstrip('/')}/kernel"
+
+    def retag(shard: int) -> int:
+        to_tag, drop = work[shard]
+        new_lines: list[str] = []
+        if to_tag:
+            with open(_shard_path(kernel_name, shard, "list"), "w", encoding="utf-8") as f:
+                f.write("".join(f"{rel}\n" for rel in to_tag))
+            name = os.path.basename(_shard_path(kernel_name, shard, ""))
+            rc = run(
+                f"cd {exec_root} && ctags {CTAGS_OPTIONS} -L {exec_index}/{name}list -f {exec_index}/{name}new",
+                f"ctags-{shard}",
+            )
+            if rc != 0:
+                return rc
+            new_lines = _read_tag_lines(_shard_path(kernel_name, shard, "new"))
+            for suffix in ("list", "new"):
+                os.remove(_shard_path(kernel_name, shard, suffix))
+        kept = [] if full or not state else [
+            line for line in _read_tag_lines(_shard_path(kernel_name, shard, "tags"))
+            if line.split("\t", 2)[1] not in drop
+        ]
+        path = _shard_path(kernel_name, shard, "tags")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            f.writelines(sorted(kept + new_lines))
+        os.replace(f"{path}.tmp", path)
+        return 0
+
+    if not state:
+        # A fresh index: every shard is rewritten, also the ones left empty.
+        for shard in range(shards):
+            work.setdefault(shard, ([], set()))
+        for name in os.listdir(index_dir(kernel_name)):
+            if name.startswith("shard-"):
+                os.remove(os.path.join(index_dir(kernel_name), name))
+    with ThreadPoolExecutor(max_workers=max(1, len(work))) as pool:
+        failures = [rc for rc in pool.map(retag, sorted(work)) if rc != 0]
+    if failures:
+        print(f"Error: ctags failed with exit code {failures[0]}.")
+        return failures[0]
+
+    count = 0
+    out = tags_path(kernel_name)
+    shard_files = [open(_shard_path(kernel_name, s, "tags"), encoding="utf-8", errors="replace") for s in range(shards)]
+    try:
+        with open(f"{out}.tmp", "w", encoding="utf-8") as f:
+            f.write(TAGS_HEADER)
+            for line in heapq.merge(*shard_files):
+                f.write(line)
+                count += 1
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+    os.replace(f"{out}.tmp", out)
+
+    state_path = os.path.join(index_dir(kernel_name), STATE_NAME)
+    with open(f"{state_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_VERSION, "options": CTAGS_OPTIONS, "shards": shards, "files": files}, f)
+    os.replace(f"{state_path}.tmp", state_path)
+    print(
+        f"ctags: {len(files)} compiled files from {cmd_count} .o.cmd; re-tagged {len(changed)}, "
+        f"dropped {len(removed)} across {len([s for s in work if work[s][0] or work[s][1]])} shard(s); "
+        f"{count} tags in {out}"
+    )
+    return 0
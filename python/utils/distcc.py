@@ -0,0 +1,313 @@
+"""distcc wiring for `compile --distcc`: fan compiles out to a pool of workers.
+
+Workers are listed in storage/distcc_workers.json:
+
+    {"workers": [{"host": "10.0.0.12", "port": 3632, "jobs": 16}, ...]}
+
+Each worker runs distccd with the same storage/toolchains checkout on its PATH
+(`kernel_builder.py distcc-worker start` does this in a builder container), so
+the pinned cross gcc is what compiles remotely. distccd runs only the compilers
+in its masquerade whitelist (/usr/lib/distcc), which the worker fills with the
+toolchains' gcc, and accepts clients from the docker bridge (connections to
+the published port) plus the --allow networks. The port is published on
+127.0.0.1 unless --bind names another host address. distcc runs in masquerade mode
+like ccache: a wrapper dir holding `<triple>gcc -> distcc` goes on PATH ahead
+of the toolchain bin, and CROSS_COMPILE is reduced to the bare triple prefix.
+Only the cross gcc is distributed; HOSTCC (scripts, fixdep) stays local.
+
+Unreachable workers are dropped before the build; with none left the build
+runs locally. distcc itself falls back to a local compile if a worker fails
+mid-build.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shlex
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from utils.docker_api import STDERR, DockerAPIError, container_config, docker_client
+
+DEFAULT_PORT = 3632
+DEFAULT_STATS_PORT = 3633
+DISTCC_DOCKER_DIR = "/tmp/kb-distcc"
+# Reaches a worker published on the build host from inside a build container.
+DOCKER_HOST_ALIAS = "host.docker.internal"
+WORKER_CONTAINER_PREFIX = "kb-distcc-"
+_LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+DEFAULT_BIND = "127.0.0.1"
+_PROBE_TIMEOUT = 1.0
+
+
+def default_workers_path() -> str:
+    return os.path.join("storage", "distcc_workers.json")
+
+
+def distcc_host_dir() -> str:
+    return os.path.join("storage", "distcc")
+
+
+@dataclass
+class DistccWorker:
+    host: str
+    port: int = DEFAULT_PORT
+    jobs: int = 8
+    stats_port: int = DEFAULT_STATS_PORT
+
+    @property
+    def label(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def host_spec(self, docker: bool = False) -> str:
+        host = DOCKER_HOST_ALIAS if docker and self.host in _LOCAL_HOSTS else self.host
+        return f"{host}:{self.port}/{self.jobs},lzo"
+
+
+def load_workers(path: str | None = None) -> list[DistccWorker]:
+    """Workers from the config file; raises ValueError on a malformed file."""
+    path = path or default_workers_path()
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("workers", []) if isinstance(data, dict) else data
+    workers = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("host"):
+            raise ValueError(f"{path}: each worker needs a 'host' (got {entry!r})")
+        workers.append(
+            DistccWorker(
+                host=entry["host"],
+                port=int(entry.get("port", DEFAULT_PORT)),
+                jobs=int(entry.get("jobs", 8)),
+                stats_port=int(entry.get("stats_port", DEFAULT_STATS_PORT)),
+            )
+        )
+    return workers
+
+
+def _reachable(worker: DistccWorker) -> bool:
+    try:
+        with socket.create_connection((worker.host, worker.port), timeout=_PROBE_TIMEOUT):
+            return True
+    except OSError:
+        return False
+
+
+def _read_stats(worker: DistccWorker) -> dict[str, int] | None:
+    """Counters from distccd's --stats page, or None if it is not served."""
+    try:
+        with socket.create_connection((worker.host, worker.stats_port), timeout=_PROBE_TIMEOUT) as sock:
+            sock.settimeout(_PROBE_TIMEOUT)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    except OSError:
+        return None
+    counters = {}
+    for line in b"".join(chunks).decode("utf-8", "replace").splitlines():
+        key, _, value = line.partition(" ")
+        if key.startswith("dcc_") and value.strip().isdigit():
+            counters[key] = int(value)
+    return counters or None
+
+
+class DistccPool:
+    """The reachable workers for one compile."""
+
+    def __init__(self, workers: list[DistccWorker], local_jobs: int | None = None) -> None:
+        self.workers = workers
+        self.local_jobs = local_jobs or os.cpu_count() or 1
+        self._stats_before: dict[str, dict[str, int] | None] = {}
+        # Per-worker {"ok", "failed"} compile counts filled in by report().
+        self.counts: dict[str, dict[str, int]] = {}
+
+    @classmethod
+    def probe(cls, workers: list[DistccWorker]) -> "DistccPool":
+        """Keep the workers that accept connections, checked concurrently."""
+        if not workers:
+            return cls([])
+        with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+            up = list(pool.map(_reachable, workers))
+        for worker, ok in zip(workers, up):
+            if not ok:
+                print(f"Warning: distcc worker {worker.label} is unreachable; skipping it.")
+        return cls([w for w, ok in zip(workers, up) if ok])
+
+    @property
+    def total_jobs(self) -> int:
+        return self.local_jobs + sum(w.jobs for w in self.workers)
+
+    def docker_args(self) -> list[str]:
+        """docker run args a build container needs to reach workers on the build host."""
+        if any(w.host in _LOCAL_HOSTS for w in self.workers):
+            return [f"--add-host={DOCKER_HOST_ALIAS}:host-gateway"]
+        return []
+
+    def hosts(self, docker: bool = False) -> str:
+        """DISTCC_HOSTS: remote workers first, the local machine last."""
+        specs = [w.host_spec(docker) for w in self.workers]
+        return " ".join(specs + [f"localhost/{self.local_jobs}"])
+
+    def env_commands(self, cross_prefix: str, distcc_dir: str, docker: bool = False) -> tuple[list[str], str]:
+        """Exports every build shell needs, plus the CROSS_COMPILE to use.
+
+        Emit these before ccache's so ccache's wrapper dir comes first on PATH
+        and calls through to distcc.
+        """
+        toolchain_bin, triple_prefix = os.path.split(cross_prefix)
+        path_dirs = [f"{distcc_dir}/bin"] + ([toolchain_bin] if toolchain_bin else [])
+        commands = [
+            f'export DISTCC_DIR="{distcc_dir}"',
+            f'export DISTCC_HOSTS="{self.hosts(docker)}"',
+            f'export PATH="{":".join(path_dirs)}:$PATH"',
+        ]
+        return commands, triple_prefix
+
+    @staticmethod
+    def prepare_commands(cross_prefix: str, distcc_dir: str) -> list[str]:
+        wrapper_dir = f"{distcc_dir}/bin"
+        compiler = f"{os.path.basename(cross_prefix)}gcc"
+        return [
+            f'mkdir -p "{wrapper_dir}"',
+            f'ln -sf "$(command -v distcc)" "{wrapper_dir}/{compiler}"',
+        ]
+
+    def snapshot_stats(self) -> None:
+        """Remember each worker's counters so report() can print this build's share."""
+        self._stats_before = self._all_stats()
+
+    def _all_stats(self) -> dict[str, dict[str, int] | None]:
+        if not self.workers:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(self.workers)) as pool:
+            return dict(zip((w.label for w in self.workers), pool.map(_read_stats, self.workers)))
+
+    def report(self) -> dict[str, dict[str, int]]:
+        """Print and return per-worker compile counts since snapshot_stats()."""
+        after = self._all_stats()
+        counts = {}
+        print("==> distcc jobs per worker (distccd counters; include other clients):")
+        for worker in self.workers:
+            before, now = self._stats_before.get(worker.label), after.get(worker.label)
+            if before is None or now is None:
+                print(f"  {worker.label:<24} -  (stats port {worker.stats_port} not served)")
+                continue
+            ok = now.get("dcc_compile_ok", 0) - before.get("dcc_compile_ok", 0)
+            failed = now.get("dcc_compile_error", 0) - before.get("dcc_compile_error", 0)
+            counts[worker.label] = {"ok": ok, "failed": failed}
+            print(f"  {worker.label:<24} {ok:>6} ok  {failed:>4} failed")
+        self.counts = counts
+        return counts
+
+
+def worker_container_name(name: str) -> str:
+    return f"{WORKER_CONTAINER_PREFIX}{name}"
+
+
+def worker_script(jobs: int, allow: list[str]) -> str:
+    """Container command: whitelist the toolchains' gcc, then serve *allow* only."""
+    allow_args = " ".join(f"--allow {shlex.quote(network)}" for network in allow)
+    return (
+        "mkdir -p /usr/lib/distcc && "
+        'for cc in /builder/toolchains/*/*/bin/*gcc; do [ -e "$cc" ] && ln -sf "$(command -v distcc)" "/usr/lib/distcc/${cc##*/}"; done; '
+        'PATH="$(ls -d /builder/toolchains/*/*/bin 2>/dev/null | tr "\\n" :)$PATH" '
+        f"exec distccd --daemon --no-detach --log-stderr {allow_args} --jobs {int(jobs)} --stats"
+    )
+
+
+def start_worker_container(
+    image: str,
+    name: str,
+    port: int,
+    stats_port: int,
+    jobs: int,
+    allow: list[str] | None = None,
+    bind: str = DEFAULT_BIND,
+    dry_run: bool = False,
+) -> int:
+    """Run distccd in a builder container, serving every toolchain in storage/toolchains."""
+    toolchains_dir_abs = os.path.abspath(os.path.join("storage", "toolchains"))
+    allow = list(allow or [])
+    try:
+        # Connections to a published port reach distccd from the bridge gateway.
+        gateway = "<docker bridge gateway>" if dry_run else docker_client().network_gateway()
+    except DockerAPIError as e:
+        print(f"Error: {e}")
+        return 1
+    if gateway:
+        allow.insert(0, gateway)
+    if not allow:
+        print("Error: no docker bridge gateway found; pass the client networks with --allow.")
+        return 1
+    script = worker_script(jobs, allow)
+    run_args = [
+        "--rm",
+        "-p", f"{bind}:{port}:{DEFAULT_PORT}",
+        "-p", f"{bind}:{stats_port}:{DEFAULT_STATS_PORT}",
+        "-v", f"{toolchains_dir_abs}:/builder/toolchains:ro",
+    ]
+    command = ["docker", "run", "-d", "--name", worker_container_name(name), *run_args, image, "/bin/bash", "-c", script]
+    if dry_run:
+        print(f"[Dry-run] Would run: {' '.join(command)}")
+        return 0
+    print(f"Starting distcc worker: {' '.join(command)}")
+    try:
+        docker_client().run_container(
+            container_config(image, ["/bin/bash", "-c", script], args=run_args), name=worker_container_name(name)
+        )
+    except DockerAPIError as e:
+        print(f"Error: {e}")
+        return 1
+    host = "localhost" if bind in ("127.0.0.1", "::1") else bind
+    entry = {"host": host, "port": port, "jobs": jobs, "stats_port": stats_port}
+    print(f"Add to {default_workers_path()}:")
+    print(f"  {json.dumps(entry)}")
+    return 0
+
+
+def stop_worker_container(name: str) -> int:
+    """Stop distccd (SIGTERM, then SIGKILL after 10s); --rm removes the container."""
+    try:
+        docker_client().stop_container(worker_container_name(name))
+    except DockerAPIError as e:
+        if e.status == 404:
+            print(f"Error: no distcc worker container {worker_container_name(name)}.")
+        else:
+            print(f"Error: {e}")
+        return 1
+    return 0
+
+
+def worker_logs(name: str, follow: bool = False, tail: str = "all") -> int:
+    """Print distccd's log (--log-stderr); with *follow*, until the worker exits, then its exit code."""
+    client = docker_client()
+    container = worker_container_name(name)
+    try:
+        for stream, data in client.logs(container, follow=follow, tail=tail):
+            target = sys.stderr if stream == STDERR else sys.stdout
+            target.write(data.decode(errors="replace"))
+            target.flush()
+    except DockerAPIError as e:
+        if e.status == 404:
+            print(f"Error: no distcc worker container {container}.")
+        else:
+            print(f"Error: {e}")
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    if not follow:
+        return 0
+    try:
+        rc = client.wait(container)
+    except DockerAPIError:
+        # Removed (--rm) before its exit code could be read.
+        print(f"distcc worker {container} exited.")
+        return 0
+    print(f"distcc worker {container} exited with code {rc}.")
+    return 0
@@ -0,0 +1,587 @@
+"""Docker Engine API client over the local unix socket (no `docker` CLI per call).
+
+Each thread keeps one HTTP/1.1 keep-alive connection to the daemon, so a
+sequence of inspects, creates and removes costs one connect. Streams (logs,
+exec output, wait) get a connection of their own; without a TTY the daemon
+multiplexes stdout and stderr into 8-byte-header frames, which are split
+again here. Cleanup of many containers runs concurrently.
+
+The daemon is found the way the docker CLI finds it: $DOCKER_HOST, else the
+endpoint of the active context ($DOCKER_CONTEXT or currentContext in
+~/.docker/config.json), else /var/run/docker.sock, else the rootless socket
+in $XDG_RUNTIME_DIR. When that endpoint is not a unix socket (tcp://,
+ssh://, TLS settings), DockerCLIClient runs the same operations through
+the `docker` CLI instead. `docker build`, `save`/`load` and the build steps'
+`docker exec` always go through the CLI (build contexts and image tarballs,
+interactive TTYs, and a real process per step for rusage and termination).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import http.client
+import json
+import os
+import re
+import selectors
+import socket
+import struct
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote, urlencode
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+# Docker 20.10 and later.
+API_VERSION = "v1.41"
+DEFAULT_TIMEOUT = 60
+CLEANUP_WORKERS = 8
+STDOUT, STDERR = 1, 2
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float | None = DEFAULT_TIMEOUT) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+def _docker_config_dir() -> str:
+    return os.environ.get("DOCKER_CONFIG") or os.path.join(os.path.expanduser("~"), ".docker")
+
+
+def _context_host(name: str) -> str | None:
+    """Docker endpoint of the named CLI context, if it has one."""
+    meta = os.path.join(_docker_config_dir(), "contexts", "meta", hashlib.sha256(name.encode()).hexdigest(), "meta.json")
+    try:
+        with open(meta, encoding="utf-8") as f:
+            return json.load(f)["Endpoints"]["docker"].get("Host") or None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def docker_endpoint() -> str:
+    """The daemon endpoint the docker CLI would use, as a URL (unix://..., tcp://..., ssh://...)."""
+    if os.environ.get("DOCKER_HOST"):
+        return os.environ["DOCKER_HOST"]
+    context = os.environ.get("DOCKER_CONTEXT")
+    if not context:
+        try:
+            with open(os.path.join(_docker_config_dir(), "config.json"), encoding="utf-8") as f:
+                context = json.load(f).get("currentContext")
+        except (OSError, ValueError, AttributeError):
+            context = None
+    if context and context != "default":
+        host = _context_host(context)
+        if host:
+            return host
+    rootless = os.path.join(os.environ.get("XDG_RUNTIME_DIR", ""), "docker.sock")
+    if not os.path.exists(DOCKER_SOCKET) and os.environ.get("XDG_RUNTIME_DIR") and os.path.exists(rootless):
+        return f"unix://{rootless}"
+    return f"unix://{DOCKER_SOCKET}"
+
+
+def socket_path() -> str | None:
+    """The daemon's unix socket, or None when it is reached otherwise (or with TLS)."""
+    endpoint = docker_endpoint()
+    if not endpoint.startswith("unix://") or os.environ.get("DOCKER_TLS_VERIFY"):
+        return None
+    return endpoint[len("unix://"):]
+
+
+def _demux(response: http.client.HTTPResponse):
+    """(stream, bytes) frames of a non-TTY attach/logs/exec stream."""
+    while True:
+        header = response.read(8)
+        if len(header) < 8:
+            return
+        stream, size = struct.unpack(">BxxxL", header)
+        data = response.read(size)
+        if data:
+            yield stream, data
+
+
+def container_config(image: str, cmd: list[str], *, args: list[str] = (), user: str | None = None, labels: dict | None = None) -> dict:
+    """Create-container body for *image* from the `docker run` flags the builder uses."""
+    host: dict = {"Binds": [], "ExtraHosts": [], "PortBindings": {}}
+    config: dict = {"Image": image, "Cmd": list(cmd), "Labels": dict(labels or {}), "Env": [], "ExposedPorts": {}}
+    if user:
+        config["User"] = user
+    numeric = {
+        "--cpuset-cpus": ("CpusetCpus", str),
+        "--cpuset-mems": ("CpusetMems", str),
+        "--memory": ("Memory", int),
+        "--memory-swap": ("MemorySwap", int),
+        "--blkio-weight": ("BlkioWeight", int),
+        "--cpu-shares": ("CpuShares", int),
+    }
+    items = iter(args)
+    for arg in items:
+        flag, eq, value = arg.partition("=")
+        if not eq and flag in ("-v", "-e", "-p", "--add-host", "--network"):
+            value = next(items)
+        if flag == "-v":
+            # host:container[:ro] is also the API's Binds syntax.
+            host["Binds"].append(value)
+        elif flag == "-e":
+            config["Env"].append(value)
+        elif flag == "--add-host":
+            host["ExtraHosts"].append(value)
+        elif flag == "--network":
+            host["NetworkMode"] = value
+        elif flag == "-p":
+            # [host ip:]host port:container port
+            host_ip, _, rest = value.partition(":") if value.count(":") == 2 else ("", "", value)
+            host_port, _, container_port = rest.rpartition(":")
+            key = container_port if "/" in container_port else f"{container_port}/tcp"
+            config["ExposedPorts"][key] = {}
+            binding = {"HostIp": host_ip, "HostPort": host_port} if host_ip else {"HostPort": host_port}
+            host["PortBindings"].setdefault(key, []).append(binding)
+        elif flag == "--cpus":
+            host["NanoCpus"] = int(float(value) * 1e9)
+        elif flag in numeric:
+            key, kind = numeric[flag]
+            host[key] = kind(value)
+        elif flag == "--rm":
+            host["AutoRemove"] = True
+        elif flag == "--init":
+            host["Init"] = True
+        else:
+            raise ValueError(f"unsupported docker run flag for the API client: {arg}")
+    config["HostConfig"] = host
+    return config
+
+
+def _gateway(network: dict) -> str | None:
+    for config in (network.get("IPAM") or {}).get("Config") or []:
+        if config.get("Gateway"):
+            return config["Gateway"]
+    return None
+
+
+class _Client:
+    """Operations shared by the API and CLI clients."""
+
+    def remove_container(self, name: str, *, force: bool = False, missing_ok: bool = False) -> bool:
+        raise NotImplementedError
+
+    def exec_stream(self, name: str, cmd: list[str], **kwargs):
+        raise NotImplementedError
+
+    def remove_containers(self, names: list[str], *, force: bool = True, workers: int = CLEANUP_WORKERS) -> dict[str, str | None]:
+        """Remove *names* concurrently; name -> error message (None on success)."""
+        def remove(name):
+            try:
+                self.remove_container(name, force=force, missing_ok=True)
+                return None
+            except DockerAPIError as e:
+                return str(e)
+
+        if not names:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(workers, len(names))) as pool:
+            return dict(zip(names, pool.map(remove, names)))
+
+    def exec_run(self, name: str, cmd: list[str], *, on_output=None, **kwargs) -> tuple[int, bytes, bytes]:
+        """(exit code, stdout, stderr) of *cmd*; *on_output(stream, data)* sees each frame as it arrives."""
+        out, err = [], []
+        frames = self.exec_stream(name, cmd, **kwargs)
+        while True:
+            try:
+                stream, data = next(frames)
+            except StopIteration as done:
+                return done.value, b"".join(out), b"".join(err)
+            (err if stream == STDERR else out).append(data)
+            if on_output is not None:
+                on_output(stream, data)
+
+    def close(self) -> None:
+        pass
+
+
+class DockerClient(_Client):
+    """The Engine API operations the builder uses."""
+
+    def __init__(self, path: str | None = None, timeout: float | None = DEFAULT_TIMEOUT) -> None:
+        self.path = path or socket_path() or DOCKER_SOCKET
+        self.timeout = timeout
+        self._local = threading.local()
+        self._conns: list[_UnixConnection] = []
+        self._conns_lock = threading.Lock()
+
+    def _connection(self) -> _UnixConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _UnixConnection(self.path, self.timeout)
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _send(self, conn: _UnixConnection, method: str, url: str, body, keep_alive: bool = True) -> http.client.HTTPResponse:
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        if not keep_alive:
+            headers["Connection"] = "close"
+        conn.request(method, f"/{API_VERSION}{url}", body=data, headers=headers)
+        return conn.getresponse()
+
+    def _request(self, method: str, url: str, *, body=None, query: dict | None = None, stream: bool = False) -> http.client.HTTPResponse:
+        if query:
+            url += "?" + urlencode(query)
+        try:
+            if stream:
+                # Streams hold their own connection, closed with the response.
+                conn = _UnixConnection(self.path, None)
+                response = self._send(conn, method, url, body, keep_alive=False)
+                # Hand the socket to the response, as http.client does for
+                # Connection: close replies; it closes with the response.
+                sock, conn.sock = conn.sock, None
+                if sock is not None:
+                    sock.close()
+            else:
+                conn = self._connection()
+                try:
+                    response = self._send(conn, method, url, body)
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    # The daemon closed the idle keep-alive connection; reconnect once.
+                    conn.close()
+                    response = self._send(conn, method, url, body)
+        except (OSError, http.client.HTTPException) as e:
+            raise DockerAPIError(0, f"cannot talk to the Docker daemon at unix://{self.path}: {e}") from e
+        if response.status >= 400:
+            raw = response.read()
+            try:
+                message = json.loads(raw).get("message", response.reason)
+            except ValueError:
+                message = raw.decode(errors="replace").strip() or response.reason
+            raise DockerAPIError(response.status, message)
+        return response
+
+    def _json(self, method: str, url: str, **kwargs):
+        raw = self._request(method, url, **kwargs).read()
+        return json.loads(raw) if raw else None
+
+    # Images
+
+    def image_inspect(self, ref: str) -> dict | None:
+        try:
+            return self._json("GET", f"/images/{quote(ref, safe='')}/json")
+        except DockerAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def images(self, reference: str | None = None) -> list[dict]:
+        query = {"filters": json.dumps({"reference": [reference]})} if reference else None
+        return self._json("GET", "/images/json", query=query)
+
+    def remove_image(self, ref: str, force: bool = False) -> None:
+        self._json("DELETE", f"/images/{quote(ref, safe='')}", query={"force": int(force)})
+
+    # Networks
+
+    def network_gateway(self, name: str = "bridge") -> str | None:
+        """Gateway address of a docker network (the host's address on it)."""
+        try:
+            network = self._json("GET", f"/networks/{quote(name, safe='')}")
+        except DockerAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+        return _gateway(network)
+
+    # Containers
+
+    def containers(self, *, include_stopped: bool = True, filters: dict | None = None) -> list[dict]:
+        query = {"all": int(include_stopped)}
+        if filters:
+            query["filters"] = json.dumps(filters)
+        return self._json("GET", "/containers/json", query=query)
+
+    def inspect_container(self, name: str) -> dict | None:
+        try:
+            return self._json("GET", f"/containers/{quote(name, safe='')}/json")
+        except DockerAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def run_container(self, config: dict, name: str | None = None) -> str:
+        """Create and start a container (`docker run -d`); returns its id."""
+        created = self._json("POST", "/containers/create", body=config, query={"name": name} if name else None)
+        try:
+            self._json("POST", f"/containers/{created['Id']}/start")
+        except DockerAPIError:
+            self.remove_container(created["Id"], force=True, missing_ok=True)
+            raise
+        return created["Id"]
+
+    def stop_container(self, name: str, timeout: int = 10) -> None:
+        try:
+            self._json("POST", f"/containers/{quote(name, safe='')}/stop", query={"t": timeout})
+        except DockerAPIError as e:
+            # 304: already stopped.
+            if e.status != 304:
+                raise
+
+    def remove_container(self, name: str, *, force: bool = False, missing_ok: bool = False) -> bool:
+        """`docker rm [-f]`; False if there was no such container and *missing_ok*."""
+        try:
+            self._json("DELETE", f"/containers/{quote(name, safe='')}", query={"force": int(force)})
+        except DockerAPIError as e:
+            # 409 "removal already in progress": an --rm container going away by itself.
+            if missing_ok and e.status in (404, 409):
+                return False
+            raise
+        return True
+
+    def logs(self, name: str, *, follow: bool = False, tail: str = "all"):
+        """(stream, bytes) frames of a non-TTY container's output, following it if *follow*."""
+        response = self._request(
+            "GET",
+            f"/containers/{quote(name, safe='')}/logs",
+            query={"stdout": 1, "stderr": 1, "follow": int(follow), "tail": tail},
+            stream=True,
+        )
+        try:
+            yield from _demux(response)
+        finally:
+            response.close()
+
+    def wait(self, name: str) -> int:
+        """Block until the container exits; its exit code."""
+        response = self._request("POST", f"/containers/{quote(name, safe='')}/wait", stream=True)
+        try:
+            return json.loads(response.read())["StatusCode"]
+        finally:
+            response.close()
+
+    def exec_stream(self, name: str, cmd: list[str], *, user: str | None = None, workdir: str | None = None, env: list[str] | None = None):
+        """Run *cmd* in a running container without a TTY.
+
+        Yields (stream, bytes) frames while it runs, then returns its exit
+        code (the generator's StopIteration value; see exec_run).
+        """
+        body = {"Cmd": list(cmd), "AttachStdout": True, "AttachStderr": True, "Tty": False}
+        if user:
+            body["User"] = user
+        if workdir:
+            body["WorkingDir"] = workdir
+        if env:
+            body["Env"] = list(env)
+        exec_id = self._json("POST", f"/containers/{quote(name, safe='')}/exec", body=body)["Id"]
+        response = self._request("POST", f"/exec/{exec_id}/start", body={"Detach": False, "Tty": False}, stream=True)
+        try:
+            yield from _demux(response)
+        finally:
+            response.close()
+        return self._json("GET", f"/exec/{exec_id}/json")["ExitCode"]
+
+    def close(self) -> None:
+        """Close every thread's keep-alive connection."""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+# `docker run` flags for the HostConfig fields container_config() sets from them.
+_HOST_FLAGS = {
+    "CpusetCpus": "--cpuset-cpus",
+    "CpusetMems": "--cpuset-mems",
+    "Memory": "--memory",
+    "MemorySwap": "--memory-swap",
+    "BlkioWeight": "--blkio-weight",
+    "CpuShares": "--cpu-shares",
+}
+
+
+def _run_flags(config: dict) -> list[str]:
+    """container_config() turned back into `docker run` flags."""
+    host = config.get("HostConfig") or {}
+    flags = ["-u", config["User"]] if config.get("User") else []
+    for key, value in (config.get("Labels") or {}).items():
+        flags += ["--label", f"{key}={value}"]
+    for value in config.get("Env") or []:
+        flags += ["-e", value]
+    for bind in host.get("Binds") or []:
+        flags += ["-v", bind]
+    for entry in host.get("ExtraHosts") or []:
+        flags.append(f"--add-host={entry}")
+    if host.get("NetworkMode"):
+        flags += ["--network", host["NetworkMode"]]
+    for port, bindings in (host.get("PortBindings") or {}).items():
+        for binding in bindings:
+            published = f"{binding['HostIp']}:{binding['HostPort']}" if binding.get("HostIp") else binding["HostPort"]
+            flags += ["-p", f"{published}:{port}"]
+    if host.get("NanoCpus"):
+        flags.append(f"--cpus={host['NanoCpus'] / 1e9:g}")
+    flags += [f"{flag}={host[key]}" for key, flag in _HOST_FLAGS.items() if key in host]
+    if host.get("AutoRemove"):
+        flags.append("--rm")
+    if host.get("Init"):
+        flags.append("--init")
+    return flags
+
+
+def _epoch(timestamp: str) -> int:
+    """Seconds since the epoch of an RFC 3339 timestamp with nanoseconds ("...T10:00:00.123456789Z")."""
+    timestamp = re.sub(r"(\.\d{6})\d+", r"\1", timestamp).replace("Z", "+00:00")
+    try:
+        return int(datetime.fromisoformat(timestamp).timestamp())
+    except ValueError:
+        return 0
+
+
+class DockerCLIClient(_Client):
+    """The same operations through the `docker` CLI, for daemons not on a local unix socket."""
+
+    def _docker(self, *args: str, check: bool = True) -> subprocess.CompletedProcess:
+        try:
+            result = subprocess.run(["docker", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            raise DockerAPIError(0, f"cannot run the docker CLI: {e}") from e
+        if check and result.returncode != 0:
+            message = result.stderr.strip() or f"docker {args[0]} failed (exit {result.returncode})"
+            lowered = message.lower()
+            status = 404 if "no such" in lowered else 409 if "in progress" in lowered or "in use" in lowered else 500
+            raise DockerAPIError(status, message)
+        return result
+
+    def _inspect(self, kind: str, refs: list[str]) -> list[dict]:
+        if not refs:
+            return []
+        try:
+            return json.loads(self._docker(kind, "inspect", *refs).stdout)
+        except DockerAPIError as e:
+            if e.status == 404:
+                return []
+            raise
+
+    def _stream(self, argv: list[str]):
+        """(stream, bytes) frames of a CLI process's stdout and stderr; returns its exit code."""
+        try:
+            proc = subprocess.Popen(["docker", *argv], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise DockerAPIError(0, f"cannot run the docker CLI: {e}") from e
+        selector = selectors.DefaultSelector()
+        selector.register(proc.stdout, selectors.EVENT_READ, STDOUT)
+        selector.register(proc.stderr, selectors.EVENT_READ, STDERR)
+        try:
+            while selector.get_map():
+                for key, _ in selector.select():
+                    data = os.read(key.fileobj.fileno(), 65536)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        continue
+                    yield key.data, data
+        finally:
+            selector.close()
+            if proc.poll() is None:
+                proc.terminate()
+            proc.stdout.close()
+            proc.stderr.close()
+        return proc.wait()
+
+    def image_inspect(self, ref: str) -> dict | None:
+        found = self._inspect("image", [ref])
+        return found[0] if found else None
+
+    def images(self, reference: str | None = None) -> list[dict]:
+        args = ["image", "ls", "-q", "--no-trunc", *(["--filter", f"reference={reference}"] if reference else [])]
+        ids = list(dict.fromkeys(self._docker(*args).stdout.split()))
+        return [
+            {"Id": i["Id"], "RepoTags": i.get("RepoTags") or [], "Size": i.get("Size", 0), "Created": _epoch(i.get("Created", ""))}
+            for i in self._inspect("image", ids)
+        ]
+
+    def remove_image(self, ref: str, force: bool = False) -> None:
+        self._docker("rmi", *(["-f"] if force else []), ref)
+
+    def network_gateway(self, name: str = "bridge") -> str | None:
+        found = self._inspect("network", [name])
+        return _gateway(found[0]) if found else None
+
+    def containers(self, *, include_stopped: bool = True, filters: dict | None = None) -> list[dict]:
+        args = ["ps", "-q", "--no-trunc", *(["-a"] if include_stopped else [])]
+        for key, values in (filters or {}).items():
+            for value in values:
+                args += ["--filter", f"{key}={value}"]
+        return [
+            {
+                "Id": c["Id"],
+                "Names": [c["Name"]],
+                "Image": c["Config"].get("Image"),
+                "State": c["State"].get("Status"),
+                "Labels": c["Config"].get("Labels") or {},
+            }
+            for c in self._inspect("container", self._docker(*args).stdout.split())
+        ]
+
+    def inspect_container(self, name: str) -> dict | None:
+        found = self._inspect("container", [name])
+        return found[0] if found else None
+
+    def run_container(self, config: dict, name: str | None = None) -> str:
+        args = ["run", "-d", *(["--name", name] if name else []), *_run_flags(config), config["Image"], *config["Cmd"]]
+        return self._docker(*args).stdout.strip()
+
+    def stop_container(self, name: str, timeout: int = 10) -> None:
+        self._docker("stop", "-t", str(timeout), name)
+
+    def remove_container(self, name: str, *, force: bool = False, missing_ok: bool = False) -> bool:
+        try:
+            self._docker("rm", *(["-f"] if force else []), name)
+        except DockerAPIError as e:
+            if missing_ok and e.status in (404, 409):
+                return False
+            raise
+        return True
+
+    def logs(self, name: str, *, follow: bool = False, tail: str = "all"):
+        if self.inspect_container(name) is None:
+            raise DockerAPIError(404, f"No such container: {name}")
+        yield from self._stream(["logs", "--tail", tail, *(["--follow"] if follow else []), name])
+
+    def wait(self, name: str) -> int:
+        return int(self._docker("wait", name).stdout.strip())
+
+    def exec_stream(self, name: str, cmd: list[str], *, user: str | None = None, workdir: str | None = None, env: list[str] | None = None):
+        args = ["exec", *(["-u", user] if user else []), *(["-w", workdir] if workdir else [])]
+        for value in env or []:
+            args += ["-e", value]
+        return (yield from self._stream([*args, name, *cmd]))
+
+
+_client: _Client | None = None
+_client_lock = threading.Lock()
+
+
+def docker_client() -> _Client:
+    """The process-wide client (its connections are per thread).
+
+    The Engine API over the unix socket when the daemon has one, else the CLI.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            path = socket_path()
+            _client = DockerClient(path) if path else DockerCLIClient()
+        return _client
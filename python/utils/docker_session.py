@@ -0,0 +1,313 @@
+"""One builder container per compile (or a named warm one) with `docker exec` per phase.
+
+The container's main process is a small watchdog that exits once nothing has
+run in it for *idle_timeout* seconds; the container is started with --rm so an
+idle or abandoned session cleans itself up. Each exec keeps a heartbeat file
+fresh while it runs, so long make phases never count as idle.
+
+Killing a `docker exec` client does not stop its command: dockerd keeps it
+running, and a named session outlives the builder. Each command therefore
+runs in its own process group, recorded in the container, and
+SessionProcess.terminate_remote() signals that group.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from utils.build_graph import sigterm_as_exit
+from utils.docker_api import DockerAPIError, container_config, docker_client
+from utils.resource_profiles import container_cgroup_stats
+
+HEARTBEAT = "/tmp/.kb-session-heartbeat"
+CONFIG_LABEL = "kb.session.config"
+DEFAULT_IDLE_TIMEOUT = 1800
+# Leak guard for anonymous sessions if the builder dies before stop().
+ANONYMOUS_IDLE_TIMEOUT = 300
+
+
+def _watchdog_script(idle_timeout: int) -> str:
+    return (
+        f"touch {HEARTBEAT}; "
+        f"while [ $(( $(date +%s) - $(stat -c %Y {HEARTBEAT}) )) -lt {int(idle_timeout)} ]; "
+        "do sleep 5; done"
+    )
+
+
+def _exec_script(command: str, stats_path: str | None = None, job: str | None = None) -> str:
+    # Subshell keeps a `set -e` inside *command* from skipping the heartbeat cleanup.
+    script = f"(while sleep 30; do touch {HEARTBEAT}; done) & kb_hb=$!; "
+    if job:
+        # Job control puts the subshell in its own process group (pgid = its
+        # pid), still in the terminal's foreground; it records it in <job>.pgid.
+        # A <job>.cancel left by _kill_script before that means do not start.
+        script += (
+            f"set -m; (echo $BASHPID > {job}.pgid; [ -e {job}.cancel ] && exit 143; {command}); kb_rc=$?; set +m; "
+            f"rm -f {job}.pgid {job}.cancel; "
+        )
+    else:
+        script += f"({command}); kb_rc=$?; "
+    script += f"kill $kb_hb 2>/dev/null; touch {HEARTBEAT}; "
+    if stats_path:
+        # `times` line 2 is the CPU time of reaped children; /proc/$$/io folds in
+        # their I/O as well. See parse_exec_stats().
+        script += f'{{ times; cat /proc/$$/io; }} > "{stats_path}" 2>/dev/null; '
+    return script + "exit $kb_rc"
+
+
+def _kill_script(job: str) -> str:
+    # The cancel marker first: either the job sees it before starting, or its pgid is already recorded.
+    return f"touch {job}.cancel; [ -s {job}.pgid ] && kill -TERM -- -$(cat {job}.pgid) 2>/dev/null; true"
+
+
+def _seconds(field: str) -> float:
+    minutes, _, seconds = field.rstrip("s").partition("m")
+    return int(minutes) * 60 + float(seconds)
+
+
+def parse_exec_stats(path: str) -> dict | None:
+    """CPU time and bytes written recorded by an exec with *stats_path*."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    if len(lines) < 2:
+        return None
+    try:
+        user, system = (_seconds(v) for v in lines[1].split())
+    except ValueError:
+        return None
+    stats = {"cpu_user_s": round(user, 3), "cpu_sys_s": round(system, 3)}
+    for line in lines[2:]:
+        key, _, value = line.partition(":")
+        if key == "write_bytes":
+            stats["bytes_written"] = int(value)
+    return stats
+
+
+class SessionProcess(subprocess.Popen):
+    """The local `docker exec` client of a command started by BuildSession.popen."""
+
+    def __init__(self, args, *, session: "BuildSession", job: str, **kwargs) -> None:
+        super().__init__(args, **kwargs)
+        self.session = session
+        self.job = job
+
+    def terminate_remote(self) -> None:
+        """SIGTERM the command's process group in the container (make and its compilers)."""
+        self.session.terminate_job(self.job)
+
+
+class BuildSession:
+    """A builder container that phases are `docker exec`'d into."""
+
+    def __init__(
+        self,
+        image: str,
+        volume_args: list[str],
+        *,
+        user: str,
+        cpus: int | None = None,
+        resource_args: list[str] | None = None,
+        name: str | None = None,
+        idle_timeout: int | None = None,
+        dry_run: bool = False,
+    ) -> None:
+        self.image = image
+        self.volume_args = list(volume_args)
+        self.user = user
+        self.cpus = cpus or os.cpu_count()
+        # cpuset/memory/blkio flags of a --resource-profile (utils/resource_profiles.py).
+        self.resource_args = list(resource_args or [])
+        self.persistent = bool(name)
+        self.idle_timeout = idle_timeout or (
+            DEFAULT_IDLE_TIMEOUT if self.persistent else ANONYMOUS_IDLE_TIMEOUT
+        )
+        self.dry_run = dry_run
+        self.config_hash = self._config_hash()
+        self.name = name or f"kb-session-{os.getpid()}-{self.config_hash[:8]}"
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._jobs = itertools.count(1)
+
+    def _config_hash(self) -> str:
+        config = {
+            "image": self.image,
+            "volumes": self.volume_args,
+            "user": self.user,
+            "cpus": self.cpus,
+        }
+        if self.resource_args:
+            config["resources"] = self.resource_args
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    def _inspect(self) -> tuple[bool, str] | None:
+        """(running, config label) of the named container, or None if absent."""
+        info = docker_client().inspect_container(self.name)
+        if info is None:
+            return None
+        return info["State"]["Running"], (info["Config"].get("Labels") or {}).get(CONFIG_LABEL, "")
+
+    def describe(self) -> dict:
+        """Image, user and host:container mounts, for `compile --plan`."""
+        mounts, extra = [], []
+        args = iter(self.volume_args)
+        for arg in args:
+            if arg == "-v":
+                host, _, container = next(args, "").partition(":")
+                mounts.append({"host": host, "container": container.split(":")[0]})
+            else:
+                extra.append(arg)
+        return {
+            "image": self.image,
+            "name": self.name,
+            "persistent": self.persistent,
+            "user": self.user,
+            "cpus": self.cpus,
+            "resources": self.resource_args,
+            "mounts": mounts,
+            "docker_args": extra,
+        }
+
+    def is_warm(self) -> bool:
+        """True if a reusable container with this exact configuration is running."""
+        if self.dry_run or not self.persistent:
+            return False
+        try:
+            state = self._inspect()
+        except DockerAPIError:
+            # ensure_docker_image / start report an unreachable daemon.
+            return False
+        return state is not None and state == (True, self.config_hash)
+
+    def start(self) -> int:
+        with self._start_lock:
+            return self._start()
+
+    def _start(self) -> int:
+        if self._started:
+            return 0
+        if self.dry_run:
+            print(f"[Dry-run] Would start build session '{self.name}' from image {self.image}")
+            self._started = True
+            return 0
+        try:
+            state = self._inspect()
+        except DockerAPIError as e:
+            print(f"Error: {e}")
+            return 1
+        if state == (True, self.config_hash):
+            print(f"Reusing warm build session '{self.name}'")
+            self._started = True
+            return 0
+        run_args = ["--rm", "--init", f"--cpus={self.cpus}", *self.resource_args, *self.volume_args]
+        command = ["/bin/bash", "-c", _watchdog_script(self.idle_timeout)]
+        print(
+            f"Starting build session: docker run -d --name {self.name} -u {self.user} "
+            f"{' '.join(run_args)} {self.image} {' '.join(command[:2])} ..."
+        )
+        client = docker_client()
+        try:
+            if state is not None:
+                client.remove_container(self.name, force=True, missing_ok=True)
+            client.run_container(
+                container_config(self.image, command, args=run_args, user=self.user, labels={CONFIG_LABEL: self.config_hash}),
+                name=self.name,
+            )
+        except DockerAPIError as e:
+            print(f"Error: docker run failed: {e}")
+            return 1
+        self._started = True
+        return 0
+
+    def popen(
+        self,
+        command: str,
+        *,
+        workdir: str = "/builder",
+        label: str = "",
+        env=None,
+        tty: bool | None = None,
+        stats_path: str | None = None,
+    ) -> SessionProcess:
+        """Start *command* with bash inside the (started) session without waiting."""
+        if tty is None:
+            tty = sys.stdin.isatty() and sys.stdout.isatty()
+        # Unique across builders sharing a named session.
+        job = f"/tmp/.kb-job-{os.getpid()}-{next(self._jobs)}"
+        exec_command = [
+            "docker", "exec", *(["-it"] if tty else []), "-u", self.user, "-w", workdir, self.name,
+            "/bin/bash", "-c", _exec_script(command, stats_path, job),
+        ]
+        prefix = f" ({label})" if label else ""
+        print(f"Running in build session '{self.name}'{prefix}: {command}")
+        return SessionProcess(exec_command, session=self, job=job, env=env)
+
+    def terminate_job(self, job: str) -> None:
+        """SIGTERM a popen() command's process group inside the container."""
+        try:
+            docker_client().exec_run(self.name, ["/bin/bash", "-c", _kill_script(job)], user=self.user)
+        except DockerAPIError as e:
+            if e.status != 404:
+                print(f"Warning: could not stop {job} in build session '{self.name}': {e}")
+
+    def exec(self, command: str, *, workdir: str = "/builder", label: str = "", env=None) -> int:
+        """Run *command* with bash inside the session; returns its exit code."""
+        if self.dry_run:
+            prefix = f" ({label})" if label else ""
+            print(f"[Dry-run] Would run in build session{prefix}: {command}")
+            return 0
+        rc = self.start()
+        if rc != 0:
+            print(f"Error: could not start build session '{self.name}'.")
+            return rc
+        proc = self.popen(command, workdir=workdir, label=label, env=env)
+        with sigterm_as_exit():
+            try:
+                return proc.wait()
+            except BaseException:
+                # Ctrl-C or SIGTERM reaches the client, not the command in the container.
+                proc.terminate_remote()
+                raise
+
+    def cgroup_stats(self) -> dict[str, int]:
+        """The container's cgroup counters; empty unless the session has started."""
+        if self.dry_run or not self._started:
+            return {}
+        return container_cgroup_stats(self.name)
+
+    def stop(self) -> None:
+        """Remove anonymous sessions; named ones stay warm until their idle timeout."""
+        if self.dry_run or not self._started or self.persistent:
+            return
+        try:
+            docker_client().remove_container(self.name, force=True, missing_ok=True)
+        except DockerAPIError as e:
+            print(f"Warning: could not remove build session '{self.name}': {e}")
+        self._started = False
+
+    def __enter__(self) -> "BuildSession":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def stop_named_session(name: str) -> int:
+    try:
+        removed = docker_client().remove_container(name, force=True, missing_ok=True)
+    except DockerAPIError as e:
+        print(f"Error: {e}")
+        return 1
+    if not removed:
+        print(f"Error: no build session named '{name}'.")
+        return 1
+    print(f"Stopped build session '{name}'.")
+    return 0
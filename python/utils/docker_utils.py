@@ -1,24 +1,68 @@
+from __future__ import annotations
+
+import hashlib
 import os
+import shutil
 import subprocess
+import time
+
+from utils.docker_api import DockerAPIError, docker_client
+
+# Prebuilt JP7 toolchain the JP7 Dockerfile installs from the build context
+# instead of downloading it (see _kernel_builder_build_context).
+JP7_TOOLCHAIN_ARCHIVE = "x-tools.tbz2"
+# Offline stand-ins that do not change what the image contains.
+_UNHASHED_CONTEXT_FILES = {JP7_TOOLCHAIN_ARCHIVE, ".gitkeep"}
 
 
 def _repo_root() -> str:
     return os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 
 
-def docker_image_tag(jp7: bool = False) -> str:
+def docker_image_repo(jp7: bool = False) -> str:
     return "kernel_builder_jp7" if jp7 else "kernel_builder"
 
 
+def _dockerfile(jp7: bool = False) -> str:
+    return os.path.join(_repo_root(), "Dockerfile.jp7" if jp7 else "Dockerfile")
+
+
+def image_content_hash(jp7: bool = False) -> str:
+    """sha256 of the Dockerfile and every file in the build context."""
+    digest = hashlib.sha256()
+    with open(_dockerfile(jp7), "rb") as f:
+        digest.update(f.read())
+    context = _kernel_builder_build_context()
+    for dirpath, dirnames, filenames in os.walk(context):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, context)
+            if rel in _UNHASHED_CONTEXT_FILES:
+                continue
+            digest.update(f"\0{rel}\0{os.stat(path).st_mode & 0o777:o}\0".encode())
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def docker_image_tag(jp7: bool = False) -> str:
+    """<repo>:<content hash>; a Dockerfile or context edit yields a new tag (and a build)."""
+    return f"{docker_image_repo(jp7)}:{image_content_hash(jp7)[:12]}"
+
+
 def docker_image_exists(tag: str) -> bool:
-    return (
-        subprocess.run(
-            ["docker", "image", "inspect", tag],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        ).returncode
-        == 0
-    )
+    return docker_client().image_inspect(tag) is not None
+
+
+def docker_image_id(tag: str) -> str:
+    """Content id of a local image, or '' when it does not exist (or Docker is unreachable)."""
+    try:
+        info = docker_client().image_inspect(tag)
+    except DockerAPIError:
+        return ""
+    return info["Id"] if info else ""
 
 
 def _kernel_builder_build_context() -> str:
@@ -27,30 +71,194 @@ def _kernel_builder_build_context() -> str:
     return context
 
 
+def _jp7_toolchain_archive() -> str | None:
+    """The x-tools.tbz2 ensure_jp7_toolchain_storage.sh downloaded, if it is still there."""
+    path = os.path.join(_repo_root(), "storage", "toolchains", "aarch64-none-linux-gnu", "13.2", JP7_TOOLCHAIN_ARCHIVE)
+    return path if os.path.isfile(path) else None
+
+
 def build_docker_image(rebuild=False, jp7=False):
     repo_root = _repo_root()
-    dockerfile = os.path.join(repo_root, "Dockerfile.jp7" if jp7 else "Dockerfile")
+    dockerfile = _dockerfile(jp7)
     context = _kernel_builder_build_context()
     tag = docker_image_tag(jp7=jp7)
 
-    build_command = ["docker", "build", "-f", dockerfile, "-t", tag]
+    # --rebuild refreshes every layer (new apt packages); a Dockerfile edit
+    # needs no flag: it changes the tag, and unchanged layers stay cached.
+    # Dockerfile.jp7 uses RUN --mount, which needs BuildKit (not the default before Docker 23).
+    build_command = ["docker", "build", "-f", dockerfile, "-t", tag, "-t", f"{docker_image_repo(jp7)}:latest"]
     if rebuild:
         build_command.append("--no-cache")
     build_command.append(context)
 
+    staged_archive = None
+    archive = _jp7_toolchain_archive() if jp7 else None
+    if archive:
+        # Offline build hosts: install the toolchain from the context instead of downloading it.
+        staged_archive = os.path.join(context, JP7_TOOLCHAIN_ARCHIVE)
+        if not os.path.exists(staged_archive):
+            try:
+                os.link(archive, staged_archive)
+            except OSError:
+                shutil.copy2(archive, staged_archive)
+        print(f"Using {archive} for the JP7 toolchain (no download).")
     print(f"Running command: {' '.join(build_command)}")
-    subprocess.run(build_command, cwd=repo_root, check=True)
+    try:
+        # RUN --mount needs BuildKit; its built-in Dockerfile frontend handles it without pulling one.
+        subprocess.run(build_command, cwd=repo_root, check=True, env={**os.environ, "DOCKER_BUILDKIT": "1"})
+    finally:
+        if staged_archive:
+            os.remove(staged_archive)
 
 
-def ensure_docker_image(jp7=False, rebuild=False, dry_run=False):
+def ensure_docker_image(jp7=False, rebuild=False, dry_run=False) -> int:
+    """Build the image unless it exists; 1 (with the error printed) if Docker is unreachable."""
     tag = docker_image_tag(jp7=jp7)
-    if docker_image_exists(tag) and not rebuild:
-        return
+    try:
+        exists = docker_image_exists(tag)
+        had_latest = not exists and docker_image_exists(f"{docker_image_repo(jp7)}:latest")
+    except DockerAPIError as e:
+        if dry_run:
+            print(f"[Dry-run] Would build Docker image '{tag}' if missing (Docker: {e})")
+            return 0
+        print(f"Error: {e}")
+        return 1
+    if exists and not rebuild:
+        return 0
     if dry_run:
         print(f"[Dry-run] Would build Docker image '{tag}'")
-        return
-    print(f"Docker image '{tag}' not found; building now (one-time setup)...")
+        return 0
+    if had_latest:
+        print(f"Docker image '{tag}' not found: the Dockerfile or build context changed; rebuilding (cached layers are reused)...")
+    else:
+        print(f"Docker image '{tag}' not found; building now (one-time setup)...")
     build_docker_image(rebuild=rebuild, jp7=jp7)
+    return 0
+
+
+def image_export_dir() -> str:
+    return os.path.join(_repo_root(), "storage", "docker_images")
+
+
+def _pipe(producer: list[str], consumer: list[str]) -> tuple[int, str]:
+    """`producer | consumer` with pipefail: (exit code, consumer's stdout).
+
+    The consumer's failure is reported over the producer's (which then usually
+    died of SIGPIPE), and a failed producer fails the pipe even if the
+    consumer succeeded on its truncated input.
+    """
+    first = subprocess.Popen(producer, stdout=subprocess.PIPE)
+    try:
+        second = subprocess.Popen(consumer, stdin=first.stdout, stdout=subprocess.PIPE, text=True)
+    except OSError:
+        first.kill()
+        first.wait()
+        raise
+    # Only the consumer reads the pipe now: the producer gets SIGPIPE if it exits early.
+    first.stdout.close()
+    output = second.communicate()[0]
+    producer_rc = first.wait()
+    return second.returncode or producer_rc, output
+
+
+def export_docker_image(jp7=False, output=None, dry_run=False) -> int:
+    """`docker save` the current image (and its :latest alias) to a tarball, zstd-compressed when available."""
+    tag = docker_image_tag(jp7=jp7)
+    compress = shutil.which("zstd") is not None
+    if output is None:
+        name = tag.replace(":", "-") + (".tar.zst" if compress else ".tar")
+        output = os.path.join(image_export_dir(), name)
+    compress = output.endswith(".zst")
+    if dry_run:
+        print(f"[Dry-run] Would export Docker image '{tag}' to {output}")
+        return 0
+    if ensure_docker_image(jp7=jp7) != 0:
+        return 1
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    save = ["docker", "save", tag, f"{docker_image_repo(jp7)}:latest"]
+    print(f"Exporting {tag} to {output} ...")
+    if compress:
+        print(f"Running command: {' '.join(save)} | zstd -T0 -3 -q -o {tmp}")
+        try:
+            rc = _pipe(save, ["zstd", "-T0", "-3", "-q", "-o", tmp])[0]
+        except OSError as e:
+            print(f"Error: {e}")
+            rc = 1
+    else:
+        rc = subprocess.run([*save, "-o", tmp]).returncode
+    if rc != 0:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        print(f"Error: exporting {tag} failed (exit {rc}).")
+        return rc
+    os.replace(tmp, output)
+    print(f"Exported {tag}: {output} ({os.path.getsize(output) / 1024**2:.0f} MiB)")
+    return 0
+
+
+def import_docker_image(path, dry_run=False) -> int:
+    """`docker load` an exported tarball; reports whether it matches the current Dockerfiles."""
+    if not os.path.isfile(path):
+        print(f"Error: {path} not found.")
+        return 1
+    if dry_run:
+        print(f"[Dry-run] Would load Docker image(s) from {path}")
+        return 0
+    print(f"Loading {path} ...")
+    if path.endswith(".zst"):
+        # docker load reads gzip, bzip2 and xz itself, but not zstd.
+        try:
+            rc, output = _pipe(["zstd", "-dc", path], ["docker", "load"])
+        except OSError as e:
+            print(f"Error: {e}")
+            return 1
+    else:
+        result = subprocess.run(["docker", "load", "-i", path], stdout=subprocess.PIPE, text=True)
+        rc, output = result.returncode, result.stdout
+    print(output, end="")
+    if rc != 0:
+        print(f"Error: docker load failed (exit {rc}).")
+        return rc
+    loaded = {line.split(":", 1)[1].strip() for line in output.splitlines() if line.startswith("Loaded image:")}
+    for jp7 in (False, True):
+        tag = docker_image_tag(jp7=jp7)
+        if tag in loaded:
+            print(f"{tag} matches the current {os.path.basename(_dockerfile(jp7))}; compiles will use it as is.")
+            return 0
+    print(
+        "Warning: the loaded image was built from a different Dockerfile or build context than this checkout; "
+        "the next compile will build a new image."
+    )
+    return 0
+
+
+def list_docker_images() -> int:
+    for jp7 in (False, True):
+        repo, tag = docker_image_repo(jp7), docker_image_tag(jp7=jp7)
+        try:
+            present = docker_image_exists(tag)
+            images = docker_client().images(repo)
+        except DockerAPIError as e:
+            print(f"Error: {e}")
+            return 1
+        print(f"{repo}: current tag {tag} ({'present' if present else 'not built'})")
+        for image in sorted(images, key=lambda i: i["Created"], reverse=True):
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(image["Created"]))
+            for repo_tag in image.get("RepoTags") or []:
+                image_tag = repo_tag.rpartition(":")[2]
+                marker = "*" if repo_tag == tag else " "
+                print(
+                    f"  {marker} {image_tag:<14} {image['Id'].split(':')[-1][:12]:<14} {created:<16} "
+                    f"{image['Size'] / 1024**2:.0f} MiB"
+                )
+    export_dir = image_export_dir()
+    exports = sorted(os.listdir(export_dir)) if os.path.isdir(export_dir) else []
+    if exports:
+        print(f"Exports in {export_dir}:")
+        for name in exports:
+            print(f"    {name} ({os.path.getsize(os.path.join(export_dir, name)) / 1024**2:.0f} MiB)")
+    return 0
 
 
 def inspect_docker_image(output_dir="output"):
@@ -68,31 +276,24 @@ def inspect_docker_image(output_dir="output"):
     os.system(inspect_command)
 
 def cleanup_docker():
-    # Stop and remove any containers using the 'kernel_builder' image
-    try:
-        # List all containers using the 'kernel_builder' image
-        result = subprocess.run(
-            ["docker", "ps", "-a", "-q", "--filter", "ancestor=kernel_builder"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        container_ids = result.stdout.strip().split("\n")
-
-        # If there are containers found, stop and remove them
-        if container_ids and container_ids[0] != "":
-            for container_id in container_ids:
-                print(f"Stopping container {container_id}")
-                subprocess.run(["docker", "stop", container_id], check=True)
-                print(f"Removing container {container_id}")
-                subprocess.run(["docker", "rm", container_id], check=True)
-
-    except subprocess.CalledProcessError as e:
-        print(f"Error stopping or removing containers: {e}")
-
-    # Now remove the image
+    """Remove every container of the kernel_builder image (concurrently), then the image."""
+    client = docker_client()
     try:
-        print("Removing Docker image 'kernel_builder'")
-        subprocess.run(["docker", "rmi", "-f", "kernel_builder"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error removing image: {e}")
+        tags = [t for image in client.images("kernel_builder") for t in image.get("RepoTags") or []]
+        containers = client.containers(filters={"ancestor": tags}) if tags else []
+    except DockerAPIError as e:
+        print(f"Error listing containers: {e}")
+        return
+    names = [c["Names"][0].lstrip("/") if c.get("Names") else c["Id"][:12] for c in containers]
+    if names:
+        print(f"Stopping and removing container(s): {', '.join(names)}")
+    for name, error in client.remove_containers(names).items():
+        if error:
+            print(f"Error stopping or removing container {name}: {error}")
+
+    for tag in tags:
+        try:
+            print(f"Removing Docker image '{tag}'")
+            client.remove_image(tag, force=True)
+        except DockerAPIError as e:
+            print(f"Error removing image: {e}")
@@ -0,0 +1,273 @@
+"""DTB include graph for `compile --dtb-only`, read from kbuild's own dep files.
+
+Every DTB kbuild builds leaves two files next to it:
+
+- .<name>.dtb.d.pre.tmp: the preprocessor's make-style dependency list (the
+  .dts and every .dtsi/.h it included);
+- .<name>.dtb.cmd: the exact command (cmd_/savedcmd_<target>) and, after
+  fixdep, the same dependencies again (deps_<target>).
+
+The graph of all DTBs in a build dir is cached in
+storage/kernels/<name>/.dtb_deps.json. Each record keeps the stamps of the
+two files it was parsed from, so a later run re-parses only records kbuild
+rewrote and walks only directories whose mtime changed.
+
+A DTB is stale when one of its sources is newer than the .dtb. In an nvbuild
+tree the sources were copied into kernel_out, so the tree's own copy (same
+relative path outside kernel_out) is compared too and copied over first.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+from dataclasses import asdict, dataclass, field
+
+from utils.kernel_tree import kernel_tree_root
+
+DEPS_FILENAME = ".dtb_deps.json"
+DEPS_VERSION = 1
+DTB_SUFFIXES = (".dtb", ".dtbo")
+_SKIP_DIRS = {".git"}
+_CMD_RE = re.compile(r"^(?:saved)?cmd_(\S+) := (.*)$")
+_MAKE_FUNC_RE = re.compile(r"\$\([^)]*\)")
+
+
+@dataclass
+class DtbRecord:
+    # Host path of the built blob.
+    dtb: str
+    # make's working directory when kbuild ran *command* (host path).
+    cwd: str
+    command: str
+    # Host paths of the .dts and everything it included.
+    deps: list[str] = field(default_factory=list)
+    cmd_file: str = ""
+    # [mtime_ns] of .cmd and .d.pre.tmp when parsed (0: missing).
+    stamp: list[int] = field(default_factory=list)
+
+
+def dtb_deps_path(kernel_name: str) -> str:
+    return os.path.join(kernel_tree_root(kernel_name), DEPS_FILENAME)
+
+
+def _mtime_ns(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _dep_files(dtb: str) -> tuple[str, str]:
+    head, name = os.path.split(dtb)
+    return os.path.join(head, f".{name}.cmd"), os.path.join(head, f".{name}.d.pre.tmp")
+
+
+def _make_deps(text: str) -> list[str]:
+    """Prerequisites of a make rule file (`target: a b \\` continuation lines)."""
+    text = text.replace("\\\n", " ")
+    deps = []
+    for line in text.splitlines():
+        if ":" in line:
+            deps += line.split(":", 1)[1].split()
+    return deps
+
+
+def _parse_cmd_file(path: str) -> tuple[str, str, list[str]]:
+    """(target, command, deps) from a kbuild .cmd file."""
+    target = command = ""
+    deps: list[str] = []
+    in_deps = False
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if in_deps:
+                # $(wildcard include/config/...) entries are Kconfig symbols, not files.
+                deps += _MAKE_FUNC_RE.sub(" ", line.rstrip("\\")).split()
+                in_deps = line.endswith("\\")
+                continue
+            match = _CMD_RE.match(line)
+            if match and not command:
+                target, command = match.groups()
+            elif line.startswith("source_"):
+                deps.append(line.split(":=", 1)[1].strip())
+            elif line.startswith("deps_"):
+                in_deps = line.endswith("\\")
+    return target, command, deps
+
+
+def _host_path(path: str, cwd: str, path_map: dict[str, str]) -> str:
+    for prefix, host in path_map.items():
+        if path == prefix or path.startswith(prefix + "/"):
+            path = host + path[len(prefix):]
+            break
+    return os.path.normpath(os.path.join(cwd, path))
+
+
+def _parse_record(dtb: str, objtree: str, path_map: dict[str, str], old: DtbRecord | None) -> DtbRecord | None:
+    cmd_file, pre_file = _dep_files(dtb)
+    stamp = [_mtime_ns(cmd_file), _mtime_ns(pre_file)]
+    if stamp[0]:
+        try:
+            target, command, deps = _parse_cmd_file(cmd_file)
+        except OSError:
+            return None
+    elif old is not None:
+        # .cmd dropped by refresh_cmd_file(); kbuild rebuilds the DTB on its next run.
+        target, command, deps = os.path.relpath(dtb, old.cwd), old.command, []
+    else:
+        return None
+    if not command:
+        return None
+    # kbuild runs from the objtree; targets are relative to it unless M= made them absolute.
+    if not target.startswith("/") and dtb.endswith(os.sep + target):
+        cwd = dtb[: -len(target)].rstrip(os.sep)
+    else:
+        cwd = objtree
+    if stamp[1]:
+        try:
+            with open(pre_file, encoding="utf-8", errors="replace") as f:
+                deps += _make_deps(f.read())
+        except OSError:
+            pass
+    unique = sorted({_host_path(dep, cwd, path_map) for dep in deps})
+    return DtbRecord(dtb=dtb, cwd=cwd, command=command, deps=unique, cmd_file=cmd_file, stamp=stamp)
+
+
+def _walk_dtbs(root: str):
+    # *root* itself may be a --ram-build symlink; links below it (an O= dir's
+    # `source`) lead back into the source tree and are not followed.
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in _SKIP_DIRS]
+        for name in filenames:
+            if name.endswith(DTB_SUFFIXES) and (f".{name}.cmd" in filenames or f".{name}.d.pre.tmp" in filenames):
+                yield os.path.join(dirpath, name)
+
+
+def _scan_dir(dirpath: str) -> list[str]:
+    try:
+        names = set(os.listdir(dirpath))
+    except OSError:
+        return []
+    return [
+        os.path.join(dirpath, n) for n in names
+        if n.endswith(DTB_SUFFIXES) and (f".{n}.cmd" in names or f".{n}.d.pre.tmp" in names)
+    ]
+
+
+def _load(kernel_name: str) -> dict:
+    try:
+        with open(dtb_deps_path(kernel_name), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if data.get("version") == DEPS_VERSION else {}
+
+
+def _save(kernel_name: str, data: dict) -> None:
+    path = dtb_deps_path(kernel_name)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def load_dtb_graph(
+    kernel_name: str,
+    roots: list[str],
+    objtree: str,
+    *,
+    path_map: dict[str, str] | None = None,
+    full: bool = False,
+) -> dict[str, DtbRecord]:
+    """Every built DTB under *roots* (host paths) with its sources, refreshed from disk.
+
+    *objtree* is kbuild's working directory for the build; *path_map* maps
+    in-container path prefixes (Docker builds) to host paths. With *full*, or
+    without a cache for these roots, the roots are walked from scratch.
+    """
+    path_map = path_map or {}
+    roots = [os.path.abspath(r) for r in roots]
+    data = _load(kernel_name)
+    if data.get("roots") != roots:
+        full = True
+    records = {} if full else {k: DtbRecord(**v) for k, v in data.get("records", {}).items()}
+    dirs = {} if full else dict(data.get("dirs", {}))
+
+    if full:
+        found = [dtb for root in roots if os.path.isdir(root) for dtb in _walk_dtbs(root)]
+    else:
+        found = [r.dtb for r in records.values()]
+        for dirpath, mtime in list(dirs.items()):
+            if _mtime_ns(dirpath) != mtime:
+                found += _scan_dir(dirpath)
+    fresh: dict[str, DtbRecord] = {}
+    for dtb in sorted(set(found)):
+        old = records.get(dtb)
+        cmd_file, pre_file = _dep_files(dtb)
+        if old is not None and old.stamp == [_mtime_ns(cmd_file), _mtime_ns(pre_file)]:
+            fresh[dtb] = old
+            continue
+        record = _parse_record(dtb, objtree, path_map, old)
+        if record is not None:
+            fresh[dtb] = record
+    dirs = {os.path.dirname(dtb): _mtime_ns(os.path.dirname(dtb)) for dtb in fresh}
+    if os.path.isdir(kernel_tree_root(kernel_name)):
+        _save(
+            kernel_name,
+            {"version": DEPS_VERSION, "roots": roots, "dirs": dirs, "records": {k: asdict(v) for k, v in fresh.items()}},
+        )
+    return fresh
+
+
+def find_dtbs(graph: dict[str, DtbRecord], name: str) -> list[DtbRecord]:
+    """Records whose file name is *name* (".dtb" added if it has no suffix), newest first."""
+    if not name.endswith(DTB_SUFFIXES):
+        name += ".dtb"
+    matches = [r for r in graph.values() if os.path.basename(r.dtb) == name]
+    return sorted(matches, key=lambda r: _mtime_ns(r.dtb), reverse=True)
+
+
+def tree_source(path: str, source_map: tuple[str, str] | None) -> str | None:
+    """The tree's own copy of a file nvbuild synced into kernel_out, if there is one."""
+    if source_map is None:
+        return None
+    out_dir, tree = source_map
+    if not path.startswith(out_dir + os.sep):
+        return None
+    source = os.path.join(tree, os.path.relpath(path, out_dir))
+    return source if os.path.isfile(source) else None
+
+
+def changed_sources(record: DtbRecord, source_map: tuple[str, str] | None = None) -> tuple[list[str], list[tuple[str, str]]]:
+    """(sources newer than the DTB, (tree copy, kernel_out copy) pairs to sync first)."""
+    built = _mtime_ns(record.dtb)
+    changed, to_sync = [], []
+    for dep in record.deps:
+        source = tree_source(dep, source_map)
+        dep_mtime = _mtime_ns(dep)
+        if source is not None and _mtime_ns(source) > dep_mtime:
+            to_sync.append((source, dep))
+            changed.append(source)
+        elif not dep_mtime or dep_mtime > built:
+            changed.append(dep)
+    return changed, to_sync
+
+
+def refresh_cmd_file(record: DtbRecord) -> int:
+    """After replaying *record*'s command, drop a .cmd whose deps miss a new include.
+
+    Its deps_ list is what kbuild checks on the next `make dtbs`; without the
+    .cmd, kbuild rebuilds this one DTB and writes a complete one.
+    """
+    _, pre_file = _dep_files(record.dtb)
+    try:
+        _, _, recorded = _parse_cmd_file(record.cmd_file)
+        with open(pre_file, encoding="utf-8", errors="replace") as f:
+            included = _make_deps(f.read())
+    except OSError:
+        return 0
+    if not set(included) <= set(recorded):
+        os.remove(record.cmd_file)
+    return 0
@@ -0,0 +1,415 @@
+"""Flattened device tree reader/writer and in-process overlay application.
+
+`compile --overlays` used to shell out to fdtoverlay (in the Docker path via
+the build container) and rename the result over the base DTB, so a second run
+merged into an already-merged blob. merge_overlays() applies the overlays here
+instead, writes <base>-merged.dtb next to the base DTB (which is left alone)
+and caches the result under storage/dtb_overlay_cache/ keyed by the hashes of
+the base and the ordered overlays, so a repeat build is a file copy.
+
+Overlay semantics follow libfdt's fdt_overlay_apply(): overlay phandles are
+shifted past the base's highest phandle (__local_fixups__ says where the
+overlay refers to its own nodes), labels in __fixups__ are resolved through
+the base's __symbols__, every fragment's __overlay__ is merged into its
+`target`/`target-path` node, and the overlay's __symbols__ are added to the
+base with their fragment paths rewritten to the target's path.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import struct
+
+FDT_MAGIC = 0xD00DFEED
+FDT_BEGIN_NODE = 1
+FDT_END_NODE = 2
+FDT_PROP = 3
+FDT_NOP = 4
+FDT_END = 9
+_HEADER = struct.Struct(">10I")
+_OUT_VERSION = 17
+_OUT_LAST_COMP_VERSION = 16
+# Bump when merge output could change for the same inputs.
+ENGINE_VERSION = 1
+
+
+class FdtError(ValueError):
+    """A malformed blob or an overlay that cannot be applied."""
+
+
+class Node:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.props: dict[str, bytes] = {}
+        self.children: dict[str, Node] = {}
+
+    def child(self, name: str) -> Node | None:
+        """Subnode by name; a name without a unit address matches `name@...`."""
+        if name in self.children:
+            return self.children[name]
+        if "@" not in name:
+            for child_name, child in self.children.items():
+                if child_name.split("@", 1)[0] == name:
+                    return child
+        return None
+
+    def add_child(self, name: str) -> Node:
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = Node(name)
+        return node
+
+    @property
+    def phandle(self) -> int:
+        for key in ("phandle", "linux,phandle"):
+            value = self.props.get(key)
+            if value is not None and len(value) == 4:
+                return struct.unpack(">I", value)[0]
+        return 0
+
+    def walk(self, path: str = ""):
+        """Yield (path, node) for this node and every descendant."""
+        yield (path or "/"), self
+        for name, child in self.children.items():
+            yield from child.walk(f"{path}/{name}")
+
+
+class Fdt:
+    def __init__(self, root: Node, reservations: list[tuple[int, int]] | None = None, boot_cpuid_phys: int = 0) -> None:
+        self.root = root
+        self.reservations = reservations or []
+        self.boot_cpuid_phys = boot_cpuid_phys
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> Fdt:
+        if len(blob) < _HEADER.size:
+            raise FdtError("blob is shorter than an FDT header")
+        (magic, totalsize, off_struct, off_strings, off_rsvmap, version,
+         _last_comp, boot_cpuid_phys, size_strings, size_struct) = _HEADER.unpack_from(blob)
+        if magic != FDT_MAGIC:
+            raise FdtError("bad FDT magic")
+        if version < 16:
+            raise FdtError(f"FDT version {version} is not supported (need 16 or later)")
+        if totalsize > len(blob):
+            raise FdtError("blob is truncated")
+        strings = blob[off_strings:off_strings + size_strings]
+        end_struct = off_struct + size_struct if version >= 17 else totalsize
+
+        reservations = []
+        pos = off_rsvmap
+        while True:
+            address, size = struct.unpack_from(">QQ", blob, pos)
+            pos += 16
+            if address == 0 and size == 0:
+                break
+            reservations.append((address, size))
+
+        def string_at(offset: int) -> str:
+            end = strings.find(b"\0", offset)
+            if offset >= len(strings) or end < 0:
+                raise FdtError(f"bad property name offset {offset}")
+            return strings[offset:end].decode("utf-8", "replace")
+
+        stack: list[Node] = []
+        root = None
+        pos = off_struct
+        while pos < end_struct:
+            (token,) = struct.unpack_from(">I", blob, pos)
+            pos += 4
+            if token == FDT_BEGIN_NODE:
+                end = blob.index(b"\0", pos)
+                node = Node(blob[pos:end].decode("utf-8", "replace"))
+                pos = _align(end + 1)
+                if stack:
+                    stack[-1].children[node.name] = node
+                elif root is None:
+                    root = node
+                else:
+                    raise FdtError("more than one root node")
+                stack.append(node)
+            elif token == FDT_END_NODE:
+                if not stack:
+                    raise FdtError("unbalanced end of node")
+                stack.pop()
+            elif token == FDT_PROP:
+                length, name_offset = struct.unpack_from(">II", blob, pos)
+                pos += 8
+                if not stack:
+                    raise FdtError("property outside a node")
+                stack[-1].props[string_at(name_offset)] = bytes(blob[pos:pos + length])
+                pos = _align(pos + length)
+            elif token == FDT_NOP:
+                continue
+            elif token == FDT_END:
+                break
+            else:
+                raise FdtError(f"unknown structure token {token:#x} at offset {pos - 4}")
+        if root is None or stack:
+            raise FdtError("structure block is incomplete")
+        return cls(root, reservations, boot_cpuid_phys)
+
+    def to_bytes(self) -> bytes:
+        strings = bytearray()
+        string_offsets: dict[str, int] = {}
+        structure = bytearray()
+
+        def emit(node: Node) -> None:
+            structure.extend(struct.pack(">I", FDT_BEGIN_NODE))
+            structure.extend(node.name.encode() + b"\0")
+            structure.extend(b"\0" * (_align(len(structure)) - len(structure)))
+            for name, value in node.props.items():
+                if name not in string_offsets:
+                    string_offsets[name] = len(strings)
+                    strings.extend(name.encode() + b"\0")
+                structure.extend(struct.pack(">III", FDT_PROP, len(value), string_offsets[name]))
+                structure.extend(value)
+                structure.extend(b"\0" * (_align(len(structure)) - len(structure)))
+            for child in node.children.values():
+                emit(child)
+            structure.extend(struct.pack(">I", FDT_END_NODE))
+
+        emit(self.root)
+        structure.extend(struct.pack(">I", FDT_END))
+
+        rsvmap = b"".join(struct.pack(">QQ", a, s) for a, s in self.reservations) + struct.pack(">QQ", 0, 0)
+        off_rsvmap = _align(_HEADER.size, 8)
+        off_struct = off_rsvmap + len(rsvmap)
+        off_strings = off_struct + len(structure)
+        totalsize = off_strings + len(strings)
+        header = _HEADER.pack(
+            FDT_MAGIC, totalsize, off_struct, off_strings, off_rsvmap, _OUT_VERSION,
+            _OUT_LAST_COMP_VERSION, self.boot_cpuid_phys, len(strings), len(structure),
+        )
+        return header + b"\0" * (off_rsvmap - _HEADER.size) + rsvmap + bytes(structure) + bytes(strings)
+
+    def lookup(self, path: str) -> Node | None:
+        """Node at an absolute path, or at an /aliases name (optionally followed by /sub/path)."""
+        if not path.startswith("/"):
+            alias, _, rest = path.partition("/")
+            aliases = self.root.child("aliases")
+            target = aliases.props.get(alias) if aliases else None
+            if target is None:
+                return None
+            path = _cstring(target) + (f"/{rest}" if rest else "")
+            if not path.startswith("/"):
+                return None
+        node = self.root
+        for part in (p for p in path.split("/") if p):
+            node = node.child(part)
+            if node is None:
+                return None
+        return node
+
+
+def _align(value: int, to: int = 4) -> int:
+    return (value + to - 1) & ~(to - 1)
+
+
+def _cstring(value: bytes) -> str:
+    return value.split(b"\0", 1)[0].decode("utf-8", "replace")
+
+
+def _set_u32(node: Node, prop: str, offset: int, value: int) -> None:
+    data = node.props.get(prop)
+    if data is None or offset + 4 > len(data):
+        raise FdtError(f"phandle reference {prop}+{offset} is outside the property")
+    node.props[prop] = data[:offset] + struct.pack(">I", value) + data[offset + 4:]
+
+
+def _get_u32(node: Node, prop: str, offset: int) -> int:
+    data = node.props.get(prop, b"")
+    if offset + 4 > len(data):
+        raise FdtError(f"phandle reference {prop}+{offset} is outside the property")
+    return struct.unpack_from(">I", data, offset)[0]
+
+
+def _local_references(overlay: Fdt):
+    """Yield (node, property, offset) for every overlay-internal phandle reference."""
+    fixups = overlay.root.children.get("__local_fixups__")
+    if fixups is None:
+        return
+
+    def walk(fixup: Node, node: Node):
+        for prop, offsets in fixup.props.items():
+            for i in range(0, len(offsets) - len(offsets) % 4, 4):
+                yield node, prop, struct.unpack_from(">I", offsets, i)[0]
+        for name, sub in fixup.children.items():
+            child = node.children.get(name)
+            if child is None:
+                raise FdtError(f"__local_fixups__ names a missing node {name!r}")
+            yield from walk(sub, child)
+
+    yield from walk(fixups, overlay.root)
+
+
+def _fragments(overlay: Fdt):
+    for name, fragment in overlay.root.children.items():
+        if name.startswith("__") or "__overlay__" not in fragment.children:
+            continue
+        yield name, fragment
+
+
+def _fragment_target(base: Fdt, phandles: dict[int, tuple[str, Node]], name: str, fragment: Node) -> tuple[str, Node]:
+    if "target" in fragment.props:
+        phandle = _get_u32(fragment, "target", 0)
+        if phandle not in phandles:
+            raise FdtError(f"{name}: target phandle {phandle:#x} is not in the base tree")
+        return phandles[phandle]
+    if "target-path" in fragment.props:
+        path = _cstring(fragment.props["target-path"])
+        node = base.lookup(path)
+        if node is None:
+            raise FdtError(f"{name}: target-path {path!r} is not in the base tree")
+        if not path.startswith("/"):
+            path = next(p for p, n in base.root.walk() if n is node)
+        return path, node
+    raise FdtError(f"{name}: fragment has neither target nor target-path")
+
+
+def _merge(target: Node, overlay: Node) -> None:
+    for name, value in overlay.props.items():
+        target.props[name] = value
+    for name, child in overlay.children.items():
+        _merge(target.add_child(name), child)
+
+
+def _keep_base_phandles(target: Node, overlay: Node, renames: dict[int, int]) -> None:
+    """An overlay node merged into a base node that has a phandle keeps the base one."""
+    base_phandle, overlay_phandle = target.phandle, overlay.phandle
+    if base_phandle and overlay_phandle and base_phandle != overlay_phandle:
+        renames[overlay_phandle] = base_phandle
+        for key in ("phandle", "linux,phandle"):
+            if key in overlay.props:
+                overlay.props[key] = struct.pack(">I", base_phandle)
+    for name, child in overlay.children.items():
+        existing = target.children.get(name)
+        if existing is not None:
+            _keep_base_phandles(existing, child, renames)
+
+
+def apply_overlay(base: Fdt, overlay: Fdt) -> None:
+    """Apply *overlay* to *base* in place (*overlay* is modified as well)."""
+    phandles = {n.phandle: (p, n) for p, n in base.root.walk() if n.phandle}
+    delta = max(phandles, default=0)
+
+    # 1. Move the overlay's own phandles past the base's and fix references to them.
+    if delta:
+        for _, node in overlay.root.walk():
+            for key in ("phandle", "linux,phandle"):
+                value = node.props.get(key)
+                if value is not None and len(value) == 4:
+                    node.props[key] = struct.pack(">I", struct.unpack(">I", value)[0] + delta)
+        for node, prop, offset in _local_references(overlay):
+            _set_u32(node, prop, offset, _get_u32(node, prop, offset) + delta)
+
+    # 2. Resolve references to base labels.
+    fixups = overlay.root.children.get("__fixups__")
+    if fixups is not None:
+        symbols = base.root.children.get("__symbols__")
+        for label, value in fixups.props.items():
+            if symbols is None or label not in symbols.props:
+                raise FdtError(f"overlay refers to label {label!r}, which the base DTB does not export (build it with -@)")
+            path = _cstring(symbols.props[label])
+            node = base.lookup(path)
+            if node is None or not node.phandle:
+                raise FdtError(f"label {label!r} points at {path!r}, which has no phandle in the base DTB")
+            for ref in (r for r in value.split(b"\0") if r):
+                ref_path, prop, offset = ref.decode("utf-8", "replace").rsplit(":", 2)
+                ref_node = overlay.lookup(ref_path)
+                if ref_node is None:
+                    raise FdtError(f"__fixups__ entry {ref!r} names a missing overlay node")
+                _set_u32(ref_node, prop, int(offset), node.phandle)
+
+    # 3. Merge every fragment into its target.
+    targets = []
+    renames: dict[int, int] = {}
+    for name, fragment in _fragments(overlay):
+        target_path, target = _fragment_target(base, phandles, name, fragment)
+        _keep_base_phandles(target, fragment.children["__overlay__"], renames)
+        targets.append((name, target_path, target))
+    if renames:
+        for node, prop, offset in _local_references(overlay):
+            value = _get_u32(node, prop, offset)
+            if value in renames:
+                _set_u32(node, prop, offset, renames[value])
+    for name, _target_path, target in targets:
+        _merge(target, overlay.root.children[name].children["__overlay__"])
+
+    # 4. Export the overlay's labels with paths inside the base tree.
+    overlay_symbols = overlay.root.children.get("__symbols__")
+    if overlay_symbols is not None and overlay_symbols.props:
+        symbols = base.root.add_child("__symbols__")
+        target_paths = {name: path for name, path, _ in targets}
+        for label, value in overlay_symbols.props.items():
+            path = _cstring(value)
+            parts = path.split("/", 3)
+            if len(parts) < 3 or parts[0] or parts[2] != "__overlay__" or parts[1] not in target_paths:
+                # Not inside a fragment's __overlay__; libfdt leaves these out too.
+                continue
+            rest = parts[3] if len(parts) > 3 else ""
+            target_path = target_paths[parts[1]].rstrip("/")
+            new_path = f"{target_path}/{rest}" if rest else (target_path or "/")
+            symbols.props[label] = new_path.encode() + b"\0"
+
+
+def overlay_cache_root() -> str:
+    return os.path.join("storage", "dtb_overlay_cache")
+
+
+def overlay_cache_key(base_path: str, overlay_paths: list[str]) -> str:
+    digest = hashlib.sha256(f"fdt-overlay-v{ENGINE_VERSION}".encode())
+    for path in [base_path, *overlay_paths]:
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def merged_dtb_path(base_path: str) -> str:
+    stem, _ = os.path.splitext(base_path)
+    return f"{stem}-merged.dtb"
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def merge_overlays(base_path: str, overlay_paths: list[str], output_path: str | None = None) -> str:
+    """Write base + overlays to *output_path* (default <base>-merged.dtb) and return it.
+
+    The base DTB is never modified. Raises FdtError (or OSError) on failure.
+    """
+    output_path = output_path or merged_dtb_path(base_path)
+    key = overlay_cache_key(base_path, overlay_paths)
+    cached = os.path.join(overlay_cache_root(), f"{key}.dtb")
+    if os.path.isfile(cached):
+        shutil.copyfile(cached, f"{output_path}.{os.getpid()}.tmp")
+        os.replace(f"{output_path}.{os.getpid()}.tmp", output_path)
+        print(f"Overlays: {os.path.basename(output_path)} restored from cache ({key[:12]}).")
+        return output_path
+
+    with open(base_path, "rb") as f:
+        tree = Fdt.from_bytes(f.read())
+    for path in overlay_paths:
+        with open(path, "rb") as f:
+            try:
+                overlay = Fdt.from_bytes(f.read())
+            except FdtError as e:
+                raise FdtError(f"{path}: {e}") from None
+        try:
+            apply_overlay(tree, overlay)
+        except FdtError as e:
+            raise FdtError(f"{path}: {e}") from None
+    blob = tree.to_bytes()
+    _write_atomic(output_path, blob)
+    os.makedirs(overlay_cache_root(), exist_ok=True)
+    _write_atomic(cached, blob)
+    print(
+        f"Overlays: applied {len(overlay_paths)} overlay(s) to {os.path.basename(base_path)} "
+        f"-> {os.path.basename(output_path)} ({len(blob)} bytes)."
+    )
+    return output_path
@@ -0,0 +1,178 @@
+"""`compile --jobs auto`: pick make -j from cores, load, memory and past builds.
+
+Every host make step records the peak RSS of its largest process (the
+biggest cc1 or ld) in build_metrics. The plan sizes two phases from that:
+
+- compile: as many jobs as there are idle cores, capped by how many of the
+  largest compiler processes fit in the memory that is free right now;
+- link: the vmlinux link (ld, kallsyms, BTF) runs alongside whatever else
+  make still has to compile, so the link phase gets one linker plus the
+  compile jobs that fit next to it.
+
+A tree whose kbuild has a vmlinux.a target (5.19+) builds it at the compile
+-j and then links at the link -j; older trees run the whole kernel step at
+the link -j. make also gets -l, so it holds back new jobs while the machine
+is busy with something else.
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import re
+from dataclasses import dataclass
+
+from utils.build_metrics import fmt_bytes, load_build_metrics, phase_name
+
+DEFAULT_COMPILE_MEMORY_KB = 1024 * 1024
+DEFAULT_LINK_MEMORY_KB = 3 * 1024 * 1024
+# Headroom on top of the recorded peak; the next heavy translation unit may be larger.
+MEMORY_MARGIN = 1.2
+# Left free for the desktop and page cache: the larger of 1 GiB and 10% of RAM.
+RESERVE_MIN_KB = 1024 * 1024
+RESERVE_FRACTION = 0.10
+# Make steps whose peak RSS is the link's (the unsplit kernel step includes it).
+LINK_PHASES = ("link", "kernel", "nvbuild")
+HISTORY = 20
+
+
+@dataclass
+class JobPlan:
+    compile_jobs: int
+    link_jobs: int
+    # make -l: no new jobs while the load average is above this.
+    max_load: int | None
+    note: str
+
+
+def mem_available_kb() -> int | None:
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def mem_total_kb() -> int | None:
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _cgroup_headroom_kb() -> int | None:
+    """memory.max minus memory.current of our cgroup (v2), if it is limited."""
+    try:
+        with open("/proc/self/cgroup", encoding="utf-8") as f:
+            path = next(line.split(":", 2)[2].strip() for line in f if line.startswith("0::"))
+        base = os.path.join("/sys/fs/cgroup", path.lstrip("/"))
+        with open(os.path.join(base, "memory.max"), encoding="utf-8") as f:
+            limit = f.read().strip()
+        if limit == "max":
+            return None
+        with open(os.path.join(base, "memory.current"), encoding="utf-8") as f:
+            current = int(f.read())
+    except (OSError, ValueError, StopIteration):
+        return None
+    return max(0, int(limit) - current) // 1024
+
+
+def _usable_memory_kb() -> int | None:
+    available = mem_available_kb()
+    headroom = _cgroup_headroom_kb()
+    if available is None:
+        return headroom
+    if headroom is not None:
+        available = min(available, headroom)
+    reserve = max(RESERVE_MIN_KB, int((mem_total_kb() or 0) * RESERVE_FRACTION))
+    return max(0, available - reserve)
+
+
+def usable_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def job_memory_kb(kernel_name: str) -> tuple[int, int]:
+    """(compile, link) peak RSS of one job, from the last make steps of this tree."""
+    compile_peaks, link_peaks = [], []
+    for record in load_build_metrics(kernel_name)[-HISTORY:]:
+        for step in record.get("steps", []):
+            if step.get("kind") != "make" or not step.get("max_rss_kb"):
+                continue
+            if phase_name(step["name"]) in LINK_PHASES:
+                link_peaks.append(step["max_rss_kb"])
+            else:
+                compile_peaks.append(step["max_rss_kb"])
+    compile_kb = max(compile_peaks, default=DEFAULT_COMPILE_MEMORY_KB)
+    link_kb = max(link_peaks, default=max(DEFAULT_LINK_MEMORY_KB, compile_kb))
+    return compile_kb, link_kb
+
+
+def plan_jobs(kernel_name: str, distcc_jobs: int | None = None) -> JobPlan:
+    """Compile and link -j for the next build of *kernel_name* on this machine.
+
+    With *distcc_jobs*, compiles run remotely: the compile -j is the pool's,
+    memory only limits the link phase, and there is no load limit.
+    """
+    cores = usable_cores()
+    load = os.getloadavg()[0]
+    idle = max(1, math.floor(cores - load + 0.5))
+    compile_kb, link_kb = (math.ceil(kb * MEMORY_MARGIN) for kb in job_memory_kb(kernel_name))
+    memory = _usable_memory_kb()
+
+    parts = [f"{cores} cores, load {load:.1f}"]
+    compile_jobs = distcc_jobs or idle
+    if memory is None:
+        link_jobs = compile_jobs
+    else:
+        parts.append(
+            f"{fmt_bytes(memory * 1024)} usable, {fmt_bytes(compile_kb * 1024)}/compile job, "
+            f"{fmt_bytes(link_kb * 1024)}/link"
+        )
+        if not distcc_jobs:
+            compile_jobs = max(1, min(compile_jobs, memory // compile_kb))
+        link_jobs = max(1, min(compile_jobs, 1 + max(0, memory - link_kb) // compile_kb))
+    return JobPlan(
+        compile_jobs=compile_jobs,
+        link_jobs=link_jobs,
+        max_load=None if distcc_jobs else cores,
+        note="; ".join(parts),
+    )
+
+
+def make_jobs_flags(jobs: int | str, max_load: int | None = None) -> str:
+    """The value after make's -j: "8", "8 -l16" or "$(nproc)"."""
+    return f"{jobs} -l{max_load}" if max_load else str(jobs)
+
+
+def kbuild_has_vmlinux_a(kernel_src: str) -> bool:
+    """Whether the tree's top Makefile can build vmlinux.a without linking (5.19+)."""
+    try:
+        with open(os.path.join(kernel_src, "Makefile"), encoding="utf-8", errors="replace") as f:
+            return re.search(r"^vmlinux\.a:", f.read(), re.MULTILINE) is not None
+    except OSError:
+        return False
+
+
+def parse_jobs(value: str) -> int | str:
+    """argparse type for --jobs/--threads: a positive count or "auto"."""
+    if value == "auto":
+        return value
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive job count or 'auto', got {value!r}")
+    return jobs
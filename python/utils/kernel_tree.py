@@ -32,6 +32,28 @@ def nvbuild_kernel_src_dir(kernel_name: str) -> str | None:
     return os.path.join(kernel_tree_root(kernel_name), "kernel", subdir)
 
 
+def validate_variant_name(variant: str) -> None:
+    """Raise ValueError unless *variant* is usable as a single directory name."""
+    if not variant or variant in (".", "..") or "/" in variant or variant != variant.strip():
+        raise ValueError(f"invalid variant name {variant!r}")
+
+
+def variant_root(kernel_name: str, variant: str) -> str:
+    """Per-variant dir holding the O= build output (out/) and its staging (modules/)."""
+    return os.path.join(kernel_tree_root(kernel_name), "variants", variant)
+
+
+def variant_build_dir(kernel_name: str, variant: str) -> str:
+    return os.path.join(variant_root(kernel_name, variant), "out")
+
+
+def kernel_modules_dir(kernel_name: str, variant: str | None = None) -> str:
+    """Staging dir read by kernel_deployer (boot/ + lib/modules/<ver>/)."""
+    if variant:
+        return os.path.join(variant_root(kernel_name, variant), "modules")
+    return os.path.join(kernel_tree_root(kernel_name), "modules")
+
+
 def nvbuild_kernel_out_dir(kernel_name: str) -> str:
     return os.path.join(kernel_tree_root(kernel_name), "kernel_out")
 
@@ -68,61 +90,105 @@ def nvbuild_incremental_ready(kernel_name: str) -> bool:
     return path is not None and os.path.isfile(path)
 
 
-def nvbuild_incremental_build_commands(
+def nvbuild_incremental_build_steps(
     arch: str,
     threads: int | None,
     *,
     oot_only: bool = False,
-) -> list[str]:
-    """Shell commands for an incremental JP6/JP7 nvbuild (cwd = kernel tree root).
-
-    Syncs sources into kernel_out without rsync --delete, keeps .config and object
-    files, runs olddefconfig instead of defconfig, then rebuilds only what changed.
+    changes_file: str | None = None,
+    link_threads: int | None = None,
+    max_load: int | None = None,
+    split_link: bool = False,
+) -> tuple[list[str], list[tuple[str, str]]]:
+    """(preamble, [(phase, command), ...]) for an incremental JP6/JP7 nvbuild.
+
+    The preamble (cwd = kernel tree root) sets up the nvbuild environment and
+    must run before every phase; the phases run in order. Syncs sources into
+    kernel_out without rsync --delete, keeps .config and object files, runs
+    olddefconfig instead of defconfig, then rebuilds only what changed.
+    With *changes_file* (tree-relative paths, see utils.sync_journal) only the
+    listed files are copied instead of rsyncing every source item.
+    With *link_threads* below *threads* the kernel phase runs at that -j, after
+    a "compile" phase building vmlinux.a at the full -j if *split_link*
+    (see utils.job_planner).
     """
     jobs = str(threads) if threads else "$(nproc)"
-    parts = [
+    link_jobs = jobs
+    if threads and link_threads and link_threads < threads:
+        link_jobs = str(link_threads)
+    if max_load:
+        jobs += f" -l{max_load}"
+        link_jobs += f" -l{max_load}"
+    preamble = [
         "set -e",
         'source "./kernel_src_build_env.sh"',
         'KERNEL_OUT="${KERNEL_OUT_DIR:-$PWD/kernel_out}"',
         'OUT_SRC="$KERNEL_OUT/kernel/${KERNEL_SRC_DIR}"',
+        'export KERNEL_HEADERS="$OUT_SRC"',
+    ]
+    sync = [
         'if [[ ! -f "$OUT_SRC/.config" ]]; then echo "Error: incremental build needs kernel_out/.config; run with --no-incremental or --clean first." >&2; exit 1; fi',
         'mkdir -p "$KERNEL_OUT/kernel"',
-        'echo "==> Incremental sync (preserving build artifacts)"',
-        'rsync -a "kernel/${KERNEL_SRC_DIR}/" "$OUT_SRC/"',
-        'cp -a kernel/Makefile "$KERNEL_OUT/kernel/"',
-        "for item in ${OOT_SOURCE_LIST}; do rsync -aR \"$item\" \"$KERNEL_OUT/\"; done",
-        'cp -a Makefile "$KERNEL_OUT/"',
-        'export KERNEL_HEADERS="$OUT_SRC"',
     ]
-    if not oot_only:
-        parts += [
-            'echo "==> Incremental in-tree kernel (reuse .config + Image + modules)"',
-            # CROSS_COMPILE MUST be passed to olddefconfig: Kconfig evaluates
-            # compiler-gated symbols (e.g. CC_HAVE_STACKPROTECTOR_SYSREG, which
-            # selects CONFIG_STACKPROTECTOR_PER_TASK on arm64) with $(CC). Without
-            # the cross prefix, $(CC) falls back to the host x86 gcc, which rejects
-            # -mstack-protector-guard=sysreg and silently drops PER_TASK. That
-            # desyncs the config from a vmlinux built per-task and makes OOT modpost
-            # fail with "__stack_chk_guard undefined". The env exports CROSS_COMPILE
-            # (see kernel_builder.py); guard against it being empty just in case.
-            'if [[ -z "${CROSS_COMPILE:-}" ]]; then echo "Error: CROSS_COMPILE unset; olddefconfig would mis-detect compiler-gated configs (e.g. STACKPROTECTOR_PER_TASK)." >&2; exit 1; fi',
-            # Resolve any NEW Kconfig symbols to their defaults non-interactively
-            # (stdin from /dev/null). olddefconfig is idempotent on a complete
-            # .config: it rewrites byte-identical content, so kbuild's syncconfig
-            # stays a no-op and the build remains incremental. Crucially it also
-            # stops `make` from dropping into an interactive oldconfig prompt
-            # (which hangs the build) whenever the source tree adds new symbols.
-            f'make -j{jobs} ARCH={arch} CROSS_COMPILE="${{CROSS_COMPILE}}" -C "$OUT_SRC" olddefconfig </dev/null',
-            f'make -j{jobs} ARCH={arch} CROSS_COMPILE="${{CROSS_COMPILE}}" -C "$OUT_SRC" --output-sync=target Image modules </dev/null',
+    if changes_file:
+        sync += [
+            f'echo "==> Incremental sync of $(wc -l < "{changes_file}") changed file(s)"',
+            f'rsync -a --files-from="{changes_file}" ./ "$KERNEL_OUT/"',
         ]
     else:
-        parts.append('echo "==> Incremental OOT modules only (kernel image unchanged)"')
-    parts += [
-        'echo "==> Incremental NVIDIA OOT modules + DTBs"',
-        f'make -j{jobs} -C "$KERNEL_OUT" kernel_name="${{kernel_name}}" system_type=l4t modules',
-        "make -C \"$KERNEL_OUT\" dtbs",
+        sync += [
+            'echo "==> Incremental sync (preserving build artifacts)"',
+            'rsync -a "kernel/${KERNEL_SRC_DIR}/" "$OUT_SRC/"',
+            'cp -a kernel/Makefile "$KERNEL_OUT/kernel/"',
+            "for item in ${OOT_SOURCE_LIST}; do rsync -aR \"$item\" \"$KERNEL_OUT/\"; done",
+            'cp -a Makefile "$KERNEL_OUT/"',
+        ]
+    steps = [("sync", " && ".join(sync))]
+    if not oot_only:
+        steps += [
+            (
+                "config",
+                # CROSS_COMPILE MUST be passed to olddefconfig: Kconfig evaluates
+                # compiler-gated symbols (e.g. CC_HAVE_STACKPROTECTOR_SYSREG, which
+                # selects CONFIG_STACKPROTECTOR_PER_TASK on arm64) with $(CC). Without
+                # the cross prefix, $(CC) falls back to the host x86 gcc, which rejects
+                # -mstack-protector-guard=sysreg and silently drops PER_TASK. That
+                # desyncs the config from a vmlinux built per-task and makes OOT modpost
+                # fail with "__stack_chk_guard undefined". The env exports CROSS_COMPILE
+                # (see kernel_builder.py); guard against it being empty just in case.
+                'if [[ -z "${CROSS_COMPILE:-}" ]]; then echo "Error: CROSS_COMPILE unset; olddefconfig would mis-detect compiler-gated configs (e.g. STACKPROTECTOR_PER_TASK)." >&2; exit 1; fi'
+                # Resolve any NEW Kconfig symbols to their defaults non-interactively
+                # (stdin from /dev/null). olddefconfig is idempotent on a complete
+                # .config: it rewrites byte-identical content, so kbuild's syncconfig
+                # stays a no-op and the build remains incremental. Crucially it also
+                # stops `make` from dropping into an interactive oldconfig prompt
+                # (which hangs the build) whenever the source tree adds new symbols.
+                f' && make -j{jobs} ARCH={arch} CROSS_COMPILE="${{CROSS_COMPILE}}" -C "$OUT_SRC" olddefconfig </dev/null',
+            ),
+        ]
+        kernel_phase = "kernel"
+        if link_jobs != jobs and split_link:
+            steps.append((
+                "compile",
+                'echo "==> Incremental in-tree objects (vmlinux.a)" && '
+                f'make -j{jobs} ARCH={arch} CROSS_COMPILE="${{CROSS_COMPILE}}" -C "$OUT_SRC" --output-sync=target vmlinux.a </dev/null',
+            ))
+            kernel_phase = "link"
+        steps.append((
+            kernel_phase,
+            'echo "==> Incremental in-tree kernel (reuse .config + Image + modules)" && '
+            f'make -j{link_jobs} ARCH={arch} CROSS_COMPILE="${{CROSS_COMPILE}}" -C "$OUT_SRC" --output-sync=target Image modules </dev/null',
+        ))
+    steps += [
+        (
+            "oot-modules",
+            ('echo "==> Incremental OOT modules only (kernel image unchanged)" && ' if oot_only else "")
+            + 'echo "==> Incremental NVIDIA OOT modules" && '
+            f'make -j{jobs} -C "$KERNEL_OUT" kernel_name="${{kernel_name}}" system_type=l4t modules',
+        ),
+        ("dtbs", 'echo "==> Incremental NVIDIA DTBs" && make -C "$KERNEL_OUT" dtbs'),
     ]
-    return parts
+    return preamble, steps
 
 
 def nvbuild_localversion_export(localversion: str) -> str:
@@ -149,6 +215,13 @@ def cross_compile_prefix(toolchain_name: str, toolchain_version: str, docker: bo
 
 
 def ensure_jp7_toolchain_storage(repo_root: str, dry_run: bool = False) -> None:
+    """Install the JP7 toolchain unless its registry stamp shows it is already there."""
+    # Imported lazily; the registry is only needed here.
+    from utils.toolchain_registry import cached_toolchain, ensure_toolchain
+
+    name, version = jp7_toolchain_defaults()
+    if cached_toolchain(name, version) is not None:
+        return
     script = os.path.join(
         repo_root, "scripts", "build", "kernel", "ensure_jp7_toolchain_storage.sh"
     )
@@ -158,24 +231,4 @@ def ensure_jp7_toolchain_storage(repo_root: str, dry_run: bool = False) -> None:
         print(f"[Dry-run] Would run: {script}")
         return
     subprocess.run(["bash", script], cwd=repo_root, check=True)
-
-
-def locate_nvbuild_dtb(kernel_name: str, dtb_name: str) -> str | None:
-    root = kernel_tree_root(kernel_name)
-    search_roots = [
-        os.path.join(root, "kernel_out"),
-        root,
-    ]
-    for search_root in search_roots:
-        if not os.path.isdir(search_root):
-            continue
-        find_command = f"find {search_root} -name {dtb_name}"
-        try:
-            find_output = subprocess.check_output(
-                find_command, shell=True, universal_newlines=True
-            ).strip()
-            if find_output:
-                return find_output.splitlines()[0]
-        except subprocess.CalledProcessError:
-            continue
-    return None
+    ensure_toolchain(name, version)
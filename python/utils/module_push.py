@@ -0,0 +1,257 @@
+"""`kernel_builder.py module`: rebuild one driver directory and push its .ko.
+
+The module's directory is built with `make M=<dir> modules` against the
+already prepared object tree (its .config, generated headers and
+Module.symvers come from the last full compile), so only that directory's
+objects are compiled and only its modules are linked. Objects live where
+the full build put them:
+
+- in-tree builds: next to the sources;
+- --variant builds: under the variant's O= dir;
+- nvbuild trees: under kernel_out, which holds copies of the sources.
+
+In the last two cases the edited sources of that one directory are synced
+into the object dir first.
+
+A .ko is pushed only when its content differs from what was last pushed to
+that device (storage/kernels/<name>/.module_push.json), and only after its
+vermagic matches both the prepared tree's kernel release and, via modinfo
+on the target, the running kernel. It replaces the installed copy that
+`modinfo -n` reports (or goes to updates/), followed by depmod and an
+optional rmmod/insmod.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import time
+
+from utils.kernel_tree import (
+    is_nvbuild_kernel,
+    kernel_modules_dir,
+    kernel_tree_root,
+    nvbuild_kernel_out_dir,
+    nvbuild_kernel_src_dir,
+    variant_build_dir,
+)
+from utils.staging import stage_file
+
+PUSH_RECORD_NAME = ".module_push.json"
+
+
+class ModuleError(Exception):
+    pass
+
+
+def module_dirs(kernel_name: str, path: str, variant: str | None = None) -> tuple[str, str, str]:
+    """(source dir, object dir, objtree) for the driver at *path* (a file or directory).
+
+    *path* is relative to the kernel source dir or to the tree root
+    (nvidia-oot/..., hardware/...); all three results are absolute.
+    """
+    root = os.path.abspath(kernel_tree_root(kernel_name))
+    nvbuild = is_nvbuild_kernel(kernel_name)
+    src_dir = os.path.abspath(nvbuild_kernel_src_dir(kernel_name) or "") if nvbuild else os.path.join(root, "kernel", "kernel")
+    for base in (src_dir, root):
+        candidate = os.path.normpath(os.path.join(base, path))
+        if os.path.exists(candidate) and candidate.startswith(root + os.sep):
+            break
+    else:
+        raise ModuleError(f"{path} not found under {src_dir} or {root}")
+    source = candidate if os.path.isdir(candidate) else os.path.dirname(candidate)
+
+    if nvbuild:
+        out_dir = os.path.abspath(nvbuild_kernel_out_dir(kernel_name))
+        objtree = os.path.join(out_dir, os.path.relpath(src_dir, root))
+        return source, os.path.join(out_dir, os.path.relpath(source, root)), objtree
+    if variant:
+        objtree = os.path.abspath(variant_build_dir(kernel_name, variant))
+        if not source.startswith(src_dir + os.sep):
+            raise ModuleError(f"{path} is not part of the kernel source; --variant builds only cover {src_dir}")
+        return source, os.path.join(objtree, os.path.relpath(source, src_dir)), objtree
+    return source, source, src_dir
+
+
+def kernel_release(objtree: str) -> str | None:
+    try:
+        with open(os.path.join(objtree, "include", "config", "kernel.release"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def check_prepared(objtree: str) -> None:
+    missing = [name for name in (".config", "Module.symvers") if not os.path.isfile(os.path.join(objtree, name))]
+    if missing or kernel_release(objtree) is None:
+        raise ModuleError(
+            f"{objtree} is not a prepared build tree (missing {', '.join(missing) or 'include/config/kernel.release'}); "
+            "run a full compile first"
+        )
+
+
+def extra_symbols(kernel_name: str, objtree: str, build_dir: str) -> list[str]:
+    """Module.symvers of other out-of-tree module trees (nvidia-oot) this driver may link against."""
+    if not is_nvbuild_kernel(kernel_name):
+        return []
+    out_dir = os.path.abspath(nvbuild_kernel_out_dir(kernel_name))
+    found = glob.glob(os.path.join(out_dir, "*", "Module.symvers")) + glob.glob(os.path.join(out_dir, "*", "*", "Module.symvers"))
+    return sorted(
+        p for p in found
+        if not p.startswith(objtree + os.sep) and not p.startswith(build_dir + os.sep)
+    )
+
+
+def read_modinfo(ko: str) -> dict[str, str]:
+    """.modinfo key=value strings of *ko*, read from the file itself (no modinfo on the host needed)."""
+    with open(ko, "rb") as f:
+        data = f.read()
+    info = {}
+    for key in (b"vermagic", b"name"):
+        start = data.find(key + b"=")
+        # "name=" also occurs in parm descriptions; the real entry starts after a NUL.
+        while start > 0 and data[start - 1] != 0:
+            start = data.find(key + b"=", start + 1)
+        if start >= 0:
+            end = data.find(b"\0", start)
+            info[key.decode()] = data[start + len(key) + 1 : end].decode(errors="replace")
+    return info
+
+
+def module_name(ko: str) -> str:
+    return read_modinfo(ko).get("name") or os.path.basename(ko)[: -len(".ko")].replace("-", "_")
+
+
+def built_modules(build_dir: str, since: float | None = None) -> list[str]:
+    kos = []
+    for dirpath, _, filenames in os.walk(build_dir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if name.endswith(".ko") and (since is None or os.path.getmtime(path) >= since):
+                kos.append(path)
+    return sorted(kos)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _record_path(kernel_name: str) -> str:
+    return os.path.join(kernel_tree_root(kernel_name), PUSH_RECORD_NAME)
+
+
+def _load_record(kernel_name: str) -> dict:
+    try:
+        with open(_record_path(kernel_name), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_record(kernel_name: str, record: dict) -> None:
+    path = _record_path(kernel_name)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp, path)
+
+
+def changed_modules(kernel_name: str, device: str, kos: list[str]) -> list[str]:
+    """The .ko files whose content differs from the last push to *device*."""
+    pushed = _load_record(kernel_name).get(device, {}).get("modules", {})
+    return [ko for ko in kos if pushed.get(os.path.basename(ko)) != _sha256(ko)]
+
+
+def stage_modules(kernel_name: str, kos: list[str], release: str, variant: str | None = None) -> None:
+    """Refresh the staged modules/lib/modules/<release> copies, so a later full deploy matches."""
+    staged_root = os.path.join(kernel_modules_dir(kernel_name, variant), "lib", "modules", release)
+    if not os.path.isdir(staged_root):
+        return
+    by_name = {}
+    for dirpath, _, filenames in os.walk(staged_root):
+        for name in filenames:
+            if name.endswith(".ko"):
+                by_name.setdefault(name, os.path.join(dirpath, name))
+    for ko in kos:
+        staged = by_name.get(os.path.basename(ko))
+        if staged:
+            stage_file(ko, staged)
+
+
+def _ssh(device_ip: str, command: str, dry_run: bool) -> subprocess.CompletedProcess | None:
+    argv = ["ssh", f"root@{device_ip}", command]
+    print(f"{'[Dry-run] Would run' if dry_run else 'Running'}: ssh root@{device_ip} {shlex.quote(command)}")
+    if dry_run:
+        return None
+    return subprocess.run(argv)
+
+
+def push_modules(
+    kernel_name: str,
+    kos: list[str],
+    *,
+    device_ip: str,
+    user: str,
+    release: str,
+    reload: bool = False,
+    dry_run: bool = False,
+) -> int:
+    """Install *kos* on the target in place of the loaded/installed copies; 0 on success."""
+    for ko in kos:
+        vermagic = read_modinfo(ko).get("vermagic", "").split(" ")[0]
+        if vermagic != release:
+            print(f"Error: {os.path.basename(ko)} has vermagic {vermagic or '(none)'}, the prepared tree is {release}.")
+            return 1
+    names = [os.path.basename(ko) for ko in kos]
+    print(f"Copying {', '.join(names)} to /tmp on {device_ip}")
+    if not dry_run:
+        rc = subprocess.run(["scp", *kos, f"{user}@{device_ip}:/tmp/"]).returncode
+        if rc != 0:
+            print(f"Error: scp to {device_ip} failed.")
+            return rc
+
+    steps = ['rel="$(uname -r)"']
+    for ko in kos:
+        name, base = module_name(ko), os.path.basename(ko)
+        steps += [
+            # The target's modinfo has the last word: the running kernel must accept it.
+            f'vm="$(modinfo -F vermagic /tmp/{base} | cut -d" " -f1)"',
+            f'if [ "$vm" != "$rel" ]; then echo "Error: /tmp/{base} vermagic $vm does not match the running kernel $rel" >&2; exit 3; fi',
+            f'dst="$(modinfo -n {name} 2>/dev/null || true)"',
+            f'case "$dst" in /*) ;; *) dst="/lib/modules/$rel/updates/{base}";; esac',
+            # A compressed install (.ko.xz/.ko.zst) is replaced by the plain .ko next to it.
+            'case "$dst" in *.ko) ;; *) rm -f "$dst"; dst="${dst%.ko.*}.ko";; esac',
+            'mkdir -p "$(dirname "$dst")"',
+            'if [ -f "$dst" ]; then cp -p "$dst" "$dst.previous"; fi',
+            f'mv /tmp/{base} "$dst"',
+            f'echo "Installed {base} -> $dst"',
+        ]
+    steps.append('depmod -a "$rel"')
+    if reload:
+        for ko in kos:
+            name = module_name(ko)
+            steps += [
+                f'if grep -q "^{name} " /proc/modules; then rmmod {name}; fi',
+                f'insmod "$(modinfo -n {name})"',
+                f'echo "Reloaded {name}"',
+            ]
+    result = _ssh(device_ip, " && ".join(steps), dry_run)
+    if result is not None and result.returncode != 0:
+        print(f"Error: installing on {device_ip} failed (exit {result.returncode}).")
+        return result.returncode
+    if not dry_run:
+        record = _load_record(kernel_name)
+        device = record.setdefault(device_ip, {"modules": {}})
+        for ko in kos:
+            device["modules"][os.path.basename(ko)] = _sha256(ko)
+        device["pushed_at"] = time.time()
+        _save_record(kernel_name, record)
+    return 0
@@ -0,0 +1,311 @@
+"""`compile --ram-build`: keep the object tree in RAM instead of on storage/.
+
+The build output dir (kernel_out of an nvbuild tree, variants/<v>/out of a
+--variant build) becomes a symlink into a tmpfs directory,
+/dev/shm/kernel_builder/<name>/<dir> by default. When running as root, a
+dedicated tmpfs of the guarded size is mounted there, so a runaway build
+hits ENOSPC rather than the OOM killer. Staged outputs (Image, DTBs, modules)
+are written to storage/ as usual; the objects stay in RAM only.
+
+Before the build a size guard compares the expected tree size with the free
+space on the tmpfs and with MemAvailable. The expected size comes from
+--ram-size, the last snapshot, or the on-disk tree being moved in. If the
+tree does not fit, the build falls back to disk. After the build,
+--ram-snapshot writes the object tree to <dir>.snapshot.tar (one sequential
+file instead of many GB of small files, zstd-compressed when zstd is
+installed) and the next --ram-build restores it, so an incremental build
+survives a reboot. Without --ram-keep the RAM tree is released once the
+build is done (also when the compile fails or is interrupted); a tree that
+was moved in from disk is first written back there unless --ram-snapshot
+saved it, so a --ram-build never loses an incremental object tree.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import subprocess
+import time
+from dataclasses import dataclass
+
+from utils.build_metrics import fmt_bytes
+from utils.job_planner import mem_available_kb
+from utils.kernel_tree import kernel_tree_root
+from utils.sync_journal import invalidate_journal
+
+DEFAULT_RAM_ROOT = os.path.join("/dev/shm", "kernel_builder")
+# Expected object tree size when nothing better is known (JP7 kernel_out).
+DEFAULT_RAM_BUILD_BYTES = 16 << 30
+MIN_RAM_BUILD_BYTES = 1 << 30
+# Growth allowance over a previously measured tree.
+SIZE_MARGIN = 1.25
+# RAM the compile itself needs on top of the tmpfs contents.
+COMPILE_RESERVE_BYTES = 4 << 30
+SNAPSHOT_SUFFIX = ".snapshot.tar"
+
+
+@dataclass
+class RamBuild:
+    # Path under storage/ that is a symlink to *ram_dir* while the build runs.
+    build_dir: str
+    ram_dir: str
+    root: str
+    size: int
+    # A dedicated tmpfs is mounted at *ram_dir* (root only).
+    mounted: bool = False
+    # The tree was copied in from *build_dir* on disk (and removed there).
+    moved_in: bool = False
+
+
+def parse_size(value: str) -> int:
+    """Bytes in "24G", "512M", "1.5T" or a plain byte count."""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    value = value.strip().upper().removesuffix("B").removesuffix("I")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def snapshot_path(build_dir: str) -> str:
+    return build_dir.rstrip(os.sep) + SNAPSHOT_SUFFIX
+
+
+def _snapshot_meta_path(build_dir: str) -> str:
+    return snapshot_path(build_dir) + ".json"
+
+
+def _load_snapshot_meta(build_dir: str) -> dict | None:
+    try:
+        with open(_snapshot_meta_path(build_dir), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ram_dir_for(kernel_name: str, build_dir: str, root: str = DEFAULT_RAM_ROOT) -> str:
+    rel = os.path.relpath(os.path.abspath(build_dir), os.path.abspath(kernel_tree_root(kernel_name)))
+    return os.path.join(root, kernel_name, rel)
+
+
+def _links_to(path: str, target: str) -> bool:
+    return os.path.islink(path) and os.path.realpath(path) == os.path.realpath(target)
+
+
+def _tree_bytes(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def drop_dangling_ram_link(build_dir: str) -> bool:
+    """Remove a build dir symlink whose RAM tree is gone (reboot, cleared tmpfs)."""
+    if os.path.islink(build_dir) and not os.path.exists(build_dir):
+        os.unlink(build_dir)
+        print(f"Removed stale RAM build link {build_dir} (its tmpfs contents are gone).")
+        return True
+    return False
+
+
+def _free_bytes(path: str) -> int:
+    while not os.path.isdir(path):
+        path = os.path.dirname(path)
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def _size_guard(ram: RamBuild, in_ram: int) -> str | None:
+    """Why *ram* does not fit, or None. *in_ram* bytes of it are already on the tmpfs."""
+    growth = max(0, ram.size - in_ram)
+    free = _free_bytes(ram.ram_dir)
+    if not ram.mounted and free < growth:
+        return f"{fmt_bytes(free)} free on {ram.root}, need {fmt_bytes(growth)}"
+    available_kb = mem_available_kb()
+    if available_kb is not None and available_kb * 1024 < growth + COMPILE_RESERVE_BYTES:
+        return (
+            f"{fmt_bytes(available_kb * 1024)} RAM available, need {fmt_bytes(growth)} "
+            f"for the tree plus {fmt_bytes(COMPILE_RESERVE_BYTES)} for the compile"
+        )
+    return None
+
+
+def _mount_tmpfs(path: str, size: int) -> bool:
+    # Never over a tree kept from an earlier --ram-keep build.
+    if os.geteuid() != 0 or os.path.ismount(path) or os.listdir(path):
+        return False
+    rc = subprocess.run(
+        ["mount", "-t", "tmpfs", "-o", f"size={size},mode=0755", "kernel_builder", path],
+        stderr=subprocess.DEVNULL,
+    ).returncode
+    return rc == 0
+
+
+def _run_tar(args: list[str], compress: bool = False) -> int:
+    # zstd keeps the snapshot a fraction of the tree size; GNU tar detects it
+    # by itself when extracting.
+    flags = ["-I", "zstd -T0 -3"] if compress and shutil.which("zstd") else []
+    return subprocess.run(["tar", *flags, *args]).returncode
+
+
+def setup_ram_build(
+    kernel_name: str,
+    build_dir: str,
+    *,
+    root: str = DEFAULT_RAM_ROOT,
+    size: int | None = None,
+    clean: bool = False,
+    dry_run: bool = False,
+) -> RamBuild | None:
+    """Point *build_dir* at a RAM directory, restoring objects into it.
+
+    Returns None (build on disk) when the guard says the tree does not fit.
+    """
+    ram_dir = ram_dir_for(kernel_name, build_dir, root)
+    drop_dangling_ram_link(build_dir)
+    linked = _links_to(build_dir, ram_dir)
+    if os.path.islink(build_dir) and not linked:
+        print(f"Warning: {build_dir} is a symlink to {os.path.realpath(build_dir)}; --ram-build leaves it alone.")
+        return None
+    on_disk = os.path.isdir(build_dir) and not linked
+    meta = _load_snapshot_meta(build_dir)
+    if size is None:
+        if on_disk and not clean:
+            size = max(MIN_RAM_BUILD_BYTES, int(_tree_bytes(build_dir) * SIZE_MARGIN))
+        elif meta and not clean:
+            size = max(MIN_RAM_BUILD_BYTES, int(meta.get("bytes", 0) * SIZE_MARGIN))
+        else:
+            size = DEFAULT_RAM_BUILD_BYTES
+    ram = RamBuild(build_dir=build_dir, ram_dir=ram_dir, root=root, size=size, moved_in=on_disk and not clean)
+
+    if dry_run:
+        print(f"[Dry-run] Would build {build_dir} in RAM at {ram_dir} (guard {fmt_bytes(size)})")
+        return ram
+
+    os.makedirs(ram_dir, exist_ok=True)
+    ram.mounted = _mount_tmpfs(ram_dir, size) or os.path.ismount(ram_dir)
+    in_ram = _tree_bytes(ram_dir) if linked and not clean else 0
+    reason = _size_guard(ram, in_ram)
+    if reason and linked:
+        # Already in RAM from a --ram-keep build; moving it back would cost more.
+        print(f"Warning: --ram-build: {reason}; continuing with the object tree already in RAM.")
+    elif reason:
+        print(f"Warning: --ram-build: the object tree does not fit in RAM ({reason}); building on disk.")
+        release_ram_build(ram)
+        return None
+
+    if clean or not linked:
+        # Not linked: whatever is there was left by an interrupted run.
+        for entry in os.scandir(ram_dir):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+    if on_disk:
+        if clean:
+            shutil.rmtree(build_dir)
+        else:
+            print(f"Moving {build_dir} into RAM at {ram_dir} ...")
+            rc = subprocess.run(["cp", "-a", f"{build_dir}/.", ram_dir]).returncode
+            if rc != 0:
+                print(f"Warning: could not copy {build_dir} into RAM; building on disk.")
+                release_ram_build(ram)
+                return None
+            shutil.rmtree(build_dir)
+    elif not linked and not clean and os.path.isfile(snapshot_path(build_dir)):
+        started = time.time()
+        rc = _run_tar(["-xf", snapshot_path(build_dir), "-C", ram_dir])
+        if rc != 0:
+            print(f"Warning: restoring {snapshot_path(build_dir)} failed; starting from an empty object tree.")
+        else:
+            print(f"Restored {snapshot_path(build_dir)} into RAM in {time.time() - started:.1f}s")
+        # The sync journal may be newer than the snapshot; rescan all sources once.
+        invalidate_journal(kernel_name)
+    if not linked:
+        os.makedirs(os.path.dirname(os.path.abspath(build_dir)), exist_ok=True)
+        os.symlink(ram_dir, build_dir)
+    print(f"RAM build: {build_dir} -> {ram_dir} ({fmt_bytes(size)} guard{', dedicated tmpfs' if ram.mounted else ''})")
+    return ram
+
+
+def snapshot_ram_build(ram: RamBuild) -> int:
+    """Write the RAM object tree to <build_dir>.snapshot.tar for the next --ram-build."""
+    path = snapshot_path(ram.build_dir)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    started = time.time()
+    rc = _run_tar(["-cf", tmp, "-C", ram.ram_dir, "."], compress=True)
+    if rc != 0:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        print(f"Error: snapshot of {ram.ram_dir} failed (tar exit {rc}).")
+        return rc
+    os.replace(tmp, path)
+    meta = {"bytes": _tree_bytes(ram.ram_dir), "created": time.time()}
+    with open(_snapshot_meta_path(ram.build_dir), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    print(
+        f"Snapshot {path}: {fmt_bytes(meta['bytes'])} tree, {fmt_bytes(os.path.getsize(path))} on disk, "
+        f"{time.time() - started:.1f}s"
+    )
+    return 0
+
+
+def release_ram_build(ram: RamBuild) -> None:
+    """Drop the RAM tree and its symlink; the build dir no longer exists afterwards."""
+    if _links_to(ram.build_dir, ram.ram_dir):
+        os.unlink(ram.build_dir)
+    if ram.mounted:
+        subprocess.run(["umount", ram.ram_dir], stderr=subprocess.DEVNULL)
+    shutil.rmtree(ram.ram_dir, ignore_errors=True)
+    try:
+        # Empty <root>/<name>/... parents; stops at the first one still in use.
+        os.removedirs(os.path.dirname(ram.ram_dir))
+    except OSError:
+        pass
+
+
+def write_back_ram_build(ram: RamBuild) -> int:
+    """Copy the RAM tree back to *build_dir* on disk, in place of the symlink."""
+    tmp = f"{ram.build_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    print(f"Writing {ram.ram_dir} back to {ram.build_dir} ...")
+    started = time.time()
+    rc = subprocess.run(["cp", "-a", f"{ram.ram_dir}/.", tmp]).returncode
+    if rc != 0:
+        shutil.rmtree(tmp, ignore_errors=True)
+        print(f"Error: could not write {ram.ram_dir} back to disk (cp exit {rc}); it stays in RAM, linked from {ram.build_dir}.")
+        return rc
+    if _links_to(ram.build_dir, ram.ram_dir):
+        os.unlink(ram.build_dir)
+    os.rename(tmp, ram.build_dir)
+    print(f"Wrote the object tree back to {ram.build_dir} in {time.time() - started:.1f}s")
+    return 0
+
+
+def finish_ram_build(ram: RamBuild, *, snapshot: bool, keep: bool, dry_run: bool = False) -> int:
+    # Releasing a tree moved in from disk without a snapshot would delete its only copy.
+    write_back = ram.moved_in and not snapshot and not keep
+    if dry_run:
+        if snapshot:
+            print(f"[Dry-run] Would snapshot {ram.ram_dir} to {snapshot_path(ram.build_dir)}")
+        if write_back:
+            print(f"[Dry-run] Would write {ram.ram_dir} back to {ram.build_dir}")
+        if not keep:
+            print(f"[Dry-run] Would release {ram.ram_dir}")
+        return 0
+    rc = snapshot_ram_build(ram) if snapshot else 0
+    if keep:
+        return rc
+    if write_back:
+        rc = write_back_ram_build(ram)
+        if rc != 0:
+            return rc
+    elif snapshot and rc != 0 and ram.moved_in:
+        print(f"Warning: keeping {ram.ram_dir} in RAM: the snapshot failed and the on-disk tree was moved in.")
+        return rc
+    release_ram_build(ram)
+    return rc
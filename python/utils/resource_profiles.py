@@ -0,0 +1,256 @@
+"""`compile --resource-profile`: CPU, memory and I/O limits for the build container.
+
+A profile turns into `docker run` flags for the build session:
+
+- CPUs: interactive builds leave CPU 0 to the desktop and kb-menu; background
+  builds get half the CPUs on whole NUMA nodes (highest node first), with
+  --cpuset-mems on the same nodes so their memory stays local; release
+  builds get every CPU. make's $(nproc) follows the cpuset.
+- Memory: --memory is what the build needs by this tree's telemetry (peak
+  RSS per compile job times the jobs, plus one link, with job_planner's
+  margin), capped at the profile's share of RAM. --memory-swap lets
+  background builds swap rather than be OOM-killed.
+- I/O and CPU time under contention: --blkio-weight and --cpu-shares.
+
+After the build the container's cgroup (v2) counters are compared with
+their values before it: CPU throttling, memory.high/max events, OOM kills
+and pressure stall time. They are printed and kept in the build metrics,
+so the profiles can be right-sized from `kernel_builder.py stats`.
+"""
+
+from __future__ import annotations
+
+import glob
+import math
+import os
+import re
+from dataclasses import dataclass, field
+
+from utils.build_metrics import fmt_bytes, fmt_seconds
+from utils.docker_api import DockerAPIError, docker_client
+from utils.job_planner import MEMORY_MARGIN, job_memory_kb, mem_total_kb, usable_cores
+
+PROFILE_NAMES = ("interactive", "background", "release")
+MIN_MEMORY_BYTES = 2 << 30
+# make, the shell and the page cache of the container on top of the jobs.
+BASE_MEMORY_BYTES = 512 << 20
+_CGROUP_FILES = ("cpu.stat", "memory.events", "memory.peak", "cpu.pressure", "memory.pressure", "io.pressure")
+
+
+@dataclass
+class ResourceProfile:
+    name: str
+    # Share of the usable CPUs, and how they are picked ("spread" or whole "node"s).
+    cpu_fraction: float
+    placement: str
+    # CPUs kept out of the cpuset for the desktop (lowest numbered first).
+    reserve_cpus: int
+    memory_fraction: float
+    # --memory-swap as a multiple of --memory (1.0: no swap).
+    swap_factor: float
+    blkio_weight: int
+    cpu_shares: int
+
+
+PROFILES = {
+    "interactive": ResourceProfile("interactive", 1.0, "spread", 1, 0.75, 1.0, 1000, 2048),
+    "background": ResourceProfile("background", 0.5, "node", 0, 0.5, 1.5, 100, 256),
+    "release": ResourceProfile("release", 1.0, "spread", 0, 0.9, 1.0, 500, 1024),
+}
+
+
+@dataclass
+class ResourceLimits:
+    profile: str
+    cpus: int
+    cpuset: list[int] = field(default_factory=list)
+    mems: list[int] = field(default_factory=list)
+    memory: int = 0
+    memory_swap: int = 0
+    blkio_weight: int = 0
+    cpu_shares: int = 0
+    note: str = ""
+
+    def docker_args(self) -> list[str]:
+        args = []
+        if self.cpuset:
+            args.append(f"--cpuset-cpus={_cpu_list(self.cpuset)}")
+        if self.mems:
+            args.append(f"--cpuset-mems={_cpu_list(self.mems)}")
+        if self.memory:
+            args += [f"--memory={self.memory}", f"--memory-swap={self.memory_swap}"]
+        return args + [f"--blkio-weight={self.blkio_weight}", f"--cpu-shares={self.cpu_shares}"]
+
+    def record(self) -> dict:
+        """The limits as stored in the build metrics."""
+        return {
+            "profile": self.profile,
+            "cpus": self.cpus,
+            "cpuset": _cpu_list(self.cpuset),
+            "mems": _cpu_list(self.mems),
+            "memory": self.memory,
+            "memory_swap": self.memory_swap,
+            "blkio_weight": self.blkio_weight,
+            "cpu_shares": self.cpu_shares,
+        }
+
+    def summary(self) -> str:
+        cpus = f"CPUs {_cpu_list(self.cpuset)}" if self.cpuset else f"{self.cpus} CPUs"
+        if self.mems:
+            cpus += f" (NUMA node {_cpu_list(self.mems)})"
+        memory = f"memory {fmt_bytes(self.memory)}" if self.memory else "memory unlimited"
+        if self.memory_swap > self.memory:
+            memory += f" + {fmt_bytes(self.memory_swap - self.memory)} swap"
+        return f"{self.profile}: {cpus}, {memory}, blkio weight {self.blkio_weight}, cpu shares {self.cpu_shares}"
+
+
+def _parse_cpu_list(text: str) -> list[int]:
+    cpus = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus += range(int(lo), int(hi) + 1)
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def _cpu_list(cpus: list[int]) -> str:
+    """[0, 1, 2, 5] -> "0-2,5"."""
+    ranges, start = [], None
+    for i, cpu in enumerate(cpus):
+        if start is None:
+            start = cpu
+        if i + 1 == len(cpus) or cpus[i + 1] != cpu + 1:
+            ranges.append(f"{start}-{cpu}" if cpu != start else str(cpu))
+            start = None
+    return ",".join(ranges)
+
+
+def numa_nodes() -> dict[int, list[int]]:
+    """NUMA node -> the CPUs of it this process may use (one pseudo node without NUMA info)."""
+    try:
+        allowed = set(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        allowed = set(range(os.cpu_count() or 1))
+    nodes = {}
+    for path in glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"):
+        node = int(re.search(r"node(\d+)/cpulist$", path).group(1))
+        try:
+            with open(path, encoding="utf-8") as f:
+                cpus = sorted(allowed.intersection(_parse_cpu_list(f.read())))
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes[node] = cpus
+    return nodes or {0: sorted(allowed)}
+
+
+def _pick_cpus(profile: ResourceProfile) -> tuple[list[int], list[int]]:
+    """(cpuset, mems); empty lists mean no pinning."""
+    nodes = numa_nodes()
+    allowed = sorted(cpu for cpus in nodes.values() for cpu in cpus)
+    wanted = max(1, math.floor(len(allowed) * profile.cpu_fraction) - profile.reserve_cpus)
+    if profile.placement == "node":
+        # Whole nodes from the highest down: node 0 usually hosts the desktop.
+        picked, mems = [], []
+        for node in sorted(nodes, reverse=True):
+            if len(picked) >= wanted:
+                break
+            picked += nodes[node]
+            mems.append(node)
+        if len(nodes) == 1:
+            # No NUMA: the highest numbered CPUs, without a memory node constraint.
+            return sorted(allowed[-wanted:]), []
+        return sorted(picked), sorted(mems)
+    if wanted >= len(allowed):
+        return [], []
+    return allowed[len(allowed) - wanted:], []
+
+
+def resource_limits(profile_name: str, kernel_name: str, threads: int | None = None) -> ResourceLimits:
+    profile = PROFILES[profile_name]
+    cpuset, mems = _pick_cpus(profile)
+    cpus = len(cpuset) or usable_cores()
+    jobs = min(threads or cpus, cpus)
+    compile_kb, link_kb = (math.ceil(kb * MEMORY_MARGIN) for kb in job_memory_kb(kernel_name))
+    need = max(MIN_MEMORY_BYTES, (jobs * compile_kb + link_kb) * 1024 + BASE_MEMORY_BYTES)
+    total_kb = mem_total_kb()
+    memory, note = need, f"{jobs} jobs x {fmt_bytes(compile_kb * 1024)} + link {fmt_bytes(link_kb * 1024)}"
+    if total_kb:
+        cap = int(total_kb * 1024 * profile.memory_fraction)
+        if need > cap:
+            memory = max(MIN_MEMORY_BYTES, cap)
+            note += f"; capped at {profile.memory_fraction:.0%} of RAM, consider fewer --jobs"
+    return ResourceLimits(
+        profile=profile.name,
+        cpus=cpus,
+        cpuset=cpuset,
+        mems=mems,
+        memory=memory,
+        memory_swap=int(memory * profile.swap_factor),
+        blkio_weight=profile.blkio_weight,
+        cpu_shares=profile.cpu_shares,
+        note=note,
+    )
+
+
+def container_cgroup_stats(container: str) -> dict[str, int]:
+    """Counters of the container's own cgroup (v2), flattened to "file.key" -> value."""
+    try:
+        _, output, _ = docker_client().exec_run(
+            container, ["sh", "-c", f"cd /sys/fs/cgroup && grep -H . {' '.join(_CGROUP_FILES)} 2>/dev/null"]
+        )
+    except DockerAPIError:
+        return {}
+    stats = {}
+    for line in output.decode(errors="replace").splitlines():
+        name, _, value = line.partition(":")
+        if name.endswith(".pressure"):
+            # "some avg10=0.00 avg60=0.00 avg300=0.00 total=123456" (usec)
+            kind, _, fields = value.partition(" ")
+            match = re.search(r"total=(\d+)", fields)
+            if match:
+                stats[f"{name}.{kind}_usec"] = int(match.group(1))
+        elif " " in value:
+            key, _, number = value.partition(" ")
+            if number.isdigit():
+                stats[f"{name}.{key}"] = int(number)
+        elif value.isdigit():
+            stats[name] = int(value)
+    return stats
+
+
+def throttling_report(before: dict[str, int], after: dict[str, int]) -> dict:
+    """What happened between two container_cgroup_stats() snapshots."""
+    def delta(key: str) -> int:
+        return max(0, after.get(key, 0) - before.get(key, 0))
+
+    report = {
+        "cpu_throttled_periods": delta("cpu.stat.nr_throttled"),
+        "cpu_throttled_s": round(delta("cpu.stat.throttled_usec") / 1e6, 1),
+        "memory_high_events": delta("memory.events.high"),
+        "memory_max_events": delta("memory.events.max"),
+        "oom_kills": delta("memory.events.oom_kill"),
+        "cpu_stall_s": round(delta("cpu.pressure.some_usec") / 1e6, 1),
+        "memory_stall_s": round(delta("memory.pressure.some_usec") / 1e6, 1),
+        "io_stall_s": round(delta("io.pressure.some_usec") / 1e6, 1),
+    }
+    if "memory.peak" in after:
+        # Lifetime peak of the container: of this build unless the session was warm.
+        report["memory_peak"] = after["memory.peak"]
+    return report
+
+
+def print_throttling(limits: ResourceLimits, report: dict) -> None:
+    peak = report.get("memory_peak")
+    print(
+        f"Resources ({limits.profile}): CPU throttled {report['cpu_throttled_periods']}x "
+        f"({fmt_seconds(report['cpu_throttled_s'])}), stalls cpu {fmt_seconds(report['cpu_stall_s'])} / "
+        f"memory {fmt_seconds(report['memory_stall_s'])} / io {fmt_seconds(report['io_stall_s'])}"
+        + (f", memory peak {fmt_bytes(peak)} of {fmt_bytes(limits.memory)}" if peak and limits.memory else "")
+    )
+    if report["oom_kills"]:
+        print(f"Warning: {report['oom_kills']} process(es) OOM-killed at the {fmt_bytes(limits.memory)} limit; use a larger profile or fewer --jobs.")
+    elif report["memory_max_events"]:
+        print(f"Warning: the build hit its {fmt_bytes(limits.memory)} memory limit {report['memory_max_events']} time(s).")
@@ -0,0 +1,159 @@
+"""Stage build outputs by reflink, hardlink or (last) copy, counting bytes written.
+
+Staging the Image, DTBs and lib/modules into modules/, into a .deb tree and
+into the release archive used to copy every byte each time. stage_file()
+and stage_tree() try, per file:
+
+1. a reflink (FICLONE: btrfs, xfs, bcachefs): a new inode sharing extents,
+   safe whatever later rewrites the source;
+2. a hardlink, where the caller allows it (the source must never be
+   rewritten in place while the staged copy matters, e.g. a throwaway
+   package tree or an archived .deb that is only ever replaced);
+3. a plain copy.
+
+The destination is always replaced (written under a temporary name, then
+renamed), so a file that is hardlinked elsewhere, such as a build cache
+entry, is never written through. A method that fails for a pair of
+filesystems is not retried for the rest of the call.
+"""
+
+from __future__ import annotations
+
+import errno
+import fcntl
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Callable
+
+from utils.build_metrics import fmt_bytes
+
+_FICLONE = 0x40049409
+# Errors meaning "this filesystem (pair) cannot do that", not "this file failed".
+_UNSUPPORTED = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY)
+
+
+@dataclass
+class StageStats:
+    files: int = 0
+    reflinked: int = 0
+    hardlinked: int = 0
+    copied: int = 0
+    symlinks: int = 0
+    # Apparent size of the staged files, and the data bytes actually written.
+    bytes_total: int = 0
+    bytes_written: int = 0
+
+    def add(self, other: StageStats) -> None:
+        for name in self.__dataclass_fields__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def summary(self) -> str:
+        methods = [
+            f"{count} {label}"
+            for count, label in (
+                (self.reflinked, "reflinked"),
+                (self.hardlinked, "hardlinked"),
+                (self.copied, "copied"),
+                (self.symlinks, "symlinks"),
+            )
+            if count
+        ]
+        return (
+            f"{self.files} file(s) ({', '.join(methods) or 'nothing'}); "
+            f"{fmt_bytes(self.bytes_written)} written of {fmt_bytes(self.bytes_total)}"
+        )
+
+
+class _Stager:
+    def __init__(self, hardlink: bool) -> None:
+        self.hardlink = hardlink
+        # (src st_dev, dst dir st_dev) pairs known not to support a method.
+        self.no_reflink: set[tuple[int, int]] = set()
+        self.no_hardlink: set[tuple[int, int]] = set()
+        self.stats = StageStats()
+
+    def file(self, src: str, dst: str) -> None:
+        tmp = os.path.join(os.path.dirname(dst) or ".", f".{os.path.basename(dst)}.{os.getpid()}.stage")
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        st = os.lstat(src)
+        self.stats.files += 1
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), tmp)
+            os.replace(tmp, dst)
+            self.stats.symlinks += 1
+            return
+        self.stats.bytes_total += st.st_size
+        pair = (st.st_dev, os.stat(os.path.dirname(dst) or ".").st_dev)
+
+        if pair not in self.no_reflink:
+            try:
+                with open(src, "rb") as s, open(tmp, "wb") as d:
+                    fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+                shutil.copystat(src, tmp)
+                os.replace(tmp, dst)
+                self.stats.reflinked += 1
+                return
+            except OSError as e:
+                if os.path.lexists(tmp):
+                    os.unlink(tmp)
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self.no_reflink.add(pair)
+        if self.hardlink and pair not in self.no_hardlink:
+            try:
+                os.link(src, tmp)
+                os.replace(tmp, dst)
+                self.stats.hardlinked += 1
+                return
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self.no_hardlink.add(pair)
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+        self.stats.copied += 1
+        self.stats.bytes_written += st.st_size
+
+    def tree(self, src: str, dst: str, ignore: Callable[[str, list[str]], list[str]] | None) -> None:
+        for dirpath, dirnames, filenames in os.walk(src):
+            out_dir = os.path.normpath(os.path.join(dst, os.path.relpath(dirpath, src)))
+            os.makedirs(out_dir, exist_ok=True)
+            # Symlinked dirs (lib/modules/<ver>/build) are staged as links.
+            for name in list(dirnames):
+                if os.path.islink(os.path.join(dirpath, name)):
+                    dirnames.remove(name)
+                    filenames.append(name)
+            ignored = set(ignore(dirpath, dirnames + filenames)) if ignore else set()
+            dirnames[:] = [d for d in dirnames if d not in ignored]
+            for name in filenames:
+                if name in ignored:
+                    continue
+                dst_path = os.path.join(out_dir, name)
+                if os.path.isdir(dst_path) and not os.path.islink(dst_path):
+                    shutil.rmtree(dst_path)
+                self.file(os.path.join(dirpath, name), dst_path)
+
+
+def stage_file(src: str, dst: str, *, hardlink: bool = False) -> StageStats:
+    """Stage one file (or symlink) at *dst*, replacing whatever is there."""
+    stager = _Stager(hardlink)
+    stager.file(src, dst)
+    return stager.stats
+
+
+def stage_tree(
+    src: str,
+    dst: str,
+    *,
+    hardlink: bool = False,
+    ignore: Callable[[str, list[str]], list[str]] | None = None,
+) -> StageStats:
+    """Mirror *src* into *dst* (merging into an existing tree), symlinks preserved.
+
+    *ignore(dir, names)* works like shutil.copytree's.
+    """
+    stager = _Stager(hardlink)
+    stager.tree(src, dst, ignore)
+    return stager.stats
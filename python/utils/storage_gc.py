@@ -0,0 +1,387 @@
+"""`kernel_builder.py gc`: per-category quotas over storage/, least recently used first.
+
+Every category is a set of units that are deleted whole: a build cache
+entry, an object tree, a staged modules dir, a .deb, an archived tag. The
+categories are listed below in eviction order, caches first and release
+artifacts last. That order also applies when the total is over its quota.
+A unit's last use is the newest mtime inside it (or atime, for single
+files). Build cache entries use their manifest's last_used.
+
+Never evicted:
+- anything a staging or production tag in storage/kernel_tags.json refers
+  to (its deb_package, config/patches archive and production_deb, plus the
+  kernel_debs packages built with its localversion);
+- .debs committed in the production_kernels submodule;
+- the object tree and staged outputs of a tree whose compile lock is held,
+  which includes the compile that triggered an automatic gc.
+
+Sizes come from a parallel scandir walk and count allocated blocks, with
+each hardlinked inode counted once per unit.
+
+storage/gc.json (optional) overrides the defaults:
+    {"quotas_gb": {"kernel_out": 100, ...}, "total_gb": 300, "auto_threshold_gb": 250}
+With auto_threshold_gb set, every successful compile runs gc once storage/
+holds more than that (a --matrix run checks once, after all its entries).
+Only one gc evicts at a time (storage/gc.lock); another one skips its run.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import glob
+import json
+import os
+import shutil
+import stat
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from utils.build_metrics import fmt_bytes
+
+GC_CONFIG = os.path.join("storage", "gc.json")
+KERNEL_TAGS = os.path.join("storage", "kernel_tags.json")
+PROTECTED_STATUSES = ("staging", "production")
+_TAG_PATH_FIELDS = ("deb_package", "config_archived", "patches_archived", "production_deb")
+SCAN_WORKERS = 16
+GB = 1024**3
+
+# Eviction order; None: no quota by default.
+DEFAULT_QUOTAS_GB: dict[str, float | None] = {
+    "build_cache": 20,
+    "dtb_overlay_cache": 1,
+    "docker_images": 20,
+    "ram_snapshots": 40,
+    "kernel_out": 150,
+    "modules": 20,
+    "kernel_debs": 10,
+    "kernel_archive": 50,
+    "production_kernels": None,
+}
+CATEGORIES = tuple(DEFAULT_QUOTAS_GB)
+
+
+@dataclass
+class Unit:
+    category: str
+    path: str
+    # Files that go with *path* (snapshot .json sidecars).
+    extra: tuple[str, ...] = ()
+    size: int = 0
+    last_used: float = 0.0
+    # Why the unit is never evicted ("" if it may be).
+    protected: str = ""
+    kernel_name: str = ""
+    slot: str = ""
+
+
+def _glob(*parts: str) -> list[str]:
+    return sorted(glob.glob(os.path.join("storage", *parts)))
+
+
+def _kernel_units(category: str, pattern: tuple[str, ...], variant_pattern: tuple[str, ...]) -> list[Unit]:
+    units = []
+    for path in _glob("kernels", "*", *pattern):
+        units.append(Unit(category, path, kernel_name=path.split(os.sep)[2], slot="tree"))
+    for path in _glob("kernels", "*", "variants", "*", *variant_pattern):
+        parts = path.split(os.sep)
+        units.append(Unit(category, path, kernel_name=parts[2], slot=f"variant-{parts[4]}"))
+    # --ram-build trees are symlinks into tmpfs: not storage/ space.
+    return [u for u in units if not os.path.islink(u.path)]
+
+
+def collect_units() -> list[Unit]:
+    units = [Unit("build_cache", p) for p in _glob("build_cache", "*") if ".tmp-" not in p]
+    units += [Unit("dtb_overlay_cache", p) for p in _glob("dtb_overlay_cache", "*")]
+    units += [Unit("docker_images", p) for p in _glob("docker_images", "*") if not p.endswith(".tmp")]
+    for unit in _kernel_units("ram_snapshots", ("kernel_out.snapshot.tar",), ("out.snapshot.tar",)):
+        unit.extra = tuple(p for p in (f"{unit.path}.json",) if os.path.exists(p))
+        units.append(unit)
+    units += _kernel_units("kernel_out", ("kernel_out",), ("out",))
+    units += _kernel_units("modules", ("modules",), ("modules",))
+    units += [Unit("kernel_debs", p) for p in _glob("kernel_debs", "*") if os.path.basename(p) != ".gitkeep"]
+    units += [Unit("kernel_archive", p) for p in _glob("kernel_archive", "*") if os.path.isdir(p)]
+    units += [Unit("production_kernels", p) for p in _glob("production_kernels", "*", "*", "*.deb")]
+    return units
+
+
+def _scan(path: str, recurse: bool = True) -> tuple[int, float, dict]:
+    """(bytes, newest mtime, {hardlinked inode: bytes}) of *path* and, for dirs, below it."""
+    size, newest, linked = 0, 0.0, {}
+
+    def add(st, is_dir):
+        nonlocal size, newest
+        if st.st_nlink > 1 and not is_dir:
+            linked[(st.st_dev, st.st_ino)] = st.st_blocks * 512
+        else:
+            size += st.st_blocks * 512
+        newest = max(newest, st.st_mtime)
+
+    try:
+        st = os.stat(path, follow_symlinks=False)
+    except OSError:
+        return 0, 0.0, {}
+    is_dir = stat.S_ISDIR(st.st_mode)
+    add(st, is_dir)
+    stack = [path] if recurse and is_dir else []
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if is_dir:
+                        stack.append(entry.path)
+                    add(st, is_dir)
+        except OSError:
+            continue
+    return size, newest, linked
+
+
+def scan_units(units: list[Unit], workers: int = SCAN_WORKERS) -> None:
+    """Fill in size and last_used, walking the top-level entries of every unit in parallel."""
+    tasks: list[tuple[int, str, bool]] = []
+    for i, unit in enumerate(units):
+        for path in (unit.path, *unit.extra):
+            if os.path.isdir(path) and not os.path.islink(path):
+                tasks.append((i, path, False))
+                try:
+                    tasks += [(i, entry.path, True) for entry in os.scandir(path)]
+                except OSError:
+                    pass
+            else:
+                tasks.append((i, path, False))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda task: _scan(task[1], task[2]), tasks))
+    linked: dict[int, dict] = {}
+    for (i, path, _), (size, newest, inodes) in zip(tasks, results):
+        unit = units[i]
+        unit.size += size
+        # A hardlinked file counts once per unit (build cache entries share inodes with modules/).
+        linked.setdefault(i, {}).update(inodes)
+        unit.last_used = max(unit.last_used, newest)
+        if path == unit.path and not os.path.isdir(path):
+            try:
+                unit.last_used = max(unit.last_used, os.stat(path).st_atime)
+            except OSError:
+                pass
+    for i, inodes in linked.items():
+        units[i].size += sum(inodes.values())
+    for unit in units:
+        if unit.category == "build_cache":
+            try:
+                with open(os.path.join(unit.path, "manifest.json"), encoding="utf-8") as f:
+                    unit.last_used = json.load(f).get("last_used", unit.last_used)
+            except (OSError, ValueError):
+                pass
+
+
+def protected_paths() -> tuple[set[str], list[str]]:
+    """(paths referenced by staging/production tags, their localversions)."""
+    try:
+        with open(KERNEL_TAGS, encoding="utf-8") as f:
+            tags = json.load(f)
+    except (OSError, ValueError):
+        return set(), []
+    paths, localversions = set(), []
+    for tag in tags if isinstance(tags, list) else []:
+        if tag.get("status") not in PROTECTED_STATUSES:
+            continue
+        for field in _TAG_PATH_FIELDS:
+            if tag.get(field):
+                paths.add(os.path.normpath(tag[field]))
+        if tag.get("localversion"):
+            localversions.append(tag["localversion"])
+    return paths, localversions
+
+
+def _tracked_production_debs() -> set[str]:
+    root = os.path.join("storage", "production_kernels")
+    if not os.path.exists(os.path.join(root, ".git")):
+        return set()
+    result = subprocess.run(["git", "-C", root, "ls-files", "*.deb"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return {os.path.normpath(os.path.join(root, p)) for p in result.stdout.splitlines()}
+
+
+def _tree_busy(kernel_name: str, slot: str) -> bool:
+    """True while a compile holds the tree (or variant) lock; see build_queue.hold_tree_lock."""
+    path = os.path.join("storage", "kernels", kernel_name, ".build_locks", f"{slot}.lock")
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except OSError:
+        return False
+    try:
+        # A lock held by this very process (auto gc after its compile) also conflicts.
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return False
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+
+
+def mark_protected(units: list[Unit]) -> None:
+    paths, localversions = protected_paths()
+    tracked = _tracked_production_debs()
+    for unit in units:
+        path = os.path.normpath(unit.path)
+        if any(p == path or p.startswith(path + os.sep) for p in paths):
+            unit.protected = "referenced by a staging/production tag"
+        elif unit.category == "kernel_debs" and any(lv in os.path.basename(path) for lv in localversions):
+            unit.protected = "package of a staging/production tag"
+        elif path in tracked:
+            unit.protected = "committed in production_kernels"
+        elif unit.kernel_name and _tree_busy(unit.kernel_name, unit.slot):
+            unit.protected = "tree is being built"
+
+
+def load_gc_config() -> dict:
+    try:
+        with open(GC_CONFIG, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def parse_quota(value: str) -> tuple[str, float]:
+    """"kernel_out=100" -> ("kernel_out", 100.0), for `gc --quota`."""
+    category, _, gb = value.partition("=")
+    if category not in CATEGORIES:
+        raise ValueError(f"unknown category {category!r} (one of {', '.join(CATEGORIES)})")
+    return category, float(gb)
+
+
+def quotas(overrides: dict[str, float] | None = None) -> dict[str, int | None]:
+    """Per-category quota in bytes (None: unlimited)."""
+    merged = dict(DEFAULT_QUOTAS_GB)
+    merged.update(load_gc_config().get("quotas_gb", {}))
+    merged.update(overrides or {})
+    return {c: None if merged.get(c) is None else int(merged[c] * GB) for c in CATEGORIES}
+
+
+def plan_evictions(units: list[Unit], limits: dict[str, int | None], total_limit: int | None) -> list[Unit]:
+    """Units to delete: LRU per category above its quota, then across categories above the total."""
+    evict: list[Unit] = []
+    usage = {c: sum(u.size for u in units if u.category == c) for c in CATEGORIES}
+    for category in CATEGORIES:
+        limit = limits.get(category)
+        if limit is None:
+            continue
+        for unit in sorted((u for u in units if u.category == category and not u.protected), key=lambda u: u.last_used):
+            if usage[category] <= limit:
+                break
+            evict.append(unit)
+            usage[category] -= unit.size
+    if total_limit is not None:
+        total = sum(usage.values())
+        for category in CATEGORIES:
+            candidates = sorted(
+                (u for u in units if u.category == category and not u.protected and u not in evict),
+                key=lambda u: u.last_used,
+            )
+            for unit in candidates:
+                if total <= total_limit:
+                    break
+                evict.append(unit)
+                total -= unit.size
+    return evict
+
+
+def _remove(unit: Unit) -> str | None:
+    try:
+        for path in (unit.path, *unit.extra):
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+    except OSError as e:
+        return str(e)
+    return None
+
+
+def run_gc(
+    quota_overrides: dict[str, float] | None = None,
+    total_gb: float | None = None,
+    *,
+    report_only: bool = False,
+    workers: int = SCAN_WORKERS,
+    dry_run: bool = False,
+) -> int:
+    if report_only or dry_run:
+        return _run_gc(quota_overrides, total_gb, report_only, workers, dry_run)
+    os.makedirs("storage", exist_ok=True)
+    with open(os.path.join("storage", "gc.lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # It plans from the same scan; evicting alongside it would race on the same units.
+            print("Another gc is already running (storage/gc.lock); skipping.")
+            return 0
+        return _run_gc(quota_overrides, total_gb, report_only, workers, dry_run)
+
+
+def _run_gc(
+    quota_overrides: dict[str, float] | None,
+    total_gb: float | None,
+    report_only: bool,
+    workers: int,
+    dry_run: bool,
+) -> int:
+    units = collect_units()
+    scan_units(units, workers)
+    mark_protected(units)
+    limits = quotas(quota_overrides)
+    if total_gb is None:
+        total_gb = load_gc_config().get("total_gb")
+    total_limit = int(total_gb * GB) if total_gb is not None else None
+    evict = [] if report_only else plan_evictions(units, limits, total_limit)
+
+    print(f"  {'category':<19} {'used':>8} {'quota':>8} {'units':>5} {'protected':>9} {'evict':>8}")
+    for category in CATEGORIES:
+        members = [u for u in units if u.category == category]
+        freed = sum(u.size for u in evict if u.category == category)
+        print(
+            f"  {category:<19} {fmt_bytes(sum(u.size for u in members)):>8} "
+            f"{fmt_bytes(limits[category]) if limits[category] is not None else '-':>8} {len(members):>5} "
+            f"{sum(1 for u in members if u.protected):>9} {fmt_bytes(freed) if freed else '-':>8}"
+        )
+    total = sum(u.size for u in units)
+    print(f"  {'total':<19} {fmt_bytes(total):>8} {fmt_bytes(total_limit) if total_limit else '-':>8}")
+    if report_only:
+        return 0
+    if not evict:
+        print("Nothing to evict: every category is within its quota.")
+        return 0
+    for unit in evict:
+        print(f"{'[Dry-run] Would remove' if dry_run else 'Removing'} {unit.path} ({fmt_bytes(unit.size)}, {unit.category})")
+    if dry_run:
+        return 0
+    rc = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for unit, error in zip(evict, pool.map(_remove, evict)):
+            if error:
+                print(f"Error: could not remove {unit.path}: {error}")
+                rc = 1
+    print(f"Freed {fmt_bytes(sum(u.size for u in evict))} from storage/.")
+    return rc
+
+
+def storage_usage(workers: int = SCAN_WORKERS) -> int:
+    units = collect_units()
+    scan_units(units, workers)
+    return sum(u.size for u in units)
+
+
+def auto_gc() -> int:
+    """After a compile: gc when storage/gc.json's auto_threshold_gb is exceeded."""
+    threshold = load_gc_config().get("auto_threshold_gb")
+    if threshold is None:
+        return 0
+    used = storage_usage()
+    if used <= threshold * GB:
+        return 0
+    print(f"storage/ holds {fmt_bytes(used)}, over the {threshold} GB auto-gc threshold; running gc.")
+    return run_gc()
@@ -0,0 +1,190 @@
+"""Change journal for incremental nvbuild source syncs.
+
+An incremental nvbuild used to rsync the whole kernel source and every OOT
+source item into kernel_out on each run. The journal records (mtime_ns, size)
+of every source file as of the last successful build, plus a signature of the
+build settings and kernel_out/.config. The next incremental build rescans the
+sources (in parallel, one stat per file), copies only files whose entry
+changed via `rsync --files-from`, and skips make entirely when nothing did.
+
+Every path is relative to the kernel tree root; kernel_out mirrors the same
+relative layout (kernel/<src>/..., <oot item>/..., Makefile).
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from utils.kernel_tree import kernel_tree_root, nvbuild_image_path, nvbuild_out_config_path
+
+JOURNAL_NAME = ".sync_journal.json"
+CHANGES_NAME = ".sync_changes"
+JOURNAL_VERSION = 1
+_SKIP_DIRS = {".git"}
+
+
+@dataclass
+class SyncPlan:
+    snapshot: dict[str, list[int]]
+    # Relative paths to copy; None when there is no usable journal (full sync).
+    changed: list[str] | None
+    up_to_date: bool
+
+
+def journal_path(kernel_name: str) -> str:
+    return os.path.join(kernel_tree_root(kernel_name), JOURNAL_NAME)
+
+
+def changes_list_path(kernel_name: str) -> str:
+    return os.path.join(kernel_tree_root(kernel_name), CHANGES_NAME)
+
+
+def nvbuild_sync_items(kernel_name: str) -> list[str] | None:
+    """Tree-relative sources nvbuild copies into kernel_out, from kernel_src_build_env.sh."""
+    root = kernel_tree_root(kernel_name)
+    if not os.path.isfile(os.path.join(root, "kernel_src_build_env.sh")):
+        return None
+    result = subprocess.run(
+        ["bash", "-c", 'source ./kernel_src_build_env.sh >/dev/null 2>&1; echo "$KERNEL_SRC_DIR"; echo $OOT_SOURCE_LIST'],
+        cwd=root,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    lines = result.stdout.splitlines()
+    if result.returncode != 0 or not lines or not lines[0]:
+        return None
+    items = [f"kernel/{lines[0]}", "kernel/Makefile", "Makefile"]
+    for item in (lines[1].split() if len(lines) > 1 else []):
+        # The shell loop globs unquoted items; mirror that.
+        if any(c in item for c in "*?["):
+            items.extend(os.path.relpath(m, root) for m in glob.glob(os.path.join(root, item)))
+        else:
+            items.append(os.path.normpath(item))
+    return items
+
+
+def _scan(root: str, rel: str) -> dict[str, list[int]]:
+    files: dict[str, list[int]] = {}
+    stack = [rel]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root, current))
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                path = f"{current}/{entry.name}"
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in _SKIP_DIRS:
+                            stack.append(path)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                files[path] = [st.st_mtime_ns, st.st_size]
+    return files
+
+
+def snapshot_sources(kernel_name: str, items: list[str], workers: int | None = None) -> dict[str, list[int]]:
+    """(mtime_ns, size) of every file under *items*, scanned across threads."""
+    root = kernel_tree_root(kernel_name)
+    snapshot: dict[str, list[int]] = {}
+    units = []
+    for item in items:
+        path = os.path.join(root, item)
+        if os.path.isdir(path) and not os.path.islink(path):
+            # Fan out at the first level so a big tree (kernel/<src>) is split up.
+            for entry in os.scandir(path):
+                sub = f"{item}/{entry.name}"
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in _SKIP_DIRS:
+                        units.append(sub)
+                else:
+                    st = entry.stat(follow_symlinks=False)
+                    snapshot[sub] = [st.st_mtime_ns, st.st_size]
+        elif os.path.lexists(path):
+            st = os.lstat(path)
+            snapshot[item] = [st.st_mtime_ns, st.st_size]
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 2)) as pool:
+        for files in pool.map(lambda unit: _scan(root, unit), units):
+            snapshot.update(files)
+    return snapshot
+
+
+def build_signature(kernel_name: str, settings: str) -> str:
+    """Hash of the build settings and the kernel_out .config they produced."""
+    config = nvbuild_out_config_path(kernel_name)
+    try:
+        st = os.stat(config) if config else None
+        config_id = f"{st.st_mtime_ns}:{st.st_size}" if st else ""
+    except OSError:
+        config_id = ""
+    return hashlib.sha256(f"{settings}\0{config_id}".encode()).hexdigest()
+
+
+def load_journal(kernel_name: str) -> dict | None:
+    try:
+        with open(journal_path(kernel_name), encoding="utf-8") as f:
+            journal = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return journal if journal.get("version") == JOURNAL_VERSION else None
+
+
+def save_journal(kernel_name: str, snapshot: dict[str, list[int]], settings: str) -> None:
+    """Record the pre-build *snapshot* once a build from it succeeded."""
+    path = journal_path(kernel_name)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": JOURNAL_VERSION,
+                # Taken after the build so olddefconfig's rewrite is part of the baseline.
+                "signature": build_signature(kernel_name, settings),
+                "files": snapshot,
+            },
+            f,
+        )
+    os.replace(tmp, path)
+
+
+def invalidate_journal(kernel_name: str) -> None:
+    """Forget the baseline (kernel_out is about to be rebuilt from scratch)."""
+    try:
+        os.remove(journal_path(kernel_name))
+    except FileNotFoundError:
+        pass
+
+
+def plan_incremental_sync(kernel_name: str, settings: str) -> SyncPlan | None:
+    """Compare the sources with the journal; None if the sync items are unknown.
+
+    Writes the changed paths to .sync_changes for `rsync --files-from`.
+    Deleted sources are not removed from kernel_out (the full rsync never did).
+    """
+    items = nvbuild_sync_items(kernel_name)
+    if items is None:
+        return None
+    snapshot = snapshot_sources(kernel_name, items)
+    journal = load_journal(kernel_name)
+    if journal is None:
+        return SyncPlan(snapshot, None, False)
+    previous = journal.get("files", {})
+    changed = sorted(path for path, stat in snapshot.items() if previous.get(path) != stat)
+    with open(changes_list_path(kernel_name), "w", encoding="utf-8") as f:
+        f.write("".join(f"{path}\n" for path in changed))
+    up_to_date = (
+        not changed
+        and journal.get("signature") == build_signature(kernel_name, settings)
+        and os.path.isfile(nvbuild_image_path(kernel_name))
+    )
+    return SyncPlan(snapshot, changed, up_to_date)
@@ -0,0 +1,198 @@
+"""Probed facts about the toolchains under storage/toolchains, kept in stamp files.
+
+Each storage/toolchains/<name>/<version>/ gets a .kb_toolchain.json once its
+cross gcc has been probed: version, target triple, sysroot, whether GCC
+plugins can be built, and a content fingerprint (SHA-256 of the gcc driver,
+cc1, as and ld). The stamp also records (size, mtime) of those files, so a
+later compile validates it with a handful of stat() calls instead of running
+gcc or the JP7 install helper again. The fingerprint is the toolchain's
+identity in the build cache key: it survives moving storage/ and changes
+only when the compiler does.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import subprocess
+from dataclasses import asdict, dataclass, field
+
+STAMP_NAME = ".kb_toolchain.json"
+STAMP_VERSION = 1
+_PROBE_TIMEOUT = 30
+
+
+@dataclass
+class ToolchainInfo:
+    name: str
+    version: str
+    gcc: str
+    gcc_version: str = ""
+    target: str = ""
+    sysroot: str = ""
+    plugins: bool = False
+    fingerprint: str = ""
+    # Files hashed into the fingerprint: path -> [size, mtime_ns].
+    files: dict[str, list[int]] = field(default_factory=dict)
+
+
+def toolchains_root() -> str:
+    return os.path.join("storage", "toolchains")
+
+
+def toolchain_dir(name: str, version: str) -> str:
+    return os.path.join(toolchains_root(), name, version)
+
+
+def toolchain_gcc(name: str, version: str) -> str:
+    return os.path.join(toolchain_dir(name, version), "bin", f"{name}-gcc")
+
+
+def stamp_path(name: str, version: str) -> str:
+    return os.path.join(toolchain_dir(name, version), STAMP_NAME)
+
+
+def _gcc_output(gcc: str, *args: str) -> str:
+    try:
+        result = subprocess.run(
+            [gcc, *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            timeout=_PROBE_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return result.stdout.strip() if result.returncode == 0 else ""
+
+
+def _compiler_files(gcc: str) -> list[str]:
+    """The driver plus the programs it runs, resolved to real paths."""
+    files = [os.path.realpath(gcc)]
+    for prog in ("cc1", "as", "ld"):
+        path = _gcc_output(gcc, f"-print-prog-name={prog}")
+        if path and not os.path.isabs(path):
+            # gcc prints the bare name when it would search PATH; the
+            # toolchain's own bin/ is what make's CROSS_COMPILE picks.
+            path = os.path.join(os.path.dirname(gcc), os.path.basename(gcc)[: -len("gcc")] + path)
+        if path and os.path.isfile(path):
+            files.append(os.path.realpath(path))
+    return sorted(set(files))
+
+
+def _stat_entry(path: str) -> list[int] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def probe_toolchain(name: str, version: str) -> ToolchainInfo | None:
+    """Run the toolchain's gcc and hash its binaries; None if there is no gcc."""
+    gcc = toolchain_gcc(name, version)
+    if not os.path.isfile(gcc):
+        return None
+    info = ToolchainInfo(name=name, version=version, gcc=os.path.abspath(gcc))
+    info.gcc_version = _gcc_output(gcc, "-dumpfullversion") or _gcc_output(gcc, "-dumpversion")
+    info.target = _gcc_output(gcc, "-dumpmachine")
+    info.sysroot = _gcc_output(gcc, "-print-sysroot")
+    plugin_dir = _gcc_output(gcc, "-print-file-name=plugin")
+    # The kernel's GCC plugins need the plugin headers, not just a plugin dir.
+    info.plugins = bool(plugin_dir) and os.path.isfile(os.path.join(plugin_dir, "include", "gcc-plugin.h"))
+    digest = hashlib.sha256()
+    for path in _compiler_files(gcc):
+        entry = _stat_entry(path)
+        if entry is None:
+            continue
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        info.files[path] = entry
+    info.fingerprint = digest.hexdigest()
+    return info
+
+
+def _load_stamp(name: str, version: str) -> ToolchainInfo | None:
+    try:
+        with open(stamp_path(name, version), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.pop("stamp_version", None) != STAMP_VERSION:
+        return None
+    try:
+        return ToolchainInfo(**data)
+    except TypeError:
+        return None
+
+
+def _stamp_valid(info: ToolchainInfo) -> bool:
+    return (
+        bool(info.files)
+        and os.path.realpath(info.gcc) in info.files
+        and all(_stat_entry(path) == entry for path, entry in info.files.items())
+    )
+
+
+def cached_toolchain(name: str, version: str) -> ToolchainInfo | None:
+    """The stamped info if it still matches the files on disk; never runs anything."""
+    info = _load_stamp(name, version)
+    return info if info is not None and _stamp_valid(info) else None
+
+
+def _write_stamp(info: ToolchainInfo) -> None:
+    path = stamp_path(info.name, info.version)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"stamp_version": STAMP_VERSION, **asdict(info)}, f, indent=2)
+        os.replace(tmp, path)
+    except OSError as e:
+        # A read-only toolchain dir only costs a re-probe next time.
+        print(f"Warning: could not write toolchain stamp {path}: {e}")
+
+
+def ensure_toolchain(name: str, version: str) -> ToolchainInfo | None:
+    """Stamped info, probing (and stamping) the toolchain only when the stamp is stale."""
+    info = cached_toolchain(name, version)
+    if info is not None:
+        return info
+    info = probe_toolchain(name, version)
+    if info is not None:
+        _write_stamp(info)
+    return info
+
+
+def registered_toolchains() -> list[tuple[str, str]]:
+    """(name, version) of every toolchain dir with a gcc in storage/toolchains."""
+    found = []
+    root = toolchains_root()
+    for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        for version in sorted(os.listdir(os.path.join(root, name))) if os.path.isdir(os.path.join(root, name)) else []:
+            if os.path.isfile(toolchain_gcc(name, version)):
+                found.append((name, version))
+    return found
+
+
+def print_toolchains(reprobe: bool = False) -> int:
+    toolchains = registered_toolchains()
+    if not toolchains:
+        print(f"No toolchains with a bin/<name>-gcc under {toolchains_root()}.")
+        return 1
+    print(f"  {'toolchain':<36} {'gcc':<8} {'target':<28} {'plugins':<7} {'fingerprint':<12} sysroot")
+    for name, version in toolchains:
+        if reprobe:
+            info = probe_toolchain(name, version)
+            if info is not None:
+                _write_stamp(info)
+        else:
+            info = ensure_toolchain(name, version)
+        if info is None:
+            continue
+        print(
+            f"  {name + '/' + version:<36} {info.gcc_version or '?':<8} {info.target or '?':<28} "
+            f"{'yes' if info.plugins else 'no':<7} {info.fingerprint[:12]:<12} {info.sysroot or '-'}"
+        )
+    return 0
@@ -34,6 +34,8 @@ HOST_BUILD_ARG=""
 DRY_RUN_ARG=""
 INCREMENTAL_ARG=""
 OVERLAYS_ARG=""
+CCACHE_ARG=""
+VARIANT_ARG=""
 TOOLCHAIN_NAME_ARG="--toolchain-name aarch64-buildroot-linux-gnu"
 TOOLCHAIN_VERSION_ARG="--toolchain-version 9.3"
 
@@ -64,6 +66,11 @@ show_help() {
     echo "  --overlays <list>              A comma-separated list of DTBO files to apply as overlays."
   echo "  --host-build                   Compile the kernel directly on the host instead of using Docker."
   echo "  --no-incremental               Force full nvbuild (rsync --delete + defconfig) when kernel_out exists."
+  echo "  --ccache                       Compile through ccache with the persistent storage/ccache cache."
+  echo "  --variant <name>               Build out-of-tree (make O=) into storage/kernels/<kernel>/variants/<name>."
+  echo "  --ram-build                    Keep kernel_out (or the --variant O= dir) on a tmpfs; only staged outputs reach storage/."
+  echo "  --ram-size <size>              Size guard for --ram-build (e.g. 24G)."
+  echo "  --ram-snapshot                 Save the RAM object tree to disk after the build for the next --ram-build."
   echo "  --dry-run                      Print the commands without executing them."
     echo "  --help                         Display this help message and exit."
     echo ""
@@ -169,6 +176,32 @@ while [[ "$#" -gt 0 ]]; do
       INCREMENTAL_ARG="--no-incremental"
       shift
       ;;
+    --ccache)
+      CCACHE_ARG="--ccache"
+      shift
+      ;;
+    --ram-build|--ram-snapshot)
+      RAM_ARGS="$RAM_ARGS $1"
+      shift
+      ;;
+    --ram-size)
+      if [ -n "$2" ]; then
+        RAM_ARGS="$RAM_ARGS --ram-size $2"
+        shift 2
+      else
+        echo "Error: --ram-size requires a value"
+        exit 1
+      fi
+      ;;
+    --variant)
+      if [ -n "$2" ]; then
+        VARIANT_ARG="--variant $2"
+        shift 2
+      else
+        echo "Error: --variant requires a value"
+        exit 1
+      fi
+      ;;
     --overlays)
       if [ -n "$2" ]; then
         OVERLAYS_ARG="--overlays $2"
@@ -190,7 +223,7 @@ while [[ "$#" -gt 0 ]]; do
 done
 
 # Compile the kernel using kernel_builder.py
-COMMAND="python3 "$KERNEL_BUILDER_PATH" compile --kernel-name "$KERNEL_NAME" --arch arm64 $TOOLCHAIN_NAME_ARG $TOOLCHAIN_VERSION_ARG $CONFIG_ARG $THREADS_ARG $LOCALVERSION_ARG $DTB_NAME_ARG $HOST_BUILD_ARG $DRY_RUN_ARG $INCREMENTAL_ARG $BUILD_TARGET_ARG $BUILD_DTB_ARG $BUILD_MODULES_ARG $OVERLAYS_ARG"
+COMMAND="python3 "$KERNEL_BUILDER_PATH" compile --kernel-name "$KERNEL_NAME" --arch arm64 $TOOLCHAIN_NAME_ARG $TOOLCHAIN_VERSION_ARG $CONFIG_ARG $THREADS_ARG $LOCALVERSION_ARG $DTB_NAME_ARG $HOST_BUILD_ARG $DRY_RUN_ARG $INCREMENTAL_ARG $BUILD_TARGET_ARG $BUILD_DTB_ARG $BUILD_MODULES_ARG $OVERLAYS_ARG $CCACHE_ARG $VARIANT_ARG $RAM_ARGS"
 
 # Execute the command
 echo "Running: $COMMAND"
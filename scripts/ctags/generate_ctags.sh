@@ -4,13 +4,14 @@
 # Usage: ./generate_ctags.sh [options]
 # Example: ./generate_ctags.sh -k jetson
 
-REPO_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
+REPO_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/../.." && pwd)"
 KERNELS_DIR="$REPO_ROOT/storage/kernels"
 KERNEL_VERSION=""
 KERNEL_DIR=""
 KERNEL_SOURCE=""
 OVERLAYS=()
 TAGS_FILE=""
+ALL_SOURCES=false
 
 # Show help function
 show_help() {
@@ -18,6 +19,7 @@ show_help() {
     echo
     echo "Options:"
     echo "  -k, --kernel-version <version>  Specify the kernel version (required)"
+    echo "  --all                           Tag every source file, even in a built tree"
     echo "  -h, --help                      Show this help message"
     echo
     echo "Examples:"
@@ -33,6 +35,10 @@ while [[ $# -gt 0 ]]; do
             KERNEL_VERSION="$2"
             shift 2
             ;;
+        --all)
+            ALL_SOURCES=true
+            shift
+            ;;
         -h|--help)
             show_help
             ;;
@@ -65,6 +71,13 @@ if [[ ! -d "$KERNEL_SOURCE" ]]; then
     exit 1
 fi
 
+# A built tree: index only what the build compiled (read from its .o.cmd
+# files), incrementally and in parallel.
+if [[ "$ALL_SOURCES" == false && -n "$(find "$KERNEL_DIR" -name '.*.o.cmd' -print -quit)" ]]; then
+    echo "Build output found; tagging only compiled sources (use --all for everything)."
+    cd "$REPO_ROOT" && exec python3 python/kernel_builder.py ctags --kernel-name "$KERNEL_VERSION"
+fi
+
 # Collect overlay directories from kernel/
 for dir in "$KERNEL_DIR"/*; do
     if [[ -d "$dir" && "$dir" != "$KERNEL_SOURCE" && "$dir" != *kernel-5.10* ]]; then
@@ -24,6 +24,7 @@ shift # Shift arguments to parse the rest of the options
 LOCALVERSION_ARG=""
 DRY_RUN=false
 DTB_NAME_ARG="--dtb-name tegra234-p3701-0000-p3737-0000.dtb"
+VARIANT_ARG=""
 
 # Function to display help message
 function display_help() {
@@ -38,6 +39,7 @@ function display_help() {
     echo "  --localversion <version>   Specify the kernel version (localversion) for packaging."
     echo "  --dry-run                  Simulate the packaging process without generating the package."
 	echo "  --dtb-name <name>           Specify the DTB filename (default: tegra234-p3701-0000-p3737-0000.dtb)."
+    echo "  --variant <name>           Package the outputs of a 'compile --variant <name>' build."
     echo "  --help                     Display this help message."
     echo ""
     echo "Examples:"
@@ -58,6 +60,7 @@ while [[ "$#" -gt 0 ]]; do
         --localversion) LOCALVERSION_ARG="--localversion $2"; shift ;;
         --dry-run) DRY_RUN=true ;;
 		--dtb-name) DTB_NAME_ARG="--dtb-name $2"; shift ;;
+        --variant) VARIANT_ARG="--variant $2"; shift ;;
         *) echo "Unknown parameter passed: $1"; exit 1 ;;
     esac
     shift
@@ -70,6 +73,10 @@ if [ -n "$LOCALVERSION_ARG" ]; then
     DEPLOY_COMMAND+=" $LOCALVERSION_ARG"
 fi
 
+if [ -n "$VARIANT_ARG" ]; then
+    DEPLOY_COMMAND+=" $VARIANT_ARG"
+fi
+
 if [ "$DRY_RUN" = true ]; then
     DEPLOY_COMMAND+=" --dry-run"
 fi
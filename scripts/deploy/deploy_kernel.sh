@@ -25,6 +25,7 @@ DRY_RUN=false
 KERNEL_ONLY=false
 DTB_FLAG=false
 LOCALVERSION_ARG=""
+VARIANT_ARG=""
 
 # Function to display help message
 function display_help() {
@@ -42,6 +43,7 @@ function display_help() {
     echo "  --kernel-only              Only deploy the kernel, skipping module deployment."
     echo "  --localversion <version>   Specify the kernel version (localversion) for deployment."
     echo "  --dtb                      Set the newly compiled DTB as the default in the boot configuration."
+    echo "  --variant <name>           Deploy the outputs of a 'compile --variant <name>' build."
     echo "  --help                     Display this help message."
     echo ""
     echo "Examples:"
@@ -76,6 +78,7 @@ while [[ "$#" -gt 0 ]]; do
         --kernel-only) KERNEL_ONLY=true ;;
         --localversion) LOCALVERSION_ARG="--localversion $2"; shift ;;
         --dtb) DTB_FLAG=true ;;
+        --variant) VARIANT_ARG="--variant $2"; shift ;;
         *) echo "Unknown parameter passed: $1"; exit 1 ;;
     esac
     shift
@@ -95,6 +98,10 @@ if [ -n "$LOCALVERSION_ARG" ]; then
     DEPLOY_COMMAND+=" $LOCALVERSION_ARG"
 fi
 
+if [ -n "$VARIANT_ARG" ]; then
+    DEPLOY_COMMAND+=" $VARIANT_ARG"
+fi
+
 if [ "$DTB_FLAG" = true ]; then
     DEPLOY_COMMAND+=" --dtb"
 fi
@@ -276,6 +276,13 @@ find_deb_package() {
   return 1
 }
 
+# Copy through the builder's staging layer: a reflink where the filesystem
+# supports it, a hardlink with --hardlink (sources that are only ever
+# replaced, like .debs), a plain copy otherwise. Prints the bytes written.
+stage_copy() {
+  python3 "$REPO_ROOT/python/kernel_builder.py" stage "$@"
+}
+
 archive_deb_package() {
   local tag_name="$1"
   local localversion="$2"
@@ -299,7 +306,7 @@ archive_deb_package() {
   local deb_filename
   deb_filename=$(basename "$source_deb")
 
-  cp "$source_deb" "$archive_tag_dir/$deb_filename"
+  stage_copy --hardlink "$source_deb" "$archive_tag_dir/$deb_filename"
   echo "  Archived: $deb_filename -> storage/kernel_archive/$tag_name/"
 
   # Return the archive path (relative to repo root)
@@ -338,7 +345,7 @@ archive_kernel_config() {
 
   local archive_tag_dir="$ARCHIVE_DIR/$tag_name"
   mkdir -p "$archive_tag_dir"
-  cp "$config_path" "$archive_tag_dir/kernel.config"
+  stage_copy "$config_path" "$archive_tag_dir/kernel.config"
   echo "  Archived kernel config -> storage/kernel_archive/$tag_name/kernel.config"
   echo "storage/kernel_archive/$tag_name/kernel.config"
 }
@@ -469,13 +476,13 @@ publish_to_production() {
 
   echo "  Publishing to storage/production_kernels/$soc/$jetpack_version/..."
   mkdir -p "$dest_dir"
-  cp "$deb_source" "$dest_dir/$deb_filename"
+  stage_copy --hardlink "$deb_source" "$dest_dir/$deb_filename"
   echo "  Copied: $deb_filename"
 
   # Copy patches tarball if available
   if [ -n "$patches_tarball" ] && [ -f "$patches_tarball" ]; then
     local patches_dest="$dest_dir/${tag_name}-patches.tar.gz"
-    cp "$patches_tarball" "$patches_dest"
+    stage_copy "$patches_tarball" "$patches_dest"
     echo "  Copied: ${tag_name}-patches.tar.gz"
   fi
 